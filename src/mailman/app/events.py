@@ -28,7 +28,8 @@ __all__ = [
 from zope import event
 
 from mailman.app import (
-    domain, membership, moderator, registrar, subscriptions)
+    domain, listnames, membership, moderator, registrar, subscriptions)
+from mailman.chains import headers
 from mailman.core import i18n, switchboard
 from mailman.languages import manager as language_manager
 from mailman.styles import manager as style_manager
@@ -40,8 +41,11 @@ def initialize():
     """Initialize global event subscribers."""
     event.subscribers.extend([
         domain.handle_DomainDeletingEvent,
+        headers.handle_ListDeletedEvent,
         i18n.handle_ConfigurationUpdatedEvent,
         language_manager.handle_ConfigurationUpdatedEvent,
+        listnames.handle_ListCreatedEvent,
+        listnames.handle_ListDeletedEvent,
         membership.handle_SubscriptionEvent,
         moderator.handle_ListDeletingEvent,
         passwords.handle_ConfigurationUpdatedEvent,
@@ -0,0 +1,163 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The registry of mailing list names.
+
+The LMTP runner checks every recipient address against the names of all the
+mailing lists.  Loading those from the database for every message is costly on
+sites with many mailing lists, so the registry keeps them in memory.  It is
+kept current in this process by the list creation and deletion events, and
+across processes by a generation file, whose status changes every time the
+creation or deletion of a mailing list is committed anywhere.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'ListNameRegistry',
+    'handle_ListCreatedEvent',
+    'handle_ListDeletedEvent',
+    'list_name_registry',
+    ]
+
+
+import os
+import logging
+
+from zope.component import getUtility
+
+from mailman.config import config
+from mailman.database.transaction import register_transaction_callbacks
+from mailman.interfaces.listmanager import (
+    IListManager, ListCreatedEvent, ListDeletedEvent)
+from mailman.testing import layers
+from mailman.utilities.filesystem import GenerationFile
+
+
+elog = logging.getLogger('mailman.error')
+
+
+
+class ListNameRegistry:
+    """The fully qualified names of all the mailing lists."""
+
+    def __init__(self):
+        self._names = None
+        self._generation = None
+        # fqdn_listname -> whether it existed before the current transaction
+        self._pending = {}
+        register_transaction_callbacks(self.committed, self.aborted)
+        layers.MockAndMonkeyLayer.register_reset(self._reset)
+
+    @property
+    def _generation_file(self):
+        return GenerationFile(
+            os.path.join(config.DATA_DIR, 'list-names.generation'))
+
+    def __contains__(self, fqdn_listname):
+        """Whether a mailing list exists.
+
+        :param fqdn_listname: The fully qualified name of the mailing list,
+            in lower case.
+        :type fqdn_listname: str
+        :return: True if the mailing list exists.
+        :rtype: bool
+        """
+        status = self._generation_file.status
+        if self._names is None or status != self._generation:
+            self._names = set(getUtility(IListManager).names)
+            self._generation = status
+        if fqdn_listname in self._names:
+            return True
+        # The names may have been loaded while the transaction which created
+        # the mailing list was still in progress.
+        if getUtility(IListManager).get(fqdn_listname) is None:
+            return False
+        self._names.add(fqdn_listname)
+        return True
+
+    def add(self, fqdn_listname):
+        """Record the creation of a mailing list in the current transaction."""
+        self._pending.setdefault(fqdn_listname, False)
+        if self._names is not None:
+            self._names.add(fqdn_listname)
+
+    def discard(self, fqdn_listname):
+        """Record the deletion of a mailing list in the current transaction."""
+        self._pending.setdefault(fqdn_listname, True)
+        if self._names is not None:
+            self._names.discard(fqdn_listname)
+
+    def clear(self):
+        """Forget the names, so that they are loaded again when needed."""
+        self._names = None
+
+    def committed(self):
+        """Tell the other processes about the committed changes."""
+        if not self._pending:
+            return
+        self._pending.clear()
+        self._bump()
+
+    def aborted(self):
+        """Undo the changes which were rolled back."""
+        if self._names is not None:
+            for fqdn_listname, existed in self._pending.items():
+                if existed:
+                    self._names.add(fqdn_listname)
+                else:
+                    self._names.discard(fqdn_listname)
+        self._pending.clear()
+
+    def _bump(self):
+        # Tell the other processes to load the names again.  This process's
+        # names are still current, unless another process had changed them
+        # too.
+        generation_file = self._generation_file
+        current = (generation_file.status == self._generation)
+        try:
+            generation_file.bump()
+        except EnvironmentError:
+            elog.exception('Cannot update the list names generation: %s',
+                           generation_file.path)
+            return
+        if current:
+            self._generation = generation_file.status
+
+    def _reset(self):
+        # The test database is reset without any deletion events.
+        self._pending.clear()
+        self._bump()
+        self.clear()
+
+
+list_name_registry = ListNameRegistry()
+
+
+
+def handle_ListCreatedEvent(event):
+    """Add a new mailing list to the registry."""
+    if isinstance(event, ListCreatedEvent):
+        list_name_registry.add(event.mailing_list.fqdn_listname)
+
+
+def handle_ListDeletedEvent(event):
+    """Remove a deleted mailing list from the registry."""
+    if isinstance(event, ListDeletedEvent):
+        list_name_registry.discard(event.fqdn_listname)
@@ -0,0 +1,177 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""The senders of a message, as seen by a mailing list.
+
+The rules, handlers and runners which process a posting all need to know
+whether its senders are members or nonmembers of the mailing list.  The
+sender context looks up the addresses and memberships of all the senders in
+one query, and is kept in the message metadata for the others to use.  It is
+a volatile metadata entry, so it doesn't survive being queued.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'SenderContext',
+    'sender_context',
+    ]
+
+
+from storm.expr import And, LeftJoin, Or
+
+from mailman.database.transaction import dbconnection
+from mailman.interfaces.member import MemberRole
+from mailman.model.address import Address
+from mailman.model.member import Member
+
+
+
+class SenderContext:
+    """The addresses and memberships of a message's senders."""
+
+    def __init__(self, mlist, senders):
+        """Look up the senders.
+
+        :param mlist: The mailing list.
+        :type mlist: `IMailingList`
+        :param senders: The senders of the message, as in `Message.senders`.
+        :type senders: list
+        """
+        self.list_id = mlist.list_id
+        self.senders = list(senders)
+        self._addresses = {}
+        self._members = {}
+        self._nonmembers = {}
+        self.resolve(self.senders)
+
+    def __getstate__(self):
+        # Held messages keep their metadata, but the records must be looked
+        # up again when they are needed.
+        return dict(list_id=self.list_id, senders=self.senders)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._addresses = {}
+        self._members = {}
+        self._nonmembers = {}
+
+    @dbconnection
+    def resolve(self, store, emails):
+        """Look up more email addresses, e.g. the recipients of a message.
+
+        Only the email addresses which haven't been looked up yet are looked
+        up, all in one query.
+
+        :param emails: The email addresses.
+        :type emails: sequence of text
+        """
+        emails = set(email for email in emails
+                     if email is not None and email not in self._addresses)
+        if len(emails) == 0:
+            return
+        for email in emails:
+            self._addresses[email] = None
+            self._members[email] = None
+            self._nonmembers[email] = None
+        origin = (
+            Address,
+            LeftJoin(Member, And(
+                Member.address_id == Address.id,
+                Member.list_id == self.list_id,
+                Or(Member.role == MemberRole.member,
+                   Member.role == MemberRole.nonmember))),
+            )
+        results = store.using(*origin).find(
+            (Address, Member), Address.email.is_in(emails))
+        for address, member in results:
+            self._addresses[address.email] = address
+            if member is None:
+                continue
+            if member.role == MemberRole.member:
+                self._members[address.email] = member
+            else:
+                self._nonmembers[address.email] = member
+
+    def address(self, email):
+        """The registered address.
+
+        :param email: The email address.
+        :type email: text
+        :return: The address, or None if the email address is not registered.
+        :rtype: `IAddress`
+        """
+        self.resolve(self.senders + [email])
+        return self._addresses.get(email)
+
+    def member(self, email):
+        """The member of the mailing list.
+
+        :param email: The email address.
+        :type email: text
+        :return: The member subscribed with the email address, or None.
+        :rtype: `IMember`
+        """
+        self.resolve(self.senders + [email])
+        return self._members.get(email)
+
+    def nonmember(self, email):
+        """The nonmember of the mailing list.
+
+        :param email: The email address.
+        :type email: text
+        :return: The nonmember subscribed with the email address, or None.
+        :rtype: `IMember`
+        """
+        self.resolve(self.senders + [email])
+        return self._nonmembers.get(email)
+
+    def add_address(self, address):
+        """Record a newly registered address."""
+        self._addresses[address.email] = address
+
+    def add_nonmember(self, member):
+        """Record a newly subscribed nonmember."""
+        self._nonmembers[member.address.email] = member
+
+
+
+def sender_context(mlist, msg, msgdata):
+    """Return the sender context of a message.
+
+    The context is looked up the first time it is needed, and again only if
+    the message is now posted to another mailing list, or its senders have
+    changed.
+
+    :param mlist: The mailing list.
+    :type mlist: `IMailingList`
+    :param msg: The message.
+    :type msg: `Message`
+    :param msgdata: The message metadata.
+    :type msgdata: dictionary
+    :return: The sender context.
+    :rtype: `SenderContext`
+    """
+    senders = msg.senders
+    context = msgdata.get('_sender_context')
+    if (context is None or context.list_id != mlist.list_id or
+            context.senders != senders):
+        context = SenderContext(mlist, senders)
+        msgdata['_sender_context'] = context
+    return context
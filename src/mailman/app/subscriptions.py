@@ -44,6 +44,11 @@ from mailman.interfaces.subscriptions import (
     ISubscriptionService, MissingUserError)
 from mailman.interfaces.usermanager import IUserManager
 from mailman.model.member import Member
+from mailman.model.roster import resolved_preferences
+
+
+# The number of members whose preferences are resolved by a single query.
+CHUNK_SIZE = 500
 
 
 
@@ -137,6 +142,19 @@ class SubscriptionService:
         results = store.find(Member, And(*query))
         return sorted(results, key=_membership_sort_key)
 
+    @dbconnection
+    def resolve_preferences(self, store, members):
+        """See `ISubscriptionService`."""
+        members = list(members)
+        resolved = {}
+        for start in range(0, len(members), CHUNK_SIZE):
+            member_ids = [member.id
+                          for member in members[start:start + CHUNK_SIZE]]
+            for member, preferences in resolved_preferences(
+                    store, Member.id.is_in(member_ids)):
+                resolved[member.id] = preferences
+        return [resolved[member.id] for member in members]
+
     def __iter__(self):
         for member in self.get_members():
             yield member
@@ -0,0 +1,120 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test the registry of mailing list names."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestListNameRegistry',
+    ]
+
+
+import os
+import unittest
+
+from mailman.app.lifecycle import create_list, remove_list
+from mailman.app.listnames import list_name_registry
+from mailman.config import config
+from mailman.model.mailinglist import MailingList
+from mailman.testing.helpers import query_log
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.filesystem import GenerationFile
+
+
+
+class TestListNameRegistry(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('ant@example.com')
+        config.db.commit()
+
+    def _changed_elsewhere(self):
+        # Another process creates or deletes a mailing list.
+        path = os.path.join(config.DATA_DIR, 'list-names.generation')
+        with open(path + '.tmp', 'w') as fp:
+            fp.write('elsewhere')
+        os.rename(path + '.tmp', path)
+
+    def test_loaded_once(self):
+        # The names are loaded from the database only once.
+        self.assertIn('ant@example.com', list_name_registry)
+        with query_log() as statements:
+            self.assertIn('ant@example.com', list_name_registry)
+        self.assertEqual(statements, [])
+
+    def test_events(self):
+        # Creating and deleting mailing lists in this process updates the
+        # registry without loading the names again.
+        self.assertNotIn('bee@example.com', list_name_registry)
+        with query_log() as statements:
+            mlist = create_list('bee@example.com')
+            self.assertIn('bee@example.com', list_name_registry)
+            remove_list(mlist)
+            self.assertNotIn('bee@example.com', list_name_registry)
+        scans = [statement for statement in statements
+                 if 'FROM mailinglist' in statement and
+                    'WHERE' not in statement]
+        self.assertEqual(scans, [])
+
+    def test_created_elsewhere(self):
+        # A mailing list created after the names were loaded is found in the
+        # database, even without a new generation.
+        self.assertIn('ant@example.com', list_name_registry)
+        config.db.store.add(MailingList('bee@example.com'))
+        self.assertIn('bee@example.com', list_name_registry)
+
+    def test_deleted_elsewhere(self):
+        # A mailing list deleted by another process is forgotten once the
+        # generation changes.
+        self.assertIn('ant@example.com', list_name_registry)
+        config.db.store.remove(self._mlist)
+        config.db.commit()
+        self.assertIn('ant@example.com', list_name_registry)
+        self._changed_elsewhere()
+        self.assertNotIn('ant@example.com', list_name_registry)
+
+    def test_abort(self):
+        # Mailing lists created in an aborted transaction are forgotten.
+        create_list('bee@example.com')
+        self.assertIn('bee@example.com', list_name_registry)
+        config.db.abort()
+        self.assertNotIn('bee@example.com', list_name_registry)
+
+    def test_abort_deletion(self):
+        # Mailing lists deleted in an aborted transaction are remembered.
+        self.assertIn('ant@example.com', list_name_registry)
+        remove_list(self._mlist)
+        self.assertNotIn('ant@example.com', list_name_registry)
+        config.db.abort()
+        with query_log() as statements:
+            self.assertIn('ant@example.com', list_name_registry)
+        self.assertEqual(statements, [])
+
+    def test_bumped_on_commit(self):
+        # The other processes are only told about the creation of a mailing
+        # list once it is committed.
+        generation_file = GenerationFile(
+            os.path.join(config.DATA_DIR, 'list-names.generation'))
+        status = generation_file.status
+        create_list('bee@example.com')
+        self.assertEqual(generation_file.status, status)
+        config.db.commit()
+        self.assertNotEqual(generation_file.status, status)
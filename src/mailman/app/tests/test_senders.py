@@ -0,0 +1,163 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test the sender context."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestSenderContext',
+    ]
+
+
+import pickle
+import unittest
+
+from zope.component import getUtility
+
+from mailman.app.lifecycle import create_list
+from mailman.app.senders import sender_context
+from mailman.config import config
+from mailman.interfaces.member import MemberRole
+from mailman.interfaces.usermanager import IUserManager
+from mailman.rules.moderation import MemberModeration, NonmemberModeration
+from mailman.testing.helpers import (
+    get_queue_messages, query_log,
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestSenderContext(unittest.TestCase):
+    """Test the sender context."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        self._anne = self._mlist.subscribe(
+            user_manager.create_address('anne@example.com'))
+        self._bart = self._mlist.subscribe(
+            user_manager.create_address('bart@example.com'),
+            MemberRole.nonmember)
+        user_manager.create_address('cris@example.com')
+        config.db.commit()
+        self._msg = mfs("""\
+From: anne@example.com
+Reply-To: bart@example.com
+Sender: cris@example.com
+To: test@example.com
+CC: dave@example.com
+
+""")
+
+    def test_senders_resolved(self):
+        msgdata = {}
+        # Load the mailing list after the commit.
+        self._mlist.list_id
+        with query_log() as statements:
+            context = sender_context(self._mlist, self._msg, msgdata)
+            members = [context.member(sender) for sender in context.senders]
+            nonmembers = [context.nonmember(sender)
+                          for sender in context.senders]
+            addresses = [context.address(sender)
+                         for sender in context.senders]
+        # All the senders were looked up in one query.
+        self.assertEqual(len(statements), 1)
+        self.assertIs(msgdata['_sender_context'], context)
+        self.assertEqual(context.senders, [
+            'anne@example.com', 'bart@example.com', 'cris@example.com'])
+        self.assertEqual(members, [self._anne, None, None])
+        self.assertEqual(nonmembers, [None, self._bart, None])
+        self.assertEqual([address.email for address in addresses],
+                         context.senders)
+
+    def test_context_reused(self):
+        # The moderation rules share the context.
+        msgdata = {}
+        context = sender_context(self._mlist, self._msg, msgdata)
+        # This subscribes Cris as a nonmember.
+        NonmemberModeration().check(self._mlist, self._msg, msgdata)
+        config.db.store.flush()
+        with query_log() as statements:
+            self.assertIs(sender_context(self._mlist, self._msg, msgdata),
+                          context)
+            MemberModeration().check(self._mlist, self._msg, msgdata)
+            NonmemberModeration().check(self._mlist, self._msg, msgdata)
+        self.assertEqual(statements, [])
+
+    def test_senders_changed(self):
+        msgdata = {}
+        context = sender_context(self._mlist, self._msg, msgdata)
+        del self._msg['from']
+        self._msg['From'] = 'dave@example.com'
+        new_context = sender_context(self._mlist, self._msg, msgdata)
+        self.assertIsNot(new_context, context)
+        self.assertIsNone(new_context.address('dave@example.com'))
+
+    def test_other_list(self):
+        msgdata = {}
+        context = sender_context(self._mlist, self._msg, msgdata)
+        mlist = create_list('other@example.com')
+        new_context = sender_context(mlist, self._msg, msgdata)
+        self.assertIsNot(new_context, context)
+        self.assertIsNone(new_context.member('anne@example.com'))
+
+    def test_resolve_more(self):
+        # Other addresses can be looked up in bulk too.
+        context = sender_context(self._mlist, self._msg, {})
+        user_manager = getUtility(IUserManager)
+        dave = self._mlist.subscribe(
+            user_manager.create_address('dave@example.com'))
+        with query_log() as statements:
+            context.resolve(['dave@example.com', 'anne@example.com'])
+            self.assertEqual(context.member('dave@example.com'), dave)
+            self.assertEqual(context.member('anne@example.com'), self._anne)
+        self.assertEqual(len(statements), 1)
+
+    def test_new_nonmember_recorded(self):
+        # The nonmember moderation rule subscribes the senders which are not
+        # yet subscribed as nonmembers, and records them in the context.
+        msgdata = {}
+        context = sender_context(self._mlist, self._msg, msgdata)
+        NonmemberModeration().check(self._mlist, self._msg, msgdata)
+        nonmember = context.nonmember('cris@example.com')
+        self.assertEqual(nonmember.role, MemberRole.nonmember)
+        self.assertEqual(self._mlist.nonmembers.get_member('cris@example.com'),
+                         nonmember)
+
+    def test_not_queued(self):
+        msgdata = {}
+        sender_context(self._mlist, self._msg, msgdata)
+        config.switchboards['in'].enqueue(self._msg, msgdata)
+        messages = get_queue_messages('in')
+        self.assertEqual(len(messages), 1)
+        self.assertNotIn('_sender_context', messages[0].msgdata)
+
+    def test_pickled(self):
+        # Held messages keep their metadata, including the context, which
+        # looks the senders up again.
+        context = sender_context(self._mlist, self._msg, {})
+        copy = pickle.loads(pickle.dumps(context))
+        self.assertEqual(copy.senders, context.senders)
+        with query_log() as statements:
+            self.assertEqual(copy.member('anne@example.com'), self._anne)
+            self.assertEqual(copy.nonmember('bart@example.com'), self._bart)
+        self.assertEqual(len(statements), 1)
@@ -0,0 +1,129 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the delivery rosters of a large mailing list.
+
+This subscribes many members to a mailing list, some of them getting digests
+and some of them with their delivery disabled, the preferences being set on
+the member, the address or the user.  It then times counting the regular and
+digest members, and calculating the recipients of a posting and of a digest,
+all of which resolve the members' preferences in the database.  For
+comparison, it also times reading the delivery mode and status of some
+members one by one.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import argparse
+
+from zope.component import getUtility
+
+from mailman.app.lifecycle import create_list
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+from mailman.interfaces.usermanager import IUserManager
+
+
+
+def populate(mlist, count):
+    """Subscribe `count` members with a mix of delivery preferences."""
+    user_manager = getUtility(IUserManager)
+    for i in range(count):
+        email = 'person{0:06d}@example.com'.format(i)
+        if i % 50 == 0:
+            # A user, with its preferences on the user.
+            user = user_manager.create_user(email)
+            address = list(user.addresses)[0]
+            user.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        else:
+            address = user_manager.create_address(email)
+        if i % 10 == 0:
+            address.preferences.delivery_mode = DeliveryMode.mime_digests
+        member = mlist.subscribe(address)
+        if i % 7 == 0:
+            member.preferences.delivery_status = DeliveryStatus.by_user
+        if i % 1000 == 999:
+            config.db.commit()
+    config.db.commit()
+
+
+def run(mlist, repeat, sample):
+    """Time the roster operations.
+
+    :return: The label and the list of timings of each operation.
+    """
+    timings = []
+    regular = mlist.regular_members
+    digest = mlist.digest_members
+    for label, operation in (
+            ('regular count', lambda: regular.member_count),
+            ('digest count', lambda: digest.member_count),
+            ('posting recipients', lambda: set(
+                member.address.email
+                for member, preferences in regular.get_resolved_members(
+                    [DeliveryStatus.enabled]))),
+            ('digest recipients', lambda: set(
+                member.address.original_email
+                for member, preferences in digest.get_resolved_members(
+                    [DeliveryStatus.enabled]))),
+            ):
+        samples = []
+        for i in range(repeat):
+            # Start from a cold cache every time.
+            config.db.abort()
+            with timed(samples):
+                operation()
+        timings.append((label, samples))
+    # The members' own attributes walk their preferences one by one.
+    config.db.abort()
+    samples = []
+    for i, member in enumerate(mlist.members.members):
+        if i == sample:
+            break
+        with timed(samples):
+            member.delivery_mode
+            member.delivery_status
+    timings.append(('one member', samples))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help='Number of members to subscribe.')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of times to time each operation.')
+    parser.add_argument('-s', '--sample', type=int, default=1000,
+                        help='Number of members to read one by one.')
+    args = parser.parse_args()
+    with scratch_instance():
+        mlist = create_list('test@example.com')
+        populate(mlist, args.count)
+        print('Delivery rosters of {0} members'.format(args.count))
+        for operation, samples in run(mlist, args.repeat, args.sample):
+            report(operation, samples)
+
+
+if __name__ == '__main__':
+    main()
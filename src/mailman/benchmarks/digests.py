@@ -0,0 +1,127 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure building the digests of a large digest mailbox.
+
+This fills a mailing list's digest mailbox with plain text messages, up to a
+given total size, and runs the digest runner over it once, building both a
+MIME and an RFC 1153 digest, for every `[switchboard]qfile_format`.  It
+reports how long that took and by how much the peak resident memory of the
+process grew while doing it.  The digests are built without holding the
+messages in memory, but the pickle format has to parse a digest to queue it,
+while the framed format copies its body to the queue file unparsed.  The body
+is memory mapped, so reading it counts towards the resident memory as well,
+although those pages are clean and the kernel can drop them at any time.
+
+Since the peak memory of a process never shrinks, only the growth of the
+first format measured is exact; the others are lower bounds.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import os
+import argparse
+import resource
+
+from zope.component import getUtility
+
+from mailman.app.lifecycle import create_list
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.interfaces.member import DeliveryMode
+from mailman.interfaces.usermanager import IUserManager
+from mailman.runners.digest import DigestRunner
+from mailman.testing.helpers import configuration, make_testable_runner
+from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.utilities.mailbox import Mailbox
+
+
+FORMATS = ('framed', 'pickle')
+
+
+
+def make_mailbox(mlist, number, total, size):
+    """Fill a digest mailbox with messages of `size` KiB, `total` MiB in all.
+
+    :return: The path to the mailbox, and the number of messages in it.
+    """
+    path = os.path.join(mlist.data_path, 'digest.1.{0}.mmdf'.format(number))
+    line = 'The quick brown fox jumps over the lazy dog.\n'
+    body = line * (size * 1024 // len(line))
+    count = total * 1024 // size
+    with Mailbox(path, create=True) as mailbox:
+        for i in range(count):
+            mailbox.add(mfs("""\
+From: person{0}@example.com
+To: test@example.com
+Subject: Digest message number {0}
+Message-ID: <digest.{0}@example.com>
+
+{1}""".format(i, body)))
+    return path, count
+
+
+def peak_rss():
+    """The peak resident memory of this process so far, in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-t', '--total', type=int, default=50,
+                        help='The size of the digest mailbox in MiB.')
+    parser.add_argument('-s', '--size', type=int, default=20,
+                        help='The size of each message in KiB.')
+    parser.add_argument('formats', nargs='*', default=list(FORMATS),
+                        help='The queue file formats to measure.')
+    args = parser.parse_args()
+    with scratch_instance():
+        mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        for email, delivery_mode in (
+                ('anne@example.com', DeliveryMode.mime_digests),
+                ('bart@example.com', DeliveryMode.plaintext_digests)):
+            member = mlist.subscribe(user_manager.create_address(email))
+            member.preferences.delivery_mode = delivery_mode
+        config.db.commit()
+        runner = make_testable_runner(DigestRunner, 'digest')
+        for number, qfile_format in enumerate(args.formats, 1):
+            path, count = make_mailbox(mlist, number, args.total, args.size)
+            config.switchboards['digest'].enqueue(
+                mfs('From: test@example.com\n\n'),
+                listname=mlist.fqdn_listname,
+                digest_path=path, volume=1, digest_number=number)
+            before = peak_rss()
+            samples = []
+            with configuration('switchboard', qfile_format=qfile_format):
+                with timed(samples):
+                    runner.run()
+            growth = peak_rss() - before
+            print('Digests of {0} messages, {1} MiB, {2} queue files'.format(
+                count, args.total, qfile_format))
+            report('build digests', samples, unit='s', scale=1.0)
+            print('{0:<24} {1} KiB'.format('peak memory growth', growth))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Measure the header-match chain with many header checks.
+
+This configures many `[antispam]header_checks` spread over a few headers, and
+times running the header-match chain over messages which match none or one of
+them.  For comparison, it also times searching the header values with each
+pattern in turn, uncompiled, the way the chain used to.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import re
+import argparse
+
+from mailman.app.lifecycle import create_list
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.core.chains import process
+from mailman.testing.helpers import specialized_message_from_string as mfs
+
+
+HEADERS = ('X-Spam-Flag', 'X-Spam-Status', 'X-Mailer', 'Subject', 'From')
+
+
+
+def header_checks(count):
+    """Return `count` header checks as (header, pattern) pairs."""
+    checks = []
+    for i in range(count):
+        header = HEADERS[i % len(HEADERS)]
+        if i % 3 == 0:
+            pattern = 'bulk-sender-{0}[.]example[.]com'.format(i)
+        elif i % 3 == 1:
+            pattern = '^spam level {0}( |$)'.format(i)
+        else:
+            pattern = 'cheap (pills|watches) #{0}\\b'.format(i)
+        checks.append((header, pattern))
+    return checks
+
+
+def make_message(i, spam):
+    subject = ('cheap watches #{0}'.format(i) if spam
+               else 'Meeting notes {0}'.format(i))
+    return mfs("""\
+From: Anne Person <anne@example.com>
+To: test@example.com
+Subject: {0}
+X-Mailer: Benchmark 1.0
+X-Spam-Status: No, score=0.{1}
+Message-ID: <bench{1}>
+
+Hello.
+""".format(subject, i))
+
+
+def uncompiled(checks, msg):
+    """Search the header values with each pattern in turn."""
+    hits = []
+    for header, pattern in checks:
+        for value in msg.get_all(header, []):
+            if re.search(pattern, value, re.IGNORECASE):
+                hits.append(pattern)
+                break
+    return hits
+
+
+def run(mlist, checks, count):
+    """Time checking `count` messages, every tenth of which is spam.
+
+    :return: The label and the list of timings of each way of checking.
+    """
+    messages = [make_message(i, i % 10 == 0) for i in range(count)]
+    samples = []
+    for msg in messages:
+        with timed(samples):
+            uncompiled(checks, msg)
+    timings = [('uncompiled', samples)]
+    # The first message compiles the checks.
+    samples = []
+    with timed(samples):
+        process(mlist, make_message(0, False), {}, 'header-match')
+    timings.append(('chain, first message', samples))
+    samples = []
+    for msg in messages:
+        with timed(samples):
+            process(mlist, msg, {}, 'header-match')
+    timings.append(('chain', samples))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--patterns', type=int, default=1000,
+                        help='Number of header checks to configure.')
+    parser.add_argument('-m', '--messages', type=int, default=500,
+                        help='Number of messages to check.')
+    args = parser.parse_args()
+    checks = header_checks(args.patterns)
+    with scratch_instance():
+        mlist = create_list('test@example.com')
+        lines = ['    {0}: {1}'.format(header, pattern)
+                 for header, pattern in checks]
+        config.push('header matches', '\n'.join(
+            ['[antispam]', 'jump_chain: discard', 'header_checks:'] + lines))
+        try:
+            print('Header-match chain with {0} header checks'.format(
+                args.patterns))
+            for label, samples in run(mlist, checks, args.messages):
+                report(label, samples)
+        finally:
+            config.pop('header matches')
+
+
+if __name__ == '__main__':
+    main()
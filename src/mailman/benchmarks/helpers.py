@@ -0,0 +1,89 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Common support for the benchmarks.
+
+Every benchmark is a module in this package with a `main()` function, and can
+be run with e.g. `python -m mailman.benchmarks.queue_latency`.  Benchmarks run
+against a throw-away Mailman instance in a temporary directory, set up the
+same way as the test suite's `ConfigLayer`.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'report',
+    'scratch_instance',
+    'timed',
+    ]
+
+
+import time
+
+from contextlib import contextmanager
+from mailman.testing.layers import ConfigLayer
+
+
+
+@contextmanager
+def scratch_instance():
+    """Run the body of the with statement against a temporary instance."""
+    ConfigLayer.setUp()
+    try:
+        ConfigLayer.testSetUp()
+        try:
+            yield
+        finally:
+            ConfigLayer.testTearDown()
+    finally:
+        ConfigLayer.tearDown()
+
+
+@contextmanager
+def timed(samples):
+    """Append the wall clock duration of the with statement to `samples`."""
+    start = time.time()
+    try:
+        yield
+    finally:
+        samples.append(time.time() - start)
+
+
+
+def report(label, samples, unit='ms', scale=1000.0):
+    """Print summary statistics for a list of timings in seconds.
+
+    :param label: The label to print in front of the statistics.
+    :type label: str
+    :param samples: The timings, in seconds.
+    :type samples: list of float
+    :param unit: The unit to display the statistics in.
+    :param scale: The multiplier that converts seconds to `unit`.
+    """
+    if len(samples) == 0:
+        print('{0:<24} no samples'.format(label))
+        return
+    ordered = sorted(samples)
+    count = len(ordered)
+    mean = sum(ordered) / count
+    median = ordered[count // 2]
+    p95 = ordered[min(count - 1, int(count * 0.95))]
+    print('{0:<24} n={1:<6} min={2:.2f}{6} median={3:.2f}{6} '
+          'mean={4:.2f}{6} p95={5:.2f}{6}'.format(
+              label, count, ordered[0] * scale, median * scale,
+              mean * scale, p95 * scale, unit))
@@ -0,0 +1,142 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare the throughput of the queue file formats.
+
+For every `[switchboard]qfile_format`, this enqueues a batch of messages with
+a sizeable attachment and then dequeues them in different ways: looking only
+at the headers as most runners do, looking at the whole message, and
+forwarding the message to another queue after changing a header, as the
+runners in the middle of the pipeline do.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import os
+import argparse
+
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.core.switchboard import Switchboard
+from mailman.testing.helpers import configuration
+from mailman.testing.helpers import specialized_message_from_string as mfs
+
+
+FORMATS = ('pickle', 'framed')
+
+
+
+def make_message(size):
+    """Return a two part message with an attachment of about `size` KiB."""
+    line = 'A' * 76 + '\n'
+    attachment = line * (size * 1024 // len(line))
+    return mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: A benchmark message
+Message-ID: <benchmark>
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="BOUNDARY"
+
+--BOUNDARY
+Content-Type: text/plain
+
+The attachment.
+
+--BOUNDARY
+Content-Type: application/octet-stream
+Content-Transfer-Encoding: base64
+
+{0}
+--BOUNDARY--
+""".format(attachment))
+
+
+def run_format(qfile_format, count, size):
+    """Time the queue operations for one format.
+
+    :return: The label and the list of timings of each operation.
+    """
+    timings = []
+    msg = make_message(size)
+    msg.recipients = set('person{0}@example.com'.format(i) for i in range(10))
+    inq = Switchboard('bench-in', os.path.join(config.QUEUE_DIR, 'bench-in'))
+    outq = Switchboard(
+        'bench-out', os.path.join(config.QUEUE_DIR, 'bench-out'))
+    def fill():
+        samples = []
+        for i in range(count):
+            with timed(samples):
+                inq.enqueue(msg, listname='test@example.com', number=i)
+        return samples
+    with configuration('switchboard', qfile_format=qfile_format):
+        timings.append(('enqueue', fill()))
+        samples = []
+        for filebase in inq.files:
+            with timed(samples):
+                msg, msgdata = inq.dequeue(filebase)
+                msg['message-id']
+                inq.finish(filebase)
+        timings.append(('headers only', samples))
+        fill()
+        samples = []
+        for filebase in inq.files:
+            with timed(samples):
+                msg, msgdata = inq.dequeue(filebase)
+                msg.as_string()
+                inq.finish(filebase)
+        timings.append(('whole message', samples))
+        fill()
+        samples = []
+        for filebase in inq.files:
+            with timed(samples):
+                msg, msgdata = inq.dequeue(filebase)
+                msg['X-Benchmark'] = 'yes'
+                outq.enqueue(msg, msgdata)
+                inq.finish(filebase)
+        timings.append(('forward', samples))
+    for filebase in outq.files:
+        outq.dequeue(filebase)
+        outq.finish(filebase)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=200,
+                        help='Number of messages to queue for each operation.')
+    parser.add_argument('-s', '--size', type=int, default=100,
+                        help='The size of the attachment in KiB.')
+    parser.add_argument('formats', nargs='*', default=list(FORMATS),
+                        help='The queue file formats to measure.')
+    args = parser.parse_args()
+    with scratch_instance():
+        print('Queue file operations, {0} KiB attachment'.format(args.size))
+        for qfile_format in args.formats:
+            for operation, samples in run_format(
+                    qfile_format, args.count, args.size):
+                report('{0} {1}'.format(qfile_format, operation), samples)
+
+
+if __name__ == '__main__':
+    main()
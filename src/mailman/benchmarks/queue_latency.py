@@ -0,0 +1,151 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the end-to-end latency of a message crossing the queues.
+
+The LMTP runner enqueues incoming messages in the `in` queue, from which they
+travel to the `pipeline` queue and then to the `out` queue.  This benchmark
+starts one runner process per queue, each of which simply forwards every
+message to the next queue, then injects messages one at a time and measures
+how long each takes to arrive at the end of the chain.  This is repeated for
+every `[switchboard]wakeup` mode.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import os
+import time
+import select
+import signal
+import argparse
+import traceback
+
+from mailman.benchmarks.helpers import report, scratch_instance
+from mailman.config import config
+from mailman.core.runner import Runner
+from mailman.testing.helpers import specialized_message_from_string as mfs
+
+
+HOPS = ('in', 'pipeline', 'out')
+MODES = ('sleep', 'poll', 'inotify')
+
+
+
+class HopRunner(Runner):
+    """Forward every message to the next queue in the chain."""
+
+    def __init__(self, name, next_name, results):
+        super(HopRunner, self).__init__(name)
+        self._next_name = next_name
+        self._results = results
+
+    def _process_one_file(self, msg, msgdata):
+        if self._next_name is None:
+            latency = time.time() - msgdata['bench_start']
+            os.write(self._results, '{0!r}\n'.format(latency).encode('ascii'))
+        else:
+            config.switchboards[self._next_name].enqueue(msg, msgdata)
+
+
+
+def _start_runners(results):
+    pids = []
+    for index, name in enumerate(HOPS):
+        next_name = (HOPS[index + 1] if index + 1 < len(HOPS) else None)
+        pid = os.fork()
+        if pid == 0:
+            # Child.  Never return into the parent's code.
+            status = 0
+            try:
+                runner = HopRunner(name, next_name, results)
+                runner.set_signals()
+                runner.run()
+            except:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        pids.append(pid)
+    return pids
+
+
+def _stop_runners(pids):
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    for pid in pids:
+        os.waitpid(pid, 0)
+
+
+def run_mode(mode, count, sleep_time):
+    msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: A benchmark message
+Message-ID: <bench>
+
+Hello.
+""")
+    sections = ['[switchboard]', 'wakeup: ' + mode]
+    for name in HOPS:
+        sections.extend(['[runner.{0}]'.format(name),
+                         'sleep_time: ' + sleep_time])
+    config.push('queue latency', '\n'.join(sections))
+    read_fd, write_fd = os.pipe()
+    pids = _start_runners(write_fd)
+    samples = []
+    try:
+        # Give the runners a chance to start up.
+        time.sleep(1)
+        for i in range(count):
+            config.switchboards[HOPS[0]].enqueue(
+                msg, listname='test@example.com', bench_start=time.time())
+            readable, ignore, ignore = select.select([read_fd], [], [], 60)
+            if not readable:
+                raise RuntimeError('Timed out waiting for the message')
+            samples.append(float(os.read(read_fd, 64)))
+    finally:
+        _stop_runners(pids)
+        os.close(read_fd)
+        os.close(write_fd)
+        config.pop('queue latency')
+    return samples
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=20,
+                        help='Number of messages to send in each mode.')
+    parser.add_argument('-s', '--sleep-time', default='1s',
+                        help='The runners\' sleep_time.')
+    parser.add_argument('modes', nargs='*', default=list(MODES),
+                        help='The wakeup modes to measure.')
+    args = parser.parse_args()
+    with scratch_instance():
+        print('End-to-end latency over {0} hops ({1}), sleep_time={2}'.format(
+            len(HOPS), ' -> '.join(HOPS), args.sleep_time))
+        for mode in args.modes:
+            report(mode, run_mode(mode, args.count, args.sleep_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure the REST server under concurrent load.
+
+This seeds the database with mailing lists and their members, then starts the
+REST runner with each given `[webservice]workers` setting, and has a number of
+local clients send it requests at the same time.  Half of the requests are
+slow roster listings, the other half are cheap requests for the system
+information.  It reports the latency of both kinds of requests, and the
+requests served per second.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import os
+import signal
+import httplib
+import argparse
+import threading
+import traceback
+
+from base64 import b64encode
+from zope.component import getUtility
+
+from mailman.app.lifecycle import create_list
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.interfaces.usermanager import IUserManager
+from mailman.testing.helpers import configuration, wait_for_webservice
+
+
+WORKERS = (0, 4)
+
+
+
+def populate(list_count, member_count):
+    """Create the mailing lists, and subscribe their members."""
+    user_manager = getUtility(IUserManager)
+    for i in range(list_count):
+        mlist = create_list('list{0:03d}@example.com'.format(i))
+        for j in range(member_count):
+            email = 'person{0:03d}.{1:05d}@example.com'.format(i, j)
+            mlist.subscribe(user_manager.create_address(email))
+    config.db.commit()
+
+
+def start_server():
+    """Start the REST runner in a child process, like the master does."""
+    # The REST application can only be imported once Mailman is configured.
+    from mailman.runners.rest import RESTRunner
+    pid = os.fork()
+    if pid == 0:
+        status = 1
+        try:
+            config.db.after_fork()
+            runner = RESTRunner('rest')
+            runner.set_signals()
+            runner.run()
+            status = 0
+        except:
+            traceback.print_exc()
+        finally:
+            os._exit(status)
+    wait_for_webservice()
+    return pid
+
+
+def client(paths, latencies, errors):
+    """Request each path in turn, timing the requests by their kind."""
+    headers = dict(Authorization='Basic ' + b64encode('{0}:{1}'.format(
+        config.webservice.admin_user, config.webservice.admin_pass)))
+    for kind, path in paths:
+        connection = httplib.HTTPConnection(
+            config.webservice.hostname, int(config.webservice.port))
+        try:
+            with timed(latencies[kind]):
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            if response.status // 100 != 2:
+                errors.append(response.status)
+        except (IOError, httplib.HTTPException) as error:
+            errors.append(error)
+        finally:
+            connection.close()
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-l', '--lists', type=int, default=10,
+                        help='The number of mailing lists.')
+    parser.add_argument('-m', '--members', type=int, default=500,
+                        help='The number of members of each list.')
+    parser.add_argument('-c', '--clients', type=int, default=8,
+                        help='The number of concurrent clients.')
+    parser.add_argument('-n', '--requests', type=int, default=50,
+                        help='The number of requests each client sends.')
+    parser.add_argument('workers', nargs='*', type=int,
+                        default=list(WORKERS),
+                        help='The numbers of REST workers to measure.')
+    args = parser.parse_args()
+    with scratch_instance():
+        populate(args.lists, args.members)
+        base = '/{0}'.format(config.webservice.api_version)
+        for workers in args.workers:
+            with configuration('webservice', workers=workers):
+                pid = start_server()
+            latencies = dict(roster=[], system=[])
+            errors = []
+            threads = []
+            for i in range(args.clients):
+                paths = []
+                for j in range(args.requests):
+                    if j % 2 == 0:
+                        path = '{0}/lists/list{1:03d}.example.com/roster/{2}'
+                        paths.append(('roster', path.format(
+                            base, (i + j) % args.lists, 'member')))
+                    else:
+                        paths.append(('system', base + '/system'))
+                threads.append(threading.Thread(
+                    target=client, args=(paths, latencies, errors)))
+            samples = []
+            with timed(samples):
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            os.kill(pid, signal.SIGTERM)
+            os.waitpid(pid, 0)
+            print('{0} workers, {1} clients'.format(workers, args.clients))
+            report('roster listing', latencies['roster'])
+            report('system', latencies['system'])
+            print('{0:<24} {1:.0f} requests/s, {2} errors'.format(
+                'throughput', args.clients * args.requests / samples[0],
+                len(errors)))
+
+
+if __name__ == '__main__':
+    main()
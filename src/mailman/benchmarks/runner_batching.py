@@ -0,0 +1,92 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Measure batching the transactions of a runner.
+
+This runs the pipeline runner over a number of list posts, once for every
+given `[runner.pipeline]batch_size`.  The posting pipeline updates the list
+in the database for every post, so every transaction has something to
+commit.  It reports how long processing the posts took, and the commits per
+second and messages per commit of the runner.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import argparse
+
+from mailman.app.lifecycle import create_list
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.runners.pipeline import PipelineRunner
+from mailman.testing.helpers import (
+    configuration, get_queue_messages, make_testable_runner,
+    specialized_message_from_string as mfs)
+
+
+BATCH_SIZES = (1, 10, 100)
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--count', type=int, default=1000,
+                        help='The number of posts to process.')
+    parser.add_argument('sizes', nargs='*', type=int,
+                        default=list(BATCH_SIZES),
+                        help='The batch sizes to measure.')
+    args = parser.parse_args()
+    with scratch_instance():
+        mlist = create_list('test@example.com')
+        config.db.commit()
+        for batch_size in args.sizes:
+            for i in range(args.count):
+                msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: Post {0}
+Message-ID: <post{0}@example.com>
+
+A post.
+""".format(i))
+                config.switchboards['pipeline'].enqueue(
+                    msg, listname=mlist.fqdn_listname, to_list=True)
+            samples = []
+            with configuration('runner.pipeline',
+                               batch_size=batch_size, batch_time='1h'):
+                runner = make_testable_runner(PipelineRunner, 'pipeline')
+                with timed(samples):
+                    runner.run()
+            for name in ('out', 'archive', 'digest', 'nntp', 'shunt'):
+                get_queue_messages(name)
+            elapsed = samples[0]
+            print('Batches of {0} posts'.format(batch_size))
+            report('process posts', samples, unit='s', scale=1.0)
+            print('{0:<24} {1:.0f} messages/s, {2:.1f} commits/s, '
+                  '{3:.1f} messages per commit'.format(
+                      'throughput', runner.committed_messages / elapsed,
+                      runner.commits / elapsed,
+                      runner.committed_messages / float(runner.commits)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compare how the master starts the runners, with exec or with fork.
+
+For every `[mailman]runner_startup` mode, this starts a number of slices of
+a runner under the master, and measures how long it takes until all of them
+have started, i.e. have logged that they did.  It then reports the memory
+the runners use: their resident set size, and their proportional set size,
+which divides the memory shared by several processes among them.  This
+needs Linux's /proc/<pid>/smaps.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'main',
+    ]
+
+
+import os
+import sys
+import time
+import argparse
+
+from mailman.benchmarks.helpers import report, scratch_instance, timed
+from mailman.config import config
+from mailman.testing.helpers import TestableMaster, configuration
+
+
+MODES = ('exec', 'fork')
+STARTED = 'runner started.'
+
+
+
+def count_started():
+    """Count the runners which logged that they started."""
+    count = 0
+    for filename in os.listdir(config.LOG_DIR):
+        with open(os.path.join(config.LOG_DIR, filename)) as fp:
+            count += sum(1 for line in fp if STARTED in line)
+    return count
+
+
+def memory(pid):
+    """Return the RSS and PSS of a process, in KiB."""
+    rss = pss = 0
+    with open('/proc/{0}/smaps'.format(pid)) as fp:
+        for line in fp:
+            if line.startswith('Rss:'):
+                rss += int(line.split()[1])
+            elif line.startswith('Pss:'):
+                pss += int(line.split()[1])
+    return rss, pss
+
+
+def run_mode(mode, runner, count, timeout):
+    """Start `count` slices of the runner, and measure them.
+
+    :return: The startup time, and the RSS and PSS of every runner.
+    """
+    samples = []
+    started = count_started()
+    # bin/runner is installed next to the interpreter, not next to
+    # `python -m`'s argv[0], which the master would look for it in.
+    bin_dir = os.path.dirname(sys.executable)
+    with configuration('mailman', runner_startup=mode), \
+         configuration('paths.testing', bin_dir=bin_dir), \
+         configuration('runner.' + runner, instances=count):
+        master = TestableMaster()
+        with timed(samples):
+            master.start(runner)
+            until = time.time() + timeout
+            while (count_started() - started < count and
+                   time.time() < until):
+                time.sleep(0.01)
+        try:
+            usage = [memory(pid) for pid in master.runner_pids]
+        finally:
+            master.stop()
+    return samples, usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-r', '--runner', default='virgin',
+                        help='The runner to start.')
+    parser.add_argument('-n', '--count', type=int, default=16,
+                        help='The number of slices to start, a power of 2.')
+    parser.add_argument('-t', '--timeout', type=int, default=120,
+                        help='The maximum number of seconds to wait.')
+    parser.add_argument('modes', nargs='*', default=list(MODES),
+                        help='The runner startup modes to measure.')
+    args = parser.parse_args()
+    with scratch_instance():
+        print('Starting {0} {1} runners'.format(args.count, args.runner))
+        for mode in args.modes:
+            samples, usage = run_mode(
+                mode, args.runner, args.count, args.timeout)
+            report('{0} startup'.format(mode), samples, unit='s', scale=1.0)
+            rss = sum(used[0] for used in usage) // 1024
+            pss = sum(used[1] for used in usage) // 1024
+            print('{0:<24} total RSS={1}MiB PSS={2}MiB'.format(
+                '{0} memory'.format(mode), rss, pss))
+
+
+if __name__ == '__main__':
+    main()
@@ -28,26 +28,36 @@ __all__ = [
 
 import os
 import sys
+import time
 import errno
+import random
 import signal
 import socket
 import logging
+import traceback
 
 from datetime import timedelta
 from enum import Enum
 from flufl.lock import Lock, NotLockedError, TimeOutError
 from lazr.config import as_boolean
 
+from mailman.bin.runner import start_runner
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
+from mailman.core.switchboard import Switchboard
 from mailman.options import Options
+from mailman.utilities.modules import find_name
 
 
 DOT = '.'
 LOCK_LIFETIME = timedelta(days=1, hours=6)
 SECONDS_IN_A_DAY = 86400
 SUBPROC_START_WAIT = timedelta(seconds=20)
+# How often the master checks the queues whose runners it scales, and how long
+# a queue must have stayed short before one of its runners is stopped.
+SCALING_INTERVAL = 1.0
+SCALE_DOWN_DELAY = 30.0
 
 
 
@@ -60,9 +70,9 @@ class ScriptOptions(Options):
 Master subprocess watcher.
 
 Start and watch the configured runners and ensure that they stay alive and
-kicking.  Each runner is forked and exec'd in turn, with the master waiting on
-their process ids.  When it detects a child runner has exited, it may restart
-it.
+kicking.  Each runner is forked and exec'd in turn, or only forked when
+`[mailman]runner_startup` is `fork`, with the master waiting on their process
+ids.  When it detects a child runner has exited, it may restart it.
 
 The runners respond to SIGINT, SIGTERM, SIGUSR1 and SIGHUP.  SIGINT, SIGTERM
 and SIGUSR1 all cause a runner to exit cleanly.  The master will restart
@@ -289,6 +299,80 @@ class PIDWatcher:
         return self._pids.pop(pid, None)
 
 
+
+class QueueScaler:
+    """Vary the number of runners for a queue with the depth of the queue."""
+
+    def __init__(self, name, runner_config):
+        """Create a scaler.
+
+        :param name: The runner's name.
+        :type name: string
+        :param runner_config: The runner's configuration section.
+        """
+        self.name = name
+        self.minimum = int(runner_config.instances)
+        self.maximum = int(runner_config.max_instances)
+        self.files_per_instance = max(1, int(runner_config.files_per_instance))
+        self.max_restarts = int(runner_config.max_restarts)
+        self.switchboard = Switchboard(
+            name, config.switchboards[name].queue_directory, shared=True)
+        # The process ids of the running runners, by their instance number.
+        self.pids = {}
+        # The process ids of the runners being stopped.
+        self.stopping = set()
+        # The number of runners which exited on their own.
+        self.failures = 0
+        self._short_since = None
+
+    def wanted(self, now):
+        """Return the number of runners the queue needs.
+
+        Runners are added as soon as the queue backs up, but only removed
+        one at a time, once the queue has stayed short for a while.  When
+        too many runners have exited on their own, the number stays as it
+        is.
+
+        :param now: The current time, in seconds since the epoch.
+        :type now: float
+        :rtype: int
+        """
+        running = len(self.pids)
+        if self.failures > self.max_restarts:
+            return running
+        depth = self.switchboard.count()
+        wanted = -(-depth // self.files_per_instance)
+        wanted = max(self.minimum, min(self.maximum, wanted))
+        if wanted >= running:
+            self._short_since = None
+            return wanted
+        if self._short_since is None:
+            self._short_since = now
+        if now - self._short_since < SCALE_DOWN_DELAY:
+            return running
+        self._short_since = now
+        return running - 1
+
+    def spec(self, number):
+        """Return the runner spec of an instance."""
+        return '{0}:{1:d}:{2:d}'.format(self.name, number, self.maximum)
+
+    def exited(self, pid):
+        """Forget a runner which exited.
+
+        :return: Whether the runner exited on its own, rather than being
+            stopped by the scaler.
+        :rtype: bool
+        """
+        if pid in self.stopping:
+            self.stopping.discard(pid)
+            return False
+        for number, running_pid in self.pids.items():
+            if running_pid == pid:
+                del self.pids[number]
+        return True
+
+
 
 class Loop:
     """Main control loop class."""
@@ -298,6 +382,10 @@ class Loop:
         self._restartable = restartable
         self._config_file = config_file
         self._kids = PIDWatcher()
+        # The scalers of the queues whose number of runners varies, by
+        # runner name, and whether to keep on scaling them.
+        self._scalers = {}
+        self._scaling = False
 
     def install_signal_handlers(self):
         """Install various signals handlers for control from the master."""
@@ -326,12 +414,14 @@ class Loop:
         # SIGTERM is what init will kill this process with when changing run
         # levels.  It's also the signal 'bin/mailman stop' uses.
         def sigterm_handler(signum, frame):
+            self._scaling = False
             for pid in self._kids:
                 os.kill(pid, signal.SIGTERM)
             log.info('Master watcher caught SIGTERM.  Exiting.')
         signal.signal(signal.SIGTERM, sigterm_handler)
         # SIGINT is what control-C gives.
         def sigint_handler(signum, frame):
+            self._scaling = False
             for pid in self._kids:
                 os.kill(pid, signal.SIGINT)
             log.info('Master watcher caught SIGINT.  Restarting.')
@@ -358,6 +448,8 @@ class Loop:
         # running under bin/master control.  This subtly changes the error
         # behavior of bin/runner.
         os.environ['MAILMAN_UNDER_MASTER_CONTROL'] = '1'
+        if config.mailman.runner_startup == 'fork':
+            self._run_forked(spec)
         # Craft the command line arguments for the exec() call.
         rswitch = '--runner=' + spec
         # Wherever master lives, so too must live the runner script.
@@ -373,6 +465,51 @@ class Loop:
         # We should never get here.
         raise RuntimeError('os.execl() failed')
 
+    def _run_forked(self, spec):
+        """Run a runner in this child process, which the master forked.
+
+        This never returns into the master's code; the child process exits
+        when the runner stops.
+
+        :param spec: A runner spec, i.e. name:slice:count
+        :type spec: string
+        """
+        status = 1
+        try:
+            # Undo what the child inherited from the master which must not be
+            # shared with it.
+            for signum in (signal.SIGALRM, signal.SIGHUP, signal.SIGUSR1,
+                           signal.SIGTERM):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            random.seed()
+            reopen()
+            config.db.after_fork()
+            log = logging.getLogger('mailman.runner')
+            log.debug('forked: %s', spec)
+            name, slice_number, count = spec.split(':')
+            status = start_runner(name, int(slice_number), int(count))
+        except SystemExit as error:
+            if error.code is None:
+                status = 0
+            elif isinstance(error.code, int):
+                status = error.code
+            else:
+                print(error.code, file=sys.stderr)
+        except:
+            traceback.print_exc()
+        finally:
+            # Clean up as the interpreter does when it exits, but without
+            # unwinding the master's stack.
+            try:
+                exitfunc = getattr(sys, 'exitfunc', None)
+                if exitfunc is not None:
+                    exitfunc()
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
     def start_runners(self, runner_names=None):
         """Start all the configured runners.
 
@@ -388,6 +525,18 @@ class Loop:
                     'Unexpected runner configuration section name: {0}'.format(
                     runner_config.name))
                 runner_names.append(runner_config.name[7:])
+        if config.mailman.runner_startup == 'fork':
+            # Import the runners here, once, so that the forked runners share
+            # the modules instead of each importing them.
+            for name in runner_names:
+                runner_config = getattr(config, 'runner.' + name, None)
+                if runner_config is None:
+                    continue
+                try:
+                    find_name(runner_config['class'])
+                except ImportError:
+                    # The runner reports this when it starts.
+                    pass
         # For each runner we want to start, find their config section, which
         # will tell us the name of the class to instantiate, along with the
         # number of hash space slices to manage.
@@ -397,6 +546,16 @@ class Loop:
             runner_config = getattr(config, section_name)
             if not as_boolean(runner_config.start):
                 continue
+            if (name in config.switchboards and
+                    int(runner_config.max_instances) >
+                    int(runner_config.instances)):
+                # The number of runners varies with the depth of the queue.
+                scaler = QueueScaler(name, runner_config)
+                self._scalers[name] = scaler
+                self._scaling = True
+                for number in range(scaler.minimum):
+                    self._start_instance(scaler, number)
+                continue
             # Find out how many runners to instantiate.  This must be a power
             # of 2.
             count = int(runner_config.instances)
@@ -411,6 +570,70 @@ class Loop:
                 log.debug('[{0:d}] {1}'.format(pid, spec))
                 self._kids.add(pid, info)
 
+    def _start_instance(self, scaler, number):
+        """Start an instance of a runner whose number of runners varies."""
+        spec = scaler.spec(number)
+        pid = self._start_runner(spec)
+        log = logging.getLogger('mailman.runner')
+        log.debug('[{0:d}] {1}'.format(pid, spec))
+        scaler.pids[number] = pid
+        self._kids.add(pid, (scaler.name, number, scaler.maximum, 0))
+
+    def scale(self, now=None):
+        """Start or stop runners for the queues which backed up or drained.
+
+        :param now: The current time, in seconds since the epoch.  If not
+            given, the current time is used.
+        :type now: float
+        """
+        if now is None:
+            now = time.time()
+        log = logging.getLogger('mailman.runner')
+        for scaler in self._scalers.values():
+            wanted = scaler.wanted(now)
+            running = len(scaler.pids)
+            if wanted > running:
+                log.info('Scaling %s up from %d to %d runners',
+                         scaler.name, running, wanted)
+                number = 0
+                while len(scaler.pids) < wanted:
+                    if number not in scaler.pids:
+                        self._start_instance(scaler, number)
+                    number += 1
+            elif wanted < running:
+                log.info('Scaling %s down from %d to %d runners',
+                         scaler.name, running, wanted)
+                while len(scaler.pids) > wanted:
+                    # Runners stop cleanly on SIGTERM, leaving the files they
+                    # haven't dequeued yet to the others.
+                    pid = scaler.pids.pop(max(scaler.pids))
+                    scaler.stopping.add(pid)
+                    try:
+                        os.kill(pid, signal.SIGTERM)
+                    except OSError as error:
+                        if error.errno != errno.ESRCH:
+                            raise
+
+    def _wait(self):
+        """Wait for a runner to exit, scaling the runners in the meantime.
+
+        :return: The process id and exit status of the runner.
+        :rtype: 2-tuple
+        """
+        while self._scaling:
+            self.scale()
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as error:
+                # There may be no runners at all for a while.
+                if error.errno != errno.ECHILD:
+                    raise
+            else:
+                if pid != 0:
+                    return pid, status
+            time.sleep(SCALING_INTERVAL)
+        return os.wait()
+
     def _pause(self):
         """Sleep until a signal is received."""
         # Sleep until a signal is received.  This prevents the master from
@@ -429,7 +652,7 @@ class Loop:
         self._pause()
         while True:
             try:
-                pid, status = os.wait()
+                pid, status = self._wait()
             except OSError as error:
                 # No children?  We're done.
                 if error.errno == errno.ECHILD:
@@ -453,6 +676,15 @@ class Loop:
             # runaway restarts (e.g.  if the subprocess had a syntax error!)
             rname, slice_number, count, restarts = self._kids.pop(pid)
             config_name = 'runner.' + rname
+            scaler = self._scalers.get(rname)
+            if scaler is not None:
+                stopped = not scaler.exited(pid)
+                # Put the files the runner had claimed back in the queue.
+                scaler.switchboard.recover_backup_files()
+                if stopped:
+                    log.debug('Master stopped runner {0}, instance {1:d}'
+                              .format(rname, slice_number))
+                    continue
             restart = False
             if why == signal.SIGUSR1 and self._restartable:
                 restart = True
@@ -479,11 +711,18 @@ Runner {0} reached maximum restart limit of {1:d}, not restarting.""",
                 new_pid = self._start_runner(spec)
                 new_info = (rname, slice_number, count, restarts)
                 self._kids.add(new_pid, new_info)
+                if scaler is not None:
+                    scaler.pids[slice_number] = new_pid
+            elif scaler is not None:
+                # The scaler starts another runner when the queue needs one,
+                # unless too many have failed.
+                scaler.failures += 1
         log.info('Master stopped')
 
     def cleanup(self):
         """Ensure that all children have exited."""
         log = logging.getLogger('mailman.runner')
+        self._scaling = False
         # Send SIGTERMs to all the child processes and wait for them all to
         # exit.
         for pid in self._kids:
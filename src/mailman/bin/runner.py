@@ -22,6 +22,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'main',
+    'start_runner',
     ]
 
 
@@ -97,6 +98,25 @@ def make_runner(name, slice, range, once=False):
     return runner_class(name, slice)
 
 
+def start_runner(name, slice, range, once=False):
+    """Make a runner and run it until it stops.
+
+    The system must already be initialized.  This is what a runner process
+    does, whether it was started as `bin/runner` or forked by the master.
+
+    :return: The runner's exit status.
+    :rtype: int
+    """
+    runner = make_runner(name, slice, range, once=once)
+    runner.set_signals()
+    # Now start up the main loop
+    log = logging.getLogger('mailman.runner')
+    log.info('%s runner started.', runner.name)
+    runner.run()
+    log.info('%s runner exiting.', runner.name)
+    return runner.status
+
+
 
 def main():
     global log
@@ -194,10 +214,4 @@ def main():
             print(_('$name runs $classname'))
         sys.exit(0)
 
-    runner = make_runner(*args.runner, once=args.once)
-    runner.set_signals()
-    # Now start up the main loop
-    log.info('%s runner started.', runner.name)
-    runner.run()
-    log.info('%s runner exiting.', runner.name)
-    sys.exit(runner.status)
+    sys.exit(start_runner(*args.runner, once=args.once))
@@ -21,17 +21,31 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'TestForkedRunners',
+    'TestMasterLock',
+    'TestRunnerScaling',
     ]
 
 
 import os
+import mock
+import time
 import errno
+import signal
 import tempfile
 import unittest
 
 from flufl.lock import Lock
 
+from mailman.app.lifecycle import create_list
 from mailman.bin import master
+from mailman.config import config
+from mailman.testing.helpers import (
+    TestableMaster,
+    configuration,
+    get_queue_messages,
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
 
 
 
@@ -71,3 +85,222 @@ class TestMasterLock(unittest.TestCase):
             my_lock.unlock()
         self.assertEqual(state, master.WatcherState.conflict)
         # XXX test stale_lock and host_mismatch states.
+
+
+
+class TestForkedRunners(unittest.TestCase):
+    """Test runners forked by the master, without exec."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        config.db.commit()
+
+    def _wait_for_files(self, queue_name):
+        switchboard = config.switchboards[queue_name]
+        until = time.time() + 10
+        while len(switchboard.files) == 0 and time.time() < until:
+            time.sleep(0.1)
+
+    @configuration('mailman', runner_startup='fork')
+    def test_forked_runner(self):
+        # A forked runner processes messages, using its own connection to the
+        # database.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+Forked.
+""")
+        config.switchboards['virgin'].enqueue(
+            msg, listname='test@example.com',
+            recipients=set(['bart@example.com']))
+        lmaster = TestableMaster()
+        lmaster.start('virgin')
+        try:
+            self._wait_for_files('out')
+        finally:
+            lmaster.stop()
+        messages = get_queue_messages('out')
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0].msg['message-id'], '<ant>')
+        self.assertEqual(messages[0].msgdata['recipients'],
+                         set(['bart@example.com']))
+        # The test's own connection to the database still works.
+        self.assertEqual(self._mlist.fqdn_listname, 'test@example.com')
+        config.db.store.execute('SELECT 1')
+
+    @configuration('mailman', runner_startup='fork')
+    @configuration('runner.virgin', max_instances=3, files_per_instance=1)
+    def test_scaled_runners(self):
+        # Runners sharing the queue process every message exactly once.
+        for i in range(20):
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{0}>
+
+Scaled.
+""".format(i))
+            config.switchboards['virgin'].enqueue(
+                msg, listname='test@example.com',
+                recipients=set(['bart@example.com']))
+        lmaster = TestableMaster()
+        lmaster.start('virgin')
+        try:
+            until = time.time() + 20
+            while (len(config.switchboards['out'].files) < 20 and
+                   time.time() < until):
+                time.sleep(0.1)
+            self.assertGreater(len(lmaster._scalers['virgin'].pids), 1)
+        finally:
+            lmaster.stop()
+        message_ids = sorted(item.msg['message-id']
+                             for item in get_queue_messages('out'))
+        self.assertEqual(message_ids,
+                         sorted('<ant{0}>'.format(i) for i in range(20)))
+        self.assertEqual(os.listdir(
+            config.switchboards['virgin'].queue_directory), [])
+
+    def _exit_status(self, pid):
+        pid, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WIFEXITED(status))
+        return os.WEXITSTATUS(status)
+
+    @configuration('mailman', runner_startup='fork')
+    def test_exit_status(self):
+        # The forked runner exits with the runner's status, without returning
+        # into the master.
+        loop = master.Loop()
+        with mock.patch('mailman.bin.master.start_runner', return_value=3):
+            pid = loop._start_runner('virgin:0:1')
+        self.assertEqual(self._exit_status(pid), 3)
+
+    @configuration('mailman', runner_startup='fork')
+    def test_sys_exit(self):
+        loop = master.Loop()
+        with mock.patch('mailman.bin.master.start_runner',
+                        side_effect=SystemExit):
+            pid = loop._start_runner('virgin:0:1')
+        self.assertEqual(self._exit_status(pid), 0)
+
+    @configuration('mailman', runner_startup='fork')
+    def test_uncaught_exception(self):
+        loop = master.Loop()
+        with mock.patch('mailman.bin.master.start_runner',
+                        side_effect=RuntimeError), \
+             mock.patch('mailman.bin.master.traceback'):
+            pid = loop._start_runner('virgin:0:1')
+        self.assertEqual(self._exit_status(pid), 1)
+
+
+
+
+class TestRunnerScaling(unittest.TestCase):
+    """Test varying the number of runners with the depth of their queue."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._loop = master.Loop()
+        self._pids = iter(range(1000, 2000))
+        self._specs = []
+        def start_runner(spec):
+            self._specs.append(spec)
+            return next(self._pids)
+        patcher = mock.patch.object(
+            self._loop, '_start_runner', side_effect=start_runner)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('mailman.bin.master.os.kill')
+        self._kill = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        get_queue_messages('out')
+
+    def _enqueue(self, count):
+        for i in range(count):
+            config.switchboards['out'].enqueue(self._msg)
+
+    @configuration('runner.out', max_instances=4, files_per_instance=2)
+    def test_start_minimum(self):
+        self._loop.start_runners(['out'])
+        self.assertEqual(self._specs, ['out:0:4'])
+
+    @configuration('runner.out', instances=3, max_instances=4)
+    def test_minimum_not_power_of_2(self):
+        self._loop.start_runners(['out'])
+        self.assertEqual(self._specs, ['out:0:4', 'out:1:4', 'out:2:4'])
+
+    @configuration('runner.out', max_instances=4, files_per_instance=2)
+    def test_scale_up(self):
+        self._loop.start_runners(['out'])
+        self._enqueue(5)
+        self._loop.scale(0)
+        self.assertEqual(self._specs, ['out:0:4', 'out:1:4', 'out:2:4'])
+        self._enqueue(10)
+        self._loop.scale(1)
+        self.assertEqual(self._specs[3:], ['out:3:4'])
+        self.assertEqual(self._kill.call_count, 0)
+
+    @configuration('runner.out', max_instances=4, files_per_instance=2)
+    def test_scale_down(self):
+        self._loop.start_runners(['out'])
+        self._enqueue(5)
+        self._loop.scale(0)
+        get_queue_messages('out')
+        # The queue must stay short for a while before a runner is stopped.
+        self._loop.scale(1)
+        self.assertEqual(self._kill.call_count, 0)
+        self._loop.scale(1 + master.SCALE_DOWN_DELAY)
+        self._kill.assert_called_once_with(1002, signal.SIGTERM)
+        # And again before the next one is stopped.
+        self._loop.scale(2 + master.SCALE_DOWN_DELAY)
+        self.assertEqual(self._kill.call_count, 1)
+        self._loop.scale(1 + 2 * master.SCALE_DOWN_DELAY)
+        self._kill.assert_called_with(1001, signal.SIGTERM)
+        # But never below the minimum.
+        self._loop.scale(1 + 4 * master.SCALE_DOWN_DELAY)
+        self.assertEqual(self._kill.call_count, 2)
+
+    @configuration('runner.out', max_instances=4, files_per_instance=2)
+    def test_reuse_instance_numbers(self):
+        self._loop.start_runners(['out'])
+        self._enqueue(5)
+        self._loop.scale(0)
+        scaler = self._loop._scalers['out']
+        # The runner of instance 1 died.
+        self.assertTrue(scaler.exited(1001))
+        self._loop.scale(1)
+        self.assertEqual(self._specs[3:], ['out:1:4'])
+
+    @configuration('runner.out', max_instances=4, files_per_instance=2)
+    def test_stopped_runner(self):
+        self._loop.start_runners(['out'])
+        self._enqueue(3)
+        self._loop.scale(0)
+        get_queue_messages('out')
+        self._loop.scale(1)
+        self._loop.scale(1 + master.SCALE_DOWN_DELAY)
+        # The runner exiting is expected, and it is not counted as a failure.
+        scaler = self._loop._scalers['out']
+        self.assertFalse(scaler.exited(1001))
+        self.assertEqual(scaler.pids, {0: 1000})
+
+    @configuration('runner.out', max_instances=4, files_per_instance=2,
+                   max_restarts=1)
+    def test_too_many_failures(self):
+        self._loop.start_runners(['out'])
+        self._loop._scalers['out'].failures = 2
+        self._enqueue(5)
+        self._loop.scale(0)
+        self.assertEqual(self._specs, ['out:0:4'])
@@ -22,11 +22,13 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'HeaderMatchChain',
+    'handle_ListDeletedEvent',
     ]
 
 
 import re
 import logging
+import weakref
 
 from zope.interface import implementer
 
@@ -34,11 +36,17 @@ from mailman.chains.base import Chain, Link
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.interfaces.chain import LinkAction
+from mailman.interfaces.listmanager import ListDeletedEvent
 from mailman.interfaces.rules import IRule
 
 
 log = logging.getLogger('mailman.error')
 
+# Patterns which refer to their own groups can't be combined with others,
+# since the groups are numbered differently in the combined pattern, and
+# neither can patterns which set flags, since those apply to all of it.
+UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[iLmsux]+\)')
+
 
 
 def make_link(header, pattern):
@@ -70,6 +78,8 @@ class HeaderMatchRule:
     def __init__(self, header, pattern):
         self.header = header
         self.pattern = pattern
+        # Invalid patterns are rejected before the rule is registered.
+        self.regex = re.compile(pattern, re.IGNORECASE)
         self.name = 'header-match-{0:02}'.format(HeaderMatchRule._count)
         HeaderMatchRule._count += 1
         self.description = '{0}: {1}'.format(header, pattern)
@@ -80,6 +90,8 @@ class HeaderMatchRule:
         # rule name.  I suppose we could do the better hit recording in the
         # check() method, and set self.record = False.
         self.record = True
+        # The matcher this rule was compiled into, if any.
+        self.matcher = None
         # Register this rule so that other parts of the system can query it.
         assert self.name not in config.rules, (
             'Duplicate HeaderMatchRule: {0} [{1}: {2}]'.format(
@@ -88,12 +100,96 @@ class HeaderMatchRule:
 
     def check(self, mlist, msg, msgdata):
         """See `IRule`."""
+        if self.matcher is not None:
+            return self in self.matcher.matches(msg)
         for value in msg.get_all(self.header, []):
-            if re.search(self.pattern, value, re.IGNORECASE):
+            if self.regex.search(value):
                 return True
         return False
 
 
+
+class HeaderMatcher:
+    """A set of header match rules compiled together.
+
+    The patterns for each header are combined into a single alternation.
+    Only when that matches a header value are the rules' own patterns tried,
+    to find out which of them matched.  The rules of a matcher are checked
+    together, the first time one of them is checked for a message.
+    """
+
+    def __init__(self, entries):
+        """Compile the header matches.
+
+        :param entries: The header names and patterns to match them with.
+            Invalid patterns are logged and skipped.
+        :type entries: sequence of 2-tuples
+        """
+        self.links = []
+        # header -> (combined pattern, rules outside of it, all rules)
+        self._headers = {}
+        self._memo = None
+        rules = {}
+        for header, pattern in entries:
+            try:
+                rule = HeaderMatchRule(header, pattern)
+            except re.error as error:
+                log.error('Invalid header match pattern: {0}: {1} ({2})'.format(
+                    header, pattern, error))
+                continue
+            rule.matcher = self
+            self.links.append(Link(rule, LinkAction.defer))
+            rules.setdefault(header.lower(), []).append(rule)
+        for header, header_rules in rules.items():
+            combinable = [rule for rule in header_rules
+                          if UNCOMBINABLE.search(rule.pattern) is None]
+            try:
+                combined = re.compile('|'.join(
+                    '(?:{0})'.format(rule.pattern) for rule in combinable),
+                    re.IGNORECASE)
+            except (re.error, AssertionError, OverflowError):
+                # E.g. too many groups, or the same group name twice.
+                combined = None
+                combinable = []
+            others = [rule for rule in header_rules if rule not in combinable]
+            self._headers[header] = (combined, others, header_rules)
+
+    def matches(self, msg):
+        """Return the rules which match the message.
+
+        The result is kept until `forget()` is called, or the rules are
+        checked for another message.
+
+        :param msg: The message.
+        :return: The matching rules.
+        :rtype: set of `HeaderMatchRule`
+        """
+        if self._memo is not None and self._memo[0]() is msg:
+            return self._memo[1]
+        matched = set()
+        for header, (combined, others, rules) in self._headers.items():
+            for value in msg.get_all(header, []):
+                candidates = (rules
+                              if combined is None or combined.search(value)
+                              else others)
+                for rule in candidates:
+                    if rule not in matched and rule.regex.search(value):
+                        matched.add(rule)
+        self._memo = (weakref.ref(msg), matched)
+        return matched
+
+    def forget(self):
+        """Forget the rules which matched the last message."""
+        self._memo = None
+
+    def unregister(self):
+        """Remove the rules from the global rule registry."""
+        for link in self.links:
+            config.rules.pop(link.rule.name, None)
+        self.links = []
+        self._headers = {}
+
+
 
 class HeaderMatchChain(Chain):
     """Default header matching chain.
@@ -106,8 +202,13 @@ class HeaderMatchChain(Chain):
             'header-match', _('The built-in header matching chain'))
         # This chain will dynamically calculate the links from the
         # configuration file, the database, and any explicitly added header
-        # checks (via the .extend() method).
-        self._extended_links = []
+        # checks (via the .extend() method).  The header checks are compiled
+        # once, and compiled again only when they change.
+        self._extended = []
+        self._site_matcher = None
+        self._extended_matcher = None
+        # fqdn_listname -> (header matches, matcher)
+        self._list_matchers = {}
 
     def extend(self, header, pattern):
         """Extend the existing header matches.
@@ -116,7 +217,12 @@ class HeaderMatchChain(Chain):
         :param pattern: The pattern to match the header's value again.  The
             match is not anchored and is done case-insensitively.
         """
-        self._extended_links.append(make_link(header, pattern))
+        # Check the pattern right away.
+        re.compile(pattern)
+        self._extended.append((header, pattern))
+        if self._extended_matcher is not None:
+            self._extended_matcher.unregister()
+            self._extended_matcher = None
 
     def flush(self):
         """See `IMutableChain`."""
@@ -125,12 +231,20 @@ class HeaderMatchChain(Chain):
         for rule_name in config.rules.keys():
             if rule_name.startswith('header-match-'):
                 del config.rules[rule_name]
-        self._extended_links = []
+        self._extended = []
+        self._site_matcher = None
+        self._extended_matcher = None
+        self._list_matchers = {}
 
-    def get_links(self, mlist, msg, msgdata):
-        """See `IChain`."""
-        # First return all the configuration file links.
-        for line in config.antispam.header_checks.splitlines():
+    def _get_site_matcher(self):
+        header_checks = config.antispam.header_checks
+        if self._site_matcher is not None:
+            checks, matcher = self._site_matcher
+            if checks == header_checks:
+                return matcher
+            matcher.unregister()
+        entries = []
+        for line in header_checks.splitlines():
             if len(line.strip()) == 0:
                 continue
             parts = line.split(':', 1)
@@ -138,15 +252,68 @@ class HeaderMatchChain(Chain):
                 log.error('Configuration error: [antispam]header_checks '
                           'contains bogus line: {0}'.format(line))
                 continue
-            yield make_link(parts[0], parts[1].lstrip())
-        # Then return all the list-specific header matches.
-        # Python 3.3: Use 'yield from'
-        for entry in mlist.header_matches:
-            yield make_link(*entry)
-        # Then return all the explicitly added links.
-        for link in self._extended_links:
-            yield link
+            entries.append((parts[0], parts[1].lstrip()))
+        matcher = HeaderMatcher(entries)
+        self._site_matcher = (header_checks, matcher)
+        return matcher
+
+    def _get_list_matcher(self, mlist):
+        header_matches = tuple(
+            tuple(entry) for entry in (mlist.header_matches or ()))
+        cached = self._list_matchers.get(mlist.fqdn_listname)
+        if cached is not None:
+            entries, matcher = cached
+            if entries == header_matches:
+                return matcher
+            self.forget_list(mlist.fqdn_listname)
+        if len(header_matches) == 0:
+            return None
+        matcher = HeaderMatcher(header_matches)
+        self._list_matchers[mlist.fqdn_listname] = (header_matches, matcher)
+        return matcher
+
+    def forget_list(self, fqdn_listname):
+        """Remove the rules for a mailing list's header matches.
+
+        :param fqdn_listname: The fully qualified name of the mailing list.
+        """
+        cached = self._list_matchers.pop(fqdn_listname, None)
+        if cached is not None:
+            entries, matcher = cached
+            matcher.unregister()
+
+    def _get_extended_matcher(self):
+        if self._extended_matcher is None and len(self._extended) > 0:
+            self._extended_matcher = HeaderMatcher(self._extended)
+        return self._extended_matcher
+
+    def get_links(self, mlist, msg, msgdata):
+        """See `IChain`."""
+        # First return all the configuration file links, then all the
+        # list-specific header matches, then all the explicitly added links.
+        matchers = (
+            self._get_site_matcher(),
+            self._get_list_matcher(mlist),
+            self._get_extended_matcher(),
+            )
+        for matcher in matchers:
+            if matcher is None:
+                continue
+            # The message, or its headers, may have changed since the rules
+            # were last checked.
+            matcher.forget()
+            for link in matcher.links:
+                yield link
         # Finally, if any of the above rules matched, jump to the chain
         # defined in the configuration file.
         yield Link(config.rules['any'], LinkAction.jump,
                    config.chains[config.antispam.jump_chain])
+
+
+
+def handle_ListDeletedEvent(event):
+    """Remove the rules for the header matches of a deleted mailing list."""
+    if isinstance(event, ListDeletedEvent):
+        chain = config.chains.get('header-match')
+        if isinstance(chain, HeaderMatchChain):
+            chain.forget_list(event.fqdn_listname)
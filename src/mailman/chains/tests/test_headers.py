@@ -27,13 +27,15 @@ __all__ = [
 
 import unittest
 
-from mailman.app.lifecycle import create_list
+from mailman.app.lifecycle import create_list, remove_list
 from mailman.chains.headers import HeaderMatchRule
 from mailman.config import config
+from mailman.core.chains import process
 from mailman.email.message import Message
 from mailman.interfaces.chain import LinkAction
 from mailman.testing.layers import ConfigLayer
-from mailman.testing.helpers import LogFileMark, configuration
+from mailman.testing.helpers import (
+    LogFileMark, configuration, specialized_message_from_string as mfs)
 
 
 
@@ -122,3 +124,94 @@ class TestHeaderChain(unittest.TestCase):
                               HeaderMatchRule, 'x-spam-score', '.*')
         finally:
             config.rules = saved_rules
+
+    def _rules(self):
+        return sorted(name for name in config.rules
+                      if name.startswith('header-match-'))
+
+    @configuration('antispam', header_checks="""
+    Foo: a+
+    Bar: bb?
+    """)
+    def test_rules_created_once(self):
+        # The header checks are compiled the first time they are needed, and
+        # not again for every message.
+        chain = config.chains['header-match']
+        first = [link.rule for link in chain.get_links(
+            self._mlist, Message(), {})]
+        rules = self._rules()
+        self.assertEqual(len(rules), 2)
+        second = [link.rule for link in chain.get_links(
+            self._mlist, Message(), {})]
+        self.assertEqual(first, second)
+        self.assertEqual(self._rules(), rules)
+
+    @configuration('antispam', jump_chain='discard', header_checks="""
+    X-Spam: yes
+    X-Spam: (ma)ybe
+    X-Spam: (.)\\1
+    X-Other: other
+    """)
+    def test_matching_rules_recorded(self):
+        # Only the rules which actually matched are recorded as hits, even
+        # though the patterns for each header are checked together.
+        msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+X-Spam: Maybe
+X-Spam: zz
+
+""")
+        msgdata = {}
+        process(self._mlist, msg, msgdata, 'header-match')
+        rules = dict((link.rule.pattern, link.rule.name)
+                     for link in config.chains['header-match'].get_links(
+                         self._mlist, msg, {})
+                     if link.rule.name != 'any')
+        self.assertEqual(sorted(msgdata['rule_hits']),
+                         sorted([rules['(ma)ybe'], rules['(.)\\1']]))
+        self.assertIn(rules['yes'], msgdata['rule_misses'])
+        self.assertIn(rules['other'], msgdata['rule_misses'])
+
+    def test_list_header_matches_changed(self):
+        # The list's header matches are compiled again when they change.
+        chain = config.chains['header-match']
+        self._mlist.header_matches = [('X-Spam', 'yes')]
+        links = list(chain.get_links(self._mlist, Message(), {}))
+        self.assertEqual(links[0].rule.pattern, 'yes')
+        rule_name = links[0].rule.name
+        self._mlist.header_matches = [('X-Spam', 'no')]
+        links = list(chain.get_links(self._mlist, Message(), {}))
+        self.assertEqual(links[0].rule.pattern, 'no')
+        # The replaced rule is gone.
+        self.assertNotIn(rule_name, config.rules)
+        self.assertEqual(len(self._rules()), 1)
+        self._mlist.header_matches = []
+        links = list(chain.get_links(self._mlist, Message(), {}))
+        self.assertEqual([link.rule.name for link in links], ['any'])
+        self.assertEqual(self._rules(), [])
+
+    def test_list_deleted(self):
+        # The rules for a list's header matches go away with the list.
+        chain = config.chains['header-match']
+        self._mlist.header_matches = [('X-Spam', 'yes')]
+        links = list(chain.get_links(self._mlist, Message(), {}))
+        rule_name = links[0].rule.name
+        remove_list(self._mlist)
+        self.assertNotIn(rule_name, config.rules)
+        self.assertEqual(self._rules(), [])
+
+    @configuration('antispam', header_checks="""
+    Foo: foo(
+    Bar: bar
+    """)
+    def test_invalid_pattern(self):
+        # An invalid pattern is skipped, with an error message logged.
+        mark = LogFileMark('mailman.error')
+        chain = config.chains['header-match']
+        patterns = [link.rule.pattern
+                    for link in chain.get_links(self._mlist, Message(), {})
+                    if link.rule.name != 'any']
+        self.assertEqual(patterns, ['bar'])
+        self.assertIn('Invalid header match pattern: Foo: foo(',
+                      mark.readline())
@@ -0,0 +1,76 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The 'evict' subcommand."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'Evict',
+    ]
+
+
+from zope.component import getUtility
+from zope.interface import implementer
+
+from mailman.core.i18n import _
+from mailman.database.transaction import transaction
+from mailman.interfaces.command import ICLISubCommand
+from mailman.interfaces.pending import IPendings
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+
+@implementer(ICLISubCommand)
+class Evict:
+    """Evict the expired pending confirmations."""
+
+    name = 'evict'
+
+    def add(self, parser, command_parser):
+        """See `ICLISubCommand`."""
+        self.parser = parser
+        command_parser.add_argument(
+            '-b', '--batch-size',
+            type=int, default=DEFAULT_BATCH_SIZE,
+            help=_("""\
+            The maximum number of expired confirmations to evict in one
+            transaction.  The transaction is committed after every batch, so
+            that the database is not locked for long.  The default is
+            %(default)s."""))
+        command_parser.add_argument(
+            '-q', '--quiet',
+            default=False, action='store_true',
+            help=_('Do not print the number of evicted confirmations.'))
+
+    def process(self, args):
+        """See `ICLISubCommand`."""
+        if args.batch_size < 1:
+            self.parser.error(_('Invalid batch size: $args.batch_size'))
+        pendings = getUtility(IPendings)
+        evicted = 0
+        while True:
+            with transaction():
+                count = pendings.evict(args.batch_size)
+            evicted += count
+            if count < args.batch_size:
+                break
+        if not args.quiet:
+            print(_('Evicted $evicted expired pending confirmations'))
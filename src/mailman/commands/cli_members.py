@@ -38,6 +38,7 @@ from mailman.app.membership import add_member
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.database.transaction import transactional
+from mailman.interfaces.bans import IBanManager
 from mailman.interfaces.command import ICLISubCommand
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.member import (
@@ -191,14 +192,22 @@ class Members:
         else:
             fp = codecs.open(args.input_filename, 'r', 'utf-8')
         try:
+            subscribers = []
             for line in fp:
                 # Ignore blank lines and lines that start with a '#'.
                 if line.startswith('#') or len(line.strip()) == 0:
                     continue
                 # Parse the line and ensure that the values are unicodes.
                 display_name, email = parseaddr(line)
-                display_name = display_name.decode(fp.encoding)
-                email = email.decode(fp.encoding)
+                subscribers.append((display_name.decode(fp.encoding),
+                                    email.decode(fp.encoding)))
+            # Check all the email addresses against the bans at once.
+            banned = IBanManager(mlist).filter_banned(
+                email for display_name, email in subscribers)
+            for display_name, email in subscribers:
+                if email in banned:
+                    print('Banned (skipping):', email, display_name)
+                    continue
                 # Give the user a default, user-friendly password.
                 password = generate(int(config.passwords.password_length))
                 try:
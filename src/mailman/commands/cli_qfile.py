@@ -31,6 +31,7 @@ from pprint import PrettyPrinter
 from zope.interface import implementer
 
 from mailman.core.i18n import _
+from mailman.core.switchboard import FramedCodec, codec_for
 from mailman.interfaces.command import ICLISubCommand
 from mailman.utilities.interact import interact
 
@@ -71,12 +72,18 @@ class QFile:
         """See `ICLISubCommand`."""
         printer = PrettyPrinter(indent=4)
         assert len(args.qfile) == 1, 'Wrong number of positional arguments'
+        # Forget the objects from any previously dumped file.
+        del m[:]
         with open(args.qfile[0]) as fp:
-            while True:
-                try:
-                    m.append(cPickle.load(fp))
-                except EOFError:
-                    break
+            codec = codec_for(fp)
+            if isinstance(codec, FramedCodec):
+                m.extend(codec.load(fp))
+            else:
+                while True:
+                    try:
+                        m.append(cPickle.load(fp))
+                    except EOFError:
+                        break
         if args.doprint:
             print(_('[----- start pickle -----]'))
             for i, obj in enumerate(m):
@@ -30,16 +30,19 @@ import signal
 import logging
 import traceback
 
+from contextlib import closing
 from cStringIO import StringIO
 from lazr.config import as_boolean, as_timedelta
 from zope.component import getUtility
 from zope.event import notify
 from zope.interface import implementer
 
+from mailman.app.senders import sender_context
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.logging import reopen
-from mailman.core.switchboard import Switchboard
+from mailman.core.switchboard import (
+    Switchboard, discard_queue_files, hold_queue_files, publish_queue_files)
 from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.listmanager import IListManager
 from mailman.interfaces.runner import IRunner, RunnerCrashEvent
@@ -50,6 +53,9 @@ dlog = logging.getLogger('mailman.debug')
 elog = logging.getLogger('mailman.error')
 rlog = logging.getLogger('mailman.runner')
 
+# How often, in seconds, a runner logs how many messages it committed.
+STATISTICS_INTERVAL = 300
+
 
 
 @implementer(IRunner)
@@ -74,8 +80,16 @@ class Runner:
         # should not have queue_directory or switchboard instance.
         if self.is_queue_runner:
             self.queue_directory = expand(section.path, substitutions)
-            self.switchboard = Switchboard(
-                name, self.queue_directory, slice, numslices, True)
+            if (as_boolean(section.shared_queue) or
+                    int(section.max_instances) > numslices):
+                # The master varies the number of instances, or runners on
+                # other hosts process the queue too.  They all share the
+                # whole queue directory.
+                self.switchboard = Switchboard(
+                    name, self.queue_directory, recover=True, shared=True)
+            else:
+                self.switchboard = Switchboard(
+                    name, self.queue_directory, slice, numslices, True)
         else:
             self.queue_directory = None
             self.switchboard= None
@@ -84,10 +98,19 @@ class Runner:
         self.sleep_float = (86400 * self.sleep_time.days +
                             self.sleep_time.seconds +
                             self.sleep_time.microseconds / 1.0e6)
+        self.batch_size = max(1, int(section.batch_size))
+        batch_time = as_timedelta(section.batch_time)
+        self.batch_float = (86400 * batch_time.days +
+                            batch_time.seconds +
+                            batch_time.microseconds / 1.0e6)
         self.max_restarts = int(section.max_restarts)
         self.start = as_boolean(section.start)
         self._stop = False
         self.status = 0
+        # Statistics.
+        self.commits = 0
+        self.committed_messages = 0
+        self._statistics_logged = (time.time(), 0, 0)
 
     def __repr__(self):
         return '<{0} at {1:#x}>'.format(self.__class__.__name__, id(self))
@@ -137,77 +160,175 @@ class Runner:
         except KeyboardInterrupt:
             pass
         finally:
+            self._log_statistics()
             self._clean_up()
+            if self.switchboard is not None:
+                self.switchboard.close()
 
     def _one_iteration(self):
         """See `IRunner`."""
         me = self.__class__.__name__
         dlog.debug('[%s] starting oneloop', me)
-        # List all the files in our queue directory.  The switchboard is
-        # guaranteed to hand us the files in FIFO order.
-        files = self.switchboard.files
-        for filebase in files:
-            dlog.debug('[%s] processing filebase: %s', me, filebase)
+        # Dequeue all the files currently in our slice of the queue.  The
+        # switchboard is guaranteed to hand us the files in FIFO order, and
+        # it logs, skips and preserves any files it cannot read.  Files we
+        # don't get to because of a short circuit stay in the queue.
+        filecnt = 0
+        # The files processed in the current transaction, when batching.
+        batch = []
+        try:
+            with closing(self.switchboard.dequeue_many()) as entries:
+                for filebase, msg, msgdata in entries:
+                    filecnt += 1
+                    dlog.debug('[%s] processing filebase: %s', me, filebase)
+                    if self.batch_size > 1:
+                        if len(batch) == 0:
+                            hold_queue_files()
+                            deadline = time.time() + self.batch_float
+                        batch.append(filebase)
+                        if not self._process_batched(batch, msg, msgdata):
+                            batch = []
+                        elif (len(batch) >= self.batch_size or
+                              time.time() >= deadline):
+                            self._commit_batch(batch)
+                            batch = []
+                    else:
+                        self._process_entry(filebase, msg, msgdata)
+                        # Other work we want to do each time through the loop.
+                        dlog.debug('[%s] doing periodic', me)
+                        self._do_periodic()
+                        dlog.debug('[%s] committing transaction', me)
+                        config.db.commit()
+                        self._count_commit(1)
+                    dlog.debug('[%s] checking short circuit', me)
+                    if self._short_circuit():
+                        dlog.debug('[%s] short circuiting', me)
+                        break
+            if len(batch) > 0:
+                self._commit_batch(batch)
+                batch = []
+        finally:
+            if len(batch) > 0:
+                # We're bailing out.  The files of the batch stay in their
+                # backup files, to be recovered later.
+                discard_queue_files()
+                config.db.abort()
+        dlog.debug('[%s] ending oneloop: %s', me, filecnt)
+        return filecnt
+
+    def _process_batched(self, batch, msg, msgdata):
+        """Process the last file of a batch in the batch's transaction.
+
+        :return: False if processing the file failed, and the batch was
+            processed again one file at a time.
+        :rtype: bool
+        """
+        try:
+            self._process_one_file(msg, msgdata)
+        except Exception:
+            self._retry_batch(batch)
+            return False
+        return True
+
+    def _commit_batch(self, batch):
+        """Commit the transaction of a batch of files, and finish them."""
+        me = self.__class__.__name__
+        dlog.debug('[%s] doing periodic', me)
+        self._do_periodic()
+        dlog.debug('[%s] committing batch of %d files', me, len(batch))
+        try:
+            config.db.commit()
+        except Exception as error:
+            self._log(error)
+            self._retry_batch(batch)
+            return
+        # Only now may the next runners see what the batch enqueued.
+        publish_queue_files()
+        for filebase in batch:
+            self.switchboard.finish(filebase)
+        self._count_commit(len(batch))
+
+    def _retry_batch(self, batch):
+        """Roll back a failed batch, and process its files one at a time.
+
+        This isolates the file which failed, which then gets shunted as
+        usual, while the others are processed again.
+        """
+        elog.error('%s runner failed a batch of %d files, '
+                   'processing them one at a time', self.name, len(batch))
+        discard_queue_files()
+        config.db.abort()
+        for filebase in batch:
             try:
-                # Ask the switchboard for the message and metadata objects
-                # associated with this queue file.
-                msg, msgdata = self.switchboard.dequeue(filebase)
-            except Exception as error:
-                # This used to just catch email.Errors.MessageParseError, but
-                # other problems can occur in message parsing, e.g.
-                # ValueError, and exceptions can occur in unpickling too.  We
-                # don't want the runner to die, so we just log and skip this
-                # entry, but preserve it for analysis.
-                self._log(error)
-                elog.error('Skipping and preserving unparseable message: %s',
-                           filebase)
+                msg, msgdata = self.switchboard.load_backup(filebase)
+            except Exception:
+                elog.exception(
+                    'Skipping and preserving unreadable queue file: %s',
+                    filebase)
                 self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
                 continue
+            self._process_entry(filebase, msg, msgdata)
+            config.db.commit()
+            self._count_commit(1)
+
+    def _count_commit(self, count):
+        """Count a committed transaction of `count` messages."""
+        self.commits += 1
+        self.committed_messages += count
+        if time.time() - self._statistics_logged[0] >= STATISTICS_INTERVAL:
+            self._log_statistics()
+
+    def _log_statistics(self):
+        """Log the commits since the statistics were last logged."""
+        now = time.time()
+        then, commits, messages = self._statistics_logged
+        commits = self.commits - commits
+        messages = self.committed_messages - messages
+        self._statistics_logged = (now, self.commits, self.committed_messages)
+        if commits == 0:
+            return
+        rlog.info('%s runner committed %d messages in %d transactions: '
+                  '%.1f commits/s, %.1f messages per commit',
+                  self.name, messages, commits,
+                  commits / max(now - then, 0.001),
+                  messages / float(commits))
+
+    def _process_entry(self, filebase, msg, msgdata):
+        """Process one dequeued file, shunting it on unexpected errors."""
+        me = self.__class__.__name__
+        try:
+            dlog.debug('[%s] processing onefile', me)
+            self._process_one_file(msg, msgdata)
+            dlog.debug('[%s] finishing filebase: %s', me, filebase)
+            self.switchboard.finish(filebase)
+        except Exception as error:
+            # All runners that implement _dispose() must guarantee that
+            # exceptions are caught and dealt with properly.  Still, there may
+            # be a bug in the infrastructure, and we do not want those to
+            # cause messages to be lost.  Any uncaught exceptions will cause
+            # the message to be stored in the shunt queue for human
+            # intervention.
+            self._log(error)
+            # Put a marker in the metadata for unshunting.
+            msgdata['whichq'] = self.switchboard.name
+            # It is possible that shunting can throw an exception, e.g. a
+            # permissions problem or a MemoryError due to a really large
+            # message.  Try to be graceful.
             try:
-                dlog.debug('[%s] processing onefile', me)
-                self._process_one_file(msg, msgdata)
-                dlog.debug('[%s] finishing filebase: %s', me, filebase)
+                shunt = config.switchboards['shunt']
+                new_filebase = shunt.enqueue(msg, msgdata)
+                elog.error('SHUNTING: %s', new_filebase)
                 self.switchboard.finish(filebase)
             except Exception as error:
-                # All runners that implement _dispose() must guarantee that
-                # exceptions are caught and dealt with properly.  Still, there
-                # may be a bug in the infrastructure, and we do not want those
-                # to cause messages to be lost.  Any uncaught exceptions will
-                # cause the message to be stored in the shunt queue for human
-                # intervention.
+                # The message wasn't successfully shunted.  Log the exception
+                # and try to preserve the original queue entry for possible
+                # analysis.
                 self._log(error)
-                # Put a marker in the metadata for unshunting.
-                msgdata['whichq'] = self.switchboard.name
-                # It is possible that shunting can throw an exception, e.g. a
-                # permissions problem or a MemoryError due to a really large
-                # message.  Try to be graceful.
-                try:
-                    shunt = config.switchboards['shunt']
-                    new_filebase = shunt.enqueue(msg, msgdata)
-                    elog.error('SHUNTING: %s', new_filebase)
-                    self.switchboard.finish(filebase)
-                except Exception as error:
-                    # The message wasn't successfully shunted.  Log the
-                    # exception and try to preserve the original queue entry
-                    # for possible analysis.
-                    self._log(error)
-                    elog.error(
-                        'SHUNTING FAILED, preserving original entry: %s',
-                        filebase)
-                    self.switchboard.finish(filebase, preserve=True)
-                config.db.abort()
-            # Other work we want to do each time through the loop.
-            dlog.debug('[%s] doing periodic', me)
-            self._do_periodic()
-            dlog.debug('[%s] committing transaction', me)
-            config.db.commit()
-            dlog.debug('[%s] checking short circuit', me)
-            if self._short_circuit():
-                dlog.debug('[%s] short circuiting', me)
-                break
-        dlog.debug('[%s] ending oneloop: %s', me, len(files))
-        return len(files)
+                elog.error(
+                    'SHUNTING FAILED, preserving original entry: %s',
+                    filebase)
+                self.switchboard.finish(filebase, preserve=True)
+            config.db.abort()
 
     def _process_one_file(self, msg, msgdata):
         """See `IRunner`."""
@@ -240,7 +361,7 @@ class Runner:
             language_manager = getUtility(ILanguageManager)
             language = language_manager[config.mailman.default_language]
         elif msg.sender:
-            member = mlist.members.get_member(msg.sender)
+            member = sender_context(mlist, msg, msgdata).member(msg.sender)
             language = (member.preferred_language
                         if member is not None
                         else mlist.preferred_language)
@@ -279,7 +400,12 @@ class Runner:
         """See `IRunner`."""
         if filecnt or self.sleep_float <= 0:
             return
-        time.sleep(self.sleep_float)
+        if self.switchboard is None:
+            time.sleep(self.sleep_float)
+        else:
+            # Depending on the [switchboard]wakeup setting, this can return
+            # early as soon as another process enqueues a file for us.
+            self.switchboard.wait_for_files(self.sleep_float)
 
     def _short_circuit(self):
         """See `IRunner`."""
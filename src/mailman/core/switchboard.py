@@ -15,38 +15,67 @@
 # You should have received a copy of the GNU General Public License along with
 # GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Queuing and dequeuing message/metadata pickle files.
+"""Queuing and dequeuing message/metadata queue files.
 
 Messages are represented as email.message.Message objects (or an instance ofa
 subclass).  Metadata is represented as a Python dictionary.  For every
-message/metadata pair in a queue, a single file containing two pickles is
-written.  First, the message is written to the pickle, then the metadata
-dictionary is written.
+message/metadata pair in a queue, a single file is written.  By default the
+file contains two pickles: first the message, then the metadata dictionary.
+The `[switchboard]qfile_format` variable can select a framed format instead,
+which stores the raw message text and JSON metadata.  Files in either format
+can always be read.  Framed queue files may refer to a body kept in the shared
+body store instead of holding it themselves.
 """
 
 from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'FramedCodec',
+    'PickleCodec',
+    'QueuedMessage',
     'Switchboard',
+    'codec_for',
+    'discard_queue_files',
     'handle_ConfigurationUpdatedEvent',
+    'hold_queue_files',
+    'publish_queue_files',
+    'sync_queue_files',
     ]
 
 
 import os
+import json
+import atexit
+import mmap
 import time
+import uuid
 import email
+import errno
+import heapq
+import base64
 import pickle
+import struct
+import socket
 import cPickle
 import hashlib
 import logging
+import datetime
+import threading
 
+from cStringIO import StringIO
+from email.generator import Generator
+from email.header import Header
+from email.parser import HeaderParser
+from lazr.config import as_timedelta
 from zope.interface import implementer
 
 from mailman.config import config
 from mailman.email.message import Message
 from mailman.interfaces.configuration import ConfigurationUpdatedEvent
-from mailman.interfaces.switchboard import ISwitchboard
+from mailman.interfaces.switchboard import IQueueFileCodec, ISwitchboard
+from mailman.utilities import inotify
+from mailman.utilities.email import flatten_headers
 from mailman.utilities.filesystem import makedirs
 from mailman.utilities.string import expand
 
@@ -60,17 +89,1110 @@ DELTA = .0001
 # In order to prevent loops and a message flood, when the count reaches this
 # value, we move the file to the bad queue as a .psv.
 MAX_BAK_COUNT = 3
+# A queue directory modified this many seconds or less before it was last
+# scanned may have changed again within the file system's timestamp
+# granularity, so its status cannot be trusted to detect new files.
+RACY_WINDOW = 2.0
+# As a safety net against file systems with unreliable timestamps, queue
+# directories are rescanned at least this often.
+MAX_SCAN_AGE = 60.0
+# With group commit durability, the open queue files waiting to be fsynced are
+# committed once there are this many of them.
+MAX_GROUP_COMMIT = 100
+# The directory in $QUEUE_DIR holding the shared message bodies.
+BODY_STORE = 'bodies'
 
 elog = logging.getLogger('mailman.error')
 
 
+
+def _seconds(delta):
+    """Convert a timedelta to a float number of seconds."""
+    return (86400 * delta.days + delta.seconds + delta.microseconds / 1.0e6)
+
+
+
+class _SleepingWatcher:
+    """Wait for new queue files by sleeping for the entire timeout."""
+
+    def __init__(self, directory, extension, index):
+        pass
+
+    def wait(self, timeout):
+        time.sleep(timeout)
+        return True
+
+    def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _PollingWatcher:
+    """Wait for new queue files by watching the directory's status.
+
+    Every enqueue renames a temporary file into the queue directory, which
+    updates the directory's modification time.  Checking that with stat() is
+    much cheaper than listing the directory.
+    """
+
+    def __init__(self, directory, extension, index):
+        self._directory = directory
+        interval = as_timedelta(config.switchboard.poll_interval)
+        self._interval = _seconds(interval)
+        # Files enqueued before the watcher existed would go unnoticed, so the
+        # first wait always returns immediately to force another scan.
+        self._last = None
+
+    def _status(self):
+        try:
+            info = os.stat(self._directory)
+        except OSError:
+            return None
+        return (info.st_mtime, info.st_ctime, info.st_ino)
+
+    def wait(self, timeout):
+        deadline = time.time() + timeout
+        while True:
+            status = self._status()
+            if status != self._last:
+                self._last = status
+                return True
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self._interval, remaining))
+
+    def drain(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    """Wait for new queue files using Linux inotify events.
+
+    The events are also handed to the queue index, which then never needs to
+    list the directory again.
+    """
+
+    def __init__(self, directory, extension, index):
+        self._extension = extension
+        self._index = index
+        self._inotify = inotify.Inotify()
+        try:
+            self._inotify.add_watch(
+                directory,
+                inotify.IN_MOVED_TO | inotify.IN_MOVED_FROM |
+                inotify.IN_DELETE)
+        except OSError:
+            self._inotify.close()
+            raise
+        index.watch()
+        # As with polling, force one more scan once the watch is in place.
+        self._primed = False
+
+    def wait(self, timeout):
+        if not self._primed:
+            self._primed = True
+            return True
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return False
+            events = self._inotify.read_events(remaining)
+            # No events means the timeout expired or a signal interrupted us;
+            # either way, let the runner take another look.
+            if len(events) == 0:
+                return False
+            self._index.apply(events)
+            for mask, name in events:
+                if mask & inotify.IN_Q_OVERFLOW:
+                    return True
+                if (mask & inotify.IN_MOVED_TO and
+                        os.path.splitext(name)[1] == self._extension):
+                    return True
+
+    def drain(self):
+        self._index.apply(self._inotify.read_events(0))
+
+    def close(self):
+        """Close the inotify file descriptor."""
+        self._inotify.close()
+
+    def __del__(self):
+        self.close()
+
+
+class _QueueIndex:
+    """A FIFO index of the queue files in one slice of a queue directory.
+
+    Every file name seen in the directory is parsed only once, and the files
+    in our slice are kept in a heap ordered by their enqueue time.  The index
+    is kept current by this process's own enqueues and dequeues, by inotify
+    events when they are available, and otherwise by listing the directory
+    again only when its status shows that it may have changed.
+    """
+
+    def __init__(self, directory, extension, lower, upper):
+        self._directory = directory
+        self._extension = extension
+        self._lower = lower
+        self._upper = upper
+        # Map every known file base to its heap key, or to None when the file
+        # is outside our slice.
+        self._entries = {}
+        # The number of file bases in our slice.
+        self._count = 0
+        # Heap of (key, filebase) items.  Entries are removed lazily, so items
+        # whose file base is no longer in _entries, or has been claimed, are
+        # stale and must be skipped.
+        self._heap = []
+        # File bases handed out by claim() but not yet dequeued.
+        self._claimed = set()
+        self._status = None
+        self._scanned = 0
+        self._watched = False
+        self._valid = False
+
+    def _key(self, filebase):
+        when, digest = filebase.split('+', 1)
+        # Throw out any files which don't match our bitrange.  MAS: both
+        # comparisons need to be <= to get complete range.
+        if (self._lower is None or
+                self._lower <= long(digest, 16) <= self._upper):
+            return float(when)
+        return None
+
+    def add(self, filebase):
+        """Record a new queue file."""
+        if filebase in self._entries:
+            return
+        key = self._key(filebase)
+        self._entries[filebase] = key
+        if key is not None:
+            self._count += 1
+            heapq.heappush(self._heap, (key, filebase))
+
+    def discard(self, filebase):
+        """Forget a queue file, e.g. because it has been dequeued."""
+        if self._entries.pop(filebase, None) is not None:
+            self._count -= 1
+        self._claimed.discard(filebase)
+
+    def watch(self):
+        """Changes will now be reported to `apply()`.
+
+        The directory is scanned once more, after which it only needs to be
+        scanned again if the event queue overflows.
+        """
+        self._watched = True
+        self._valid = False
+
+    def unwatch(self):
+        """Changes are no longer reported, so scan the directory again."""
+        self._watched = False
+        self._status = None
+
+    def apply(self, events):
+        """Update the index from (mask, name) inotify events."""
+        for mask, name in events:
+            if mask & inotify.IN_Q_OVERFLOW:
+                self._valid = False
+                continue
+            filebase, ext = os.path.splitext(name)
+            if ext != self._extension:
+                continue
+            if mask & inotify.IN_MOVED_TO:
+                self.add(filebase)
+            else:
+                self.discard(filebase)
+
+    def refresh(self):
+        """Bring the index up to date with the queue directory."""
+        if self._watched:
+            if self._valid:
+                return
+        else:
+            try:
+                info = os.stat(self._directory)
+            except OSError:
+                info = None
+            status = (None if info is None
+                      else (info.st_mtime, info.st_ctime, info.st_ino))
+            if (status is not None and
+                    status == self._status and
+                    self._scanned - max(status[:2]) > RACY_WINDOW and
+                    time.time() - self._scanned < MAX_SCAN_AGE):
+                return
+            self._status = status
+        self._scan()
+
+    def _scan(self):
+        self._scanned = time.time()
+        self._valid = True
+        current = set()
+        for f in os.listdir(self._directory):
+            # By ignoring anything that doesn't end in .pck, we ignore
+            # tempfiles and avoid a race condition.
+            filebase, ext = os.path.splitext(f)
+            if ext != self._extension:
+                continue
+            current.add(filebase)
+            self.add(filebase)
+        for filebase in set(self._entries) - current:
+            self.discard(filebase)
+        # Rebuild the heap when it's mostly stale items.
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [(key, filebase)
+                          for filebase, key in self._entries.items()
+                          if key is not None and
+                          filebase not in self._claimed]
+            heapq.heapify(self._heap)
+
+    def __len__(self):
+        """Return the number of file bases in our slice."""
+        return self._count
+
+    def files(self):
+        """Return the file bases in our slice, in FIFO order."""
+        return [filebase for key, filebase in sorted(
+            (key, filebase) for filebase, key in self._entries.items()
+            if key is not None)]
+
+    def claim(self, count=None):
+        """Remove and return up to `count` of the oldest file bases.
+
+        Claimed files stay in the index until they are discarded, but are
+        not handed out again unless they are returned with `unclaim()`.
+        """
+        filebases = []
+        while len(self._heap) > 0 and (count is None or
+                                       len(filebases) < count):
+            key, filebase = heapq.heappop(self._heap)
+            if (filebase in self._claimed or
+                    self._entries.get(filebase, None) != key):
+                continue
+            self._claimed.add(filebase)
+            filebases.append(filebase)
+        return filebases
+
+    def unclaim(self, filebases):
+        """Make claimed but unprocessed file bases available again."""
+        for filebase in filebases:
+            if filebase in self._claimed:
+                self._claimed.discard(filebase)
+                heapq.heappush(
+                    self._heap, (self._entries[filebase], filebase))
+
+
+_WATCHERS = dict(
+    sleep=_SleepingWatcher,
+    poll=_PollingWatcher,
+    inotify=_InotifyWatcher,
+    )
+
+
+
+@implementer(IQueueFileCodec)
+class PickleCodec:
+    """The classic queue file format.
+
+    The file contains two pickles: first the message object, or the message
+    text when the `_plaintext` flag is set, then the metadata dictionary.
+    """
+
+    name = 'pickle'
+
+    def encode(self, msg, data, plaintext=False, store=None):
+        """See `IQueueFileCodec`."""
+        if plaintext:
+            protocol = 0
+            msgsave = cPickle.dumps(str(msg), protocol)
+        else:
+            protocol = pickle.HIGHEST_PROTOCOL
+            msgsave = cPickle.dumps(msg, protocol)
+        # We have to tell load() whether to parse the message object or not.
+        data['_parsemsg'] = (protocol == 0)
+        return [msgsave, cPickle.dumps(data, protocol)]
+
+    def load(self, fp):
+        """See `IQueueFileCodec`."""
+        msg = cPickle.load(fp)
+        data = cPickle.load(fp)
+        if data.get('_parsemsg'):
+            # Calculate the original size of the text now so that we won't
+            # have to generate the message later when we do size restriction
+            # checking.
+            original_size = len(msg)
+            msg = email.message_from_string(msg, Message)
+            msg.original_size = original_size
+            data['original_size'] = original_size
+        return msg, data
+
+    def load_metadata(self, fp):
+        """See `IQueueFileCodec`."""
+        # Unpickling the message also makes sure that it is still readable.
+        cPickle.load(fp)
+        position = fp.tell()
+        return cPickle.load(fp), position
+
+    def dump_metadata(self, fp, data):
+        """See `IQueueFileCodec`."""
+        protocol = (0 if data.get('_parsemsg') else 1)
+        cPickle.dump(data, fp, protocol)
+
+
+
+# Message attributes which only hold the body, and are left in the queue file
+# until they are needed.
+_BODY_STATE = ('_payload', 'preamble', 'epilogue')
+# Message attributes which are reconstructed from the message text.
+_MESSAGE_STATE = frozenset(_BODY_STATE + (
+    '_headers', '_unixfrom', '_charset', '_default_type', 'defects',
+    '__version__', '_qfile_body',
+    ))
+
+
+class QueuedMessage(Message):
+    """A message read from a framed queue file.
+
+    Only the headers are parsed when the message is dequeued.  The body stays
+    in a read-only memory map of the queue file until something first asks
+    for the payload, at which point the whole message text is parsed.
+    """
+
+    @classmethod
+    def from_text(cls, headers, body, reference=None):
+        """Create a message whose body is only parsed when it is needed.
+
+        Until then, the framed format writes the body to queue files as is.
+
+        :param headers: The message's header block, including the blank line
+            separating it from the body.
+        :type headers: 8-bit string
+        :param body: The body.
+        :type body: 8-bit string or buffer
+        :param reference: The body's reference in the body store, if that's
+            where it is.
+        :type reference: str
+        :return: The message.
+        :rtype: `QueuedMessage`
+        """
+        msg = HeaderParser(cls).parsestr(headers)
+        for name in _BODY_STATE:
+            del msg.__dict__[name]
+        msg._qfile_body = (headers, body, reference)
+        return msg
+
+    def __getattr__(self, name):
+        # This is only called for attributes which are missing from the
+        # instance, i.e. the body state while it is still in the queue file.
+        if name in _BODY_STATE and '_qfile_body' in self.__dict__:
+            self._load_body()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # Pickles and copies need the body.
+        self._load_body()
+        return self.__dict__
+
+    def _load_body(self):
+        body = self.__dict__.pop('_qfile_body', None)
+        if body is None:
+            return
+        headers, raw_body, reference = body
+        parsed = email.message_from_string(headers + raw_body[:], Message)
+        for name in _BODY_STATE:
+            if name not in self.__dict__:
+                self.__dict__[name] = getattr(parsed, name)
+
+    @property
+    def raw_body(self):
+        """The unparsed body, or None if it may have been changed.
+
+        This is a read-only buffer into the memory mapped queue file, or into
+        the body store.
+        """
+        body = self.__dict__.get('_qfile_body')
+        if body is None or any(name in self.__dict__ for name in _BODY_STATE):
+            return None
+        return body[1]
+
+    @property
+    def body_reference(self):
+        """The unchanged body's reference in the body store, or None."""
+        if self.raw_body is None:
+            return None
+        return self._qfile_body[2]
+
+
+def _split_text(text):
+    """Split message text into its header block and its body."""
+    if text.startswith(b'\n') or text.startswith(b'\r\n'):
+        # There are no headers.
+        index = text.index(b'\n') + 1
+        return text[:index], text[index:]
+    ends = []
+    for separator in (b'\n\n', b'\r\n\r\n'):
+        index = text.find(separator)
+        if index >= 0:
+            ends.append(index + len(separator))
+    if len(ends) == 0:
+        return text, b''
+    index = min(ends)
+    return text[:index], text[index:]
+
+
+def _check_headers(msg):
+    # Header objects and non-ASCII unicode values could only be stored in an
+    # RFC 2047 encoded form, so they would not come back as they went in.
+    for name, value in msg._headers:
+        if isinstance(value, Header):
+            raise TypeError('Header instance in {0}'.format(name))
+        if isinstance(value, unicode):
+            value.encode('ascii')
+
+
+def _message_text(msg):
+    """Return the message's header block and body as 8-bit strings."""
+    if isinstance(msg, bytes):
+        return _split_text(msg)
+    unixfrom = msg.get_unixfrom()
+    unixfrom = (unixfrom.encode('ascii') + b'\n' if unixfrom else b'')
+    raw_body = (msg.raw_body if isinstance(msg, QueuedMessage) else None)
+    if raw_body is None:
+        for part in msg.walk():
+            _check_headers(part)
+        fp = StringIO()
+        fp.write(unixfrom)
+        Generator(fp, mangle_from_=False, maxheaderlen=0).flatten(msg)
+        return _split_text(fp.getvalue())
+    # The body is unchanged, so pass it through as is.
+    _check_headers(msg)
+    return unixfrom + flatten_headers(msg, maxheaderlen=0), raw_body
+
+
+def _to_json(obj):
+    """Convert metadata to something JSON can represent.
+
+    Types which JSON does not have are tagged with a single key dictionary.
+    """
+    if obj is None or isinstance(obj, (bool, int, long, float, unicode)):
+        return obj
+    if isinstance(obj, bytes):
+        try:
+            return obj.decode('ascii')
+        except UnicodeError:
+            return {'!bytes': base64.b64encode(obj).decode('ascii')}
+    if isinstance(obj, list):
+        return [_to_json(item) for item in obj]
+    if isinstance(obj, tuple):
+        return {'!tuple': [_to_json(item) for item in obj]}
+    if isinstance(obj, (set, frozenset)):
+        return {'!set': [_to_json(item) for item in obj]}
+    if isinstance(obj, datetime.datetime):
+        if obj.tzinfo is not None:
+            raise TypeError('Aware datetime: {0!r}'.format(obj))
+        return {'!datetime': [obj.year, obj.month, obj.day, obj.hour,
+                              obj.minute, obj.second, obj.microsecond]}
+    if isinstance(obj, datetime.timedelta):
+        return {'!timedelta': [obj.days, obj.seconds, obj.microseconds]}
+    if isinstance(obj, dict):
+        if (all(isinstance(key, basestring) for key in obj) and
+            not (len(obj) == 1 and obj.keys()[0].startswith('!'))):
+            return dict((_to_json(key), _to_json(value))
+                        for key, value in obj.items())
+        return {'!dict': [[_to_json(key), _to_json(value)]
+                          for key, value in obj.items()]}
+    raise TypeError('Unsupported metadata type: {0}'.format(type(obj)))
+
+
+def _dumps(obj):
+    """Return the compact JSON representation of obj as an 8-bit string."""
+    return json.dumps(_to_json(obj), separators=(',', ':')).encode('ascii')
+
+
+def _from_json(obj):
+    """The inverse of `_to_json()`."""
+    if isinstance(obj, list):
+        return [_from_json(item) for item in obj]
+    if not isinstance(obj, dict):
+        return obj
+    if len(obj) == 1:
+        tag, value = obj.items()[0]
+        if tag == '!bytes':
+            return base64.b64decode(value)
+        elif tag == '!tuple':
+            return tuple(_from_json(item) for item in value)
+        elif tag == '!set':
+            return set(_from_json(item) for item in value)
+        elif tag == '!datetime':
+            return datetime.datetime(*value)
+        elif tag == '!timedelta':
+            return datetime.timedelta(*value)
+        elif tag == '!dict':
+            return dict((_from_json(key), _from_json(item))
+                        for key, item in value)
+    return dict((key, _from_json(value)) for key, value in obj.items())
+
+
+@implementer(IQueueFileCodec)
+class FramedCodec:
+    """A framed queue file format holding the raw message text.
+
+    The file starts with a fixed size frame header holding a magic number, the
+    format version, and the lengths of the next three parts: the message
+    object's own attributes (e.g. its recipients) as JSON, the message's
+    header block, and its body.  The rest of the file is the metadata as
+    JSON.  Messages and metadata which can't be represented this way make
+    `encode()` raise a TypeError, ValueError or UnicodeError.
+
+    In version 2 of the format, the body part is the body's reference in the
+    body store instead of the body itself.
+    """
+
+    name = 'framed'
+    magic = b'MMQF'
+    version = 1
+    referenced_version = 2
+    frame = struct.Struct(b'>4sBQQQ')
+
+    def encode(self, msg, data, plaintext=False, store=None):
+        """See `IQueueFileCodec`."""
+        attributes = {}
+        if not isinstance(msg, bytes):
+            for name, value in msg.__dict__.items():
+                if name not in _MESSAGE_STATE:
+                    attributes[name] = value
+        headers, body = _message_text(msg)
+        attributes = _dumps(attributes)
+        data['_parsemsg'] = bool(plaintext)
+        metadata = _dumps(data)
+        version = self.version
+        if store is not None:
+            source = (msg.body_reference
+                      if isinstance(msg, QueuedMessage)
+                      else None)
+            if source is not None or len(body) >= store.threshold:
+                body = store.add(body, source)
+                version = self.referenced_version
+        frame = self.frame.pack(
+            self.magic, version, len(attributes), len(headers), len(body))
+        # The headers identify the message well enough, so there's no need to
+        # hash the body for the file name.
+        return [frame + attributes + headers, body, metadata]
+
+    def _read_frame(self, header):
+        magic, version, attributes_size, headers_size, body_size = (
+            self.frame.unpack(header))
+        if (magic != self.magic or
+                version not in (self.version, self.referenced_version)):
+            raise ValueError('Unsupported queue file format: {0!r} {1}'.format(
+                magic, version))
+        start = self.frame.size + attributes_size
+        return (version, start, start + headers_size,
+                start + headers_size + body_size)
+
+    def load(self, fp):
+        """See `IQueueFileCodec`."""
+        mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        version, start, body_start, end = self._read_frame(
+            mm[:self.frame.size])
+        attributes = _from_json(json.loads(mm[self.frame.size:start]))
+        data = _from_json(json.loads(mm[end:]))
+        headers = mm[start:body_start]
+        if version == self.referenced_version:
+            reference = mm[body_start:end]
+            body = _body_store.open(reference)
+        else:
+            reference = None
+            body = buffer(mm, body_start, end - body_start)
+        msg = QueuedMessage.from_text(headers, body, reference)
+        for name, value in attributes.items():
+            setattr(msg, name, value)
+        if data.get('_parsemsg'):
+            original_size = len(headers) + len(body)
+            msg.original_size = original_size
+            data['original_size'] = original_size
+        return msg, data
+
+    def load_metadata(self, fp):
+        """See `IQueueFileCodec`."""
+        version, start, body_start, end = self._read_frame(
+            fp.read(self.frame.size))
+        fp.seek(end)
+        return _from_json(json.loads(fp.read())), end
+
+    def body_reference(self, fp):
+        """Return the reference to the queue file's body, if it has one.
+
+        :param fp: The open queue file, positioned at its start.
+        :return: The body's reference in the body store, or None if the body
+            is in the queue file.
+        """
+        version, start, body_start, end = self._read_frame(
+            fp.read(self.frame.size))
+        if version != self.referenced_version:
+            return None
+        fp.seek(body_start)
+        return fp.read(end - body_start)
+
+    def dump_metadata(self, fp, data):
+        """See `IQueueFileCodec`."""
+        fp.write(_dumps(data))
+
+
+_CODECS = dict(
+    pickle=PickleCodec(),
+    framed=FramedCodec(),
+    )
+
+
+def codec_for(fp):
+    """Return the codec which reads the queue file open as `fp`."""
+    magic = fp.read(len(FramedCodec.magic))
+    fp.seek(0)
+    return _CODECS['framed' if magic == FramedCodec.magic else 'pickle']
+
+
+
+class _BodyStore:
+    """Message bodies shared by several framed queue files.
+
+    A body is written once, to a file in the body store named after the SHA1
+    digest of its contents.  Every queue file referring to the body has its
+    own hard link to that file, whose name is the queue file's reference to
+    the body.  The file's link count is thus the number of references to it,
+    whichever processes hold them, and the body goes away when the last
+    queue file referring to it is finished.
+    """
+
+    @property
+    def directory(self):
+        return os.path.join(config.QUEUE_DIR, BODY_STORE)
+
+    @property
+    def threshold(self):
+        """The size of the smallest bodies which are stored here."""
+        return int(config.switchboard.body_store_threshold)
+
+    def add(self, body, source=None):
+        """Add a reference to a body.
+
+        :param body: The body.
+        :type body: 8-bit string or buffer
+        :param source: Another reference to the same body, if it is already
+            in the store.
+        :type source: str
+        :return: The new reference.
+        :rtype: str
+        """
+        directory = self.directory
+        durability = _durability()
+        digest = (hashlib.sha1(body).hexdigest()
+                  if source is None
+                  else source.split('.', 1)[0])
+        reference = '{0}.{1}'.format(digest, uuid.uuid4().hex)
+        path = os.path.join(directory, reference)
+        for existing in (source, digest):
+            if existing is None:
+                continue
+            try:
+                os.link(os.path.join(directory, existing), path)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+            else:
+                if durability == 'group':
+                    _group_commit.add(None, directory)
+                return reference
+        # This is the first reference to the body, so write it.
+        makedirs(directory, 0770)
+        tmpfile = os.path.join(directory, reference + '.tmp')
+        group_fd = None
+        with open(tmpfile, 'w') as fp:
+            fp.write(body)
+            fp.flush()
+            if durability == 'fsync':
+                os.fsync(fp.fileno())
+            elif durability == 'group':
+                group_fd = os.dup(fp.fileno())
+        os.link(tmpfile, path)
+        # Later references link to the body by its digest.
+        os.rename(tmpfile, os.path.join(directory, digest))
+        if group_fd is not None:
+            _group_commit.add(group_fd, directory)
+        return reference
+
+    def open(self, reference):
+        """Return a read-only buffer of the referenced body."""
+        with open(os.path.join(self.directory, reference)) as fp:
+            if os.fstat(fp.fileno()).st_size == 0:
+                return buffer(b'')
+            return buffer(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def release(self, reference):
+        """Remove a reference to a body, and the body if it was the last."""
+        directory = self.directory
+        try:
+            os.unlink(os.path.join(directory, reference))
+        except EnvironmentError:
+            elog.exception('Failed to unlink body reference: %s', reference)
+            return
+        digest = os.path.join(directory, reference.split('.', 1)[0])
+        try:
+            # Only the digest's own link is left.  If another process links to
+            # it in the meantime, its reference still keeps the body.
+            if os.stat(digest).st_nlink == 1:
+                os.unlink(digest)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                elog.exception('Failed to unlink body: %s', digest)
+
+
+_body_store = _BodyStore()
+
+
+
+
+def _durability():
+    """Return the configured `[switchboard]durability` mode."""
+    durability = config.switchboard.durability
+    if durability not in ('fsync', 'group', 'none'):
+        elog.error('Unknown [switchboard]durability value: %s', durability)
+        return 'fsync'
+    return durability
+
+
+class _GroupCommit:
+    """Queue files waiting to be fsynced together.
+
+    The files are kept open, so that they can still be fsynced after another
+    process has moved them.  Committing fsyncs every file, then every
+    directory the files were renamed into.
+
+    The group may be shared by several threads, e.g. the LMTP runner's
+    workers.  A commit holds the lock until all the files are durable, so
+    that a thread committing its own files waits for another thread which is
+    already committing them.
+    """
+
+    def __init__(self):
+        self._fds = []
+        self._directories = set()
+        self._deadline = None
+        self._lock = threading.Lock()
+
+    def add(self, fd, directory):
+        """Take over the open file descriptor `fd` of a queue file.
+
+        `fd` may be None when only the directory has changed.
+
+        The group is committed right away when it is full, or when its
+        oldest file is older than `[switchboard]group_commit_window`.
+        """
+        with self._lock:
+            if self._deadline is None:
+                window = as_timedelta(config.switchboard.group_commit_window)
+                self._deadline = time.time() + _seconds(window)
+            if fd is not None:
+                self._fds.append(fd)
+            self._directories.add(directory)
+            if (len(self._fds) >= MAX_GROUP_COMMIT or
+                time.time() >= self._deadline):
+                self._commit()
+
+    def commit(self):
+        """Fsync all the pending queue files and their directories."""
+        with self._lock:
+            self._commit()
+
+    def _commit(self):
+        fds, self._fds = self._fds, []
+        directories, self._directories = self._directories, set()
+        self._deadline = None
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            except EnvironmentError:
+                elog.exception('Failed to fsync queue file')
+            finally:
+                os.close(fd)
+        for directory in directories:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except EnvironmentError:
+                elog.exception('Failed to fsync queue directory: %s',
+                               directory)
+
+
+_group_commit = _GroupCommit()
+
+
+def sync_queue_files():
+    """Make all the queue files written by this process durable.
+
+    This only has an effect with the `group` durability, which otherwise
+    delays the fsyncs until a queue file is finished, the group commit window
+    expires, or the process exits.  Call this before telling anybody outside
+    of Mailman that a message has been safely queued.
+    """
+    _group_commit.commit()
+
+
+atexit.register(sync_queue_files)
+
+
+# The queue files enqueued by each thread while it holds them back.
+_held = threading.local()
+
+
+def hold_queue_files():
+    """Hold back the queue files this thread enqueues from now on.
+
+    The files are written, but other processes only see them once they are
+    published with `publish_queue_files()`.  A runner holds back the files it
+    enqueues while processing a batch of files in one database transaction,
+    so that they can be discarded with `discard_queue_files()` if the
+    transaction is rolled back.
+    """
+    assert getattr(_held, 'files', None) is None, (
+        'Already holding back queue files')
+    _held.files = []
+
+
+def publish_queue_files():
+    """Move the queue files held back by this thread into their queues."""
+    files, _held.files = _held.files, None
+    durability = _durability()
+    for switchboard, tmpfile, filebase in files:
+        switchboard._publish(tmpfile, filebase)
+        if durability == 'group':
+            # The queue directory changed since the file was written.
+            _group_commit.add(None, switchboard.queue_directory)
+
+
+def discard_queue_files():
+    """Remove the queue files held back by this thread, if any."""
+    files = getattr(_held, 'files', None) or []
+    _held.files = None
+    for switchboard, tmpfile, filebase in files:
+        reference = switchboard._body_reference(tmpfile)
+        try:
+            os.unlink(tmpfile)
+        except OSError:
+            elog.exception('Failed to discard queue file: %s', tmpfile)
+        else:
+            if reference is not None:
+                _body_store.release(reference)
+
+
+def _read_claim(path):
+    """Read a claim file.
+
+    :return: The host name and process id of the claim's owner, and the time
+        its lease expires, or None if the claim can't be parsed.
+    :raises EnvironmentError: when the claim can't be read, e.g. because it
+        was released.
+    """
+    with open(path) as fp:
+        text = fp.read()
+    try:
+        host, pid, expires = text.split()
+        return host, int(pid), float(expires)
+    except ValueError:
+        return None
+
+
+class _Leases:
+    """The claims of this process on the queue files of shared queues.
+
+    A claim file names the host and the process holding the claim, and when
+    its lease expires.  Other processes, possibly on other hosts, break a
+    claim once its lease has expired, or, on the same host, once its process
+    is gone.  While this process holds claims, a thread renews their leases
+    every third of `[switchboard]claim_lease`.
+
+    Leases are compared with the clocks of all the hosts sharing a queue
+    directory, so these must be kept in sync, e.g. with NTP.
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._paths = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def lease(self):
+        """The length of a lease, in seconds."""
+        return _seconds(as_timedelta(config.switchboard.claim_lease))
+
+    def _write(self, path):
+        """Write a new claim for `path` to a temporary file next to it."""
+        host = socket.gethostname()
+        tmpfile = '{0}.{1}.{2:d}.tmp'.format(path, host, os.getpid())
+        with open(tmpfile, 'w') as fp:
+            fp.write('{0} {1:d} {2:.3f}\n'.format(
+                host, os.getpid(), time.time() + self.lease))
+        return tmpfile
+
+    def claim(self, path):
+        """Claim a queue file.
+
+        :param path: The path of the claim file.
+        :raises OSError: with errno EEXIST when the file is already claimed.
+        """
+        if self._pid != os.getpid():
+            # The claims and the thread of the process we were forked from
+            # are not ours.
+            self._reset()
+        # Write the claim in full before linking it into place, so that
+        # nobody ever reads a partial claim.  Only one process can create the
+        # link.
+        tmpfile = self._write(path)
+        try:
+            os.link(tmpfile, path)
+        finally:
+            os.unlink(tmpfile)
+        with self._lock:
+            self._paths.add(path)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+
+    def release(self, path):
+        """Release a claim of this process."""
+        with self._lock:
+            if path not in self._paths:
+                # The claim was lost, and belongs to another process now.
+                return
+            self._paths.discard(path)
+            try:
+                os.unlink(path)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+
+    def renew(self):
+        """Extend the leases of all the claims of this process."""
+        owner = (socket.gethostname(), os.getpid())
+        with self._lock:
+            for path in list(self._paths):
+                try:
+                    try:
+                        claim = _read_claim(path)
+                    except IOError as error:
+                        if error.errno != errno.ENOENT:
+                            raise
+                        claim = None
+                    if claim is None or claim[:2] != owner:
+                        # Our lease expired, and another process broke the
+                        # claim.
+                        elog.error('Lost the claim on queue file: %s', path)
+                        self._paths.discard(path)
+                        continue
+                    os.rename(self._write(path), path)
+                except EnvironmentError:
+                    elog.exception('Failed to renew the claim: %s', path)
+
+    def _run(self):
+        while True:
+            time.sleep(self.lease / 3)
+            self.renew()
+
+    def is_stale(self, path, claim):
+        """Can the claim be broken?
+
+        :param path: The path of the claim file.
+        :param claim: The claim, as returned by `_read_claim()`.
+        :rtype: bool
+        """
+        if claim is None:
+            return True
+        host, pid, expires = claim
+        if expires < time.time():
+            return True
+        if host != socket.gethostname():
+            return False
+        if pid == os.getpid():
+            # Unless we hold it, the claim is left over from an earlier
+            # process which had the same process id.
+            return self._pid != pid or path not in self._paths
+        try:
+            os.kill(pid, 0)
+        except OSError as error:
+            return error.errno == errno.ESRCH
+        return False
+
+    def break_stale(self, path):
+        """Break a stale claim, and claim the queue file for this process.
+
+        :param path: The path of the claim file.
+        :return: True if this process now holds the claim, False if the claim
+            is not stale, or another process broke it first.
+        :rtype: bool
+        """
+        try:
+            claim = _read_claim(path)
+        except EnvironmentError:
+            # Released in the meantime, or unreadable.  Leave it alone.
+            return False
+        if not self.is_stale(path, claim):
+            return False
+        # Only one process can move the claim out of the way.
+        broken = '{0}.{1}.{2:d}.broken'.format(
+            path, socket.gethostname(), os.getpid())
+        try:
+            os.rename(path, broken)
+        except OSError as error:
+            if error.errno == errno.ENOENT:
+                return False
+            raise
+        try:
+            if _read_claim(broken) != claim:
+                # Another process broke the claim and claimed the file again
+                # just before we moved its claim.  Put it back.
+                try:
+                    os.link(broken, path)
+                except OSError as error:
+                    if error.errno != errno.EEXIST:
+                        raise
+                return False
+        finally:
+            os.unlink(broken)
+        try:
+            self.claim(path)
+        except OSError as error:
+            if error.errno == errno.EEXIST:
+                return False
+            raise
+        return True
+
+
+_leases = _Leases()
+
+
 
 @implementer(ISwitchboard)
 class Switchboard:
     """See `ISwitchboard`."""
 
     def __init__(self, name, queue_directory,
-                 slice=None, numslices=1, recover=False):
+                 slice=None, numslices=1, recover=False, shared=False):
         """Create a switchboard object.
 
         :param name: The queue name.
@@ -85,17 +1207,31 @@ class Switchboard:
         :type numslices: int
         :param recover: True if backup files should be recovered.
         :type recover: bool
+        :param shared: True if several processes, possibly on several hosts,
+            dequeue from the whole queue directory, instead of each from its
+            own slice.  They then claim every file before dequeuing it, so
+            that only one of them does.
+        :type shared: bool
         """
         assert (numslices & (numslices - 1)) == 0, (
             'Not a power of 2: {0}'.format(numslices))
+        assert not (shared and numslices != 1), (
+            'A shared queue has no slices')
         self.name = name
         self.queue_directory = queue_directory
+        self._shared = shared
+        # When the stale claims of a shared queue are next broken.
+        self._next_recovery = 0
         # If configured to, create the directory if it doesn't yet exist.
         if config.create_paths:
             makedirs(self.queue_directory, 0770)
         # Fast track for no slices
         self._lower = None
         self._upper = None
+        # The queue index and watcher are created on demand, since most
+        # switchboards are only ever used for enqueuing.
+        self._index = None
+        self._watcher = None
         # BAW: test performance and end-cases of this algorithm
         if numslices <> 1:
             self._lower = ((shamax + 1) * slice) / numslices
@@ -115,15 +1251,19 @@ class Switchboard:
         listname = data.get('listname', '--nolist--')
         # Get some data for the input to the sha hash.
         now = time.time()
-        if data.get('_plaintext'):
-            protocol = 0
-            msgsave = cPickle.dumps(str(_msg), protocol)
-        else:
-            protocol = pickle.HIGHEST_PROTOCOL
-            msgsave = cPickle.dumps(_msg, protocol)
+        plaintext = data.get('_plaintext', False)
+        # Always add the metadata schema version number
+        data['version'] = config.QFILE_SCHEMA_VERSION
+        # Filter out volatile entries.  Use .keys() so that we can mutate the
+        # dictionary during the iteration.
+        for k in data.keys():
+            if k.startswith('_'):
+                del data[k]
+        chunks = self._encode(_msg, data, plaintext)
         # listname is unicode but the input to the hash function must be an
         # 8-bit string (eventually, a bytes object).
-        hashfood = msgsave + listname.encode('utf-8') + repr(now)
+        # The first chunk identifies the message.
+        hashfood = chunks[0] + listname.encode('utf-8') + repr(now)
         # Encode the current time into the file name for FIFO sorting.  The
         # file name consists of two parts separated by a '+': the received
         # time for this message (i.e. when it first showed up on this system)
@@ -131,51 +1271,131 @@ class Switchboard:
         filebase = repr(now) + '+' + hashlib.sha1(hashfood).hexdigest()
         filename = os.path.join(self.queue_directory, filebase + '.pck')
         tmpfile = filename + '.tmp'
-        # Always add the metadata schema version number
-        data['version'] = config.QFILE_SCHEMA_VERSION
-        # Filter out volatile entries.  Use .keys() so that we can mutate the
-        # dictionary during the iteration.
-        for k in data.keys():
-            if k.startswith('_'):
-                del data[k]
-        # We have to tell the dequeue() method whether to parse the message
-        # object or not.
-        data['_parsemsg'] = (protocol == 0)
-        # Write to the pickle file the message object and metadata.
+        # Write the message object and metadata to the queue file.
+        durability = _durability()
+        group_fd = None
         with open(tmpfile, 'w') as fp:
-            fp.write(msgsave)
-            cPickle.dump(data, fp, protocol)
+            for chunk in chunks:
+                fp.write(chunk)
             fp.flush()
-            os.fsync(fp.fileno())
-        os.rename(tmpfile, filename)
+            if durability == 'fsync':
+                os.fsync(fp.fileno())
+            elif durability == 'group':
+                group_fd = os.dup(fp.fileno())
+        held = getattr(_held, 'files', None)
+        if held is None:
+            self._publish(tmpfile, filebase)
+        else:
+            held.append((self, tmpfile, filebase))
+        if group_fd is not None:
+            _group_commit.add(group_fd, self.queue_directory)
         return filebase
 
+    def _publish(self, tmpfile, filebase):
+        """Move a newly written queue file into the queue."""
+        os.rename(tmpfile,
+                  os.path.join(self.queue_directory, filebase + '.pck'))
+        if self._index is not None:
+            self._index.add(filebase)
+
     def dequeue(self, filebase):
         """See `ISwitchboard`."""
         # Calculate the filename from the given filebase.
         filename = os.path.join(self.queue_directory, filebase + '.pck')
         backfile = os.path.join(self.queue_directory, filebase + '.bak')
+        if self._index is not None:
+            self._index.discard(filebase)
+        if self._shared:
+            # Other processes may be dequeuing the same file.  Only the one
+            # which claims it gets to move it.
+            self._claim(filebase)
+        try:
+            fp = open(filename)
+        except EnvironmentError:
+            if self._shared:
+                self._release(filebase)
+            raise
         # Read the message object and metadata.
-        with open(filename) as fp:
+        with fp:
             # Move the file to the backup file name for processing.  If this
             # process crashes uncleanly the .bak file will be used to
             # re-instate the .pck file in order to try again.
             os.rename(filename, backfile)
-            msg = cPickle.load(fp)
-            data = cPickle.load(fp)
-        if data.get('_parsemsg'):
-            # Calculate the original size of the text now so that we won't
-            # have to generate the message later when we do size restriction
-            # checking.
-            original_size = len(msg)
-            msg = email.message_from_string(msg, Message)
-            msg.original_size = original_size
-            data['original_size'] = original_size
-        return msg, data
+            return codec_for(fp).load(fp)
+
+    def load_backup(self, filebase):
+        """See `ISwitchboard`."""
+        backfile = os.path.join(self.queue_directory, filebase + '.bak')
+        with open(backfile) as fp:
+            return codec_for(fp).load(fp)
+
+    def _encode(self, msg, data, plaintext):
+        """Encode a queue file's contents in the configured format."""
+        qfile_format = config.switchboard.qfile_format
+        codec = _CODECS.get(qfile_format)
+        if codec is None:
+            elog.error('Unknown [switchboard]qfile_format value: %s',
+                       qfile_format)
+            codec = _CODECS['pickle']
+        # Framed queue files can refer to a body in the body store.
+        store = (_body_store
+                 if codec is _CODECS['framed'] and _body_store.threshold > 0
+                 else None)
+        try:
+            return codec.encode(msg, data, plaintext, store)
+        except (TypeError, ValueError, UnicodeError):
+            if codec is _CODECS['pickle']:
+                raise
+        # Not everything can be stored in the framed format, but anything
+        # that can be pickled can still be queued.
+        return _CODECS['pickle'].encode(msg, data, plaintext)
+
+    def dequeue_many(self, count=None):
+        """See `ISwitchboard`."""
+        if self._shared and time.time() >= self._next_recovery:
+            # Processes sharing the queue may have died or hung, even on
+            # other hosts, so take over their files once their leases expire.
+            self.recover_backup_files()
+        filebases = self._refresh_index().claim(count)
+        try:
+            while len(filebases) > 0:
+                filebase = filebases.pop(0)
+                try:
+                    msg, data = self.dequeue(filebase)
+                except EnvironmentError as error:
+                    if error.errno in (errno.ENOENT, errno.EEXIST):
+                        # Someone else removed or claimed the file in the
+                        # meantime.
+                        continue
+                    elog.exception(
+                        'Skipping and preserving unreadable queue file: %s',
+                        filebase)
+                    self.finish(filebase, preserve=True)
+                    continue
+                except Exception:
+                    # This used to just catch email.Errors.MessageParseError,
+                    # but other problems can occur in message parsing,
+                    # e.g. ValueError, and exceptions can occur in unpickling
+                    # too.  Log and skip this entry, but preserve it for
+                    # analysis.
+                    elog.exception(
+                        'Skipping and preserving unparseable message: %s',
+                        filebase)
+                    self.finish(filebase, preserve=True)
+                    continue
+                yield filebase, msg, data
+        finally:
+            # If the caller stopped early, the rest of the files stay queued.
+            self._index.unclaim(filebases)
 
     def finish(self, filebase, preserve=False):
         """See `ISwitchboard`."""
+        # Whatever was enqueued while processing this file must be durable
+        # before the file itself goes away.
+        _group_commit.commit()
         bakfile = os.path.join(self.queue_directory, filebase + '.bak')
+        # A preserved file keeps its reference to the body.
+        reference = (None if preserve else self._body_reference(bakfile))
         try:
             if preserve:
                 bad_dir = config.switchboards['bad'].queue_directory
@@ -186,14 +1406,52 @@ class Switchboard:
         except EnvironmentError:
             elog.exception(
                 'Failed to unlink/preserve backup file: %s', bakfile)
+        else:
+            if reference is not None:
+                _body_store.release(reference)
+        if self._shared:
+            self._release(filebase)
+
+    def _claim_path(self, filebase):
+        return os.path.join(self.queue_directory, filebase + '.claim')
+
+    def _claim(self, filebase):
+        """Claim a queue file for this process.
+
+        :raises OSError: with errno EEXIST when another process has already
+            claimed the file.
+        """
+        _leases.claim(self._claim_path(filebase))
+
+    def _release(self, filebase):
+        """Release this process's claim on a queue file."""
+        _leases.release(self._claim_path(filebase))
+
+    def _body_reference(self, path):
+        """Return the queue file's reference to its body, if it has one."""
+        try:
+            with open(path) as fp:
+                codec = codec_for(fp)
+                if codec is _CODECS['framed']:
+                    return codec.body_reference(fp)
+        except (EnvironmentError, ValueError, struct.error):
+            # The file can't be read, so it can't be finished either.
+            pass
+        return None
 
     @property
     def files(self):
         """See `ISwitchboard`."""
         return self.get_files()
 
+    def count(self):
+        """See `ISwitchboard`."""
+        return len(self._refresh_index())
+
     def get_files(self, extension='.pck'):
         """See `ISwitchboard`."""
+        if extension == '.pck':
+            return self._refresh_index().files()
         times = {}
         lower = self._lower
         upper = self._upper
@@ -215,6 +1473,48 @@ class Switchboard:
         # FIFO sort
         return [times[key] for key in sorted(times)]
 
+    def _get_index(self):
+        if self._index is None:
+            self._index = _QueueIndex(
+                self.queue_directory, '.pck', self._lower, self._upper)
+        return self._index
+
+    def _refresh_index(self):
+        """Return the up to date index of this slice's queue files."""
+        index = self._get_index()
+        if self._watcher is not None:
+            self._watcher.drain()
+        index.refresh()
+        return index
+
+    def wait_for_files(self, timeout):
+        """See `ISwitchboard`."""
+        if self._watcher is None:
+            self._watcher = self._make_watcher()
+        return self._watcher.wait(timeout)
+
+    def close(self):
+        """See `ISwitchboard`."""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+            self._index.unwatch()
+
+    def _make_watcher(self):
+        wakeup = config.switchboard.wakeup
+        if wakeup not in _WATCHERS:
+            elog.error('Unknown [switchboard]wakeup value: %s', wakeup)
+            wakeup = 'sleep'
+        index = self._get_index()
+        if wakeup == 'inotify':
+            try:
+                return _InotifyWatcher(self.queue_directory, '.pck', index)
+            except OSError as error:
+                elog.error('inotify unavailable for %s, polling instead: %s',
+                           self.queue_directory, error)
+                wakeup = 'poll'
+        return _WATCHERS[wakeup](self.queue_directory, '.pck', index)
+
     def recover_backup_files(self):
         """See `ISwitchboard`."""
         # Move all .bak files in our slice to .pck.  It's impossible for both
@@ -223,37 +1523,74 @@ class Switchboard:
         # _bak_count in the metadata of the number of times we recover this
         # file.  When the count reaches MAX_BAK_COUNT, we move the .bak file
         # to a .psv file in the bad queue.
-        for filebase in self.get_files('.bak'):
+        durability = _durability()
+        filebases = self.get_files('.bak')
+        if self._shared:
+            # Other processes may still be working on their files, so only
+            # recover the files whose claims are stale, and files which are
+            # not claimed at all.  A file is claimed before it is moved to
+            # .bak, so list the claims after the .bak files.  Each file is
+            # claimed while it is being recovered, so that no other process
+            # recovers it at the same time.
+            claims = set(self.get_files('.claim'))
+            claimed = []
+            for filebase in sorted(claims.union(filebases)):
+                if filebase in claims:
+                    if not _leases.break_stale(self._claim_path(filebase)):
+                        continue
+                else:
+                    try:
+                        self._claim(filebase)
+                    except OSError as error:
+                        if error.errno != errno.EEXIST:
+                            raise
+                        continue
+                claimed.append(filebase)
+            filebases = claimed
+            self._next_recovery = time.time() + _leases.lease
+        for filebase in filebases:
             src = os.path.join(self.queue_directory, filebase + '.bak')
             dst = os.path.join(self.queue_directory, filebase + '.pck')
-            with open(src, 'rb+') as fp:
+            try:
+                fp = open(src, 'rb+')
+            except IOError as error:
+                if error.errno == errno.ENOENT:
+                    # The file was finished in the meantime, or a stale claim
+                    # was left before the file was dequeued.
+                    if self._shared:
+                        self._release(filebase)
+                    continue
+                raise
+            with fp:
                 try:
-                    msg = cPickle.load(fp)
-                    data_pos = fp.tell()
-                    data = cPickle.load(fp)
+                    codec = codec_for(fp)
+                    data, data_pos = codec.load_metadata(fp)
                 except Exception as error:
-                    # If unpickling throws any exception, just log and
-                    # preserve this entry
+                    # If reading throws any exception, just log and preserve
+                    # this entry
                     elog.error('Unpickling .bak exception: %s\n'
                                'Preserving file: %s', error, filebase)
                     self.finish(filebase, preserve=True)
                 else:
                     data['_bak_count'] = data.get('_bak_count', 0) + 1
                     fp.seek(data_pos)
-                    if data.get('_parsemsg'):
-                        protocol = 0
-                    else:
-                        protocol = 1
-                    cPickle.dump(data, fp, protocol)
+                    codec.dump_metadata(fp, data)
                     fp.truncate()
                     fp.flush()
-                    os.fsync(fp.fileno())
+                    if durability == 'fsync':
+                        os.fsync(fp.fileno())
+                    elif durability == 'group':
+                        _group_commit.add(
+                            os.dup(fp.fileno()), self.queue_directory)
                     if data['_bak_count'] >= MAX_BAK_COUNT:
                         elog.error('.bak file max count, preserving file: %s',
                                    filebase)
                         self.finish(filebase, preserve=True)
                     else:
                         os.rename(src, dst)
+                        if self._shared:
+                            self._release(filebase)
+        _group_commit.commit()
 
 
 
@@ -21,10 +21,12 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'TestBatching',
     'TestRunner',
     ]
 
 
+import mock
 import unittest
 
 from mailman.app.lifecycle import create_list
@@ -32,7 +34,7 @@ from mailman.config import config
 from mailman.core.runner import Runner
 from mailman.interfaces.runner import RunnerCrashEvent
 from mailman.testing.helpers import (
-    configuration, event_subscribers, get_queue_messages,
+    LogFileMark, configuration, event_subscribers, get_queue_messages,
     make_testable_runner, specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 
@@ -43,6 +45,14 @@ class CrashingRunner(Runner):
         raise RuntimeError('borked')
 
 
+class ForwardingRunner(Runner):
+    def _dispose(self, mlist, msg, msgdata):
+        if msg['x-fail'] is not None:
+            raise RuntimeError('borked')
+        config.switchboards['out'].enqueue(msg, msgdata)
+        return False
+
+
 
 class TestRunner(unittest.TestCase):
     """Test the Runner base class behavior."""
@@ -87,3 +97,117 @@ Message-ID: <ant>
         shunted = get_queue_messages('shunt')
         self.assertEqual(len(shunted), 1)
         self.assertEqual(shunted[0].msg['message-id'], '<ant>')
+
+
+
+
+class TestBatching(unittest.TestCase):
+    """Test processing several queue files in one transaction."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        create_list('test@example.com')
+        # A failed batch is rolled back.
+        config.db.commit()
+
+    def _run(self):
+        # The runner reads its configuration when it is created.
+        runner = make_testable_runner(ForwardingRunner, 'in')
+        runner.run()
+        return runner
+
+    def _enqueue(self, count, fail=()):
+        for i in range(count):
+            msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{0}>
+
+""".format(i))
+            if i in fail:
+                msg['X-Fail'] = 'yes'
+            config.switchboards['in'].enqueue(
+                msg, listname='test@example.com')
+
+    def _forwarded(self):
+        return sorted(item.msg['message-id']
+                      for item in get_queue_messages('out'))
+
+    def _ids(self, numbers):
+        return sorted('<ant{0}>'.format(i) for i in numbers)
+
+    def test_unbatched(self):
+        self._enqueue(3)
+        runner = self._run()
+        self.assertEqual(runner.commits, 3)
+        self.assertEqual(runner.committed_messages, 3)
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_batches(self):
+        self._enqueue(25)
+        runner = self._run()
+        self.assertEqual(runner.commits, 3)
+        self.assertEqual(runner.committed_messages, 25)
+        self.assertEqual(self._forwarded(), self._ids(range(25)))
+        self.assertEqual(config.switchboards['in'].files, [])
+
+    @configuration('runner.in', batch_size=10, batch_time='0s')
+    def test_batch_time(self):
+        self._enqueue(3)
+        runner = self._run()
+        self.assertEqual(runner.commits, 3)
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_enqueued_on_commit(self):
+        # The next queue only gets the files of a batch once it commits.
+        forwarded = []
+        def commit():
+            forwarded.append(len(config.switchboards['out'].files))
+        self._enqueue(15)
+        with mock.patch.object(config.db, 'commit', side_effect=commit):
+            runner = self._run()
+        self.assertEqual(forwarded, [0, 10])
+        self.assertEqual(len(config.switchboards['out'].files), 15)
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_failed_file(self):
+        # The batch is rolled back and processed again one file at a time, so
+        # that only the failing file is shunted, and no message is forwarded
+        # twice.
+        self._enqueue(5, fail=[2])
+        mark = LogFileMark('mailman.error')
+        runner = self._run()
+        self.assertIn('failed a batch of 3 files', mark.readline())
+        self.assertEqual(self._forwarded(), self._ids([0, 1, 3, 4]))
+        shunted = get_queue_messages('shunt')
+        self.assertEqual(len(shunted), 1)
+        self.assertEqual(shunted[0].msg['message-id'], '<ant2>')
+        # Three transactions for the first three files, and one for the rest.
+        self.assertEqual(runner.commits, 4)
+        self.assertEqual(runner.committed_messages, 5)
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_failed_commit(self):
+        commits = []
+        def commit():
+            commits.append(len(commits))
+            if len(commits) == 1:
+                raise RuntimeError('database is locked')
+        self._enqueue(3)
+        with mock.patch.object(config.db, 'commit', side_effect=commit):
+            runner = self._run()
+        # The batch, then each of its files.
+        self.assertEqual(len(commits), 4)
+        self.assertEqual(self._forwarded(), self._ids(range(3)))
+        self.assertEqual(get_queue_messages('shunt'), [])
+
+    @configuration('runner.in', batch_size=10, batch_time='1h')
+    def test_statistics(self):
+        self._enqueue(25)
+        mark = LogFileMark('mailman.runner')
+        runner = self._run()
+        line = mark.readline()
+        self.assertIn('in runner committed 25 messages in 3 transactions',
+                      line)
+        self.assertIn('8.3 messages per commit', line)
@@ -0,0 +1,846 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the switchboard."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestBodyStore',
+    'TestDurability',
+    'TestFramedQueueFiles',
+    'TestSharedQueue',
+    'TestSwitchboardIndex',
+    'TestSwitchboardWakeup',
+    ]
+
+
+import os
+import copy
+import errno
+import mock
+import time
+import shutil
+import socket
+import cPickle
+import datetime
+import tempfile
+import unittest
+import threading
+
+from mailman.config import config
+from mailman.core.switchboard import (
+    BODY_STORE, FramedCodec, Switchboard, _leases, sync_queue_files)
+from mailman.testing.helpers import (
+    LogFileMark, configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities import inotify
+
+
+
+class TestSwitchboardIndex(unittest.TestCase):
+    """Test the incremental queue file index."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'index')
+        self._switchboard = Switchboard('index', self._queue_directory)
+        # Another process enqueuing into the same queue directory.
+        self._other = Switchboard('index', self._queue_directory)
+
+    def tearDown(self):
+        for filename in os.listdir(self._queue_directory):
+            os.remove(os.path.join(self._queue_directory, filename))
+
+    def test_files_from_other_process(self):
+        self.assertEqual(self._switchboard.files, [])
+        filebase = self._other.enqueue(self._msg)
+        self.assertEqual(self._switchboard.files, [filebase])
+        self._other.dequeue(filebase)
+        self.assertEqual(self._switchboard.files, [])
+
+    def test_stale_directory_status(self):
+        # A file must be noticed even when the directory's modification time
+        # did not change, e.g. because of coarse timestamps.
+        self.assertEqual(self._switchboard.files, [])
+        info = os.stat(self._queue_directory)
+        filebase = self._other.enqueue(self._msg)
+        os.utime(self._queue_directory, (info.st_atime, info.st_mtime))
+        self.assertEqual(self._switchboard.files, [filebase])
+
+    def test_dequeue_many_fifo(self):
+        filebases = [self._other.enqueue(self._msg, foo=i) for i in range(5)]
+        entries = list(self._switchboard.dequeue_many())
+        self.assertEqual([entry[0] for entry in entries], filebases)
+        self.assertEqual([entry[2]['foo'] for entry in entries], range(5))
+        self.assertEqual(self._switchboard.files, [])
+        for filebase, msg, msgdata in entries:
+            self._switchboard.finish(filebase)
+
+    def test_dequeue_many_count(self):
+        filebases = [self._other.enqueue(self._msg, foo=i) for i in range(5)]
+        entries = list(self._switchboard.dequeue_many(2))
+        self.assertEqual([entry[0] for entry in entries], filebases[:2])
+        self.assertEqual(self._switchboard.files, filebases[2:])
+        entries = list(self._switchboard.dequeue_many(2))
+        self.assertEqual([entry[0] for entry in entries], filebases[2:4])
+
+    def test_dequeue_many_stop_early(self):
+        # Files not reached by the caller stay in the queue and are handed
+        # out again later.
+        filebases = [self._other.enqueue(self._msg, foo=i) for i in range(3)]
+        entries = self._switchboard.dequeue_many()
+        filebase, msg, msgdata = next(entries)
+        entries.close()
+        self.assertEqual(filebase, filebases[0])
+        self.assertEqual(self._switchboard.files, filebases[1:])
+        entries = list(self._switchboard.dequeue_many())
+        self.assertEqual([entry[0] for entry in entries], filebases[1:])
+
+    def test_dequeue_many_enqueue_while_iterating(self):
+        # Files enqueued while iterating are left for the next pass.
+        first = self._other.enqueue(self._msg)
+        seen = []
+        for filebase, msg, msgdata in self._switchboard.dequeue_many():
+            seen.append(filebase)
+            second = self._switchboard.enqueue(self._msg)
+        self.assertEqual(seen, [first])
+        self.assertEqual(self._switchboard.files, [second])
+
+    def test_dequeue_many_vanished_file(self):
+        filebases = [self._other.enqueue(self._msg, foo=i) for i in range(2)]
+        entries = self._switchboard.dequeue_many()
+        filebase, msg, msgdata = next(entries)
+        # Another process got to the second file first.
+        self._other.dequeue(filebases[1])
+        self.assertEqual(list(entries), [])
+
+    def test_dequeue_many_preserves_unparseable(self):
+        filebase = self._other.enqueue(self._msg)
+        filename = os.path.join(self._queue_directory, filebase + '.pck')
+        with open(filename, 'w') as fp:
+            fp.write('garbage')
+        self.assertEqual(list(self._switchboard.dequeue_many()), [])
+        bad_dir = config.switchboards['bad'].queue_directory
+        psvfile = os.path.join(bad_dir, filebase + '.psv')
+        self.assertTrue(os.path.exists(psvfile))
+        os.remove(psvfile)
+
+    def test_slices(self):
+        slices = [Switchboard('index', self._queue_directory, i, 2)
+                  for i in range(2)]
+        filebases = [self._other.enqueue(self._msg, foo=i) for i in range(8)]
+        files = [switchboard.files for switchboard in slices]
+        self.assertEqual(sorted(files[0] + files[1]), sorted(filebases))
+        self.assertEqual(set(files[0]) & set(files[1]), set())
+
+    def test_count(self):
+        # The count follows the files in the switchboard's slice, including
+        # the ones dequeued by another process.
+        slices = [Switchboard('index', self._queue_directory, i, 2)
+                  for i in range(2)]
+        self.assertEqual(self._switchboard.count(), 0)
+        filebases = [self._other.enqueue(self._msg, foo=i) for i in range(8)]
+        self.assertEqual(self._switchboard.count(), 8)
+        self.assertEqual([switchboard.count() for switchboard in slices],
+                         [len(switchboard.files) for switchboard in slices])
+        self._other.dequeue(filebases[0])
+        self.assertEqual(self._switchboard.count(), 7)
+        self.assertEqual(sum(switchboard.count() for switchboard in slices),
+                         7)
+
+    @unittest.skipUnless(inotify.available(), 'inotify is not available')
+    @configuration('switchboard', wakeup='inotify')
+    def test_inotify_index(self):
+        # Once the watcher exists, the index is maintained from events.
+        self._switchboard.wait_for_files(0)
+        self.assertEqual(self._switchboard.files, [])
+        filebase = self._other.enqueue(self._msg)
+        self.assertTrue(self._switchboard.wait_for_files(5))
+        self.assertEqual(self._switchboard.files, [filebase])
+        self._other.dequeue(filebase)
+        self.assertEqual(self._switchboard.files, [])
+
+    @unittest.skipUnless(inotify.available(), 'inotify is not available')
+    @configuration('switchboard', wakeup='inotify')
+    def test_inotify_close(self):
+        # Closing the switchboard closes the inotify file descriptor, and the
+        # index goes back to scanning the directory.
+        self._switchboard.wait_for_files(0)
+        fd = self._switchboard._watcher._inotify.fileno()
+        self._switchboard.close()
+        self.assertRaises(OSError, os.fstat, fd)
+        filebase = self._other.enqueue(self._msg)
+        self.assertEqual(self._switchboard.files, [filebase])
+
+
+
+class TestSwitchboardWakeup(unittest.TestCase):
+    """Test waiting for new queue files."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        queue_directory = os.path.join(config.QUEUE_DIR, 'wakeup')
+        self._switchboard = Switchboard('wakeup', queue_directory)
+
+    def tearDown(self):
+        for filebase in self._switchboard.files:
+            self._switchboard.dequeue(filebase)
+            self._switchboard.finish(filebase)
+
+    def _enqueue_later(self, delay):
+        # Enqueue the message through a separate switchboard instance, the
+        # way another runner process would.
+        other = Switchboard('wakeup', self._switchboard.queue_directory)
+        timer = threading.Timer(delay, other.enqueue, (self._msg,))
+        timer.start()
+        return timer
+
+    def _check_early_wakeup(self):
+        # The first wait only primes the watcher.
+        self.assertTrue(self._switchboard.wait_for_files(10))
+        timer = self._enqueue_later(0.2)
+        start = time.time()
+        woken = self._switchboard.wait_for_files(10)
+        elapsed = time.time() - start
+        timer.join()
+        self.assertTrue(woken)
+        self.assertLess(elapsed, 5)
+        self.assertEqual(len(self._switchboard.files), 1)
+
+    @configuration('switchboard', wakeup='sleep')
+    def test_sleep_waits_for_timeout(self):
+        start = time.time()
+        self._switchboard.wait_for_files(0.3)
+        self.assertGreaterEqual(time.time() - start, 0.3)
+
+    @configuration('switchboard', wakeup='poll', poll_interval='0.01s')
+    def test_poll_wakes_up_on_enqueue(self):
+        self._check_early_wakeup()
+
+    @configuration('switchboard', wakeup='poll', poll_interval='0.01s')
+    def test_poll_times_out(self):
+        self.assertTrue(self._switchboard.wait_for_files(0.1))
+        self.assertFalse(self._switchboard.wait_for_files(0.1))
+
+    @unittest.skipUnless(inotify.available(), 'inotify is not available')
+    @configuration('switchboard', wakeup='inotify')
+    def test_inotify_wakes_up_on_enqueue(self):
+        self._check_early_wakeup()
+
+    @unittest.skipUnless(inotify.available(), 'inotify is not available')
+    @configuration('switchboard', wakeup='inotify')
+    def test_inotify_ignores_dequeue(self):
+        # Moving a file to .bak while processing it does not count as a new
+        # queue file.
+        filebase = self._switchboard.enqueue(self._msg)
+        self.assertTrue(self._switchboard.wait_for_files(0.1))
+        self._switchboard.dequeue(filebase)
+        self.assertFalse(self._switchboard.wait_for_files(0.2))
+        self._switchboard.finish(filebase)
+
+
+
+
+class TestFramedQueueFiles(unittest.TestCase):
+    """Test the framed queue file format."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+From the body.
+""")
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'framed')
+        self._switchboard = Switchboard('framed', self._queue_directory)
+
+    def tearDown(self):
+        for filename in os.listdir(self._queue_directory):
+            os.remove(os.path.join(self._queue_directory, filename))
+
+    def _read(self, filebase, extension='.pck'):
+        path = os.path.join(self._queue_directory, filebase + extension)
+        with open(path) as fp:
+            return fp.read()
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_round_trip(self):
+        self._msg.recipients = set(['bart@example.com'])
+        when = datetime.datetime(2014, 1, 2, 3, 4, 5)
+        filebase = self._switchboard.enqueue(
+            self._msg, listname='test@example.com', when=when, pair=(1, 2))
+        self.assertTrue(self._read(filebase).startswith(FramedCodec.magic))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+        self.assertEqual(msg.recipients, set(['bart@example.com']))
+        self.assertEqual(msg.get_payload(), 'From the body.\n')
+        self.assertEqual(msgdata['listname'], 'test@example.com')
+        self.assertEqual(msgdata['when'], when)
+        self.assertEqual(msgdata['pair'], (1, 2))
+        self.assertFalse(msgdata['_parsemsg'])
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_body_is_lazy(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['to'], 'test@example.com')
+        self.assertNotIn('_payload', msg.__dict__)
+        # An unchanged body is passed through to the next queue as is.
+        self.assertEqual(str(msg.raw_body), 'From the body.\n')
+        msg['X-Hop'] = 'yes'
+        new_filebase = self._switchboard.enqueue(msg)
+        self.assertNotIn('_payload', msg.__dict__)
+        self.assertIn('X-Hop: yes\n\nFrom the body.\n',
+                      self._read(new_filebase))
+        self._switchboard.finish(filebase)
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_changed_body(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        msg.set_payload('A new body.\n')
+        self.assertIsNone(msg.raw_body)
+        new_msg, msgdata = self._switchboard.dequeue(
+            self._switchboard.enqueue(msg))
+        self.assertEqual(new_msg.get_payload(), 'A new body.\n')
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_pickle_and_copy(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(copy.deepcopy(msg).get_payload(), 'From the body.\n')
+        unpickled = cPickle.loads(cPickle.dumps(msg, 2))
+        self.assertEqual(unpickled.as_string(), msg.as_string())
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_plaintext(self):
+        filebase = self._switchboard.enqueue(self._msg, _plaintext=True)
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertTrue(msgdata['_parsemsg'])
+        # The size of the message text, without any From_ mangling.
+        self.assertEqual(msg.original_size, 78)
+        self.assertEqual(msgdata['original_size'], msg.original_size)
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_unrepresentable_falls_back_to_pickle(self):
+        # Non-ASCII unicode headers would come back RFC 2047 encoded.
+        self._msg['Subject'] = 'Caf\xe9'
+        filebase = self._switchboard.enqueue(self._msg)
+        self.assertFalse(self._read(filebase).startswith(FramedCodec.magic))
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['subject'], 'Caf\xe9')
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_recover_backup_files(self):
+        filebase = self._switchboard.enqueue(self._msg, foo=1)
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [filebase])
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msgdata['_bak_count'], 1)
+        self.assertEqual(msgdata['foo'], 1)
+        self.assertEqual(msg.get_payload(), 'From the body.\n')
+        self._switchboard.finish(filebase)
+
+    def test_read_either_format(self):
+        with configuration('switchboard', qfile_format='framed'):
+            framed = self._switchboard.enqueue(self._msg, foo=1)
+        pickled = self._switchboard.enqueue(self._msg, foo=2)
+        self.assertFalse(self._read(pickled).startswith(FramedCodec.magic))
+        entries = [(msg['message-id'], msgdata['foo'])
+                   for filebase, msg, msgdata
+                   in self._switchboard.dequeue_many()]
+        self.assertEqual(entries, [('<ant>', 1), ('<ant>', 2)])
+
+
+
+
+class TestBodyStore(unittest.TestCase):
+    """Test the store of message bodies shared by framed queue files."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._body = 'A line of the body.\n' * 250
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""" + self._body)
+        self._store = os.path.join(config.QUEUE_DIR, BODY_STORE)
+        self._in = Switchboard('in-bodies', os.path.join(
+            config.QUEUE_DIR, 'in-bodies'))
+        self._out = Switchboard('out-bodies', os.path.join(
+            config.QUEUE_DIR, 'out-bodies'))
+
+    def _bodies(self):
+        # The number of stored bodies, and the number of references to them.
+        if not os.path.isdir(self._store):
+            return 0, 0
+        filenames = os.listdir(self._store)
+        references = [name for name in filenames if '.' in name]
+        return len(filenames) - len(references), len(references)
+
+    def _size(self, switchboard, filebase):
+        return os.path.getsize(os.path.join(
+            switchboard.queue_directory, filebase + '.pck'))
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_body_written_once(self):
+        # A message queued for several recipients has its body stored once.
+        first = self._in.enqueue(self._msg, listname='ant@example.com')
+        second = self._in.enqueue(self._msg, listname='bee@example.com')
+        self.assertEqual(self._bodies(), (1, 2))
+        self.assertLess(self._size(self._in, first), len(self._body))
+        for filebase, listname in ((first, 'ant'), (second, 'bee')):
+            msg, msgdata = self._in.dequeue(filebase)
+            self.assertEqual(msgdata['listname'], listname + '@example.com')
+            self.assertEqual(msg.get_payload(), self._body)
+            self._in.finish(filebase)
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_finish_releases_body(self):
+        # The body is removed when the last queue file referring to it is
+        # finished.
+        filebases = [self._in.enqueue(self._msg) for i in range(2)]
+        self._in.dequeue(filebases[0])
+        self._in.finish(filebases[0])
+        self.assertEqual(self._bodies(), (1, 1))
+        self._in.dequeue(filebases[1])
+        self._in.finish(filebases[1])
+        self.assertEqual(self._bodies(), (0, 0))
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_unchanged_body_passed_on(self):
+        # Passing a message with an unchanged body on to the next queue only
+        # adds a reference to the body.
+        filebase = self._in.enqueue(self._msg)
+        msg, msgdata = self._in.dequeue(filebase)
+        msg['X-Hop'] = 'yes'
+        with mock.patch('mailman.core.switchboard.open',
+                        create=True, side_effect=open) as open_:
+            out_filebase = self._out.enqueue(msg, msgdata)
+        # Only the queue file itself was written.
+        self.assertEqual(open_.call_count, 1)
+        self._in.finish(filebase)
+        self.assertEqual(self._bodies(), (1, 1))
+        msg, msgdata = self._out.dequeue(out_filebase)
+        self.assertEqual(msg['x-hop'], 'yes')
+        self.assertEqual(msg.get_payload(), self._body)
+        self._out.finish(out_filebase)
+        self.assertEqual(self._bodies(), (0, 0))
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_changed_body(self):
+        filebase = self._in.enqueue(self._msg)
+        msg, msgdata = self._in.dequeue(filebase)
+        msg.set_payload('A new body.\n' * 500)
+        out_filebase = self._out.enqueue(msg, msgdata)
+        self.assertEqual(self._bodies(), (2, 2))
+        self._in.finish(filebase)
+        msg, msgdata = self._out.dequeue(out_filebase)
+        self.assertEqual(msg.get_payload(), 'A new body.\n' * 500)
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_small_body(self):
+        # Small bodies stay in the queue file.
+        self._msg.set_payload('A small body.\n')
+        filebase = self._in.enqueue(self._msg)
+        self.assertEqual(self._bodies(), (0, 0))
+        msg, msgdata = self._in.dequeue(filebase)
+        self.assertEqual(msg.get_payload(), 'A small body.\n')
+
+    @configuration('switchboard', qfile_format='framed',
+                   body_store_threshold=0)
+    def test_disabled(self):
+        filebase = self._in.enqueue(self._msg)
+        self.assertEqual(self._bodies(), (0, 0))
+        self.assertGreater(self._size(self._in, filebase), len(self._body))
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_preserve(self):
+        # A preserved queue file still refers to its body.
+        filebase = self._in.enqueue(self._msg)
+        self._in.dequeue(filebase)
+        self._in.finish(filebase, preserve=True)
+        self.assertEqual(self._bodies(), (1, 1))
+        bad = config.switchboards['bad'].queue_directory
+        with open(os.path.join(bad, filebase + '.psv')) as fp:
+            msg, msgdata = FramedCodec().load(fp)
+        self.assertEqual(msg.get_payload(), self._body)
+
+    @configuration('switchboard', qfile_format='framed')
+    def test_plaintext(self):
+        filebase = self._in.enqueue(self._msg, _plaintext=True)
+        msg, msgdata = self._in.dequeue(filebase)
+        self.assertEqual(msg.original_size, len(self._msg.as_string()))
+
+
+
+
+class TestDurability(unittest.TestCase):
+    """Test the queue file durability modes."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'durable')
+        self._switchboard = Switchboard('durable', self._queue_directory)
+        patcher = mock.patch('os.fsync')
+        self._fsync = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        sync_queue_files()
+        for filename in os.listdir(self._queue_directory):
+            os.remove(os.path.join(self._queue_directory, filename))
+
+    def test_fsync(self):
+        for i in range(3):
+            self._switchboard.enqueue(self._msg)
+        self.assertEqual(self._fsync.call_count, 3)
+
+    @configuration('switchboard', durability='none')
+    def test_none(self):
+        for i in range(3):
+            self._switchboard.enqueue(self._msg)
+        sync_queue_files()
+        self.assertEqual(self._fsync.call_count, 0)
+
+    @configuration('switchboard', durability='group',
+                   group_commit_window='1h')
+    def test_group_commit(self):
+        for i in range(3):
+            self._switchboard.enqueue(self._msg)
+        self.assertEqual(self._fsync.call_count, 0)
+        sync_queue_files()
+        # Every file, then the queue directory.
+        self.assertEqual(self._fsync.call_count, 4)
+        sync_queue_files()
+        self.assertEqual(self._fsync.call_count, 4)
+
+    @configuration('switchboard', durability='group',
+                   group_commit_window='1h')
+    def test_group_commit_before_finish(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        sync_queue_files()
+        self._fsync.reset_mock()
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self._switchboard.enqueue(msg, msgdata)
+        self._switchboard.enqueue(msg, msgdata)
+        self.assertEqual(self._fsync.call_count, 0)
+        self._switchboard.finish(filebase)
+        self.assertEqual(self._fsync.call_count, 3)
+
+    @configuration('switchboard', durability='group',
+                   group_commit_window='0s')
+    def test_group_commit_window(self):
+        self._switchboard.enqueue(self._msg)
+        self.assertEqual(self._fsync.call_count, 2)
+
+    @configuration('switchboard', durability='group',
+                   group_commit_window='1h')
+    def test_group_commit_file_moved(self):
+        # The file is still fsynced after a runner has dequeued it.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        sync_queue_files()
+        self.assertEqual(self._fsync.call_count, 2)
+
+    @configuration('switchboard', durability='none')
+    def test_recover_none(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [filebase])
+        self.assertEqual(self._fsync.call_count, 0)
+
+    @configuration('switchboard', durability='group',
+                   group_commit_window='1h')
+    def test_recover_group_commit(self):
+        for i in range(2):
+            self._switchboard.dequeue(self._switchboard.enqueue(self._msg))
+        sync_queue_files()
+        self._fsync.reset_mock()
+        self._switchboard.recover_backup_files()
+        self.assertEqual(len(self._switchboard.files), 2)
+        self.assertEqual(self._fsync.call_count, 3)
+
+
+
+
+class TestSharedQueue(unittest.TestCase):
+    """Test several processes dequeuing from the whole queue directory."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._msg = mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant>
+
+""")
+        self._queue_directory = os.path.join(config.QUEUE_DIR, 'shared')
+        self._switchboard = Switchboard(
+            'shared', self._queue_directory, shared=True)
+        # Another runner sharing the queue directory.
+        self._other = Switchboard(
+            'shared', self._queue_directory, shared=True)
+
+    def tearDown(self):
+        for filename in os.listdir(self._queue_directory):
+            os.remove(os.path.join(self._queue_directory, filename))
+
+    def _claim_path(self, filebase):
+        return os.path.join(self._queue_directory, filebase + '.claim')
+
+    def _claim_for(self, filebase, pid, host=None, lease=60):
+        # Pretend the file was claimed by another process.
+        if host is None:
+            host = socket.gethostname()
+        with open(self._claim_path(filebase), 'w') as fp:
+            fp.write('{0} {1:d} {2:.3f}\n'.format(
+                host, pid, time.time() + lease))
+
+    def _read_claim(self, filebase):
+        with open(self._claim_path(filebase)) as fp:
+            host, pid, expires = fp.read().split()
+        return host, int(pid), float(expires)
+
+    def _dead_pid(self):
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def test_no_slices(self):
+        self.assertRaises(AssertionError, Switchboard,
+                          'shared', self._queue_directory, 0, 2, shared=True)
+
+    def test_dequeue_claims(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self.assertTrue(os.path.exists(self._claim_path(filebase)))
+        self._switchboard.finish(filebase)
+        self.assertFalse(os.path.exists(self._claim_path(filebase)))
+        self.assertEqual(os.listdir(self._queue_directory), [])
+
+    def test_claim(self):
+        # The claim names this host and process, and when its lease expires.
+        filebase = self._switchboard.enqueue(self._msg)
+        now = time.time()
+        self._switchboard.dequeue(filebase)
+        host, pid, expires = self._read_claim(filebase)
+        self.assertEqual(host, socket.gethostname())
+        self.assertEqual(pid, os.getpid())
+        self.assertTrue(now + 59 < expires < now + 61)
+        self._switchboard.finish(filebase)
+
+    def test_dequeue_claimed(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._claim_for(filebase, os.getppid())
+        with self.assertRaises(OSError) as cm:
+            self._other.dequeue(filebase)
+        self.assertEqual(cm.exception.errno, errno.EEXIST)
+        # The file is still in the queue.
+        self.assertEqual(self._other.files, [filebase])
+
+    def test_dequeue_vanished(self):
+        # The claim is released when the file turns out to be gone.
+        filebase = self._switchboard.enqueue(self._msg)
+        os.remove(os.path.join(self._queue_directory, filebase + '.pck'))
+        with self.assertRaises(IOError) as cm:
+            self._switchboard.dequeue(filebase)
+        self.assertEqual(cm.exception.errno, errno.ENOENT)
+        self.assertEqual(os.listdir(self._queue_directory), [])
+
+    def test_dequeue_many_disjoint(self):
+        filebases = [self._switchboard.enqueue(self._msg, foo=i)
+                     for i in range(6)]
+        seen = []
+        entries = self._switchboard.dequeue_many()
+        other_entries = self._other.dequeue_many()
+        # Both runners listed all the files before dequeuing any of them.
+        seen.append(next(entries)[0])
+        seen.append(next(other_entries)[0])
+        seen.extend(entry[0] for entry in entries)
+        # The files are still claimed, since neither runner finished them.
+        self.assertEqual(list(other_entries), [])
+        self.assertEqual(sorted(seen), sorted(filebases))
+
+    def test_recover_live_claim(self):
+        # The files of runners which are still alive are left alone.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._other.dequeue(filebase)
+        self._claim_for(filebase, os.getppid())
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [])
+        self.assertTrue(os.path.exists(self._claim_path(filebase)))
+
+    def test_recover_dead_claim(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._other.dequeue(filebase)
+        self._claim_for(filebase, self._dead_pid())
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [filebase])
+        self.assertFalse(os.path.exists(self._claim_path(filebase)))
+        # Now it can be dequeued again.
+        msg, msgdata = self._switchboard.dequeue(filebase)
+        self.assertEqual(msg['message-id'], '<ant>')
+
+    def test_recover_dead_claim_not_dequeued(self):
+        # The runner died after claiming the file, but before dequeuing it.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._claim_for(filebase, self._dead_pid())
+        self._switchboard.recover_backup_files()
+        self.assertFalse(os.path.exists(self._claim_path(filebase)))
+        self._switchboard.dequeue(filebase)
+
+    def test_recover_unclaimed(self):
+        # Backup files left from before the queue was shared are recovered.
+        filebase = self._switchboard.enqueue(self._msg)
+        os.rename(os.path.join(self._queue_directory, filebase + '.pck'),
+                  os.path.join(self._queue_directory, filebase + '.bak'))
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [filebase])
+
+    def test_recover_other_host(self):
+        # Whether the process of a claim from another host is alive can't be
+        # known, so the claim is left alone until its lease expires.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._other.dequeue(filebase)
+        self._claim_for(filebase, self._dead_pid(), 'elsewhere.example.com')
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [])
+
+    def test_recover_expired_lease(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._other.dequeue(filebase)
+        self._claim_for(filebase, 1, 'elsewhere.example.com', lease=-1)
+        self._switchboard.recover_backup_files()
+        self.assertEqual(self._switchboard.files, [filebase])
+        self.assertFalse(os.path.exists(self._claim_path(filebase)))
+
+    def test_dequeue_many_recovers(self):
+        # Files whose leases expired are taken over while dequeuing.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._other.dequeue(filebase)
+        self._claim_for(filebase, 1, 'elsewhere.example.com', lease=-1)
+        entries = list(self._switchboard.dequeue_many())
+        self.assertEqual([entry[0] for entry in entries], [filebase])
+        self.assertEqual(entries[0][2]['_bak_count'], 1)
+        self._switchboard.finish(filebase)
+
+    def test_renew(self):
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self._claim_for(filebase, os.getpid(), lease=1)
+        _leases.renew()
+        host, pid, expires = self._read_claim(filebase)
+        self.assertGreater(expires, time.time() + 59)
+        self._switchboard.finish(filebase)
+
+    def test_lost_claim(self):
+        # Another host took over the file after our lease expired.
+        filebase = self._switchboard.enqueue(self._msg)
+        self._switchboard.dequeue(filebase)
+        self._claim_for(filebase, 1, 'elsewhere.example.com')
+        mark = LogFileMark('mailman.error')
+        _leases.renew()
+        self.assertIn('Lost the claim on queue file', mark.readline())
+        self.assertEqual(self._read_claim(filebase)[0],
+                         'elsewhere.example.com')
+        # Finishing the file leaves the other host's claim alone.
+        self._switchboard.finish(filebase)
+        self.assertTrue(os.path.exists(self._claim_path(filebase)))
+
+    @configuration('switchboard', claim_lease='1s')
+    def test_hosts(self):
+        # Processes standing in for several hosts process every file once,
+        # including the files of a host which crashed.
+        filebases = [self._switchboard.enqueue(self._msg, foo=i)
+                     for i in range(30)]
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        def host(number, crash):
+            with mock.patch('socket.gethostname',
+                            return_value='host{0}'.format(number)):
+                switchboard = Switchboard(
+                    'shared', self._queue_directory, shared=True)
+                if crash:
+                    list(switchboard.dequeue_many(2))
+                    return
+                until = time.time() + 20
+                output = open(os.path.join(tempdir, str(number)), 'w')
+                while time.time() < until:
+                    for filebase, msg, msgdata in switchboard.dequeue_many():
+                        switchboard.finish(filebase)
+                        print(filebase, file=output)
+                        output.flush()
+                    if not any(os.path.splitext(name)[1] in ('.pck', '.bak')
+                               for name in os.listdir(self._queue_directory)):
+                        break
+                    time.sleep(0.1)
+        def fork(number, crash=False):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    host(number, crash)
+                    status = 0
+                finally:
+                    os._exit(status)
+            return pid
+        # The first host crashes while holding two files, and its leases
+        # expire after a second.
+        self.assertEqual(os.waitpid(fork(0, crash=True), 0)[1], 0)
+        for pid in [fork(number) for number in (1, 2, 3)]:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        processed = []
+        for number in (1, 2, 3):
+            with open(os.path.join(tempdir, str(number))) as fp:
+                processed.extend(fp.read().split())
+        self.assertEqual(sorted(processed), sorted(filebases))
+        self.assertEqual(os.listdir(self._queue_directory), [])
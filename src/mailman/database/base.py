@@ -34,6 +34,8 @@ from storm.locals import create_database, Store
 from zope.interface import implementer
 
 from mailman.config import config
+from mailman.database.transaction import (
+    transaction_aborted, transaction_committed)
 from mailman.interfaces.database import IDatabase
 from mailman.model.version import Version
 from mailman.utilities.string import expand
@@ -58,6 +60,7 @@ class StormBaseDatabase:
     def __init__(self):
         self.url = None
         self.store = None
+        self._inherited_stores = []
 
     def begin(self):
         """See `IDatabase`."""
@@ -67,10 +70,22 @@ class StormBaseDatabase:
     def commit(self):
         """See `IDatabase`."""
         self.store.commit()
+        transaction_committed()
 
     def abort(self):
         """See `IDatabase`."""
         self.store.rollback()
+        transaction_aborted()
+
+    def after_fork(self):
+        """See `IDatabase`."""
+        # Garbage collecting the inherited store would close its connection,
+        # which for e.g. PostgreSQL ends the parent's session as well.  Keep
+        # it until this process exits.
+        self._inherited_stores.append(self.store)
+        database = create_database(self.url)
+        database.DEBUG = self.store.get_database().DEBUG
+        self.store = Store(database, GenerationalCache())
 
     def _database_exists(self):
         """Return True if the database exists and is initialized.
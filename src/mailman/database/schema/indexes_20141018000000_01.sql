@@ -0,0 +1,26 @@
+-- This file contains the SQLite and PostgreSQL schema migration from
+-- 3.0b4 to 3.0b5
+--
+-- After 3.0b5 is released you may not edit this file.
+
+-- These are the columns looked up on the hot paths, e.g. by
+-- IRoster.get_member(), IUserManager.get_address(), IPendings.confirm(),
+-- IMessageStore.get_message_by_id() and IBanManager.is_banned().
+
+CREATE INDEX ix_address_email ON address (email);
+
+CREATE INDEX ix_autoresponserecord_address_id_mailing_list_id
+    ON autoresponserecord
+    (address_id, mailing_list_id, response_type, date_sent);
+
+CREATE INDEX ix_ban_list_id_email ON ban (list_id, email);
+
+CREATE INDEX ix_bounceevent_processed ON bounceevent (processed);
+
+CREATE INDEX ix_member_list_id_role ON member (list_id, role);
+CREATE INDEX ix_member_user_id ON member (user_id);
+
+CREATE INDEX ix_message_message_id ON message (message_id);
+CREATE INDEX ix_message_message_id_hash ON message (message_id_hash);
+
+CREATE INDEX ix_pended_token ON pended (token);
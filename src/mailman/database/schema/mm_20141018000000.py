@@ -0,0 +1,47 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""3.0b4 -> 3.0b5 schema migrations.
+
+Added indexes:
+ * address (email)
+ * autoresponserecord (address_id, mailing_list_id, response_type, date_sent)
+ * ban (list_id, email)
+ * bounceevent (processed)
+ * member (list_id, role)
+ * member (user_id)
+ * message (message_id)
+ * message (message_id_hash)
+ * pended (token)
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'upgrade',
+    ]
+
+
+VERSION = '20141018000000'
+
+
+
+def upgrade(database, store, version, module_path):
+    # The indexes are created the same way in every database.
+    database.load_schema(
+        store, version, 'indexes_{}_01.sql'.format(version), module_path)
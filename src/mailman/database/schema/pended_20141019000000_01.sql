@@ -0,0 +1,15 @@
+-- This file contains the SQLite and PostgreSQL schema migration from
+-- 3.0b4 to 3.0b5
+--
+-- After 3.0b5 is released you may not edit this file.
+
+-- ADDs to the pended table:
+-- ADD payload
+
+-- The pended event data is stored as one JSON object in the pended row,
+-- instead of as pendedkeyvalue rows.  Expired rows are found through the
+-- index on the expiration date.
+
+ALTER TABLE pended ADD COLUMN payload TEXT;
+
+CREATE INDEX ix_pended_expiration_date ON pended (expiration_date);
@@ -28,6 +28,8 @@ __all__ = [
     'TestMigration20121015Schema',
     'TestMigration20130406MigratedData',
     'TestMigration20130406Schema',
+    'TestMigration20141018Schema',
+    'TestMigration20141019Schema',
     ]
 
 
@@ -504,3 +506,64 @@ class TestMigration20130406MigratedData(MigrationTestBase):
         self.assertEqual(events[0].message_id, '<abc@example.com>')
         self.assertEqual(events[0].context, BounceContext.normal)
         self.assertFalse(events[0].processed)
+
+
+
+class TestMigration20141018Schema(MigrationTestBase):
+    """Test index migrations."""
+
+    _indexes = (
+        'ix_address_email',
+        'ix_autoresponserecord_address_id_mailing_list_id',
+        'ix_ban_list_id_email',
+        'ix_bounceevent_processed',
+        'ix_member_list_id_role',
+        'ix_member_user_id',
+        'ix_message_message_id',
+        'ix_message_message_id_hash',
+        'ix_pended_token',
+        )
+
+    def _index_names(self):
+        if self._database.TAG == 'postgres':
+            query = 'SELECT indexname FROM pg_indexes;'
+        else:
+            query = "SELECT name FROM sqlite_master WHERE type = 'index';"
+        return set(row[0] for row in self._database.store.execute(query))
+
+    def test_pre_upgrade_indexes(self):
+        self._database.load_migrations('20141017999999')
+        self.assertEqual(self._index_names() & set(self._indexes), set())
+
+    def test_post_upgrade_indexes(self):
+        self._database.load_migrations('20141018000000')
+        self.assertEqual(self._index_names() & set(self._indexes),
+                         set(self._indexes))
+
+
+
+
+class TestMigration20141019Schema(MigrationTestBase):
+    """Test the pended payload migration."""
+
+    def test_pre_upgrade_columns_migration(self):
+        self._missing_present('pended',
+                              ['20141018999999'],
+                              ('payload',),
+                              ('token', 'expiration_date'))
+
+    def test_post_upgrade_columns_migration(self):
+        self._missing_present('pended',
+                              ['20141018999999',
+                               '20141019000000'],
+                              (),
+                              ('token', 'expiration_date', 'payload'))
+
+    def test_post_upgrade_indexes(self):
+        self._database.load_migrations('20141019000000')
+        if self._database.TAG == 'postgres':
+            query = 'SELECT indexname FROM pg_indexes;'
+        else:
+            query = "SELECT name FROM sqlite_master WHERE type = 'index';"
+        indexes = set(row[0] for row in self._database.store.execute(query))
+        self.assertIn('ix_pended_expiration_date', indexes)
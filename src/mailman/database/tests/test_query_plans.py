@@ -0,0 +1,169 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test that the hot queries use indexes."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestQueryPlans',
+    ]
+
+
+import re
+import unittest
+
+from zope.component import getUtility
+from zope.interface import implementer
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.autorespond import IAutoResponseSet, Response
+from mailman.interfaces.bans import IBanManager
+from mailman.interfaces.bounce import IBounceProcessor
+from mailman.interfaces.messages import IMessageStore
+from mailman.interfaces.pending import IPendable, IPendings
+from mailman.interfaces.usermanager import IUserManager
+from mailman.testing.helpers import (
+    query_log, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+
+
+
+@implementer(IPendable)
+class SimplePendable(dict):
+    pass
+
+
+
+class TestQueryPlans(unittest.TestCase):
+    """Run EXPLAIN on the queries behind the hot paths.
+
+    Every table these queries touch must be searched through an index,
+    otherwise lookups get slower as the site grows.
+    """
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        # Seed every table with more than one row.
+        for i in range(5):
+            email = 'person{0}@example.com'.format(i)
+            address = user_manager.create_address(email)
+            self._mlist.subscribe(address)
+            IBanManager(self._mlist).ban('banned{0}@example.com'.format(i))
+            IAutoResponseSet(self._mlist).response_sent(
+                address, Response.hold)
+            getUtility(IPendings).add(SimplePendable(type='test'))
+            msg = mfs("""\
+From: {0}
+Message-ID: <{1}>
+
+""".format(email, i))
+            getUtility(IMessageStore).add(msg)
+            getUtility(IBounceProcessor).register(self._mlist, email, msg)
+        self._token = getUtility(IPendings).add(SimplePendable(type='test'))
+        self._address = user_manager.get_address('person2@example.com')
+        config.db.commit()
+        # The plans of the queries are checked with sequential scans turned
+        # off, because PostgreSQL prefers them for tables this small.
+        if config.db.TAG == 'postgres':
+            config.db.store.execute('SET enable_seqscan = off;')
+
+    def tearDown(self):
+        if config.db.TAG == 'postgres':
+            config.db.store.execute('SET enable_seqscan = on;')
+
+    def _full_scans(self, statements):
+        """Return the tables which the queries have to scan."""
+        if config.db.TAG == 'postgres':
+            explain = 'EXPLAIN '
+            scan = re.compile(r'Seq Scan on "?(\w+)')
+        else:
+            explain = 'EXPLAIN QUERY PLAN '
+            # Newer versions of SQLite leave out the TABLE.
+            scan = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?(?: AS \w+)?$')
+        tables = set()
+        for statement, params in statements:
+            if not statement.lstrip().upper().startswith(
+                    ('SELECT', 'DELETE')):
+                continue
+            for row in config.db.store.execute(explain + statement, params):
+                # The plan's description is in the last column.
+                match = scan.search(row[-1])
+                if match is not None:
+                    tables.add(match.group(1))
+        return tables
+
+    def _check(self, function, *args):
+        with query_log(params=True) as statements:
+            function(*args)
+        self.assertNotEqual(statements, [])
+        self.assertEqual(self._full_scans(statements), set())
+
+    def test_get_member(self):
+        self._check(self._mlist.members.get_member, 'person3@example.com')
+
+    def test_regular_members(self):
+        self._check(lambda: self._mlist.regular_members.member_count)
+
+    def test_get_address(self):
+        self._check(getUtility(IUserManager).get_address,
+                    'person3@example.com')
+
+    def test_confirm(self):
+        self._check(getUtility(IPendings).confirm, self._token, False)
+
+    def test_evict(self):
+        self._check(getUtility(IPendings).evict, 100)
+
+    def test_get_message_by_id(self):
+        self._check(getUtility(IMessageStore).get_message_by_id, '<3>')
+
+    def test_get_message_by_hash(self):
+        message_id_hash = getUtility(IMessageStore).get_message_by_id(
+            '<3>')['x-message-id-hash']
+        self._check(getUtility(IMessageStore).get_message_by_hash,
+                    message_id_hash)
+
+    def test_is_banned(self):
+        # The bans are loaded into memory once, after which checking an email
+        # address doesn't query the database at all.
+        ban_manager = IBanManager(self._mlist)
+        ban_manager.is_banned('banned3@example.com')
+        with query_log() as statements:
+            self.assertTrue(ban_manager.is_banned('banned3@example.com'))
+            self.assertFalse(ban_manager.is_banned('person3@example.com'))
+        self.assertEqual(statements, [])
+
+    def test_ban(self):
+        self._check(IBanManager(self._mlist).ban, 'banned3@example.com')
+
+    def test_unprocessed_bounces(self):
+        self._check(
+            lambda: list(getUtility(IBounceProcessor).unprocessed))
+
+    def test_todays_count(self):
+        self._check(IAutoResponseSet(self._mlist).todays_count,
+                    self._address, Response.hold)
+
+    def test_last_response(self):
+        self._check(IAutoResponseSet(self._mlist).last_response,
+                    self._address, Response.hold)
@@ -22,7 +22,10 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'dbconnection',
+    'register_transaction_callbacks',
     'transaction',
+    'transaction_aborted',
+    'transaction_committed',
     'transactional',
     ]
 
@@ -32,6 +35,11 @@ from contextlib import contextmanager
 from mailman.config import config
 
 
+# The functions called after every commit and every rollback.
+_committed_callbacks = []
+_aborted_callbacks = []
+
+
 
 @contextmanager
 def transaction():
@@ -77,3 +85,41 @@ def dbconnection(function):
         # args[0] is self.
         return function(args[0], config.db.store, *args[1:], **kws)
     return wrapper
+
+
+
+def register_transaction_callbacks(committed=None, aborted=None):
+    """Call functions after every commit or rollback of the database.
+
+    Use this for the state a module keeps in memory which follows the
+    database, e.g. a cache, so that the database layer need not know about
+    it.  The callbacks are called without arguments, in the order they were
+    registered.
+
+    :param committed: The function to call after every commit, or None.
+    :type committed: callable
+    :param aborted: The function to call after every rollback, or None.
+    :type aborted: callable
+    """
+    if committed is not None:
+        _committed_callbacks.append(committed)
+    if aborted is not None:
+        _aborted_callbacks.append(aborted)
+
+
+def transaction_committed():
+    """Call the callbacks registered for commits.
+
+    `IDatabase` implementations call this once they have committed.
+    """
+    for callback in _committed_callbacks:
+        callback()
+
+
+def transaction_aborted():
+    """Call the callbacks registered for rollbacks.
+
+    `IDatabase` implementations call this once they have rolled back.
+    """
+    for callback in _aborted_callbacks:
+        callback()
@@ -31,6 +31,7 @@ __all__ = [
 from zope.component import getUtility
 from zope.interface import implementer
 
+from mailman.app.senders import sender_context
 from mailman.core.i18n import _
 from mailman.email.message import UserNotification
 from mailman.interfaces.handler import IHandler
@@ -51,7 +52,7 @@ class Acknowledge:
         """See `IHandler`."""
         # Extract the sender's address and find them in the user database
         sender = msgdata.get('original_sender', msg.sender)
-        member = mlist.members.get_member(sender)
+        member = sender_context(mlist, msg, msgdata).member(sender)
         if member is None or not member.acknowledge_posts:
             # Either the sender is not a member, in which case we can't know
             # whether they want an acknowlegment or not, or they are a member
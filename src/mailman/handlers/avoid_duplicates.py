@@ -34,6 +34,7 @@ __all__ = [
 from email.utils import getaddresses, formataddr
 from zope.interface import implementer
 
+from mailman.app.senders import sender_context
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
 
@@ -82,6 +83,9 @@ class AvoidDuplicates:
             # No one was explicitly addressed, so we can't do any dup
             # collapsing
             return
+        # Look up all the explicit recipients at once.
+        context = sender_context(mlist, msg, msgdata)
+        context.resolve(explicit_recips.intersection(recips))
         newrecips = set()
         for r in recips:
             # If this recipient is explicitly addressed...
@@ -90,7 +94,7 @@ class AvoidDuplicates:
                 # If the member wants to receive duplicates, or if the
                 # recipient is not a member at all, they will get a copy.
                 # header.
-                member = mlist.members.get_member(r)
+                member = context.member(r)
                 if member and not member.receive_list_copy:
                     send_duplicate = False
                 # We'll send a duplicate unless the user doesn't wish it.  If
@@ -24,6 +24,7 @@ __all__ = [
     'Decorate',
     'decorate',
     'decorate_template',
+    'decoration_data',
     ]
 
 
@@ -51,20 +52,7 @@ def process(mlist, msg, msgdata):
     # Digests and Mailman-craft messages should not get additional headers.
     if msgdata.get('isdigest') or msgdata.get('nodecorate'):
         return
-    d = {}
-    member = msgdata.get('member')
-    if member is not None:
-        # Calculate the extra personalization dictionary.
-        recipient = msgdata.get('recipient', member.address.original_email)
-        d['user_address'] = recipient
-        d['user_delivered_to'] = member.address.original_email
-        d['user_language'] = member.preferred_language.description
-        d['user_name'] = (member.user.display_name
-                          if member.user.display_name
-                          else member.address.original_email)
-        d['user_optionsurl'] = member.options_url
-    # These strings are descriptive for the log file and shouldn't be i18n'd
-    d.update(msgdata.get('decoration-data', {}))
+    d = decoration_data(msgdata)
     try:
         header = decorate(mlist, mlist.header_uri, d)
     except URLError:
@@ -202,6 +190,45 @@ def process(mlist, msg, msgdata):
 
 
 
+def decoration_data(msgdata):
+    """Return the recipient specific substitutions for the decorations.
+
+    :param msgdata: The message metadata.  The `member` key names the
+        recipient's membership, if any, and the `decoration-data` key can
+        supply additional substitutions, overriding the member's.  The
+        `recipient-context` key can hold the `IRecipient` already loaded
+        for the member.
+    :type msgdata: dict
+    :return: The substitutions.
+    :rtype: dict
+    """
+    d = {}
+    member = msgdata.get('member')
+    if member is not None:
+        context = msgdata.get('recipient-context')
+        if context is not None and context.member is member:
+            address = context.address
+            user = context.user
+            language = context.preferred_language
+        else:
+            address = member.address
+            user = member.user
+            language = member.preferred_language
+        # Calculate the extra personalization dictionary.
+        recipient = msgdata.get('recipient', address.original_email)
+        d['user_address'] = recipient
+        d['user_delivered_to'] = address.original_email
+        d['user_language'] = language.description
+        d['user_name'] = (user.display_name
+                          if user.display_name
+                          else address.original_email)
+        d['user_optionsurl'] = member.options_url
+    # These strings are descriptive for the log file and shouldn't be i18n'd
+    d.update(msgdata.get('decoration-data', {}))
+    return d
+
+
+
 def decorate(mlist, uri, extradict=None):
     """Expand the decoration template from its URI."""
     if uri is None:
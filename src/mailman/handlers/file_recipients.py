@@ -30,6 +30,7 @@ import errno
 
 from zope.interface import implementer
 
+from mailman.app.senders import sender_context
 from mailman.core.i18n import _
 from mailman.interfaces.handler import IHandler
 
@@ -57,7 +58,7 @@ class FileRecipients:
             return
         # If the sender is a member of the list, remove them from the file
         # recipients.
-        member = mlist.members.get_member(msg.sender)
+        member = sender_context(mlist, msg, msgdata).member(msg.sender)
         if member is not None:
             addrs.discard(member.address.email)
         msgdata['recipients'] = addrs
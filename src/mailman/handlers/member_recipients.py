@@ -33,6 +33,7 @@ __all__ = [
 
 from zope.interface import implementer
 
+from mailman.app.senders import sender_context
 from mailman.config import config
 from mailman.core import errors
 from mailman.core.i18n import _
@@ -57,7 +58,7 @@ class MemberRecipients:
             return
         # Should the original sender should be included in the recipients list?
         include_sender = True
-        member = mlist.members.get_member(msg.sender)
+        member = sender_context(mlist, msg, msgdata).member(msg.sender)
         if member and not member.receive_own_postings:
             include_sender = False
         # Support for urgent messages, which bypasses digests and disabled
@@ -88,9 +89,10 @@ for delivery.  The original message as received by Mailman is attached.
 """)
                 raise errors.RejectMessage(wrap(text))
         # Calculate the regular recipients of the message
+        enabled_members = mlist.regular_members.get_resolved_members(
+            [DeliveryStatus.enabled])
         recipients = set(member.address.email
-                         for member in mlist.regular_members.members
-                         if member.delivery_status == DeliveryStatus.enabled)
+                         for member, preferences in enabled_members)
         # Remove the sender if they don't want to receive their own posts
         if not include_sender and member.address.email in recipients:
             recipients.remove(member.address.email)
@@ -100,3 +100,15 @@ class IBanManager(Interface):
             or not.
         :rtype: bool
         """
+
+    def filter_banned(emails):
+        """Check many email addresses at once.
+
+        This is like calling `is_banned()` for every email address, but
+        cheaper, e.g. when subscribing many email addresses.
+
+        :param emails: The text email addresses being checked.
+        :type emails: iterable of str
+        :return: The email addresses which are banned.
+        :rtype: set
+        """
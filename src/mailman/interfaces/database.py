@@ -55,10 +55,29 @@ class IDatabase(Interface):
         """Begin the current transaction."""
 
     def commit():
-        """Commit the current transaction."""
+        """Commit the current transaction.
+
+        Afterward, the functions registered with
+        `mailman.database.transaction.register_transaction_callbacks()` for
+        commits are called.
+        """
 
     def abort():
-        """Abort the current transaction."""
+        """Abort the current transaction.
+
+        Afterward, the functions registered with
+        `mailman.database.transaction.register_transaction_callbacks()` for
+        rollbacks are called.
+        """
+
+    def after_fork():
+        """Give this process its own connection to the database.
+
+        Call this in a child process forked while the database was already
+        initialized, before using the database.  The connection inherited
+        from the parent process is neither used nor closed, since the parent
+        may still be using it.
+        """
 
     store = Attribute(
         """The underlying Storm store on which you can do queries.""")
@@ -230,13 +230,14 @@ class IMailingList(Interface):
     regular_members = Attribute(
         """An iterator over all the IMembers who are to receive regular
         postings (i.e. non-digests) from the mailing list, regardless of
-        whether they have their delivery disabled or not.""")
+        whether they have their delivery disabled or not.  This is an
+        `IDeliveryRoster`.""")
 
     digest_members = Attribute(
         """An iterator over all the IMembers who are to receive digests of
         postings to this mailing list, regardless of whether they have their
         deliver disabled or not, or of the type of digest they are to
-        receive.""")
+        receive.  This is an `IDeliveryRoster`.""")
 
     subscribers = Attribute(
         """An iterator over all IMembers subscribed to this list, with any
@@ -89,6 +89,18 @@ class IMessageStore(Interface):
         :returns: The message, or None if no matching message was found.
         """
 
+    def get_messages_by_ids(message_ids):
+        """Return many messages at once.
+
+        This is cheaper than calling `get_message_by_id()` for each of them.
+
+        :param message_ids: The Message-ID header contents to search for.
+        :type message_ids: sequence
+        :returns: The messages, in the same order as `message_ids`, with None
+            for those which were not found.
+        :rtype: list
+        """
+
     def delete_message(message_id):
         """Remove the given message from the store.
 
@@ -108,4 +120,10 @@ class IMessage(Interface):
 
     message_id_hash = Attribute("""The unique SHA1 hash of the message.""")
 
-    path = Attribute("""The filesystem path to the message object.""")
+    path = Attribute(
+        """Where the message is stored, relative to the messages directory.
+
+        This is the path to the message object, or for messages in the
+        segmented message store, the path of the segment followed by the
+        offset and length of the message in it.
+        """)
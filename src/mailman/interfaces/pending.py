@@ -61,6 +61,13 @@ class IPended(Interface):
 
     expiration_date = Attribute("""The expiration date of the pended event.""")
 
+    payload = Attribute(
+        """The pended event data, serialized as a JSON object.
+
+        This is None for events pended by older versions, which stored the
+        data as `IPendedKeyValue` pairs.
+        """)
+
 
 
 class IPendedKeyValue(Interface):
@@ -95,5 +102,16 @@ class IPendings(Interface):
         :return: The matching IPendable or None if no match was found.
         """
 
-    def evict():
-        """Remove all pended items whose lifetime has expired."""
+    def evict(limit=None):
+        """Remove the pended items whose lifetime has expired.
+
+        The items are removed with set based deletes, without loading them.
+
+        :param limit: The maximum number of items to remove, oldest first,
+            or None to remove all the expired items.  Large numbers of
+            expired items can be removed in batches, committing the
+            transaction after each one, to keep the transactions short.
+        :type limit: int or None
+        :return: The number of items removed.
+        :rtype: int
+        """
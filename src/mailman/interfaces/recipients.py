@@ -0,0 +1,84 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Interfaces for the recipients of a delivery."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'IRecipient',
+    'IRecipients',
+    ]
+
+
+from zope.interface import Interface, Attribute
+
+
+
+class IRecipient(Interface):
+    """What a delivery needs to know about one of its recipients."""
+
+    email = Attribute(
+        """The recipient's email address, as given.""")
+
+    address = Attribute(
+        """The `IAddress` for the recipient's email address, or None.""")
+
+    user = Attribute(
+        """The `IUser` controlling the recipient's address, or None.
+
+        This is the user `IUserManager.get_user()` would return for the
+        recipient's email address.
+        """)
+
+    member = Attribute(
+        """The recipient's membership of the mailing list, or None.
+
+        This is the member `mlist.members.get_member()` would return for the
+        recipient's email address.
+        """)
+
+    preferred_language = Attribute(
+        """The member's preferred `ILanguage`, or None for nonmembers.
+
+        This is the same as the member's `preferred_language`, taking the
+        member's, the address's and the user's preferences, and the mailing
+        list's preferred language, into account.
+        """)
+
+
+
+class IRecipients(Interface):
+    """The recipients of a delivery, loaded all at once.
+
+    Loading the recipients takes a fixed number of database queries for
+    every few hundred recipients, instead of several queries for each of
+    them.  The members, addresses, users and preferences stay loaded for as
+    long as this object is in use.
+    """
+
+    def __getitem__(email):
+        """Return the `IRecipient` for one of the email addresses.
+
+        :param email: One of the recipients' email addresses.
+        :type email: string
+        :raises KeyError: if the email address is not one of the recipients.
+        """
+
+    def __len__():
+        """The number of recipients."""
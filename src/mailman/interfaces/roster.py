@@ -21,6 +21,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'IDeliveryRoster',
     'IRoster',
     ]
 
@@ -40,6 +41,16 @@ class IRoster(Interface):
     members = Attribute(
         """An iterator over all the IMembers managed by this roster.""")
 
+    resolved_members = Attribute(
+        """An iterator over the IMembers and their effective preferences.
+
+        This produces 2-tuples of the member and its `IPreferences`, in which
+        every preference has been resolved through the member's, its
+        address's and its user's preferences to the system default.  All the
+        members' preferences are resolved at once, so this is much cheaper
+        than reading them from every member in `members`.
+        """)
+
     member_count = Attribute(
         """The number of members managed by this roster.""")
 
@@ -64,3 +75,21 @@ class IRoster(Interface):
         :return: The member if found, otherwise None
         :rtype: `IMember` or None
         """
+
+
+
+class IDeliveryRoster(IRoster):
+    """The members of a mailing list having a particular kind of delivery."""
+
+    def get_resolved_members(delivery_statuses=None):
+        """Like `resolved_members`, optionally filtered by delivery status.
+
+        The members' delivery statuses are resolved by the database, so this
+        is a single query.
+
+        :param delivery_statuses: The delivery statuses to filter on, or None
+            for members with any delivery status.
+        :type delivery_statuses: sequence of `DeliveryStatus`
+        :return: The members and their effective preferences.
+        :rtype: iterator over 2-tuples of (`IMember`, `IPreferences`)
+        """
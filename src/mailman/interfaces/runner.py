@@ -63,6 +63,16 @@ class IRunner(Interface):
         through the main loop.
         """)
 
+    commits = Attribute("""\
+        The number of database transactions this runner committed.
+        """)
+
+    committed_messages = Attribute("""\
+        The number of messages processed in the transactions this runner
+        committed.  With `[runner.*]batch_size`, a transaction may include
+        several messages.
+        """)
+
     def set_signals():
         """Set up the signal handlers necessary to control the runner.
 
@@ -89,6 +89,16 @@ class ISubscriptionService(Interface):
         :rtype: list of `IMember`
         """
 
+    def resolve_preferences(members):
+        """Resolve the effective preferences of many members at once.
+
+        :param members: The members.
+        :type members: sequence of `IMember`
+        :return: The effective preferences of each member, in the same order
+            as `members`.  See `IRoster.resolved_members`.
+        :rtype: list of `IPreferences`
+        """
+
     def __iter__():
         """See `get_members()`."""
 
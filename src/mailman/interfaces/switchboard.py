@@ -21,6 +21,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'IQueueFileCodec',
     'ISwitchboard',
     ]
 
@@ -60,14 +61,47 @@ class ISwitchboard(Interface):
         metadata.  The message file is preserved in a backup file, which must
         be removed by calling the .finish() method.
 
+        When several processes share the queue directory, the file is claimed
+        for this process first, and `OSError` is raised with errno EEXIST if
+        another process has already claimed it.  The claim is released by
+        .finish().
+
         Returned is a 2-tuple of the form (message, metadata).
         """
 
+    def load_backup(filebase):
+        """Read a dequeued file again.
+
+        This is used to process the file again, after processing it failed
+        and the changes were rolled back.
+
+        :param filebase: The base name of a file which was dequeued, but not
+            yet finished.
+        :return: The message and metadata, as originally dequeued.
+        :rtype: 2-tuple of (`Message`, dict)
+        """
+
+    def dequeue_many(count=None):
+        """Dequeue the oldest files in the queue.
+
+        This is an iterator over 3-tuples of the form (filebase, message,
+        metadata), in FIFO order.  Each file is dequeued just before it is
+        produced, so files which are not reached because the caller stops
+        iterating remain in the queue.  Files which cannot be read are
+        logged, skipped, and preserved in the 'bad' queue.  As with
+        `dequeue()`, `finish()` must be called for every file produced.
+
+        :param count: The maximum number of files to dequeue, or None to
+            dequeue all the files currently in the queue.
+        :type count: int or None
+        """
+
     def finish(filebase, preserve=False):
         """Remove the backup file for filebase.
 
         If preserve is True, then the backup file is actually just renamed to
-        a preservation file instead of being unlinked.
+        a preservation file instead of being unlinked.  Any queue files this
+        process enqueued with group commit durability are made durable first.
         """
 
     files = Attribute(
@@ -76,6 +110,16 @@ class ISwitchboard(Interface):
         The base names of the matching files are returned.
         """)
 
+    def count():
+        """The number of .pck files in the queue directory.
+
+        This is the length of the 'files' attribute, but is much cheaper to
+        compute when the queue is long.
+
+        :return: The number of queue files in this switchboard's slice.
+        :rtype: int
+        """
+
     def get_files(extension='.pck'):
         """Like the 'files' attribute, but accepts an alternative extension.
 
@@ -84,10 +128,89 @@ class ISwitchboard(Interface):
         returned.
         """
 
+    def wait_for_files(timeout):
+        """Wait until new files may have been enqueued.
+
+        How the switchboard waits is controlled by the `[switchboard]wakeup`
+        configuration variable.  This returns no later than `timeout` seconds
+        from now, but may return earlier, e.g. when another process enqueues
+        a file in this queue directory.
+
+        :param timeout: The maximum number of seconds to wait.
+        :type timeout: float
+        :return: True if new files may have arrived, False if the timeout
+            expired without any sign of them.
+        :rtype: bool
+        """
+
+    def close():
+        """Release what `wait_for_files()` waits with, e.g. an inotify fd.
+
+        The switchboard can still be used afterward; waiting for files again
+        sets up a new watcher.
+        """
+
     def recover_backup_files():
         """Move all backup files to active message files.
 
         It is impossible for both the .bak and .pck files to exist at the same
         time, so moving them is enough to ensure that a normal dequeing
-        operation will handle them.
+        operation will handle them.  When several processes share the queue
+        directory, only the backup files whose claims are stale are moved,
+        i.e. whose leases have expired, or whose processes on this host no
+        longer exist.  These are also recovered periodically by
+        .dequeue_many().
+        """
+
+
+
+class IQueueFileCodec(Interface):
+    """A queue file format."""
+
+    name = Attribute(
+        """The name of the format, as used in `[switchboard]qfile_format`.""")
+
+    def encode(msg, data, plaintext=False, store=None):
+        """Encode a message and its metadata.
+
+        This sets the `_parsemsg` key in the metadata.
+
+        :param msg: The message.
+        :type msg: `Message`
+        :param data: The metadata.
+        :type data: dict
+        :param plaintext: Whether the message only needs to be stored as
+            text, i.e. the `_plaintext` metadata flag.
+        :type plaintext: bool
+        :param store: The body store to keep large bodies in, or None.
+            Formats which can't refer to a body ignore it.
+        :return: The contents of the queue file, as a list of 8-bit strings
+            or buffers.  The first one must identify the message, since the
+            queue file's name is derived from it.
+        :raises TypeError, ValueError, UnicodeError: when the format can't
+            represent the message or metadata.
+        """
+
+    def load(fp):
+        """Read a message and its metadata.
+
+        :param fp: The open queue file, positioned at its start.
+        :return: The message and the metadata.
+        :rtype: 2-tuple of (`Message`, dict)
+        """
+
+    def load_metadata(fp):
+        """Read only the metadata.
+
+        :param fp: The open queue file, positioned at its start.
+        :return: The metadata, and the position in the file where it starts.
+        :rtype: 2-tuple of (dict, int)
+        """
+
+    def dump_metadata(fp, data):
+        """Write the metadata at the current position of `fp`.
+
+        :param fp: The open queue file.
+        :param data: The metadata.
+        :type data: dict
         """
@@ -34,6 +34,7 @@ from zope.interface import implementer
 from mailman.database.model import Model
 from mailman.interfaces.address import (
     AddressVerificationEvent, IAddress, IEmailValidator)
+from mailman.model.preferences import resolved_preferences_cache
 from mailman.utilities.datetime import now
 
 
@@ -77,6 +78,9 @@ class Address(Model):
             return '<Address: {0} [{1}] key: {2} at {3:#x}>'.format(
                 address_str, verified, self.email, id(self))
 
+    def __storm_flushed__(self):
+        resolved_preferences_cache.invalidate(self)
+
     @property
     def verified_on(self):
         return self._verified_on
@@ -21,18 +21,36 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'BanIndex',
     'BanManager',
+    'ban_index',
     ]
 
 
+import os
 import re
+import logging
 
 from storm.locals import Int, Unicode
 from zope.interface import implementer
 
+from mailman.config import config
 from mailman.database.model import Model
-from mailman.database.transaction import dbconnection
+from mailman.database.transaction import (
+    dbconnection, register_transaction_callbacks)
 from mailman.interfaces.bans import IBan, IBanManager
+from mailman.testing import layers
+from mailman.utilities.filesystem import GenerationFile
+
+
+elog = logging.getLogger('mailman.error')
+
+# Patterns which refer to their own groups can't be combined with others,
+# since the groups are numbered differently in the combined pattern, and
+# neither can patterns which set flags, since those apply to all of it.
+UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P=|\(\?\(|\(\?[iLmsux]+\)')
+# Python's regular expressions can't have more than 100 groups.
+MAXIMUM_GROUPS = 99
 
 
 
@@ -50,6 +68,152 @@ class Ban(Model):
         self.list_id = list_id
 
 
+
+def _combine(patterns):
+    """Compile patterns into one regular expression, if possible."""
+    if len(patterns) == 1:
+        return [re.compile(patterns[0], re.IGNORECASE)]
+    try:
+        return [re.compile('|'.join('(?:{0})'.format(pattern)
+                                    for pattern in patterns),
+                           re.IGNORECASE)]
+    except (re.error, AssertionError, OverflowError):
+        # E.g. the same group name in two patterns.
+        return [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+
+
+def _compile(patterns):
+    """Compile ban patterns into as few regular expressions as possible.
+
+    Invalid patterns are logged and skipped.
+
+    :param patterns: The ban patterns.
+    :type patterns: sequence of text
+    :return: The compiled regular expressions.
+    :rtype: list
+    """
+    regexes = []
+    chunk = []
+    groups = 0
+    for pattern in patterns:
+        try:
+            regex = re.compile(pattern, re.IGNORECASE)
+        except (re.error, AssertionError, OverflowError) as error:
+            elog.error('Invalid ban pattern: {0} ({1})'.format(
+                pattern, error))
+            continue
+        if UNCOMBINABLE.search(pattern) is not None:
+            regexes.append(regex)
+            continue
+        if len(chunk) > 0 and groups + regex.groups > MAXIMUM_GROUPS:
+            regexes.extend(_combine(chunk))
+            chunk = []
+            groups = 0
+        chunk.append(pattern)
+        groups += regex.groups
+    if len(chunk) > 0:
+        regexes.extend(_combine(chunk))
+    return regexes
+
+
+
+class BanIndex:
+    """The global bans and the bans of every mailing list.
+
+    The bans are loaded from the database once, with the exact bans of each
+    scope in a set and its pattern bans compiled together.  They are loaded
+    again when the bans change in this process, or when the generation file
+    shows that they changed in another process.  The other processes are
+    told about a change once it is committed.
+    """
+
+    def __init__(self):
+        # list-id or None -> (set of exact bans, list of compiled patterns)
+        self._scopes = None
+        self._generation = None
+        self._changed = False
+        register_transaction_callbacks(self.committed, self.aborted)
+        layers.MockAndMonkeyLayer.register_reset(self._reset)
+
+    @property
+    def _generation_file(self):
+        return GenerationFile(os.path.join(config.DATA_DIR, 'bans.generation'))
+
+    @dbconnection
+    def _load(self, store):
+        scopes = {}
+        patterns = {}
+        for email, list_id in store.find((Ban.email, Ban.list_id)):
+            exact, regexes = scopes.setdefault(list_id, (set(), []))
+            if email.startswith('^'):
+                patterns.setdefault(list_id, []).append(email)
+            else:
+                exact.add(email)
+        for list_id, scope_patterns in patterns.items():
+            scopes[list_id][1].extend(_compile(scope_patterns))
+        return scopes
+
+    def banned(self, list_id, emails):
+        """Return the banned email addresses.
+
+        :param list_id: The list-id of the mailing list, or None to only
+            check the global bans.
+        :type list_id: text
+        :param emails: The email addresses to check.
+        :type emails: iterable of text
+        :return: The email addresses which are banned.
+        :rtype: set
+        """
+        status = self._generation_file.status
+        if self._scopes is None or status != self._generation:
+            self._scopes = self._load()
+            self._generation = status
+        scopes = [self._scopes[scope] for scope in (list_id, None)
+                  if scope in self._scopes]
+        if list_id is None:
+            scopes = scopes[:1]
+        banned = set()
+        for email in emails:
+            for exact, regexes in scopes:
+                if (email in exact or
+                        any(regex.match(email) for regex in regexes)):
+                    banned.add(email)
+                    break
+        return banned
+
+    def changed(self):
+        """Record a change to the bans in the current transaction."""
+        self._scopes = None
+        self._changed = True
+
+    def committed(self):
+        """Tell the other processes about the committed changes."""
+        if not self._changed:
+            return
+        self._changed = False
+        generation_file = self._generation_file
+        try:
+            generation_file.bump()
+        except EnvironmentError:
+            elog.exception('Cannot update the bans generation: %s',
+                           generation_file.path)
+
+    def aborted(self):
+        """Forget the changes which were rolled back."""
+        if self._changed:
+            self._scopes = None
+            self._changed = False
+
+    def _reset(self):
+        # The test database is reset without committing any unbans.
+        self._changed = True
+        self.committed()
+        self._scopes = None
+
+
+ban_index = BanIndex()
+
+
 
 @implementer(IBanManager)
 class BanManager:
@@ -66,6 +230,7 @@ class BanManager:
         if bans.count() == 0:
             ban = Ban(email, self._list_id)
             store.add(ban)
+            ban_index.changed()
 
     @dbconnection
     def unban(self, store, email):
@@ -73,42 +238,12 @@ class BanManager:
         ban = store.find(Ban, email=email, list_id=self._list_id).one()
         if ban is not None:
             store.remove(ban)
+            ban_index.changed()
 
-    @dbconnection
-    def is_banned(self, store, email):
+    def is_banned(self, email):
         """See `IBanManager`."""
-        list_id = self._list_id
-        if list_id is None:
-            # The client is asking for global bans.  Look up bans on the
-            # specific email address first.
-            bans = store.find(Ban, email=email, list_id=None)
-            if bans.count() > 0:
-                return True
-            # And now look for global pattern bans.
-            bans = store.find(Ban, list_id=None)
-            for ban in bans:
-                if (ban.email.startswith('^') and
-                    re.match(ban.email, email, re.IGNORECASE) is not None):
-                    return True
-        else:
-            # This is a list-specific ban.
-            bans = store.find(Ban, email=email, list_id=list_id)
-            if bans.count() > 0:
-                return True
-            # Try global bans next.
-            bans = store.find(Ban, email=email, list_id=None)
-            if bans.count() > 0:
-                return True
-            # Now try specific mailing list bans, but with a pattern.
-            bans = store.find(Ban, list_id=list_id)
-            for ban in bans:
-                if (ban.email.startswith('^') and
-                    re.match(ban.email, email, re.IGNORECASE) is not None):
-                    return True
-            # And now try global pattern bans.
-            bans = store.find(Ban, list_id=None)
-            for ban in bans:
-                if (ban.email.startswith('^') and
-                    re.match(ban.email, email, re.IGNORECASE) is not None):
-                    return True
-        return False
+        return len(ban_index.banned(self._list_id, [email])) > 0
+
+    def filter_banned(self, emails):
+        """See `IBanManager`."""
+        return ban_index.banned(self._list_id, emails)
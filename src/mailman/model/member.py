@@ -41,6 +41,7 @@ from mailman.interfaces.member import (
     IMember, MemberRole, MembershipError, UnsubscriptionEvent)
 from mailman.interfaces.user import IUser, UnverifiedAddressError
 from mailman.interfaces.usermanager import IUserManager
+from mailman.model.preferences import resolved_preferences_cache
 from mailman.utilities.uid import UniqueIDFactory
 
 
@@ -94,6 +95,9 @@ class Member(Model):
         return '<Member: {0} on {1} as {2}>'.format(
             self.address, self.mailing_list.fqdn_listname, self.role)
 
+    def __storm_flushed__(self):
+        resolved_preferences_cache.invalidate(self)
+
     @property
     def mailing_list(self):
         """See `IMember`."""
@@ -137,6 +141,15 @@ class Member(Model):
                 else getUtility(IUserManager).get_user(self._address.email))
 
     def _lookup(self, preference, default=None):
+        # The roster may already have resolved this member's preferences.
+        values = resolved_preferences_cache.get(self.id)
+        if values is not None:
+            pref = values[preference]
+            if pref is not None:
+                return pref
+            if default is None:
+                return getattr(system_preferences, preference)
+            return default
         pref = getattr(self.preferences, preference)
         if pref is not None:
             return pref
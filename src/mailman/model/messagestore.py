@@ -21,28 +21,51 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'ConfiguredMessageStore',
     'MessageStore',
+    'SegmentDeadBytes',
+    'SegmentRetirements',
+    'SegmentedMessageStore',
+    'dead_segment_bytes',
+    'segment_retirements',
     ]
 
 import os
+import mmap
+import email
 import errno
 import base64
 import hashlib
+import logging
 import cPickle as pickle
 
+from cStringIO import StringIO
+from email.generator import Generator
+from flufl.lock import Lock
+from storm.expr import And
 from zope.interface import implementer
 
 from mailman.config import config
-from mailman.database.transaction import dbconnection
+from mailman.database.transaction import (
+    dbconnection, register_transaction_callbacks)
+from mailman.email.message import Message as EmailMessage
 from mailman.interfaces.messages import IMessageStore
 from mailman.model.message import Message
+from mailman.testing import layers
 from mailman.utilities.filesystem import makedirs
+from mailman.utilities.modules import call_name
 
 
+elog = logging.getLogger('mailman.error')
+
 # It could be very bad if you have already stored files and you change this
 # value.  We'd need a script to reshuffle and resplit.
 MAX_SPLITS = 2
 EMPTYSTRING = ''
+# The directory of the segmented message store, relative to the messages
+# directory.  Its messages' paths are of the form
+# segments/<segment number>:<offset>:<length>
+SEGMENTS = 'segments'
 
 
 
@@ -50,8 +73,7 @@ EMPTYSTRING = ''
 class MessageStore:
     """See `IMessageStore`."""
 
-    @dbconnection
-    def add(self, store, message):
+    def _prepare(self, store, message):
         # Ensure that the message has the requisite headers.
         message_ids = message.get_all('message-id', [])
         if len(message_ids) <> 1:
@@ -68,6 +90,11 @@ class MessageStore:
         hash32 = base64.b32encode(shaobj.digest())
         del message['X-Message-ID-Hash']
         message['X-Message-ID-Hash'] = hash32
+        return message_id, hash32
+
+    @dbconnection
+    def add(self, store, message):
+        message_id, hash32 = self._prepare(store, message)
         # Calculate the path on disk where we're going to store this message
         # object, in pickled format.
         parts = []
@@ -125,6 +152,22 @@ class MessageStore:
             return None
         return self._get_message(row)
 
+    @dbconnection
+    def get_messages_by_ids(self, store, message_ids):
+        message_ids = list(message_ids)
+        if len(message_ids) == 0:
+            return []
+        rows = dict((row.message_id, row) for row in store.find(
+            Message, Message.message_id.is_in(set(message_ids))))
+        # Read the messages in the order they are stored in.
+        messages = dict((row.message_id, self._get_message(row))
+                        for row in sorted(rows.values(),
+                                          key=self._sort_key))
+        return [messages.get(message_id) for message_id in message_ids]
+
+    def _sort_key(self, row):
+        return row.path
+
     @property
     @dbconnection
     def messages(self, store):
@@ -139,3 +182,410 @@ class MessageStore:
         path = os.path.join(config.MESSAGES_DIR, row.path)
         os.remove(path)
         store.remove(row)
+
+
+
+class SegmentRetirements:
+    """The segments compacted in the current transaction.
+
+    The messages of a compacted segment are moved to the latest segment in
+    the database, so the segment can only be removed once that is committed.
+    Until then, it is only marked as retired, and it is removed by a later
+    deletion, once no message refers to it any more.
+    """
+
+    def __init__(self):
+        self._paths = set()
+        # The paths of the retired segments, or None until the segments
+        # directory has been scanned for them.
+        self._retired = None
+        register_transaction_callbacks(self.committed, self.aborted)
+        layers.MockAndMonkeyLayer.register_reset(self._reset)
+
+    def add(self, path):
+        """Record the compaction of a segment."""
+        self._paths.add(path)
+
+    def retired(self, directory):
+        """Return the paths of the retired segments.
+
+        The segments directory is only scanned for them the first time,
+        after that the segments retired by this process are added as their
+        compaction is committed.
+        """
+        if self._retired is None:
+            try:
+                filenames = os.listdir(directory)
+            except OSError as error:
+                if error.errno != errno.ENOENT:
+                    raise
+                filenames = []
+            self._retired = set(
+                os.path.join(directory, os.path.splitext(filename)[0])
+                for filename in filenames if filename.endswith('.retired'))
+        return set(self._retired)
+
+    def removed(self, path):
+        """Record the removal of a retired segment."""
+        if self._retired is not None:
+            self._retired.discard(path)
+
+    def committed(self):
+        """Retire the segments compacted in the committed transaction."""
+        for path in self._paths:
+            try:
+                with open(path + '.retired', 'w'):
+                    pass
+            except EnvironmentError:
+                elog.exception('Cannot retire the message segment: %s', path)
+                continue
+            if self._retired is not None:
+                self._retired.add(path)
+        self._paths.clear()
+
+    def aborted(self):
+        """Keep the segments whose compaction was rolled back."""
+        self._paths.clear()
+
+    def _reset(self):
+        self._paths.clear()
+        self._retired = None
+
+
+segment_retirements = SegmentRetirements()
+
+
+
+def _segments_lock():
+    return Lock(os.path.join(config.LOCK_DIR, 'message-segments.lck'))
+
+
+def _read_dead_bytes(path):
+    """The committed count of a segment's bytes of deleted messages."""
+    try:
+        with open(path + '.deleted') as fp:
+            return int(fp.read())
+    except IOError as error:
+        if error.errno != errno.ENOENT:
+            raise
+        return 0
+
+
+class SegmentDeadBytes:
+    """The bytes of message segments which the current transaction kills.
+
+    The bytes of the messages deleted in the transaction only count as dead
+    once it is committed, while the bytes appended for messages added or
+    compacted in the transaction are dead if it is rolled back instead.  The
+    counts are kept in the segments' `.deleted` files.
+    """
+
+    def __init__(self):
+        # segment path -> bytes
+        self._deleted = {}
+        self._appended = {}
+        # This must come after the segments are retired on commit.
+        register_transaction_callbacks(self.committed, self.aborted)
+        layers.MockAndMonkeyLayer.register_reset(self._reset)
+
+    def deleted(self, path, length):
+        """Record the deletion of a message from a segment."""
+        self._deleted[path] = self._deleted.get(path, 0) + length
+
+    def appended(self, path, length):
+        """Record the bytes appended to a segment."""
+        self._appended[path] = self._appended.get(path, 0) + length
+
+    def pending(self, path):
+        """The bytes deleted from a segment in the current transaction."""
+        return self._deleted.get(path, 0)
+
+    def committed(self):
+        """Count the bytes of the messages deleted by the transaction."""
+        self._count(self._deleted)
+
+    def aborted(self):
+        """Count the bytes appended by the rolled back transaction."""
+        self._count(self._appended)
+
+    def _count(self, counts):
+        try:
+            if len(counts) > 0:
+                with _segments_lock():
+                    for path, length in counts.items():
+                        # The segment may have been retired or removed
+                        # meanwhile, and then its count doesn't matter.
+                        if (not os.path.exists(path) or
+                                os.path.exists(path + '.retired')):
+                            continue
+                        dead = _read_dead_bytes(path) + length
+                        with open(path + '.deleted', 'w') as fp:
+                            fp.write(str(dead))
+        except EnvironmentError:
+            elog.exception('Cannot count the deleted bytes of the message '
+                           'segments')
+        finally:
+            self._reset()
+
+    def _reset(self):
+        self._deleted.clear()
+        self._appended.clear()
+
+
+dead_segment_bytes = SegmentDeadBytes()
+
+
+
+class SegmentedMessageStore(MessageStore):
+    """A message store keeping the messages in append-only segment files.
+
+    The messages are kept as their RFC 822 text, appended to the latest
+    segment file until it reaches `[messagestore]segment_size`.  Each
+    message's row in the database records its segment, offset and length,
+    and the segments are read through memory maps.  When enough of a
+    segment's messages have been deleted, the remaining ones are copied to
+    the latest segment, and the old segment is removed once no committed
+    message refers to it any more.  Messages added by `MessageStore` can
+    still be read and deleted.
+    """
+
+    def __init__(self):
+        # segment number -> memory map
+        self._maps = {}
+        layers.MockAndMonkeyLayer.register_reset(self._close)
+
+    @property
+    def _directory(self):
+        return os.path.join(config.MESSAGES_DIR, SEGMENTS)
+
+    def _segment_path(self, number, suffix=''):
+        return os.path.join(
+            self._directory, '{0:08d}{1}'.format(number, suffix))
+
+    def _segments(self):
+        """The numbers of the segments, in order."""
+        try:
+            filenames = os.listdir(self._directory)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            return []
+        return sorted(int(filename) for filename in filenames
+                      if filename.isdigit())
+
+    def _location(self, row):
+        """The segment, offset and length of a message, or None."""
+        if not row.path.startswith(SEGMENTS + '/'):
+            return None
+        number, offset, length = row.path[len(SEGMENTS) + 1:].split(':')
+        return int(number), int(offset), int(length)
+
+    def _sort_key(self, row):
+        location = self._location(row)
+        return (0, row.path) if location is None else (1, location)
+
+    def _append(self, texts):
+        """Append messages to the latest segment.
+
+        Call this with the lock held.
+
+        :param texts: The texts of the messages.
+        :type texts: list of 8-bit strings
+        :return: The segment number, and the offset of each message.
+        """
+        segments = self._segments()
+        number = (segments[-1] if len(segments) > 0 else 1)
+        path = self._segment_path(number)
+        try:
+            size = os.path.getsize(path)
+        except OSError as error:
+            if error.errno != errno.ENOENT:
+                raise
+            makedirs(self._directory)
+            size = 0
+        if size > 0 and size + sum(len(text) for text in texts) > int(
+                config.messagestore.segment_size):
+            number += 1
+            path = self._segment_path(number)
+            size = 0
+        offsets = []
+        with open(path, 'ab') as fp:
+            for text in texts:
+                offsets.append(size)
+                fp.write(text)
+                size += len(text)
+            fp.flush()
+            os.fsync(fp.fileno())
+        return number, offsets
+
+    def _flatten(self, message):
+        fp = StringIO()
+        generator = Generator(fp, mangle_from_=False)
+        generator.flatten(message, unixfrom=message.get_unixfrom() is not None)
+        text = fp.getvalue()
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        return text
+
+    @dbconnection
+    def add(self, store, message):
+        """See `IMessageStore`."""
+        message_id, hash32 = self._prepare(store, message)
+        text = self._flatten(message)
+        with _segments_lock():
+            number, offsets = self._append([text])
+        dead_segment_bytes.appended(self._segment_path(number), len(text))
+        Message(message_id=message_id,
+                message_id_hash=hash32,
+                path=self._path(number, offsets[0], len(text)))
+        return hash32
+
+    def _path(self, number, offset, length):
+        return '{0}/{1:08d}:{2}:{3}'.format(
+            SEGMENTS, number, offset, length).encode('ascii')
+
+    def _in_segment(self, number):
+        # The messages in a segment have the paths starting with its prefix,
+        # and ';' comes right after ':'.  The paths are byte strings, which
+        # not all databases can compare with LIKE.
+        prefix = '{0}/{1:08d}'.format(SEGMENTS, number).encode('ascii')
+        return And(Message.path > prefix + b':', Message.path < prefix + b';')
+
+    def _read(self, number, offset, length):
+        segment = self._maps.get(number)
+        if segment is None or offset + length > len(segment):
+            # The segment grew since it was mapped.
+            with open(self._segment_path(number), 'rb') as fp:
+                segment = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            if number in self._maps:
+                self._maps[number].close()
+            self._maps[number] = segment
+        return segment[offset:offset + length]
+
+    def _get_message(self, row):
+        location = self._location(row)
+        if location is None:
+            return super(SegmentedMessageStore, self)._get_message(row)
+        text = self._read(*location)
+        message = email.message_from_string(text, EmailMessage)
+        # Pickled messages kept the size they were received with, and held
+        # messages go through the max-size rule again when they are approved.
+        message.original_size = len(text)
+        return message
+
+    @property
+    @dbconnection
+    def messages(self, store):
+        """See `IMessageStore`."""
+        # Read the messages in the order they are stored in.
+        for row in sorted(store.find(Message), key=self._sort_key):
+            yield self._get_message(row)
+
+    @dbconnection
+    def delete_message(self, store, message_id):
+        """See `IMessageStore`."""
+        row = store.find(Message, message_id=message_id).one()
+        if row is None:
+            raise LookupError(message_id)
+        location = self._location(row)
+        if location is None:
+            super(SegmentedMessageStore, self).delete_message(message_id)
+            return
+        store.remove(row)
+        number, offset, length = location
+        path = self._segment_path(number)
+        dead_segment_bytes.deleted(path, length)
+        with _segments_lock():
+            self._remove_retired(store)
+            deleted = _read_dead_bytes(path) + dead_segment_bytes.pending(path)
+            size = os.path.getsize(path)
+            threshold = float(config.messagestore.compaction_threshold)
+            if number != self._segments()[-1] and deleted >= size * threshold:
+                self._compact(store, number)
+
+    def _compact(self, store, number):
+        """Copy the messages still in a segment to the latest segment.
+
+        Call this with the lock held.  The old segment is only retired once
+        the transaction moving its messages is committed.
+        """
+        rows = sorted(store.find(Message, self._in_segment(number)),
+                      key=self._sort_key)
+        texts = [self._read(*self._location(row)) for row in rows]
+        if len(texts) > 0:
+            new_number, offsets = self._append(texts)
+            for row, offset, text in zip(rows, offsets, texts):
+                row.path = self._path(new_number, offset, len(text))
+            dead_segment_bytes.appended(
+                self._segment_path(new_number),
+                sum(len(text) for text in texts))
+        segment_retirements.add(self._segment_path(number))
+
+    def _remove_retired(self, store):
+        """Remove the retired segments which no message refers to.
+
+        Call this with the lock held.
+        """
+        for path in segment_retirements.retired(self._directory):
+            number = int(os.path.basename(path))
+            if not store.find(Message, self._in_segment(number)).is_empty():
+                continue
+            # Another process may have removed the segment already.
+            for suffix in ('', '.retired', '.deleted'):
+                try:
+                    os.remove(path + suffix)
+                except OSError as error:
+                    if error.errno != errno.ENOENT:
+                        raise
+            segment_retirements.removed(path)
+            segment = self._maps.pop(number, None)
+            if segment is not None:
+                segment.close()
+
+    def _close(self):
+        for segment in self._maps.values():
+            segment.close()
+        self._maps.clear()
+
+
+
+@implementer(IMessageStore)
+class ConfiguredMessageStore:
+    """The message store selected by `[messagestore]class`."""
+
+    def __init__(self):
+        self._class_name = None
+        self._store = None
+
+    @property
+    def _delegate(self):
+        class_name = config.messagestore['class']
+        if class_name != self._class_name:
+            self._store = call_name(class_name)
+            self._class_name = class_name
+        return self._store
+
+    def add(self, message):
+        """See `IMessageStore`."""
+        return self._delegate.add(message)
+
+    def get_message_by_id(self, message_id):
+        """See `IMessageStore`."""
+        return self._delegate.get_message_by_id(message_id)
+
+    def get_message_by_hash(self, message_id_hash):
+        """See `IMessageStore`."""
+        return self._delegate.get_message_by_hash(message_id_hash)
+
+    def get_messages_by_ids(self, message_ids):
+        """See `IMessageStore`."""
+        return self._delegate.get_messages_by_ids(message_ids)
+
+    @property
+    def messages(self):
+        """See `IMessageStore`."""
+        return self._delegate.messages
+
+    def delete_message(self, message_id):
+        """See `IMessageStore`."""
+        self._delegate.delete_message(message_id)
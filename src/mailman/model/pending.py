@@ -26,11 +26,12 @@ __all__ = [
     ]
 
 
-import time
-import random
-import hashlib
+import os
+import json
+import binascii
 
 from lazr.config import as_timedelta
+from storm.expr import Select, Undef
 from storm.locals import DateTime, Int, RawStr, ReferenceSet, Unicode
 from zope.interface import implementer
 from zope.interface.verify import verifyObject
@@ -64,14 +65,16 @@ class PendedKeyValue(Model):
 class Pended(Model):
     """A pended event, tied to a token."""
 
-    def __init__(self, token, expiration_date):
+    def __init__(self, token, expiration_date, payload=None):
         super(Pended, self).__init__()
         self.token = token
         self.expiration_date = expiration_date
+        self.payload = payload
 
     id = Int(primary=True)
     token = RawStr()
     expiration_date = DateTime()
+    payload = Unicode()
     key_values = ReferenceSet(id, PendedKeyValue.pended_id)
 
 
@@ -92,85 +95,64 @@ class Pendings:
         # Calculate the token and the lifetime.
         if lifetime is None:
             lifetime = as_timedelta(config.mailman.pending_request_life)
-        # Calculate a unique token.  Algorithm vetted by the Timbot.  time()
-        # has high resolution on Linux, clock() on Windows.  random gives us
-        # about 45 bits in Python 2.2, 53 bits on Python 2.3.  The time and
-        # clock values basically help obscure the random number generator, as
-        # does the hash calculation.  The integral parts of the time values
-        # are discarded because they're the most predictable bits.
-        for attempts in range(3):
-            right_now = time.time()
-            x = random.random() + right_now % 1.0 + time.clock() % 1.0
-            # Use sha1 because it produces shorter strings.
-            token = hashlib.sha1(repr(x)).hexdigest()
-            # In practice, we'll never get a duplicate, but we'll be anal
-            # about checking anyway.
-            if store.find(Pended, token=token).count() == 0:
-                break
-        else:
-            raise AssertionError('Could not find a valid pendings token')
-        # Create the record, and then the individual key/value pairs.
-        pending = Pended(
-            token=token,
-            expiration_date=now() + lifetime)
+        # The token is 160 random bits, so unlike the time based tokens of
+        # old, there's no need to look for a duplicate in the database.
+        token = binascii.hexlify(os.urandom(20))
+        # The whole pendable is stored in the pended row, as a JSON object.
+        # This keeps the types of integer, float, boolean, and list values.
+        payload = {}
         for key, value in pendable.items():
             if isinstance(key, str):
                 key = unicode(key, 'utf-8')
             if isinstance(value, str):
                 value = unicode(value, 'utf-8')
-            elif type(value) is int:
-                value = '__builtin__.int\1%s' % value
-            elif type(value) is float:
-                value = '__builtin__.float\1%s' % value
-            elif type(value) is bool:
-                value = '__builtin__.bool\1%s' % value
-            elif type(value) is list:
-                # We expect this to be a list of strings.
-                value = ('mailman.model.pending.unpack_list\1' +
-                         '\2'.join(value))
-            keyval = PendedKeyValue(key=key, value=value)
-            pending.key_values.add(keyval)
-        store.add(pending)
+            payload[key] = value
+        store.add(Pended(
+            token=token,
+            expiration_date=now() + lifetime,
+            payload=unicode(json.dumps(payload))))
         return token
 
     @dbconnection
     def confirm(self, store, token, expunge=True):
         # Token can come in as a unicode, but it's stored in the database as
         # bytes.  They must be ascii.
-        pendings = store.find(Pended, token=str(token))
-        if pendings.count() == 0:
+        pending = store.find(Pended, token=str(token)).one()
+        if pending is None:
             return None
-        assert pendings.count() == 1, (
-            'Unexpected token count: {0}'.format(pendings.count()))
-        pending = pendings[0]
         pendable = UnpendedPendable()
-        # Find all PendedKeyValue entries that are associated with the pending
-        # object's ID.  Watch out for type conversions.
-        for keyvalue in store.find(PendedKeyValue,
-                                   PendedKeyValue.pended_id == pending.id):
-            if keyvalue.value is not None and '\1' in keyvalue.value:
-                type_name, value = keyvalue.value.split('\1', 1)
-                pendable[keyvalue.key] = call_name(type_name, value)
-            else:
-                pendable[keyvalue.key] = keyvalue.value
+        if pending.payload is not None:
+            pendable.update(json.loads(pending.payload))
+        else:
+            # The pendable was stored by an older version, as key/value
+            # pairs.  Watch out for type conversions.
+            key_values = store.find(PendedKeyValue,
+                                    PendedKeyValue.pended_id == pending.id)
+            for keyvalue in key_values:
+                if keyvalue.value is not None and '\1' in keyvalue.value:
+                    type_name, value = keyvalue.value.split('\1', 1)
+                    pendable[keyvalue.key] = call_name(type_name, value)
+                else:
+                    pendable[keyvalue.key] = keyvalue.value
             if expunge:
-                store.remove(keyvalue)
+                key_values.remove()
         if expunge:
             store.remove(pending)
         return pendable
 
     @dbconnection
-    def evict(self, store):
-        right_now = now()
-        for pending in store.find(Pended):
-            if pending.expiration_date < right_now:
-                # Find all PendedKeyValue entries that are associated with the
-                # pending object's ID.
-                q = store.find(PendedKeyValue,
-                               PendedKeyValue.pended_id == pending.id)
-                for keyvalue in q:
-                    store.remove(keyvalue)
-                store.remove(pending)
+    def evict(self, store, limit=None):
+        # Make sure the pendings added in this transaction are seen by the
+        # DELETE statements, which bypass the store.
+        store.flush()
+        # Both statements select the same expired pendings, through the index
+        # on the expiration date.  They are removed oldest first.
+        expired = Select(Pended.id, Pended.expiration_date < now(),
+                         order_by=(Pended.expiration_date, Pended.id),
+                         limit=(Undef if limit is None else limit))
+        store.find(PendedKeyValue,
+                   PendedKeyValue.pended_id.is_in(expired)).remove()
+        return store.find(Pended, Pended.id.is_in(expired)).remove()
 
 
 
@@ -22,18 +22,28 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'Preferences',
+    'ResolvedPreferences',
+    'ResolvedPreferencesCache',
+    'resolved_preferences_cache',
     ]
 
 
+import time
+
+from lazr.config import as_timedelta
 from storm.locals import Bool, Int, Unicode
 from zope.component import getUtility
 from zope.interface import implementer
 
+from mailman.config import config
+from mailman.core.constants import system_preferences
 from mailman.database.model import Model
+from mailman.database.transaction import register_transaction_callbacks
 from mailman.database.types import Enum
 from mailman.interfaces.languages import ILanguageManager
 from mailman.interfaces.member import DeliveryMode, DeliveryStatus
 from mailman.interfaces.preferences import IPreferences
+from mailman.testing import layers
 
 
 
@@ -53,6 +63,9 @@ class Preferences(Model):
     def __repr__(self):
         return '<Preferences object at {0:#x}>'.format(id(self))
 
+    def __storm_flushed__(self):
+        resolved_preferences_cache.invalidate(self)
+
     @property
     def preferred_language(self):
         if self._preferred_language is None:
@@ -68,3 +81,174 @@ class Preferences(Model):
             self._preferred_language = language.code
         except AttributeError:
             self._preferred_language = language
+
+
+
+@implementer(IPreferences)
+class ResolvedPreferences:
+    """The effective preferences of a member.
+
+    Every preference is looked up in the member's own preferences, then in
+    those of its address, then in those of the address's user, falling back
+    to the system defaults.  Unlike `Preferences`, none of them are None.
+    """
+
+    def __init__(self, member, values):
+        """Create the resolved preferences.
+
+        :param member: The member whose preferences these are.
+        :type member: `IMember`
+        :param values: The first preference values found for the member, by
+            preference name.  A value is None when it is unset everywhere.
+        :type values: dict
+        """
+        self._member = member
+        self._values = values
+
+    def __repr__(self):
+        return '<ResolvedPreferences object at {0:#x}>'.format(id(self))
+
+    def _lookup(self, preference):
+        value = self._values[preference]
+        if value is None:
+            return getattr(system_preferences, preference)
+        return value
+
+    @property
+    def acknowledge_posts(self):
+        """See `IPreferences`."""
+        return self._lookup('acknowledge_posts')
+
+    @property
+    def hide_address(self):
+        """See `IPreferences`."""
+        return self._lookup('hide_address')
+
+    @property
+    def preferred_language(self):
+        """See `IPreferences`."""
+        language = self._values['preferred_language']
+        if language is None:
+            mlist = self._member.mailing_list
+            language = ((mlist and mlist.preferred_language) or
+                        system_preferences.preferred_language)
+        return language
+
+    @property
+    def receive_list_copy(self):
+        """See `IPreferences`."""
+        return self._lookup('receive_list_copy')
+
+    @property
+    def receive_own_postings(self):
+        """See `IPreferences`."""
+        return self._lookup('receive_own_postings')
+
+    @property
+    def delivery_mode(self):
+        """See `IPreferences`."""
+        return self._lookup('delivery_mode')
+
+    @property
+    def delivery_status(self):
+        """See `IPreferences`."""
+        return self._lookup('delivery_status')
+
+
+
+class ResolvedPreferencesCache:
+    """A cache of the preference values resolved for members.
+
+    Entries are forgotten when any of the member, address, user or
+    preferences rows they were resolved from is flushed, when the transaction
+    is aborted, and when they are older than
+    `[database]preferences_cache_lifetime`.  Only the lifetime bounds how long
+    changes made by other processes go unnoticed.  A lifetime of zero turns
+    the cache off.
+    """
+
+    def __init__(self):
+        # member id -> (expiration time, values, dependencies)
+        self._entries = {}
+        # (table name, row id) -> set of member ids
+        self._dependents = {}
+        self._setting = None
+        self._lifetime = 0
+        # Preferences resolved since the last commit may be rolled back.
+        register_transaction_callbacks(aborted=self.clear)
+        layers.MockAndMonkeyLayer.register_reset(self.clear)
+
+    @property
+    def lifetime(self):
+        """The number of seconds entries are kept for."""
+        setting = config.database.preferences_cache_lifetime
+        if setting != self._setting:
+            self._lifetime = as_timedelta(setting).total_seconds()
+            self._setting = setting
+        return self._lifetime
+
+    def get(self, member_id):
+        """Return the cached values for a member.
+
+        :param member_id: The member's row id.
+        :type member_id: int
+        :return: The values by preference name, as passed to `add()`, or None
+            if there are none cached for the member.
+        :rtype: dict
+        """
+        entry = self._entries.get(member_id)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._forget(member_id)
+            return None
+        return entry[1]
+
+    def add(self, member_id, values, dependencies):
+        """Cache the values resolved for a member, if the cache is on.
+
+        :param member_id: The member's row id.
+        :type member_id: int
+        :param values: The values by preference name, see
+            `ResolvedPreferences`.
+        :type values: dict
+        :param dependencies: The rows the values were resolved from, as
+            2-tuples of the table name and the row id.
+        :type dependencies: sequence
+        """
+        lifetime = self.lifetime
+        if lifetime <= 0:
+            return
+        self._forget(member_id)
+        self._entries[member_id] = (
+            time.time() + lifetime, values, dependencies)
+        for key in dependencies:
+            self._dependents.setdefault(key, set()).add(member_id)
+
+    def invalidate(self, row):
+        """Forget the values resolved from a row.
+
+        :param row: The member, address, user or preferences which changed.
+        """
+        key = (row.__storm_table__, row.id)
+        for member_id in self._dependents.pop(key, ()):
+            self._forget(member_id)
+
+    def clear(self):
+        """Forget everything."""
+        self._entries.clear()
+        self._dependents.clear()
+
+    def _forget(self, member_id):
+        entry = self._entries.pop(member_id, None)
+        if entry is None:
+            return
+        for key in entry[2]:
+            dependents = self._dependents.get(key)
+            if dependents is not None:
+                dependents.discard(member_id)
+                if len(dependents) == 0:
+                    del self._dependents[key]
+
+
+resolved_preferences_cache = ResolvedPreferencesCache()
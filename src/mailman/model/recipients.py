@@ -0,0 +1,155 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""The recipients of a delivery."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'Recipient',
+    'Recipients',
+    ]
+
+
+from zope.interface import implementer
+
+from mailman.core.constants import system_preferences
+from mailman.database.transaction import dbconnection
+from mailman.interfaces.member import MemberRole
+from mailman.interfaces.recipients import IRecipient, IRecipients
+from mailman.model.address import Address
+from mailman.model.member import Member
+from mailman.model.preferences import Preferences
+from mailman.model.user import User
+
+
+# Keep the IN clauses well below SQLite's limit of 999 parameters.
+CHUNK_SIZE = 500
+
+
+
+def _chunks(values):
+    values = list(values)
+    for index in range(0, len(values), CHUNK_SIZE):
+        yield values[index:index + CHUNK_SIZE]
+
+
+def _lookup(preferences, name):
+    for preference in preferences:
+        if preference is not None:
+            value = getattr(preference, name)
+            if value is not None:
+                return value
+    return None
+
+
+
+@implementer(IRecipient)
+class Recipient:
+    """See `IRecipient`."""
+
+    def __init__(self, email, address=None, user=None, member=None,
+                 preferred_language=None):
+        self.email = email
+        self.address = address
+        self.user = user
+        self.member = member
+        self.preferred_language = preferred_language
+
+    def __repr__(self):
+        return '<Recipient {0} at {1:#x}>'.format(self.email, id(self))
+
+
+
+@implementer(IRecipients)
+class Recipients:
+    """See `IRecipients`."""
+
+    @dbconnection
+    def __init__(self, store, mlist, emails):
+        """Load the recipients of a delivery.
+
+        :param mlist: The mailing list being delivered to, or None.
+        :type mlist: `IMailingList`
+        :param emails: The recipients' email addresses.
+        :type emails: sequence
+        """
+        self._recipients = {}
+        emails = set(emails)
+        # Addresses are stored in lower case.
+        addresses = {}
+        for chunk in _chunks(set(email.lower() for email in emails)):
+            for address in store.find(Address, Address.email.is_in(chunk)):
+                addresses[address.email] = address
+        user_ids = set(address.user_id for address in addresses.values()
+                       if address.user_id is not None)
+        users = {}
+        for chunk in _chunks(user_ids):
+            for user in store.find(User, User.id.is_in(chunk)):
+                users[user.id] = user
+        members = {}
+        if mlist is not None:
+            address_ids = [address.id for address in addresses.values()]
+            for chunk in _chunks(address_ids):
+                for member in store.find(Member,
+                                         Member.list_id == mlist.list_id,
+                                         Member.role == MemberRole.member,
+                                         Member.address_id.is_in(chunk)):
+                    members[member.address_id] = member
+        preference_ids = set(
+            obj.preferences_id
+            for obj in (list(addresses.values()) + list(users.values()) +
+                        list(members.values()))
+            if obj.preferences_id is not None)
+        # Keep the preferences alive, so that following the references to
+        # them below doesn't have to query the database again.
+        self._preferences = []
+        for chunk in _chunks(preference_ids):
+            self._preferences.extend(
+                store.find(Preferences, Preferences.id.is_in(chunk)))
+        list_language = (None if mlist is None else mlist.preferred_language)
+        for email in emails:
+            address = addresses.get(email.lower())
+            user = (None
+                    if address is None or address.user_id is None
+                    else users.get(address.user_id))
+            member = None
+            language = None
+            # Like get_member(), the email address must match exactly.
+            if address is not None and address.email == email:
+                member = members.get(address.id)
+            if member is not None:
+                # This is the same lookup as for the member's
+                # preferred_language attribute.
+                language = _lookup(
+                    (member.preferences, address.preferences,
+                     None if user is None else user.preferences),
+                    'preferred_language')
+                if language is None:
+                    language = (list_language or
+                                system_preferences.preferred_language)
+            self._recipients[email] = Recipient(
+                email, address, user, member, language)
+
+    def __getitem__(self, email):
+        """See `IRecipients`."""
+        return self._recipients[email]
+
+    def __len__(self):
+        """See `IRecipients`."""
+        return len(self._recipients)
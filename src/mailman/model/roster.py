@@ -34,20 +34,143 @@ __all__ = [
     'OwnerRoster',
     'RegularMemberRoster',
     'Subscribers',
+    'resolved_preferences',
     ]
 
 
-from storm.expr import And, Or
+from storm.exceptions import NotOneError
+from storm.expr import And, Coalesce, LeftJoin, Or
+from storm.info import ClassAlias
+from zope.component import getUtility
 from zope.interface import implementer
 
+from mailman.core.constants import system_preferences
 from mailman.database.transaction import dbconnection
-from mailman.interfaces.member import DeliveryMode, MemberRole
-from mailman.interfaces.roster import IRoster
+from mailman.interfaces.languages import ILanguageManager
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
+from mailman.interfaces.roster import IDeliveryRoster, IRoster
 from mailman.model.address import Address
 from mailman.model.member import Member
+from mailman.model.preferences import (
+    Preferences, ResolvedPreferences, resolved_preferences_cache)
+
+
+# The preferences resolved in the database, the name of their column in the
+# Preferences model, and how to convert the raw column values.
+_PREFERENCES = (
+    ('acknowledge_posts', 'acknowledge_posts', bool),
+    ('delivery_mode', 'delivery_mode', DeliveryMode),
+    ('delivery_status', 'delivery_status', DeliveryStatus),
+    ('hide_address', 'hide_address', bool),
+    ('preferred_language', '_preferred_language',
+     lambda code: getUtility(ILanguageManager)[code]),
+    ('receive_list_copy', 'receive_list_copy', bool),
+    ('receive_own_postings', 'receive_own_postings', bool),
+    )
+
+
+
+class _PreferenceJoins:
+    """The joins which resolve members' preferences in the database.
+
+    Every preference is the first one set in the member's preferences, its
+    address's preferences, or its address's user's preferences.
+    """
+
+    def __init__(self):
+        # Avoid circular imports.
+        from mailman.model.user import User
+        self._user = User
+        self._subscribed_user = ClassAlias(User)
+        self._sources = (ClassAlias(Preferences),
+                         ClassAlias(Preferences),
+                         ClassAlias(Preferences))
+        member_preferences, address_preferences, user_preferences = (
+            self._sources)
+        # Members subscribed as a user are subscribed with its preferred
+        # address.
+        self.origin = (
+            Member,
+            LeftJoin(self._subscribed_user,
+                     Member.user_id == self._subscribed_user.id),
+            LeftJoin(Address, Address.id == Coalesce(
+                Member.address_id,
+                self._subscribed_user._preferred_address_id)),
+            LeftJoin(User, Address.user_id == User.id),
+            LeftJoin(member_preferences,
+                     Member.preferences_id == member_preferences.id),
+            LeftJoin(address_preferences,
+                     Address.preferences_id == address_preferences.id),
+            LeftJoin(user_preferences,
+                     User.preferences_id == user_preferences.id),
+            )
+
+    def preference(self, column, default=None):
+        """The expression resolving a preference.
+
+        :param column: The name of the preference's column in `Preferences`.
+        :type column: str
+        :param default: The raw column value to use when the preference is
+            not set anywhere, otherwise the expression is NULL.
+        :return: The expression, for use with `origin`.
+        """
+        expressions = [getattr(source, column) for source in self._sources]
+        if default is not None:
+            expressions.append(default)
+        return Coalesce(*expressions)
+
+    def resolve(self, store, *expressions):
+        """See `resolved_preferences()`.
+
+        The expressions can use `preference()`.
+        """
+        User = self._user
+        columns = tuple(self.preference(column)
+                        for name, column, convert in _PREFERENCES)
+        rows = (self._subscribed_user.id, User.id) + tuple(
+            source.id for source in self._sources)
+        results = store.using(*self.origin).find(
+            (Member, Address) + columns + rows, *expressions)
+        for result in results:
+            member, address = result[:2]
+            values = {}
+            for (name, column, convert), value in zip(
+                    _PREFERENCES, result[2:2 + len(columns)]):
+                values[name] = (None if value is None else convert(value))
+            subscribed_user_id, user_id = result[-5:-3]
+            dependencies = [(Member.__storm_table__, member.id)]
+            if address is not None:
+                dependencies.append((Address.__storm_table__, address.id))
+            dependencies.extend(
+                (User.__storm_table__, row_id)
+                for row_id in (subscribed_user_id, user_id)
+                if row_id is not None)
+            dependencies.extend(
+                (Preferences.__storm_table__, row_id)
+                for row_id in result[-3:]
+                if row_id is not None)
+            resolved_preferences_cache.add(member.id, values, dependencies)
+            yield member, ResolvedPreferences(member, values)
+
+
+def resolved_preferences(store, *expressions):
+    """Resolve the effective preferences of many members in one query.
+
+    Every preference is the first one set in the member's preferences, its
+    address's preferences, or its address's user's preferences, as worked out
+    by the database.  The results are added to the resolved preferences cache
+    so that the members' own attributes can use them too.
+
+    :param store: The store to query.
+    :param expressions: The conditions selecting the members.
+    :return: The members and their effective preferences, in no particular
+        order.
+    :rtype: iterator over 2-tuples of (`IMember`, `IPreferences`)
+    """
+    return _PreferenceJoins().resolve(store, *expressions)
+
 
 
-
 @implementer(IRoster)
 class AbstractRoster:
     """An abstract IRoster class.
@@ -76,6 +199,16 @@ class AbstractRoster:
         for member in self._query():
             yield member
 
+    @dbconnection
+    def _resolve(self, store, query):
+        return resolved_preferences(
+            store, Member.id.is_in(query.get_select_expr(Member.id)))
+
+    @property
+    def resolved_members(self):
+        """See `IRoster`."""
+        return self._resolve(self._query())
+
     @property
     def member_count(self):
         """See `IRoster`."""
@@ -110,11 +243,9 @@ class AbstractRoster:
             Member.role == self.role,
             Address.email == address,
             Member.address_id == Address.id)
-        if results.count() == 0:
-            return None
-        elif results.count() == 1:
-            return results[0]
-        else:
+        try:
+            return results.one()
+        except NotOneError:
             raise AssertionError(
                 'Too many matching member results: {0}'.format(
                     results.count()))
@@ -176,73 +307,78 @@ class AdministratorRoster(AbstractRoster):
                    Member.role == MemberRole.owner),
                 Address.email == address,
                 Member.address_id == Address.id)
-        if results.count() == 0:
-            return None
-        elif results.count() == 1:
-            return results[0]
-        else:
+        try:
+            return results.one()
+        except NotOneError:
             raise AssertionError(
                 'Too many matching member results: {0}'.format(results))
 
 
 
+@implementer(IDeliveryRoster)
 class DeliveryMemberRoster(AbstractRoster):
-    """Return all the members having a particular kind of delivery."""
+    """Return all the members having a particular kind of delivery.
+
+    Subclasses must set `delivery_modes` to the modes to filter on.  The
+    members' delivery modes are resolved by the database.
+    """
+
+    role = MemberRole.member
+    delivery_modes = ()
+
+    def _conditions(self, joins, delivery_statuses=None):
+        default_mode = system_preferences.delivery_mode.value
+        conditions = [
+            Member.list_id == self._mlist.list_id,
+            Member.role == MemberRole.member,
+            joins.preference('delivery_mode', default_mode).is_in(
+                [mode.value for mode in self.delivery_modes]),
+            ]
+        if delivery_statuses is not None:
+            default_status = system_preferences.delivery_status.value
+            conditions.append(
+                joins.preference('delivery_status', default_status).is_in(
+                    [status.value for status in delivery_statuses]))
+        return conditions
+
+    @dbconnection
+    def _query(self, store):
+        joins = _PreferenceJoins()
+        return store.using(*joins.origin).find(
+            Member, *self._conditions(joins))
 
     @property
-    def member_count(self):
+    def resolved_members(self):
         """See `IRoster`."""
-        # XXX 2012-03-15 BAW: It would be nice to make this more efficient.
-        # The problem is that you'd have to change the loop in _get_members()
-        # checking the delivery mode to a query parameter.
-        return len(tuple(self.members))
+        return self.get_resolved_members()
 
     @dbconnection
-    def _get_members(self, store, *delivery_modes):
-        """The set of members for a mailing list, filter by delivery mode.
+    def get_resolved_members(self, store, delivery_statuses=None):
+        """See `IDeliveryRoster`."""
+        joins = _PreferenceJoins()
+        return joins.resolve(
+            store, *self._conditions(joins, delivery_statuses))
 
-        :param delivery_modes: The modes to filter on.
-        :type delivery_modes: sequence of `DeliveryMode`.
-        :return: A generator of members.
-        :rtype: generator
-        """
-        results = store.find(
-            Member,
-            And(Member.list_id == self._mlist.list_id,
-                Member.role == MemberRole.member))
-        for member in results:
-            if member.delivery_mode in delivery_modes:
-                yield member
 
 
 class RegularMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'regular_members'
+    delivery_modes = (DeliveryMode.regular,)
 
-    @property
-    def members(self):
-        """See `IRoster`."""
-        for member in self._get_members(DeliveryMode.regular):
-            yield member
 
 
-
 class DigestMemberRoster(DeliveryMemberRoster):
     """Return all the regular delivery members of a list."""
 
     name = 'digest_members'
+    delivery_modes = (DeliveryMode.plaintext_digests,
+                      DeliveryMode.mime_digests,
+                      DeliveryMode.summary_digests)
 
-    @property
-    def members(self):
-        """See `IRoster`."""
-        for member in self._get_members(DeliveryMode.plaintext_digests,
-                                        DeliveryMode.mime_digests,
-                                        DeliveryMode.summary_digests):
-            yield member
 
 
-
 class Subscribers(AbstractRoster):
     """Return all subscribed members regardless of their role."""
 
@@ -283,6 +419,16 @@ class Memberships:
         for member in self._query():
             yield member
 
+    @property
+    def resolved_members(self):
+        """See `IRoster`."""
+        return self._resolve(self._query())
+
+    @dbconnection
+    def _resolve(self, store, query):
+        return resolved_preferences(
+            store, Member.id.is_in(query.get_select_expr(Member.id)))
+
     @property
     def users(self):
         """See `IRoster`."""
@@ -0,0 +1,125 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test the ban index."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestBanIndex',
+    ]
+
+
+import os
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.bans import IBanManager
+from mailman.model.bans import Ban
+from mailman.testing.helpers import LogFileMark, query_log
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.filesystem import GenerationFile
+
+
+
+class TestBanIndex(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._list_bans = IBanManager(self._mlist)
+        self._global_bans = IBanManager(None)
+
+    def test_loaded_once(self):
+        for i in range(100):
+            self._list_bans.ban('^person{0}@'.format(i))
+            self._global_bans.ban('anne{0}@example.com'.format(i))
+        config.db.commit()
+        self.assertTrue(self._list_bans.is_banned('person7@example.com'))
+        with query_log() as statements:
+            self.assertTrue(self._list_bans.is_banned('PERSON99@example.com'))
+            self.assertTrue(self._list_bans.is_banned('anne3@example.com'))
+            self.assertFalse(self._list_bans.is_banned('bart@example.com'))
+            self.assertFalse(
+                self._global_bans.is_banned('person7@example.com'))
+        self.assertEqual(statements, [])
+
+    def test_ban_and_unban(self):
+        # Changes are seen right away, before they are committed.
+        self.assertFalse(self._list_bans.is_banned('anne@example.com'))
+        self._list_bans.ban('^anne@')
+        self.assertTrue(self._list_bans.is_banned('anne@example.com'))
+        self._list_bans.unban('^anne@')
+        self.assertFalse(self._list_bans.is_banned('anne@example.com'))
+
+    def test_abort(self):
+        self._global_bans.ban('anne@example.com')
+        self.assertTrue(self._global_bans.is_banned('anne@example.com'))
+        config.db.abort()
+        self.assertFalse(self._global_bans.is_banned('anne@example.com'))
+
+    def test_banned_elsewhere(self):
+        # Another process bans an email address.
+        self.assertFalse(self._list_bans.is_banned('anne@example.com'))
+        config.db.store.add(Ban('anne@example.com', self._mlist.list_id))
+        config.db.commit()
+        self.assertFalse(self._list_bans.is_banned('anne@example.com'))
+        GenerationFile(
+            os.path.join(config.DATA_DIR, 'bans.generation')).bump()
+        self.assertTrue(self._list_bans.is_banned('anne@example.com'))
+
+    def test_commit_bumps_generation(self):
+        generation_file = GenerationFile(
+            os.path.join(config.DATA_DIR, 'bans.generation'))
+        status = generation_file.status
+        self._list_bans.ban('anne@example.com')
+        self.assertEqual(generation_file.status, status)
+        config.db.commit()
+        self.assertNotEqual(generation_file.status, status)
+
+    def test_filter_banned(self):
+        self._list_bans.ban('anne@example.com')
+        self._global_bans.ban('^bart@')
+        self.assertEqual(
+            self._list_bans.filter_banned([
+                'anne@example.com', 'bart@example.com', 'cris@example.com']),
+            set(['anne@example.com', 'bart@example.com']))
+        self.assertEqual(
+            self._global_bans.filter_banned([
+                'anne@example.com', 'bart@example.com', 'cris@example.com']),
+            set(['bart@example.com']))
+
+    def test_many_groups(self):
+        # More patterns with groups than one regular expression can hold.
+        for i in range(150):
+            self._list_bans.ban('^(anne|bart){0}@'.format(i))
+        self._list_bans.ban('^(cris)\\1@')
+        self.assertTrue(self._list_bans.is_banned('bart149@example.com'))
+        self.assertTrue(self._list_bans.is_banned('anne0@example.com'))
+        self.assertTrue(self._list_bans.is_banned('criscris@example.com'))
+        self.assertFalse(self._list_bans.is_banned('cris@example.com'))
+
+    def test_invalid_pattern(self):
+        mark = LogFileMark('mailman.error')
+        self._list_bans.ban('^anne(@')
+        self._list_bans.ban('^bart@')
+        self.assertFalse(self._list_bans.is_banned('anne(@example.com'))
+        self.assertTrue(self._list_bans.is_banned('bart@example.com'))
+        self.assertIn('Invalid ban pattern: ^anne(@', mark.readline())
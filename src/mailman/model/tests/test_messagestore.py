@@ -0,0 +1,266 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Test the message stores."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestConfiguredMessageStore',
+    'TestMessageStore',
+    'TestSegmentedMessageStore',
+    ]
+
+
+import os
+import unittest
+
+from zope.component import getUtility
+
+from mailman.config import config
+from mailman.interfaces.messages import IMessageStore
+from mailman.model.message import Message
+from mailman.model.messagestore import (
+    MessageStore, SegmentedMessageStore)
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+
+
+
+def make_message(i, size=0):
+    return mfs("""\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{0}>
+
+{1}
+From the body.
+""".format(i, 'x' * size))
+
+
+
+class TestMessageStore(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._store = MessageStore()
+
+    def test_get_messages_by_ids(self):
+        for i in range(3):
+            self._store.add(make_message(i))
+        messages = self._store.get_messages_by_ids(
+            ['<ant2>', '<bee>', '<ant0>'])
+        self.assertEqual(messages[0]['message-id'], '<ant2>')
+        self.assertIsNone(messages[1])
+        self.assertEqual(messages[2]['message-id'], '<ant0>')
+        self.assertEqual(self._store.get_messages_by_ids([]), [])
+
+
+
+class TestSegmentedMessageStore(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._store = SegmentedMessageStore()
+        self._directory = os.path.join(config.MESSAGES_DIR, 'segments')
+
+    def _segments(self):
+        return sorted(os.listdir(self._directory))
+
+    def test_add_and_get(self):
+        msg = make_message(1)
+        msg.set_unixfrom('From bounces@example.com Mon Apr  7 12:00:00 2014')
+        hash32 = self._store.add(msg)
+        self.assertEqual(self._segments(), ['00000001'])
+        for found in (self._store.get_message_by_id('<ant1>'),
+                      self._store.get_message_by_hash(hash32)):
+            self.assertEqual(found['x-message-id-hash'], hash32)
+            self.assertEqual(found.get_unixfrom(), msg.get_unixfrom())
+            # The body is not mangled.
+            self.assertEqual(found.get_payload(), '\nFrom the body.\n')
+            # The max-size rule needs the size of the message.
+            self.assertGreater(found.original_size, 0)
+        self.assertRaises(ValueError, self._store.add, make_message(1))
+
+    def test_many_messages_one_file(self):
+        for i in range(20):
+            self._store.add(make_message(i))
+        self.assertEqual(self._segments(), ['00000001'])
+        messages = self._store.get_messages_by_ids(
+            ['<ant{0}>'.format(i) for i in (19, 3, 7)] + ['<bee>'])
+        self.assertEqual([message and message['message-id']
+                          for message in messages],
+                         ['<ant19>', '<ant3>', '<ant7>', None])
+        self.assertEqual(len(list(self._store.messages)), 20)
+
+    @configuration('messagestore', segment_size=1000)
+    def test_new_segment(self):
+        for i in range(4):
+            self._store.add(make_message(i, 300))
+        self.assertEqual(self._segments(), ['00000001', '00000002'])
+        for i in range(4):
+            message = self._store.get_message_by_id('<ant{0}>'.format(i))
+            self.assertEqual(message['message-id'], '<ant{0}>'.format(i))
+
+    @configuration('messagestore', segment_size=1000)
+    def test_compaction(self):
+        for i in range(5):
+            self._store.add(make_message(i, 300))
+        config.db.commit()
+        self.assertEqual(self._segments(),
+                         ['00000001', '00000002', '00000003'])
+        # Half of the first segment is deleted, so the other message in it is
+        # copied to the latest segment.
+        self._store.delete_message('<ant0>')
+        row = config.db.store.find(Message, message_id='<ant1>').one()
+        self.assertTrue(row.path.startswith(b'segments/00000003:'))
+        # The segment is retired once that is committed.
+        self.assertEqual(self._segments(),
+                         ['00000001', '00000002', '00000003'])
+        config.db.commit()
+        self.assertEqual(self._segments(),
+                         ['00000001', '00000001.retired', '00000002',
+                          '00000003'])
+        # And removed by the next deletion.
+        self._store.delete_message('<ant2>')
+        config.db.commit()
+        self.assertEqual(self._segments(),
+                         ['00000002', '00000002.retired', '00000003',
+                          '00000004'])
+        self.assertEqual(
+            [message['message-id'] for message in self._store.messages],
+            ['<ant4>', '<ant1>', '<ant3>'])
+
+    @configuration('messagestore', segment_size=1000,
+                   compaction_threshold=0.9)
+    def test_deleted_bytes_counted(self):
+        for i in range(3):
+            self._store.add(make_message(i, 300))
+        config.db.commit()
+        self._store.delete_message('<ant0>')
+        # The deleted bytes are counted once the deletion is committed.
+        self.assertEqual(self._segments(), ['00000001', '00000002'])
+        config.db.commit()
+        self.assertEqual(self._segments(),
+                         ['00000001', '00000001.deleted', '00000002'])
+        self._store.delete_message('<ant1>')
+        config.db.commit()
+        self.assertEqual(self._segments(),
+                         ['00000001', '00000001.deleted', '00000001.retired',
+                          '00000002'])
+
+    def _dead_bytes(self, number):
+        path = os.path.join(self._directory, '{0:08d}.deleted'.format(number))
+        if not os.path.exists(path):
+            return 0
+        with open(path) as fp:
+            return int(fp.read())
+
+    def test_aborted_add_is_dead(self):
+        # The bytes of a message whose addition is rolled back are dead.
+        self._store.add(make_message(0))
+        config.db.commit()
+        self._store.add(make_message(1))
+        config.db.abort()
+        size = os.path.getsize(os.path.join(self._directory, '00000001'))
+        self.assertEqual(self._dead_bytes(1), size / 2)
+        self.assertIsNone(self._store.get_message_by_id('<ant1>'))
+
+    @configuration('messagestore', segment_size=1000,
+                   compaction_threshold=0.9)
+    def test_aborted_delete_not_counted(self):
+        for i in range(3):
+            self._store.add(make_message(i, 300))
+        config.db.commit()
+        self._store.delete_message('<ant0>')
+        config.db.abort()
+        self.assertEqual(self._dead_bytes(1), 0)
+        self._store.delete_message('<ant0>')
+        config.db.commit()
+        self.assertGreater(self._dead_bytes(1), 0)
+
+    @configuration('messagestore', segment_size=1000)
+    def test_compaction_aborted(self):
+        for i in range(3):
+            self._store.add(make_message(i, 300))
+        config.db.commit()
+        self._store.delete_message('<ant0>')
+        config.db.abort()
+        # The copies of the compacted messages are dead, and the compacted
+        # segment keeps its count.
+        self.assertGreater(self._dead_bytes(2), 0)
+        self.assertEqual(self._dead_bytes(1), 0)
+        # The compacted segment stays, since the messages in it are back.
+        self._store.delete_message('<ant2>')
+        config.db.commit()
+        self.assertIn('00000001', self._segments())
+        self.assertNotIn('00000001.retired', self._segments())
+        for message_id in ('<ant0>', '<ant1>'):
+            message = self._store.get_message_by_id(message_id)
+            self.assertEqual(message['message-id'], message_id)
+
+    @configuration('messagestore', segment_size=1000)
+    def test_retired_before_startup(self):
+        # Segments retired before the process started are found and removed
+        # by the first deletion.
+        os.makedirs(self._directory)
+        for filename in ('00000001', '00000001.retired'):
+            with open(os.path.join(self._directory, filename), 'w') as fp:
+                fp.write('x' * 1000)
+        for i in range(2):
+            self._store.add(make_message(i))
+        config.db.commit()
+        self.assertEqual(self._segments(),
+                         ['00000001', '00000001.retired', '00000002'])
+        self._store.delete_message('<ant0>')
+        self.assertEqual(self._segments(), ['00000002'])
+
+    def test_legacy_messages(self):
+        # Messages stored by the default message store can still be read and
+        # deleted.
+        MessageStore().add(make_message(1))
+        self._store.add(make_message(2))
+        self.assertEqual(
+            sorted(message['message-id']
+                   for message in self._store.messages),
+            ['<ant1>', '<ant2>'])
+        self._store.delete_message('<ant1>')
+        self.assertIsNone(self._store.get_message_by_id('<ant1>'))
+
+
+
+class TestConfiguredMessageStore(unittest.TestCase):
+    layer = ConfigLayer
+
+    def test_default(self):
+        message_store = getUtility(IMessageStore)
+        message_store.add(make_message(1))
+        self.assertFalse(os.path.exists(
+            os.path.join(config.MESSAGES_DIR, 'segments')))
+
+    def test_segmented(self):
+        message_store = getUtility(IMessageStore)
+        with configuration('messagestore', **{
+                'class': 'mailman.model.messagestore.SegmentedMessageStore'}):
+            message_store.add(make_message(1))
+            self.assertTrue(os.path.exists(
+                os.path.join(config.MESSAGES_DIR, 'segments', '00000001')))
+            message = message_store.get_message_by_id('<ant1>')
+        self.assertEqual(message['message-id'], '<ant1>')
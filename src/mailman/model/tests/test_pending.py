@@ -0,0 +1,131 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the pending database."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestPendings',
+    ]
+
+
+import unittest
+
+from datetime import timedelta
+from zope.component import getUtility
+from zope.interface import implementer
+
+from mailman.config import config
+from mailman.interfaces.pending import IPendable, IPendings
+from mailman.model.pending import Pended, PendedKeyValue
+from mailman.testing.helpers import query_log
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.datetime import now
+
+
+
+@implementer(IPendable)
+class SimplePendable(dict):
+    pass
+
+
+
+class TestPendings(unittest.TestCase):
+    """Test the pending database."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._pendings = getUtility(IPendings)
+
+    def test_payload_types(self):
+        token = self._pendings.add(SimplePendable(
+            type=b'subscription',
+            id=7,
+            ratio=0.5,
+            flag=True,
+            names=['anne', 'bart'],
+            nothing=None))
+        pendable = self._pendings.confirm(token)
+        self.assertEqual(pendable, dict(
+            type='subscription',
+            id=7,
+            ratio=0.5,
+            flag=True,
+            names=['anne', 'bart'],
+            nothing=None))
+        self.assertIsInstance(pendable['type'], unicode)
+
+    def test_one_row(self):
+        # The pendable is stored in the pended row itself.
+        self._pendings.add(SimplePendable(type='one', address='anne'))
+        store = config.db.store
+        self.assertEqual(store.find(Pended).count(), 1)
+        self.assertEqual(store.find(PendedKeyValue).count(), 0)
+
+    def test_legacy_key_values(self):
+        # Pendables stored by older versions as key/value pairs can still be
+        # confirmed.
+        pended = Pended(b'abcdef', now() + timedelta(days=1))
+        for key, value in (('type', 'old'),
+                           ('id', '__builtin__.int\1%s' % 7),
+                           ('names', 'mailman.model.pending.unpack_list\1'
+                                     'anne\2bart')):
+            pended.key_values.add(PendedKeyValue(key=key, value=value))
+        config.db.store.add(pended)
+        self.assertEqual(self._pendings.confirm('abcdef', expunge=False),
+                         dict(type='old', id=7, names=['anne', 'bart']))
+        self.assertEqual(self._pendings.confirm('abcdef'),
+                         dict(type='old', id=7, names=['anne', 'bart']))
+        self.assertIsNone(self._pendings.confirm('abcdef'))
+        self.assertEqual(config.db.store.find(PendedKeyValue).count(), 0)
+
+    def test_evict_in_batches(self):
+        expired = [
+            self._pendings.add(SimplePendable(type='expired'),
+                               lifetime=timedelta(days=-1))
+            for i in range(5)]
+        live = self._pendings.add(SimplePendable(type='live'))
+        self.assertEqual(self._pendings.evict(3), 3)
+        # The oldest ones went first.
+        for token in expired[:3]:
+            self.assertIsNone(self._pendings.confirm(token, expunge=False))
+        self.assertEqual(self._pendings.evict(3), 2)
+        self.assertEqual(self._pendings.evict(3), 0)
+        self.assertEqual(self._pendings.confirm(live), dict(type='live'))
+
+    def test_evict_legacy_key_values(self):
+        pended = Pended(b'abcdef', now() - timedelta(days=1))
+        pended.key_values.add(PendedKeyValue(key='type', value='old'))
+        config.db.store.add(pended)
+        self.assertEqual(self._pendings.evict(), 1)
+        self.assertEqual(config.db.store.find(PendedKeyValue).count(), 0)
+
+    def test_evict_does_not_load_pendings(self):
+        for i in range(3):
+            self._pendings.add(SimplePendable(type='expired'),
+                               lifetime=timedelta(days=-1))
+        config.db.store.flush()
+        with query_log() as statements:
+            self.assertEqual(self._pendings.evict(), 3)
+        # The key/value pairs and the pendings are deleted in one statement
+        # each.
+        self.assertEqual(len(statements), 2)
+        for statement in statements:
+            self.assertTrue(statement.lstrip().upper().startswith('DELETE'))
@@ -0,0 +1,133 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test loading the recipients of a delivery."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestRecipients',
+    ]
+
+
+import unittest
+
+from zope.component import getUtility
+
+from mailman.app.lifecycle import create_list
+from mailman.app.membership import add_member
+from mailman.config import config
+from mailman.interfaces.languages import ILanguageManager
+from mailman.interfaces.member import DeliveryMode
+from mailman.interfaces.usermanager import IUserManager
+from mailman.model.recipients import Recipients
+from mailman.testing.helpers import query_log
+from mailman.testing.layers import ConfigLayer
+
+
+
+class TestRecipients(unittest.TestCase):
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._anne = add_member(self._mlist, 'anne@example.com',
+                                'Anne Person', 'xyz',
+                                DeliveryMode.regular, 'en')
+        self._bart = add_member(self._mlist, 'bart@example.com',
+                                'Bart Person', 'xyz',
+                                DeliveryMode.regular, 'en')
+        # Cris is a user, but not a member of the mailing list.
+        getUtility(IUserManager).create_user('cris@example.com', 'Cris')
+        config.db.commit()
+
+    def test_recipients(self):
+        emails = ['anne@example.com', 'bart@example.com',
+                  'cris@example.com', 'dave@example.com']
+        recipients = Recipients(self._mlist, emails)
+        self.assertEqual(len(recipients), 4)
+        user_manager = getUtility(IUserManager)
+        for email in emails:
+            recipient = recipients[email]
+            self.assertEqual(recipient.email, email)
+            self.assertEqual(recipient.member,
+                             self._mlist.members.get_member(email))
+            self.assertEqual(recipient.user, user_manager.get_user(email))
+            self.assertEqual(recipient.address,
+                             user_manager.get_address(email))
+        self.assertEqual(recipients['anne@example.com'].member, self._anne)
+        self.assertEqual(recipients['dave@example.com'].address, None)
+        self.assertRaises(KeyError, recipients.__getitem__,
+                          'elle@example.com')
+
+    def test_case_insensitive_user(self):
+        # Users are found regardless of the case of the email address, but
+        # the member is only found by its exact address, like get_member().
+        recipients = Recipients(self._mlist, ['Anne@Example.com'])
+        recipient = recipients['Anne@Example.com']
+        self.assertEqual(recipient.user.display_name, 'Anne Person')
+        self.assertEqual(recipient.member, None)
+        self.assertEqual(recipient.preferred_language, None)
+
+    def test_preferred_language(self):
+        # The member's preferences take precedence, then those of the
+        # address, then the user, then the mailing list.
+        french = getUtility(ILanguageManager)['fr']
+        self._mlist.preferred_language = french
+        for member in (self._anne, self._bart):
+            member.preferences.preferred_language = None
+            member.address.user.preferences.preferred_language = None
+        self._bart.address.preferences.preferred_language = 'en'
+        config.db.commit()
+        recipients = Recipients(
+            self._mlist, ['anne@example.com', 'bart@example.com'])
+        self.assertEqual(recipients['anne@example.com'].preferred_language,
+                         french)
+        self.assertEqual(recipients['bart@example.com'].preferred_language,
+                         self._bart.preferred_language)
+        self.assertEqual(
+            recipients['bart@example.com'].preferred_language.code, 'en')
+
+    def test_no_mailing_list(self):
+        recipients = Recipients(None, ['anne@example.com'])
+        recipient = recipients['anne@example.com']
+        self.assertEqual(recipient.member, None)
+        self.assertEqual(recipient.user.display_name, 'Anne Person')
+
+    def test_fixed_number_of_queries(self):
+        emails = ['person{0:03d}@example.com'.format(i) for i in range(600)]
+        for email in emails[:30]:
+            add_member(self._mlist, email, 'Person', 'xyz',
+                       DeliveryMode.regular, 'en')
+        config.db.commit()
+        with query_log() as statements:
+            recipients = Recipients(self._mlist, emails)
+        # Two queries for each of the addresses, users, members and
+        # preferences, because there are more than 500 addresses.
+        self.assertLessEqual(len(statements), 8)
+        # Everything delivery needs to know has been loaded.
+        with query_log() as statements:
+            for email in emails:
+                recipient = recipients[email]
+                if recipient.member is None:
+                    continue
+                recipient.member.address.original_email
+                recipient.member.options_url
+                recipient.user.display_name
+                recipient.preferred_language.description
+        self.assertEqual(statements, [])
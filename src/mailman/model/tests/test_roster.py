@@ -23,16 +23,21 @@ __metaclass__ = type
 __all__ = [
     'TestMailingListRoster',
     'TestMembershipsRoster',
+    'TestResolvedMembers',
     ]
 
 
 import unittest
 
 from zope.component import getUtility
+from zope.interface.verify import verifyObject
 
 from mailman.app.lifecycle import create_list
-from mailman.interfaces.member import DeliveryMode, MemberRole
+from mailman.config import config
+from mailman.interfaces.member import DeliveryMode, DeliveryStatus, MemberRole
+from mailman.interfaces.roster import IDeliveryRoster
 from mailman.interfaces.usermanager import IUserManager
+from mailman.testing.helpers import configuration, query_log
 from mailman.testing.layers import ConfigLayer
 from mailman.utilities.datetime import now
 
@@ -154,3 +159,186 @@ class TestMembershipsRoster(unittest.TestCase):
         self._ant.subscribe(self._anne)
         self._bee.subscribe(self._anne)
         self.assertEqual(self._anne.memberships.member_count, 2)
+
+
+
+class TestResolvedMembers(unittest.TestCase):
+    """Test the preferences resolved for a roster's members."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        user_manager = getUtility(IUserManager)
+        self._anne = user_manager.create_address('anne@example.com')
+        self._bart = user_manager.create_address('bart@example.com')
+        self._cris = user_manager.create_user('cris@example.com')
+        preferred = list(self._cris.addresses)[0]
+        preferred.verified_on = now()
+        self._cris.preferred_address = preferred
+
+    def _resolved(self, roster):
+        return dict((member.address.email, preferences)
+                    for member, preferences in roster.resolved_members)
+
+    def test_resolution_order(self):
+        # Preferences are resolved from the member, then its address, then
+        # its user, then the system defaults.
+        anne = self._mlist.subscribe(self._anne)
+        anne.preferences.delivery_status = DeliveryStatus.by_user
+        self._anne.preferences.delivery_status = DeliveryStatus.by_bounces
+        self._anne.preferences.acknowledge_posts = True
+        self._bart.preferences.preferred_language = 'fr'
+        self._mlist.subscribe(self._bart)
+        self._cris.preferences.receive_own_postings = False
+        self._mlist.subscribe(self._cris)
+        resolved = self._resolved(self._mlist.members)
+        self.assertEqual(sorted(resolved), [
+            'anne@example.com', 'bart@example.com', 'cris@example.com'])
+        preferences = resolved['anne@example.com']
+        self.assertEqual(preferences.delivery_status, DeliveryStatus.by_user)
+        self.assertTrue(preferences.acknowledge_posts)
+        self.assertEqual(preferences.preferred_language.code, 'en')
+        preferences = resolved['bart@example.com']
+        self.assertEqual(preferences.delivery_status, DeliveryStatus.enabled)
+        self.assertFalse(preferences.acknowledge_posts)
+        self.assertEqual(preferences.preferred_language.code, 'fr')
+        preferences = resolved['cris@example.com']
+        self.assertFalse(preferences.receive_own_postings)
+        self.assertTrue(preferences.receive_list_copy)
+        self.assertEqual(preferences.delivery_mode, DeliveryMode.regular)
+        # The members themselves agree.
+        for member in self._mlist.members.members:
+            preferences = resolved[member.address.email]
+            for name in ('acknowledge_posts', 'delivery_mode',
+                         'delivery_status', 'preferred_language',
+                         'receive_list_copy', 'receive_own_postings'):
+                self.assertEqual(getattr(preferences, name),
+                                 getattr(member, name))
+
+    def test_delivery_rosters(self):
+        # The regular and digest member rosters filter on the resolved
+        # delivery mode.
+        self._mlist.subscribe(self._anne)
+        self._bart.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._mlist.subscribe(self._bart)
+        self._cris.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        self._mlist.subscribe(self._cris)
+        self._mlist.subscribe(self._anne, MemberRole.owner)
+        self.assertEqual(sorted(self._resolved(self._mlist.regular_members)),
+                         ['anne@example.com'])
+        self.assertEqual(sorted(self._resolved(self._mlist.digest_members)),
+                         ['bart@example.com', 'cris@example.com'])
+        self.assertEqual(self._mlist.digest_members.member_count, 2)
+
+    def test_delivery_roster_interface(self):
+        # The delivery rosters can filter on the resolved delivery status.
+        for roster in (self._mlist.regular_members,
+                       self._mlist.digest_members):
+            self.assertTrue(verifyObject(IDeliveryRoster, roster))
+
+    def test_delivery_status(self):
+        # The delivery rosters can also filter on the resolved delivery
+        # status.
+        self._mlist.subscribe(self._anne)
+        self._bart.preferences.delivery_status = DeliveryStatus.by_bounces
+        self._mlist.subscribe(self._bart)
+        member = self._mlist.subscribe(self._cris)
+        member.preferences.delivery_status = DeliveryStatus.enabled
+        self._cris.preferences.delivery_status = DeliveryStatus.by_user
+        enabled = self._mlist.regular_members.get_resolved_members(
+            [DeliveryStatus.enabled])
+        self.assertEqual(
+            sorted(member.address.email for member, preferences in enabled),
+            ['anne@example.com', 'cris@example.com'])
+        disabled = self._mlist.regular_members.get_resolved_members(
+            [DeliveryStatus.by_bounces, DeliveryStatus.by_user])
+        self.assertEqual(
+            [member.address.email for member, preferences in disabled],
+            ['bart@example.com'])
+
+    def test_delivery_roster_queries(self):
+        # The delivery rosters and their counts are single queries.
+        self._mlist.subscribe(self._anne)
+        self._bart.preferences.delivery_mode = DeliveryMode.mime_digests
+        self._mlist.subscribe(self._bart)
+        config.db.commit()
+        self._mlist.list_id
+        with query_log() as statements:
+            self.assertEqual(self._mlist.regular_members.member_count, 1)
+            self.assertEqual(self._mlist.digest_members.member_count, 1)
+            self.assertEqual(len(list(self._mlist.digest_members.members)), 1)
+        self.assertEqual(len(statements), 3)
+
+    def test_memberships(self):
+        # A user's memberships resolve their preferences too.
+        self._cris.preferences.delivery_status = DeliveryStatus.by_moderator
+        self._mlist.subscribe(self._cris)
+        self._mlist.subscribe(self._cris, MemberRole.owner)
+        resolved = list(self._cris.memberships.resolved_members)
+        self.assertEqual(len(resolved), 2)
+        for member, preferences in resolved:
+            self.assertEqual(preferences.delivery_status,
+                             DeliveryStatus.by_moderator)
+
+    def test_one_query(self):
+        # All the members' preferences are resolved by a single query.
+        user_manager = getUtility(IUserManager)
+        for i in range(20):
+            address = user_manager.create_address(
+                'person{0:02d}@example.com'.format(i))
+            self._mlist.subscribe(address)
+        config.db.commit()
+        # Reload the mailing list first.
+        self._mlist.list_id
+        with query_log() as statements:
+            resolved = self._resolved(self._mlist.regular_members)
+        self.assertEqual(len(resolved), 20)
+        self.assertEqual(len(statements), 1)
+
+    def test_no_cache(self):
+        # By default, the members still look up their own preferences.
+        member = self._mlist.subscribe(self._anne)
+        config.db.commit()
+        list(self._mlist.members.resolved_members)
+        with query_log() as statements:
+            self.assertEqual(member.delivery_mode, DeliveryMode.regular)
+        self.assertNotEqual(statements, [])
+
+    @configuration('database', preferences_cache_lifetime='1h')
+    def test_cache(self):
+        # With the cache turned on, the members use the resolved preferences.
+        member = self._mlist.subscribe(self._anne)
+        config.db.commit()
+        list(self._mlist.members.resolved_members)
+        with query_log() as statements:
+            self.assertEqual(member.delivery_mode, DeliveryMode.regular)
+            self.assertFalse(member.acknowledge_posts)
+        self.assertEqual(statements, [])
+
+    @configuration('database', preferences_cache_lifetime='1h')
+    def test_cache_invalidation(self):
+        # Changing any of the preferences a member's were resolved from
+        # forgets them.
+        member = self._mlist.subscribe(self._cris)
+        config.db.commit()
+        list(self._mlist.members.resolved_members)
+        self._cris.preferences.delivery_mode = DeliveryMode.mime_digests
+        config.db.commit()
+        self.assertEqual(member.delivery_mode, DeliveryMode.mime_digests)
+        list(self._mlist.members.resolved_members)
+        member.preferences.delivery_mode = DeliveryMode.plaintext_digests
+        config.db.commit()
+        self.assertEqual(member.delivery_mode,
+                         DeliveryMode.plaintext_digests)
+
+    @configuration('database', preferences_cache_lifetime='1h')
+    def test_cache_abort(self):
+        # Preferences resolved in an aborted transaction are forgotten.
+        member = self._mlist.subscribe(self._anne)
+        config.db.commit()
+        self._anne.preferences.delivery_mode = DeliveryMode.mime_digests
+        list(self._mlist.members.resolved_members)
+        self.assertEqual(member.delivery_mode, DeliveryMode.mime_digests)
+        config.db.abort()
+        self.assertEqual(member.delivery_mode, DeliveryMode.regular)
@@ -37,7 +37,8 @@ from mailman.interfaces.address import (
 from mailman.interfaces.user import (
     IUser, PasswordChangeEvent, UnverifiedAddressError)
 from mailman.model.address import Address
-from mailman.model.preferences import Preferences
+from mailman.model.preferences import (
+    Preferences, resolved_preferences_cache)
 from mailman.model.roster import Memberships
 from mailman.utilities.datetime import factory as date_factory
 from mailman.utilities.uid import UniqueIDFactory
@@ -80,6 +81,9 @@ class User(Model):
         return '<User "{0.display_name}" ({2}) at {1:#x}>'.format(
             self, id(self), short_user_id)
 
+    def __storm_flushed__(self):
+        resolved_preferences_cache.invalidate(self)
+
     @property
     def user_id(self):
         """See `IUser`."""
@@ -31,11 +31,14 @@ import socket
 import logging
 import smtplib
 
+from lazr.config import as_boolean
 from zope.interface import implementer
 
 from mailman.config import config
 from mailman.interfaces.mta import IMailTransportAgentDelivery
-from mailman.mta.connection import Connection
+from mailman.model.recipients import Recipients
+from mailman.mta.connection import Connection, current_pool
+from mailman.mta.template import make_template
 
 
 log = logging.getLogger('mailman.smtp')
@@ -50,10 +53,30 @@ class BaseDelivery:
         """Create a basic deliverer."""
         username = (config.mta.smtp_user if config.mta.smtp_user else None)
         password = (config.mta.smtp_pass if config.mta.smtp_pass else None)
-        self._connection = Connection(
+        self._connection_args = (
             config.mta.smtp_host, int(config.mta.smtp_port),
             int(config.mta.max_sessions_per_connection),
             username, password)
+        # In the outgoing runner, connections are borrowed from its pool for
+        # each SMTP transaction.  Otherwise, this deliverer has its own.
+        self._pool = current_pool()
+        self._connection = (Connection(*self._connection_args)
+                            if self._pool is None
+                            else None)
+
+    def _sendmail(self, sender, recipients, msgtext):
+        """Send the message text over a pooled or private connection."""
+        if self._pool is None:
+            return self._connection.sendmail(sender, recipients, msgtext)
+        connection = self._pool.get(*self._connection_args)
+        try:
+            return connection.sendmail(sender, recipients, msgtext)
+        except (socket.error, IOError):
+            # The connection is in an unknown state; don't reuse it.
+            connection.close()
+            raise
+        finally:
+            self._pool.release(connection)
 
     def _deliver_to_recipients(self, mlist, msg, msgdata, recipients):
         """Low-level delivery to a set of recipients.
@@ -71,10 +94,28 @@ class BaseDelivery:
         """
         # Do the actual sending.
         sender = self._get_sender(mlist, msg, msgdata)
-        message_id = msg['message-id']
+        return self._send_to_recipients(
+            sender, recipients, msg.as_string(), msg['message-id'])
+
+    def _send_to_recipients(self, sender, recipients, msgtext, message_id):
+        """Send the message text, and collect the refused recipients.
+
+        Unlike `_deliver_to_recipients()`, this needs neither the mailing list
+        nor the message, so it can be called from other threads.
+
+        :param sender: The envelope sender.
+        :type sender: string
+        :param recipients: The recipients of this message.
+        :type recipients: sequence
+        :param msgtext: The flattened message.
+        :type msgtext: string
+        :param message_id: The Message-ID of the message, for logging.
+        :type message_id: string
+        :return: delivery failures as defined by `smtplib.SMTP.sendmail`
+        :rtype: dictionary
+        """
         try:
-            refused = self._connection.sendmail(
-                sender, recipients, msg.as_string())
+            refused = self._sendmail(sender, recipients, msgtext)
         except smtplib.SMTPRecipientsRefused as error:
             log.error('%s recipients refused: %s', message_id, error)
             refused = error.recipients
@@ -150,11 +191,17 @@ class IndividualDelivery(BaseDelivery):
         """
         refused = {}
         recipients = msgdata.get('recipients', set())
+        # Look up the members, users and preferences of all the recipients at
+        # once, instead of separately for every recipient.
+        contexts = Recipients(mlist, recipients)
+        # When possible, the callbacks are only run once, on a template of
+        # the message which every recipient's message is rendered from.
+        template = None
+        if (len(recipients) > 1 and
+                as_boolean(config.mta.personalization_templates)):
+            template = make_template(mlist, msg, msgdata, self.callbacks)
         for recipient in recipients:
             log.debug('IndividualDelivery to: %s', recipient)
-            # Make a copy of the original messages and operator on it, since
-            # we're going to munge it repeatedly for each recipient.
-            message_copy = copy.deepcopy(msg)
             msgdata_copy = msgdata.copy()
             # Squirrel the current recipient away in the message metadata.
             # That way the subclass's _get_sender() override can encode the
@@ -162,12 +209,20 @@ class IndividualDelivery(BaseDelivery):
             msgdata_copy['recipient'] = recipient
             # See if the recipient is a member of the mailing list, and if so,
             # squirrel this information away for use by other modules, such as
-            # the header/footer decorator.  XXX 2012-03-05 this is probably
-            # highly inefficient on the database.
-            member = mlist.members.get_member(recipient)
-            msgdata_copy['member'] = member
-            for callback in self.callbacks:
-                callback(mlist, message_copy, msgdata_copy)
+            # the header/footer decorator.
+            context = contexts[recipient]
+            msgdata_copy['recipient-context'] = context
+            msgdata_copy['member'] = context.member
+            message_copy = (None
+                            if template is None
+                            else template.render(mlist, msgdata_copy))
+            if message_copy is None:
+                # Make a copy of the original message and operate on it,
+                # since we're going to munge it repeatedly for each
+                # recipient.
+                message_copy = copy.deepcopy(msg)
+                for callback in self.callbacks:
+                    callback(mlist, message_copy, msgdata_copy)
             status = self._deliver_to_recipients(
                 mlist, message_copy, msgdata_copy, [recipient])
             refused.update(status)
@@ -25,7 +25,17 @@ __all__ = [
     ]
 
 
+import sys
+import logging
+import threading
+
+from Queue import Empty, Queue
+from mailman.config import config
 from mailman.mta.base import BaseDelivery
+from mailman.mta.connection import ConnectionPool
+
+
+log = logging.getLogger('mailman.smtp')
 
 
 # A mapping of top-level domains to bucket numbers.  The zeroth bucket is
@@ -102,10 +112,73 @@ class BulkDelivery(BaseDelivery):
 
     def deliver(self, mlist, msg, msgdata):
         """See `IMailTransportAgentDelivery`."""
+        chunks = list(self.chunkify(msgdata.get('recipients', set())))
+        threads = min(int(config.mta.max_delivery_threads), len(chunks))
+        if threads > 1:
+            results = self._deliver_concurrently(
+                mlist, msg, msgdata, chunks, threads)
+        else:
+            results = [
+                self._deliver_to_recipients(mlist, msg, msgdata, recipients)
+                for recipients in chunks]
         refused = {}
-        for recipients in self.chunkify(msgdata.get('recipients', set())):
-            chunk_refused = self._deliver_to_recipients(
-                mlist, msg, msgdata, recipients)
+        for chunk_refused in results:
             refused.update(chunk_refused)
         return refused
 
+    def _deliver_concurrently(self, mlist, msg, msgdata, chunks, threads):
+        """Deliver the chunks over parallel SMTP sessions.
+
+        :param chunks: The recipient chunks.
+        :type chunks: list of sets of strings
+        :param threads: The number of delivery threads to use.
+        :type threads: int
+        :return: The refused recipients of each chunk, in chunk order.
+        :rtype: list of dictionaries
+        """
+        log.debug('Delivering %s chunks in %s threads', len(chunks), threads)
+        # The threads must not touch the database objects, and generating the
+        # message text can change the message, e.g. by adding a MIME boundary.
+        # So the sender and the text are computed here, once, and the threads
+        # get only those.
+        sender = self._get_sender(mlist, msg, msgdata)
+        msgtext = msg.as_string()
+        message_id = msg['message-id']
+        work = Queue()
+        for index, recipients in enumerate(chunks):
+            work.put((index, recipients))
+        results = [None] * len(chunks)
+        errors = []
+        def deliver_chunks():
+            while True:
+                try:
+                    index, recipients = work.get_nowait()
+                except Empty:
+                    return
+                try:
+                    results[index] = self._send_to_recipients(
+                        sender, recipients, msgtext, message_id)
+                except Exception:
+                    errors.append(sys.exc_info())
+                    return
+        # Every session needs a connection of its own.
+        private_pool = (self._pool is None)
+        if private_pool:
+            self._pool = ConnectionPool(threads, float('inf'))
+        try:
+            workers = [threading.Thread(target=deliver_chunks)
+                       for i in range(threads)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            if private_pool:
+                self._pool.close()
+                self._pool = None
+        if len(errors) > 0:
+            # Re-raise the first unexpected error in this thread.
+            exc_type, exc_value, exc_traceback = errors[0]
+            raise exc_type, exc_value, exc_traceback
+        return results
+
@@ -22,18 +22,30 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'Connection',
+    'ConnectionPool',
+    'current_pool',
     ]
 
 
+import time
+import socket
 import logging
 import smtplib
+import threading
 
+from contextlib import contextmanager
 from lazr.config import as_boolean
 from mailman.config import config
 
 
 log = logging.getLogger('mailman.smtp')
 
+# Pooled connections which have been idle for longer than this many seconds
+# are checked with a NOOP before they are reused.
+HEALTH_CHECK_INTERVAL = 1.0
+# The connection pool which the delivery agents borrow connections from.
+_current_pool = None
+
 
 
 class Connection:
@@ -66,7 +78,17 @@ class Connection:
         self._session_count = None
         self._connection = None
 
-    def _connect(self):
+    @property
+    def key(self):
+        """The SMTP server and credentials this connection is for."""
+        return (self._host, self._port, self._username, self._password)
+
+    @property
+    def is_open(self):
+        """Whether there is an open connection to the SMTP server."""
+        return self._connection is not None
+
+    def connect(self):
         """Open a new connection."""
         self._connection = smtplib.SMTP()
         log.debug('Connecting to %s:%s', self._host, self._port)
@@ -83,7 +105,7 @@ class Connection:
             # to the same number of recipients.
             recipients = [config.devmode.recipient] * len(recipients)
         if self._connection is None:
-            self._connect()
+            self.connect()
         try:
             log.debug('envsender: %s, recipients: %s, size(msgtext): %s',
                       envsender, recipients, len(msgtext))
@@ -108,6 +130,158 @@ class Connection:
             return
         try:
             self._connection.quit()
-        except smtplib.SMTPException:
+        except (socket.error, smtplib.SMTPException):
             pass
         self._connection = None
+
+    def noop(self):
+        """Check that the connection still works.
+
+        :return: True if the SMTP server answered the NOOP command.  If it
+            did not, the connection is closed.
+        :rtype: bool
+        """
+        if self._connection is None:
+            return False
+        try:
+            code, message = self._connection.noop()
+        except (socket.error, smtplib.SMTPException):
+            code = None
+        if code == 250:
+            return True
+        self.close()
+        return False
+
+    def close(self):
+        """Close the connection without saying goodbye to the server."""
+        if self._connection is None:
+            return
+        try:
+            self._connection.close()
+        except socket.error:
+            pass
+        self._connection = None
+
+
+
+class ConnectionPool:
+    """A pool of open connections to SMTP servers.
+
+    Connections are kept per SMTP server and credentials.  Delivery agents
+    borrow a connection for each SMTP transaction with `get()`, and give it
+    back with `release()`.  A borrowed connection is only ever used by one
+    agent at a time, but the pool itself is thread safe.
+    """
+
+    def __init__(self, max_size, idle_timeout):
+        """Create a connection pool.
+
+        :param max_size: The maximum number of idle connections to keep.
+        :type max_size: int
+        :param idle_timeout: The number of seconds after which idle
+            connections are closed.
+        :type idle_timeout: float
+        """
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # Map (host, port, user, password) to a list of (last used time,
+        # connection) tuples, most recently used last.
+        self._idle = {}
+        self._idle_count = 0
+        # Statistics.
+        self.opened = 0
+        self.reused = 0
+
+    def _pop(self, key):
+        with self._lock:
+            connections = self._idle.get(key)
+            if not connections:
+                return None, None
+            self._idle_count -= 1
+            return connections.pop()
+
+    def get(self, host, port, sessions_per_connection,
+            smtp_user=None, smtp_pass=None):
+        """Borrow a connection, opening a new one if none is idle.
+
+        The arguments are the same as for `Connection`.
+
+        :return: An open connection.
+        :rtype: `Connection`
+        """
+        key = (host, port, smtp_user, smtp_pass)
+        self.prune()
+        while True:
+            last_used, connection = self._pop(key)
+            if connection is None:
+                break
+            if (time.time() - last_used < HEALTH_CHECK_INTERVAL or
+                connection.noop()):
+                with self._lock:
+                    self.reused += 1
+                return connection
+            log.debug('Discarding dead SMTP connection to %s:%s', host, port)
+        connection = Connection(
+            host, port, sessions_per_connection, smtp_user, smtp_pass)
+        connection.connect()
+        with self._lock:
+            self.opened += 1
+        return connection
+
+    def release(self, connection):
+        """Give back a borrowed connection.
+
+        Closed connections, e.g. because they reached their maximum number of
+        sessions or because of an error, are dropped.  So are connections
+        which would make the pool exceed its maximum size.
+        """
+        if not connection.is_open:
+            return
+        with self._lock:
+            if self._idle_count < self._max_size:
+                self._idle.setdefault(connection.key, []).append(
+                    (time.time(), connection))
+                self._idle_count += 1
+                return
+        connection.quit()
+
+    def prune(self):
+        """Close the connections which have been idle for too long."""
+        expired = []
+        deadline = time.time() - self._idle_timeout
+        with self._lock:
+            for connections in self._idle.values():
+                while len(connections) > 0 and connections[0][0] < deadline:
+                    expired.append(connections.pop(0)[1])
+                    self._idle_count -= 1
+        for connection in expired:
+            connection.quit()
+
+    def close(self):
+        """Close all the idle connections."""
+        with self._lock:
+            connections = [connection
+                           for idle in self._idle.values()
+                           for last_used, connection in idle]
+            self._idle.clear()
+            self._idle_count = 0
+        for connection in connections:
+            connection.quit()
+
+    @contextmanager
+    def in_use(self):
+        """Make the delivery agents use this pool in the with statement."""
+        global _current_pool
+        saved_pool = _current_pool
+        _current_pool = self
+        try:
+            yield self
+        finally:
+            _current_pool = saved_pool
+
+
+
+def current_pool():
+    """Return the connection pool the delivery agents use, or None."""
+    return _current_pool
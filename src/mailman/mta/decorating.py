@@ -27,6 +27,7 @@ __all__ = [
 
 
 from mailman.config import config
+from mailman.mta.template import decorations_only
 from mailman.mta.verp import VERPDelivery
 
 
@@ -34,6 +35,7 @@ from mailman.mta.verp import VERPDelivery
 class DecoratingMixin:
     """Decorate a message with recipient-specific headers and footers."""
 
+    @decorations_only
     def decorate(self, mlist, msg, msgdata):
         """Add recipient-specific headers and footers."""
         decorator = config.handlers['decorate']
@@ -32,6 +32,7 @@ from zope.component import getUtility
 
 from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.usermanager import IUserManager
+from mailman.mta.template import headers_only
 from mailman.mta.verp import VERPDelivery
 
 
@@ -44,6 +45,7 @@ class PersonalizedMixin:
     concrete base class.
     """
 
+    @headers_only
     def personalize_to(self, mlist, msg, msgdata):
         """Modify the To header to contain the recipient.
 
@@ -55,8 +57,11 @@ class PersonalizedMixin:
         if mlist.personalize != Personalization.full:
             return
         recipient = msgdata['recipient']
-        user_manager = getUtility(IUserManager)
-        user = user_manager.get_user(recipient)
+        # The delivery may have looked up the recipient's user already.
+        context = msgdata.get('recipient-context')
+        user = (getUtility(IUserManager).get_user(recipient)
+                if context is None
+                else context.user)
         if user is None:
             msg.replace_header('To', recipient)
         else:
@@ -0,0 +1,321 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Message templates for individual delivery.
+
+Individual delivery crafts a unique message for every recipient, but most of
+that message is the same for all of them.  A template is the message with the
+delivery callbacks applied once, and its body flattened once, with markers
+where the recipient specific decoration substitutions go.  The message for
+each recipient is then spliced together from that text, and only the
+callbacks which change the headers are run again.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'MessageTemplate',
+    'SplicedMessage',
+    'decorations_only',
+    'headers_only',
+    'make_template',
+    ]
+
+
+import re
+import copy
+import uuid
+import email
+import logging
+
+from mailman.email.message import Message
+from mailman.handlers.decorate import decoration_data
+from mailman.utilities.email import flatten_headers
+
+
+EMPTYSTRING = b''
+log = logging.getLogger('mailman.smtp')
+
+# The decoration substitutions which are different for every recipient.
+SLOT_KEYS = (
+    'user_address',
+    'user_delivered_to',
+    'user_language',
+    'user_name',
+    'user_optionsurl',
+    )
+
+# The parts of the message state which make up its body.
+_BODY_STATE = ('_payload', 'preamble', 'epilogue')
+# Markers can only be replaced in parts whose body is not transfer encoded.
+_IDENTITY_ENCODINGS = ('7bit', '8bit', 'binary')
+# Metadata keys which are set separately for every recipient.
+_RECIPIENT_KEYS = (
+    'recipient', 'recipient-context', 'member', 'decoration-data')
+
+
+
+def headers_only(callback):
+    """Mark an `IndividualDelivery` callback as only changing the headers.
+
+    Such callbacks can be run on the message rendered from a template.
+    """
+    callback.headers_only = True
+    return callback
+
+
+def decorations_only(callback):
+    """Mark an `IndividualDelivery` callback as only personalizing decorations.
+
+    Such callbacks change the message the same way for every recipient,
+    except for the `decoration_data()` substitutions in the headers and
+    footers they add, so they only need to be run to create the template.
+    """
+    callback.decorations_only = True
+    return callback
+
+
+
+class SplicedMessage(Message):
+    """A message rendered from a `MessageTemplate`.
+
+    The body is kept as the text spliced together for the recipient.  It is
+    only parsed when something first asks for the payload.
+    """
+
+    def __getattr__(self, name):
+        # This is only called for attributes which are missing from the
+        # instance, i.e. the body state while it is still only text.
+        if name in _BODY_STATE and '_spliced_body' in self.__dict__:
+            self._load_body()
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def __getstate__(self):
+        # Pickles and copies need the body.
+        self._load_body()
+        return self.__dict__
+
+    def _load_body(self):
+        body = self.__dict__.pop('_spliced_body', None)
+        if body is None:
+            return
+        parsed = email.message_from_string(self._header_text() + body,
+                                           Message)
+        for name in _BODY_STATE:
+            if name not in self.__dict__:
+                self.__dict__[name] = getattr(parsed, name)
+
+    def _header_text(self):
+        return flatten_headers(self)
+
+    def as_string(self, unixfrom=False):
+        body = self.__dict__.get('_spliced_body')
+        if body is None or unixfrom:
+            return Message.as_string(self, unixfrom)
+        return self._header_text() + body
+
+
+
+def _splice_value(value):
+    """Return the substitution as body text, or None if it can't be spliced.
+
+    The value must come out of the decoration the same way as the marker
+    which stood in for it did.
+    """
+    if not isinstance(value, basestring) or len(value) == 0:
+        return None
+    try:
+        text = (value.encode('ascii')
+                if isinstance(value, unicode)
+                else value.decode('ascii').encode('ascii'))
+    except UnicodeError:
+        # The decoration may have to be in a different character set.
+        return None
+    # Decorations have trailing whitespace stripped from their lines, and the
+    # generator mangles lines starting with 'From '.
+    if (b'\n' in text or b'\r' in text or
+            text.endswith(b' ') or text.startswith(b'From')):
+        return None
+    return text
+
+
+
+class MessageTemplate:
+    """A message decorated and flattened once for many recipients."""
+
+    def __init__(self, template, callbacks, segments, keys, changes, token):
+        """Create a template.
+
+        Use `make_template()` to create templates.
+        """
+        (self._original_headers, self._before_callbacks,
+         self._decorated_headers, self._after_callbacks) = callbacks
+        self._segments = segments
+        self._keys = keys
+        self._changes = changes
+        self._token = token
+        self._state = dict((name, value)
+                           for name, value in template.__dict__.items()
+                           if name not in _BODY_STATE)
+        self._headers = template._headers
+
+    def render(self, mlist, msgdata):
+        """Return the message for one recipient.
+
+        :param mlist: The mailing list being delivered to.
+        :type mlist: `IMailingList`
+        :param msgdata: The recipient's copy of the message metadata, with the
+            `recipient` and `member` keys set.  This is updated the same way
+            the delivery callbacks would have.
+        :type msgdata: dictionary
+        :return: The message, or None if it can't be rendered for this
+            recipient, in which case the callbacks must be run on a copy of
+            the original message instead.
+        :rtype: `SplicedMessage`
+        """
+        data = msgdata.copy()
+        if len(self._before_callbacks) > 0:
+            # The callbacks which ran before the decorations must have left
+            # the same headers for this recipient as they did for the
+            # template, otherwise the headers would end up in another order.
+            original = Message()
+            original._headers = list(self._original_headers)
+            for callback in self._before_callbacks:
+                callback(mlist, original, data)
+            if original._headers != self._decorated_headers:
+                return None
+        # Only work out the substitutions if there's somewhere to put them;
+        # e.g. messages which must not be decorated have no markers.
+        substitutions = (decoration_data(msgdata)
+                         if len(self._keys) > 0
+                         else {})
+        body = [self._segments[0]]
+        for key, segment in zip(self._keys, self._segments[1:]):
+            value = _splice_value(substitutions.get(key))
+            if value is None:
+                return None
+            body.append(value)
+            body.append(segment)
+        message = SplicedMessage()
+        for name in _BODY_STATE:
+            del message.__dict__[name]
+        message.__dict__.update(self._state)
+        message._headers = list(self._headers)
+        message._spliced_body = EMPTYSTRING.join(body)
+        data.update(self._changes)
+        for callback in self._after_callbacks:
+            callback(mlist, message, data)
+        if self._token in message._header_text():
+            return None
+        msgdata.update(data)
+        return message
+
+
+
+def make_template(mlist, msg, msgdata, callbacks):
+    """Make a template of the message for individual delivery.
+
+    :param mlist: The mailing list being delivered to.
+    :type mlist: `IMailingList`
+    :param msg: The original message being delivered.
+    :type msg: `Message`
+    :param msgdata: The message metadata.
+    :type msgdata: dictionary
+    :param callbacks: The delivery callbacks.
+    :type callbacks: sequence
+    :return: The template, or None if the message can't be rendered from one.
+    :rtype: `MessageTemplate`
+    """
+    # The callbacks which only change the headers are run again for every
+    # recipient, before and after the decorations.
+    before_callbacks = []
+    after_callbacks = []
+    for callback in callbacks:
+        if getattr(callback, 'headers_only', False):
+            after_callbacks.append(callback)
+        elif not getattr(callback, 'decorations_only', False):
+            log.debug('No template for %s, unknown callback: %s',
+                      msg.get('message-id'), callback)
+            return None
+        elif len(before_callbacks) > 0 and len(after_callbacks) > 0:
+            log.debug('No template for %s, interleaved callback: %s',
+                      msg.get('message-id'), callback)
+            return None
+        elif len(after_callbacks) > 0:
+            before_callbacks = after_callbacks
+            after_callbacks = []
+    # The token is never going to appear in the message by chance.
+    token = b'mmslot' + uuid.uuid4().hex.encode('ascii')
+    template = copy.deepcopy(msg)
+    template_data = msgdata.copy()
+    template_data['recipient'] = '{0}@example.invalid'.format(token)
+    template_data['member'] = None
+    decorations = dict(
+        (key, '{0}{1}x'.format(token, index))
+        for index, key in enumerate(SLOT_KEYS))
+    decorations.update(msgdata.get('decoration-data', {}))
+    template_data['decoration-data'] = decorations
+    decorated_headers = None
+    for callback in callbacks:
+        if (decorated_headers is None and
+                getattr(callback, 'decorations_only', False)):
+            decorated_headers = list(template._headers)
+        callback(mlist, template, template_data)
+    # Flatten the body the same way Message.as_string() would.  Flattening
+    # can add a MIME boundary to the headers, so they are only written after.
+    text = template.as_string()
+    headers = flatten_headers(template)
+    if not text.startswith(headers):
+        log.debug('No template for %s, headers not flattened as expected',
+                  msg.get('message-id'))
+        return None
+    body = text[len(headers):]
+    # Every marker must appear verbatim in the body, exactly once for each
+    # time it appears in a decorated part.
+    expected = 0
+    for part in template.walk():
+        if part.is_multipart():
+            continue
+        payload = part.get_payload()
+        if not isinstance(payload, basestring):
+            return None
+        count = part.get_payload(decode=True).count(token)
+        cte = part.get('content-transfer-encoding', '7bit').lower()
+        if count > 0 and (cte not in _IDENTITY_ENCODINGS or
+                          payload.count(token) != count):
+            log.debug('No template for %s, decoration is %s encoded',
+                      msg.get('message-id'), cte)
+            return None
+        expected += count
+    pieces = re.split(re.escape(token) + br'(\d)x', body)
+    if body.count(token) != expected or len(pieces) != 2 * expected + 1:
+        log.debug('No template for %s, misplaced decorations',
+                  msg.get('message-id'))
+        return None
+    segments = pieces[0::2]
+    keys = [SLOT_KEYS[int(index)] for index in pieces[1::2]]
+    # The callbacks may also leave their mark in the metadata.
+    missing = object()
+    changes = dict(
+        (key, value) for key, value in template_data.items()
+        if key not in _RECIPIENT_KEYS and msgdata.get(key, missing) != value)
+    callbacks = (list(msg._headers), before_callbacks,
+                 decorated_headers, after_callbacks)
+    return MessageTemplate(
+        template, callbacks, segments, keys, changes, token)
@@ -0,0 +1,143 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test concurrent bulk delivery."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestConcurrentBulkDelivery',
+    ]
+
+
+import time
+import unittest
+import threading
+
+from mailman.app.lifecycle import create_list
+from mailman.mta.bulk import BulkDelivery
+from mailman.testing.helpers import (
+    configuration, specialized_message_from_string as mfs)
+from mailman.testing.layers import SMTPLayer
+
+
+
+class SlowBulkDelivery(BulkDelivery):
+    """Refuse every recipient, finishing the chunks in reverse order."""
+
+    def _send_to_recipients(self, sender, recipients, msgtext, message_id):
+        time.sleep(0.01 * len([r for r in recipients if r.startswith('a')]))
+        return dict((recipient, (450, 'Try again'))
+                    for recipient in recipients)
+
+
+class BrokenBulkDelivery(BulkDelivery):
+    def _send_to_recipients(self, sender, recipients, msgtext, message_id):
+        raise RuntimeError('borked')
+
+
+class CountingBulkDelivery(BulkDelivery):
+    """Record the threads which compute the sender."""
+
+    def __init__(self, max_recipients):
+        super(CountingBulkDelivery, self).__init__(max_recipients)
+        self.sender_threads = []
+
+    def _get_sender(self, mlist, msg, msgdata):
+        self.sender_threads.append(threading.current_thread())
+        return super(CountingBulkDelivery, self)._get_sender(
+            mlist, msg, msgdata)
+
+
+
+class TestConcurrentBulkDelivery(unittest.TestCase):
+    """Test delivering bulk chunks over parallel SMTP sessions."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <ant>
+
+This is a test.
+""")
+        self._recipients = set('person{0:02}@example.com'.format(i)
+                               for i in range(10))
+
+    @configuration('mta', max_delivery_threads=3)
+    def test_all_chunks_delivered(self):
+        bulk = BulkDelivery(2)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        messages = list(SMTPLayer.smtpd.messages)
+        self.assertEqual(len(messages), 5)
+        delivered = set()
+        for message in messages:
+            delivered.update(message['x-rcptto'].split(', '))
+        self.assertEqual(delivered, self._recipients)
+        # Each thread used at most one connection.
+        self.assertLessEqual(SMTPLayer.smtpd.get_connection_count(), 3)
+
+    @configuration('mta', max_delivery_threads=3)
+    def test_refused_recipients_merged(self):
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 500))
+        SMTPLayer.smtpd.err_queue.put(('rcpt', 500))
+        bulk = BulkDelivery(2)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(len(refused), 2)
+        for code, message in refused.values():
+            self.assertEqual(code, 500)
+
+    @configuration('mta', max_delivery_threads=4)
+    def test_same_result_as_sequential(self):
+        recipients = set(['aaa@example.com', 'ab@example.com',
+                          'b@example.com', 'c@example.org', 'd@example.net'])
+        msgdata = dict(recipients=recipients)
+        refused = SlowBulkDelivery(1).deliver(self._mlist, self._msg, msgdata)
+        with configuration('mta', max_delivery_threads=0):
+            expected = SlowBulkDelivery(1).deliver(
+                self._mlist, self._msg, msgdata)
+        self.assertEqual(refused, expected)
+        self.assertEqual(set(refused), recipients)
+
+    @configuration('mta', max_delivery_threads=2)
+    def test_unexpected_error_propagates(self):
+        bulk = BrokenBulkDelivery(2)
+        with self.assertRaises(RuntimeError):
+            bulk.deliver(
+                self._mlist, self._msg, dict(recipients=self._recipients))
+
+    @configuration('mta', max_delivery_threads=3)
+    def test_sender_computed_once(self):
+        # The threads don't read the mailing list; the sender is computed
+        # once, in the calling thread.
+        bulk = CountingBulkDelivery(2)
+        refused = bulk.deliver(
+            self._mlist, self._msg, dict(recipients=self._recipients))
+        self.assertEqual(refused, {})
+        self.assertEqual(bulk.sender_threads, [threading.current_thread()])
+        messages = list(SMTPLayer.smtpd.messages)
+        self.assertEqual(len(messages), 5)
+        for message in messages:
+            self.assertEqual(message['x-mailfrom'], 'test-bounces@example.com')
@@ -0,0 +1,141 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the SMTP connection pool."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestConnectionPool',
+    ]
+
+
+import mock
+import unittest
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.mta.bulk import BulkDelivery
+from mailman.mta.connection import ConnectionPool, current_pool
+from mailman.testing.helpers import (
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import SMTPLayer
+
+
+MSGTEXT = """\
+From: anne@example.com
+To: bart@example.com
+Subject: aardvarks
+
+"""
+
+
+
+class TestConnectionPool(unittest.TestCase):
+    """Test the SMTP connection pool."""
+
+    layer = SMTPLayer
+
+    def setUp(self):
+        self._pool = ConnectionPool(2, 60)
+        self._args = (config.mta.smtp_host, int(config.mta.smtp_port), 0)
+
+    def tearDown(self):
+        self._pool.close()
+
+    def _send(self, connection):
+        connection.sendmail('anne@example.com', ['bart@example.com'], MSGTEXT)
+
+    def test_reuse(self):
+        connection = self._pool.get(*self._args)
+        self._send(connection)
+        self._pool.release(connection)
+        self.assertIs(self._pool.get(*self._args), connection)
+        self._send(connection)
+        self.assertEqual(self._pool.opened, 1)
+        self.assertEqual(self._pool.reused, 1)
+        self.assertEqual(SMTPLayer.smtpd.get_connection_count(), 1)
+
+    def test_borrowed_connections_are_not_shared(self):
+        connection_1 = self._pool.get(*self._args)
+        connection_2 = self._pool.get(*self._args)
+        self.assertIsNot(connection_1, connection_2)
+        self.assertEqual(self._pool.opened, 2)
+
+    def test_max_size(self):
+        connections = [self._pool.get(*self._args) for i in range(3)]
+        for connection in connections:
+            self._pool.release(connection)
+        # Only two connections are kept.
+        self.assertTrue(connections[0].is_open)
+        self.assertTrue(connections[1].is_open)
+        self.assertFalse(connections[2].is_open)
+
+    def test_sessions_per_connection(self):
+        args = (config.mta.smtp_host, int(config.mta.smtp_port), 1)
+        connection = self._pool.get(*args)
+        self._send(connection)
+        self._pool.release(connection)
+        self.assertIsNot(self._pool.get(*args), connection)
+        self.assertEqual(self._pool.opened, 2)
+        self.assertEqual(self._pool.reused, 0)
+
+    def test_idle_timeout(self):
+        pool = ConnectionPool(2, 0)
+        connection = pool.get(*self._args)
+        pool.release(connection)
+        pool.prune()
+        self.assertFalse(connection.is_open)
+        self.assertIsNot(pool.get(*self._args), connection)
+        pool.close()
+
+    def test_health_check(self):
+        connection = self._pool.get(*self._args)
+        self._pool.release(connection)
+        # Simulate the server dropping the idle connection.
+        connection._connection.close()
+        with mock.patch('mailman.mta.connection.HEALTH_CHECK_INTERVAL', 0):
+            new_connection = self._pool.get(*self._args)
+        self.assertIsNot(new_connection, connection)
+        self.assertFalse(connection.is_open)
+        self._send(new_connection)
+        self.assertEqual(self._pool.opened, 2)
+        self.assertEqual(self._pool.reused, 0)
+
+    def test_healthy_connection_is_reused(self):
+        connection = self._pool.get(*self._args)
+        self._pool.release(connection)
+        with mock.patch('mailman.mta.connection.HEALTH_CHECK_INTERVAL', 0):
+            self.assertIs(self._pool.get(*self._args), connection)
+
+    def test_in_use(self):
+        self.assertIsNone(current_pool())
+        with self._pool.in_use():
+            self.assertIs(current_pool(), self._pool)
+        self.assertIsNone(current_pool())
+
+    def test_delivery_agents_borrow(self):
+        mlist = create_list('test@example.com')
+        msg = mfs(MSGTEXT)
+        msgdata = dict(recipients=['bart@example.com'])
+        with self._pool.in_use():
+            for i in range(3):
+                BulkDelivery().deliver(mlist, msg, msgdata)
+        self.assertEqual(self._pool.opened, 1)
+        self.assertEqual(self._pool.reused, 2)
+        self.assertEqual(SMTPLayer.smtpd.get_connection_count(), 1)
@@ -22,6 +22,7 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestIndividualDelivery',
+    'TestTemplatedDelivery',
     ]
 
 
@@ -36,8 +37,9 @@ from mailman.config import config
 from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.member import DeliveryMode
 from mailman.mta.deliver import Deliver
+from mailman.mta.template import SplicedMessage
 from mailman.testing.helpers import (
-    specialized_message_from_string as mfs)
+    query_log, specialized_message_from_string as mfs)
 from mailman.testing.layers import ConfigLayer
 
 
@@ -139,3 +141,229 @@ name     : Anne Person
 options  : http://example.com/anne@example.org
 
 """)
+
+
+
+class TestTemplatedDelivery(unittest.TestCase):
+    """Test individual delivery from message templates."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._mlist.personalize = Personalization.individual
+        for email, name in (('anne@example.org', 'Anne Person'),
+                            ('bart@example.org', 'Bart Person'),
+                            ('cris@example.org', 'Cris P\xe9rson')):
+            add_member(self._mlist, email, name, 'xyz',
+                       DeliveryMode.regular, 'en')
+        # Dave is not a member, so his footer can't be filled in.
+        self._recipients = ['anne@example.org', 'bart@example.org',
+                            'cris@example.org', 'dave@example.org']
+        del _deliveries[:]
+        self._template_dir = tempfile.mkdtemp()
+        path = os.path.join(self._template_dir,
+                            'site', 'en', 'member-footer.txt')
+        os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fp:
+            print("""\
+name   : $user_name
+options: $user_optionsurl""", file=fp)
+        config.push('templates', """
+        [paths.testing]
+        template_dir: {0}
+        """.format(self._template_dir))
+        self._mlist.footer_uri = 'mailman:///member-footer.txt'
+        self.maxDiff = None
+
+    def tearDown(self):
+        del _deliveries[:]
+        shutil.rmtree(self._template_dir)
+        config.pop('templates')
+
+    def _deliver(self, msg, templates, **msgdata):
+        config.push('templates', """
+        [mta]
+        personalization_templates: {0}
+        """.format(templates))
+        try:
+            msgdata['recipients'] = self._recipients
+            DeliverTester().deliver(self._mlist, msg, msgdata)
+        finally:
+            config.pop('templates')
+        deliveries = [(recipients, msg, msgdata)
+                      for mlist, msg, msgdata, recipients in _deliveries]
+        del _deliveries[:]
+        return deliveries
+
+    def _check(self, msg, spliced, **msgdata):
+        # The messages rendered from the template are exactly the same as
+        # the messages crafted the original way.
+        expected = self._deliver(msg, 'no', **msgdata)
+        delivered = self._deliver(msg, 'yes', **msgdata)
+        self.assertEqual(len(delivered), len(expected))
+        for (recipients, msg, msgdata), (
+                original_recipients, original_msg, original_msgdata) in zip(
+                    delivered, expected):
+            self.assertEqual(recipients, original_recipients)
+            self.assertMultiLineEqual(msg.as_string(),
+                                      original_msg.as_string())
+            # The recipients were looked up separately for each delivery.
+            del msgdata['recipient-context']
+            del original_msgdata['recipient-context']
+            self.assertEqual(msgdata, original_msgdata)
+        self.assertEqual(
+            [recipients[0] for recipients, msg, msgdata in delivered
+             if isinstance(msg, SplicedMessage)],
+            spliced)
+        return delivered
+
+    def test_decorated_text(self):
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <alpha>
+
+From the body.
+""")
+        delivered = self._check(
+            msg, ['anne@example.org', 'bart@example.org'])
+        self.assertMultiLineEqual(delivered[1][1].as_string(), """\
+From: anne@example.org
+To: test@example.com
+Subject: test
+Message-ID: <alpha>
+MIME-Version: 1.0
+Content-Type: text/plain; charset="us-ascii"
+Content-Transfer-Encoding: 7bit
+
+>From the body.
+name   : Bart Person
+options: http://example.com/bart@example.org
+""")
+        # The original message is unchanged.
+        self.assertEqual(msg.get_payload(), 'From the body.\n')
+
+    def test_personalized_headers(self):
+        self._mlist.personalize = Personalization.full
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+
+A message.
+""")
+        # Bart's message gets its X-Mailman-Copy header before it is
+        # decorated, so it isn't rendered from the template.
+        delivered = self._check(
+            msg, ['anne@example.org'],
+            verp=True, **{'add-dup-header': {'bart@example.org': True}})
+        self.assertEqual(delivered[0][1]['to'],
+                         'Anne Person <anne@example.org>')
+        self.assertEqual(delivered[0][1]['x-mailman-copy'], None)
+        self.assertEqual(delivered[1][1]['x-mailman-copy'], 'yes')
+
+    def test_multipart_mixed(self):
+        # Cris's footer can't be added to this message in the list's
+        # character set.
+        self._recipients.remove('cris@example.org')
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: multipart/mixed; boundary="AAA"
+
+--AAA
+Content-Type: text/plain
+
+One.
+--AAA
+Content-Type: text/plain
+
+Two.
+--AAA--
+""")
+        self._check(msg, ['anne@example.org', 'bart@example.org'])
+
+    def test_encoded_decoration(self):
+        # The footer has to be added to this message in utf-8, which is base64
+        # encoded, so no message can be rendered from a template.
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+MIME-Version: 1.0
+Content-Type: text/plain; charset="utf-8"
+Content-Transfer-Encoding: quoted-printable
+
+Caf=C3=A9.
+""")
+        self._check(msg, [])
+
+    def test_undecorated(self):
+        # Without decorations, every member's message is rendered from the
+        # template.
+        self._mlist.footer_uri = None
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+
+A message.
+""")
+        self._check(msg, self._recipients)
+
+    def test_payload(self):
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+
+A message.
+""")
+        delivered = self._deliver(msg, 'yes')
+        rendered = delivered[0][1]
+        self.assertTrue(isinstance(rendered, SplicedMessage))
+        self.assertEqual(rendered.get_payload(), b"""\
+A message.
+name   : Anne Person
+options: http://example.com/anne@example.org
+""")
+        rendered.set_payload('Changed.\n')
+        self.assertTrue(rendered.as_string().endswith('\n\nChanged.\n'))
+
+    def test_one_recipient(self):
+        # There's no point in a template for only one recipient.
+        self._recipients = ['anne@example.org']
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+
+A message.
+""")
+        self._check(msg, [])
+
+    def test_queries(self):
+        # The recipients are looked up all at once, so the number of database
+        # queries doesn't grow with the number of recipients.  The footer
+        # would look up the list's domain for every recipient, though.
+        self._mlist.personalize = Personalization.full
+        self._mlist.footer_uri = None
+        msg = mfs("""\
+From: anne@example.org
+To: test@example.com
+Subject: test
+
+A message.
+""")
+        counts = []
+        for recipients in (self._recipients[:1], self._recipients):
+            self._recipients = recipients
+            config.db.commit()
+            with query_log() as statements:
+                self._deliver(msg, 'no')
+            counts.append(len(statements))
+        self.assertEqual(counts[0], counts[1])
@@ -30,6 +30,7 @@ import logging
 
 from mailman.config import config
 from mailman.mta.base import IndividualDelivery
+from mailman.mta.template import headers_only
 from mailman.utilities.email import split_email
 from mailman.utilities.string import expand
 
@@ -80,6 +81,7 @@ class VERPMixin:
         else:
             return sender
 
+    @headers_only
     def avoid_duplicates(self, mlist, msg, msgdata):
         """Flag the message for duplicate avoidance.
 
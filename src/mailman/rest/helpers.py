@@ -159,6 +159,19 @@ class CollectionMixin:
         """Return the JSON formatted representation of the resource."""
         return etag(self._resource_as_dict(resource))
 
+    def _resources_as_dicts(self, resources):
+        """Return the dictionary representations of many resources.
+
+        Subclasses can override this to look up what the representations
+        need for all the resources at once.
+
+        :param resources: The resource objects.
+        :type resources: list
+        :return: The representations of the resources, in the same order.
+        :rtype: list of dicts
+        """
+        return [self._resource_as_dict(resource) for resource in resources]
+
     def _get_collection(self, request):
         """Return the collection as a concrete list.
 
@@ -176,8 +189,7 @@ class CollectionMixin:
         if len(collection) == 0:
             return dict(start=0, total_size=0)
         else:
-            entries = [self._resource_as_dict(resource)
-                       for resource in collection]
+            entries = self._resources_as_dicts(collection)
             # Tag the resources but use the dictionaries.
             [etag(resource) for resource in entries]
             # Create the collection resource
@@ -53,8 +53,11 @@ from mailman.rest.validator import (
 class _MemberBase(resource.Resource, CollectionMixin):
     """Shared base class for member representations."""
 
-    def _resource_as_dict(self, member):
+    def _resource_as_dict(self, member, preferences=None):
         """See `CollectionMixin`."""
+        if preferences is None:
+            preferences = getUtility(ISubscriptionService).resolve_preferences(
+                [member])[0]
         enum, dot, role = str(member.role).partition('.')
         # The member will always have a member id and an address id.  It will
         # only have a user id if the address is linked to a user.
@@ -68,7 +71,7 @@ class _MemberBase(resource.Resource, CollectionMixin):
             role=role,
             address=path_to('addresses/{}'.format(member.address.email)),
             self_link=path_to('members/{}'.format(member.member_id.int)),
-            delivery_mode=member.delivery_mode,
+            delivery_mode=preferences.delivery_mode,
             )
         # Add the user link if there is one.
         user = member.user
@@ -76,6 +79,14 @@ class _MemberBase(resource.Resource, CollectionMixin):
             response['user'] = path_to('users/{}'.format(user.user_id.int))
         return response
 
+    def _resources_as_dicts(self, members):
+        """See `CollectionMixin`."""
+        # Resolve the delivery modes of the whole page at once.
+        resolved = getUtility(ISubscriptionService).resolve_preferences(
+            members)
+        return [self._resource_as_dict(member, preferences)
+                for member, preferences in zip(members, resolved)]
+
     @paginate
     def _get_collection(self, request):
         """See `CollectionMixin`."""
@@ -21,15 +21,18 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'AdminWebServiceWSGIServer',
     'make_application',
     'make_server',
     ]
 
 
+import time
 import logging
 
 from restish.app import RestishApp
-from wsgiref.simple_server import WSGIRequestHandler
+from lazr.config import as_timedelta
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
 from wsgiref.simple_server import make_server as wsgi_server
 
 from mailman.config import config
@@ -49,6 +52,40 @@ class AdminWebServiceWSGIRequestHandler(WSGIRequestHandler):
         log.info('%s - - %s', self.address_string(), format % args)
 
 
+class AdminWebServiceWSGIServer(WSGIServer):
+    """The REST server, with request timeouts.
+
+    The REST runner's workers all accept requests on the same listening
+    socket, so the backlog of connections is larger than the default.
+    """
+
+    request_queue_size = 64
+
+    # The timeout in seconds for reading a request and writing its response,
+    # or None to wait indefinitely.
+    request_timeout = None
+
+    # When set, this is called with the time a request starts, and with 0
+    # when it is done.
+    heartbeat = None
+
+    def get_request(self):
+        """See `TCPServer`."""
+        connection, address = WSGIServer.get_request(self)
+        connection.settimeout(self.request_timeout)
+        return connection, address
+
+    def process_request(self, request, client_address):
+        """See `BaseServer`."""
+        if self.heartbeat is not None:
+            self.heartbeat(time.time())
+        try:
+            WSGIServer.process_request(self, request, client_address)
+        finally:
+            if self.heartbeat is not None:
+                self.heartbeat(0)
+
+
 class AdminWebServiceApplication(RestishApp):
     """Connect the restish WSGI application to Mailman's database."""
 
@@ -78,5 +115,9 @@ def make_server():
     port = int(config.webservice.port)
     server = wsgi_server(
         host, port, make_application(),
+        server_class=AdminWebServiceWSGIServer,
         handler_class=AdminWebServiceWSGIRequestHandler)
+    timeout = as_timedelta(config.webservice.request_timeout).total_seconds()
+    if timeout > 0:
+        server.request_timeout = timeout
     return server
@@ -26,14 +26,13 @@ __all__ = [
     ]
 
 
-from zope.component import getUtility
 from zope.interface import implementer
 
+from mailman.app.senders import sender_context
 from mailman.core.i18n import _
 from mailman.interfaces.action import Action
 from mailman.interfaces.member import MemberRole
 from mailman.interfaces.rules import IRule
-from mailman.interfaces.usermanager import IUserManager
 
 
 
@@ -47,8 +46,9 @@ class MemberModeration:
 
     def check(self, mlist, msg, msgdata):
         """See `IRule`."""
-        for sender in msg.senders:
-            member = mlist.members.get_member(sender)
+        context = sender_context(mlist, msg, msgdata)
+        for sender in context.senders:
+            member = context.member(sender)
             action = (None if member is None
                       else member.moderation_action)
             if action is Action.defer:
@@ -75,25 +75,26 @@ class NonmemberModeration:
 
     def check(self, mlist, msg, msgdata):
         """See `IRule`."""
-        user_manager = getUtility(IUserManager)
+        context = sender_context(mlist, msg, msgdata)
         # First ensure that all senders are already either members or
         # nonmembers.  If they are not subscribed in some role to the mailing
         # list, make them nonmembers.
-        for sender in msg.senders:
-            if (mlist.members.get_member(sender) is None and
-                mlist.nonmembers.get_member(sender) is None):
+        for sender in context.senders:
+            if (context.member(sender) is None and
+                context.nonmember(sender) is None):
                 # The address is neither a member nor nonmember.
-                address = user_manager.get_address(sender)
+                address = context.address(sender)
                 assert address is not None, (
                     'Posting address is not registered: {0}'.format(sender))
-                mlist.subscribe(address, MemberRole.nonmember)
+                context.add_nonmember(
+                    mlist.subscribe(address, MemberRole.nonmember))
         ## # If a member is found, the member-moderation rule takes precedence.
-        for sender in msg.senders:
-            if mlist.members.get_member(sender) is not None:
+        for sender in context.senders:
+            if context.member(sender) is not None:
                 return False
         # Do nonmember moderation check.
-        for sender in msg.senders:
-            nonmember = mlist.nonmembers.get_member(sender)
+        for sender in context.senders:
+            nonmember = context.nonmember(sender)
             action = (None if nonmember is None
                       else nonmember.moderation_action)
             if action is Action.defer:
@@ -15,7 +15,14 @@
 # You should have received a copy of the GNU General Public License along with
 # GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
 
-"""Digest runner."""
+"""Digest runner.
+
+The digests are built in one pass over the digest mailbox, one message at a
+time.  The message sections of each digest are written to a temporary spool
+file as they are added, and only the table of contents is kept in memory.
+The finished digest's body is then written to another temporary file, which
+is memory mapped and left unparsed in the message put in the virgin queue.
+"""
 
 from __future__ import absolute_import, print_function, unicode_literals
 
@@ -26,33 +33,89 @@ __all__ = [
 
 
 import re
+import mmap
+import uuid
+import codecs
 import logging
+import tempfile
 
 # cStringIO doesn't support unicode.
 from StringIO import StringIO
-from copy import deepcopy
+from email import base64mime, quoprimime
+from email.charset import Charset
+from email.generator import Generator
 from email.header import Header
 from email.message import Message
 from email.mime.message import MIMEMessage
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.utils import formatdate, getaddresses, make_msgid
+from functools import partial
 from urllib2 import URLError
 
 from mailman.config import config
 from mailman.core.i18n import _
 from mailman.core.runner import Runner
+from mailman.core.switchboard import QueuedMessage
 from mailman.handlers.decorate import decorate
 from mailman.interfaces.member import DeliveryMode, DeliveryStatus
+from mailman.utilities.email import flatten_headers
 from mailman.utilities.i18n import make
 from mailman.utilities.mailbox import Mailbox
 from mailman.utilities.string import oneline, wrap
 
 
+# The spools are read in blocks of whole base64 lines of 57 bytes.
+BLOCK_SIZE = 57 * 1024
+# The generator mangles lines starting with 'From ' in the body.
+FROM_LINE = re.compile(br'^From ', re.MULTILINE)
+
 log = logging.getLogger('mailman.error')
 
 
-
+
+def _flatten(part):
+    """Return the part as text, the way `Message.as_string()` would."""
+    fp = StringIO()
+    Generator(fp).flatten(part)
+    text = fp.getvalue()
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text
+
+
+def _make_boundary():
+    """Return a MIME boundary in the style of the email package's."""
+    return '=' * 15 + uuid.uuid4().hex + '=='
+
+
+def _base64(blocks):
+    """Encode the blocks exactly as `base64mime.body_encode()` would."""
+    pending = b''
+    for block in blocks:
+        pending += block
+        end = len(pending) - len(pending) % 57
+        yield base64mime.body_encode(pending[:end])
+        pending = pending[end:]
+    yield base64mime.body_encode(pending)
+
+
+def _quoted_printable(blocks):
+    """Encode the blocks exactly as `quoprimime.body_encode()` would."""
+    # Each line is encoded by itself, except that trailing whitespace is
+    # encoded differently on the last line.  So there's always a line held
+    # back until the end, and the lines encoded before then are followed by
+    # a stand-in for it.
+    pending = b''
+    for block in blocks:
+        pending += block
+        end = pending.rfind(b'\n', 0, len(pending) - 1) + 1
+        yield quoprimime.body_encode(pending[:end] + b'x')[:-1]
+        pending = pending[end:]
+    yield quoprimime.body_encode(pending)
+
+
+
 class Digester:
     """Base digester class."""
 
@@ -96,6 +159,9 @@ class Digester:
                 self._header = ''
         self._toc = StringIO()
         print(_("Today's Topics:\n"), file=self._toc)
+        # The messages follow the table of contents in the digest, but they
+        # are added before it is complete, so they wait in the spool.
+        self._spool = tempfile.TemporaryFile(dir=mlist.data_path)
 
     def add_to_toc(self, msg, count):
         """Add a message to the table of contents."""
@@ -132,47 +198,59 @@ class Digester:
             else:
                 print('     ', line.lstrip(), file=self._toc)
 
-    def add_message(self, msg, count):
-        """Add the message to the digest."""
-        # We do not want all the headers of the original message to leak
-        # through in the digest messages.
-        keepers = {}
-        for header in self._keepers:
-            keepers[header] = msg.get_all(header, [])
-        # Remove all the unkempt <wink> headers.  Use .keys() to allow for
-        # destructive iteration...
-        for header in msg.keys():
-            del msg[header]
-        # ... and add them in the designated order.
-        for header in self._keepers:
-            for value in keepers[header]:
-                msg[header] = value
-        # Add some useful extra stuff.
-        msg['Message'] = unicode(count)
-
-
-
-
+    def _spooled(self):
+        """Read back the spool, in blocks."""
+        self._spool.seek(0)
+        for block in iter(partial(self._spool.read, BLOCK_SIZE), b''):
+            yield block
+        self._spool.close()
+
+    def _make_digest(self, body):
+        """Write the digest's body, and return the email-ready digest.
+
+        :param body: The body, in blocks of 8-bit strings.  This is consumed
+            before the digest's headers are written.
+        :return: The digest, whose body is left unparsed in a memory map of
+            a temporary file.
+        :rtype: `QueuedMessage`
+        """
+        with tempfile.TemporaryFile(dir=self._mlist.data_path) as fp:
+            for block in body:
+                fp.write(block)
+            fp.flush()
+            body = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return QueuedMessage.from_text(
+            flatten_headers(self._message), buffer(body))
+
+
+
 class MIMEDigester(Digester):
     """A MIME digester."""
 
     def __init__(self, mlist, volume, digest_number):
         super(MIMEDigester, self).__init__(mlist, volume, digest_number)
+        # The parts which come before the messages.
         masthead = MIMEText(self._masthead.encode(self._charset),
                             _charset=self._charset)
         masthead['Content-Description'] = self._subject
-        self._message.attach(masthead)
+        self._parts = [masthead]
         # Add the optional digest header.
         if mlist.digest_header_uri is not None:
             header = MIMEText(self._header.encode(self._charset),
                               _charset=self._charset)
             header['Content-Description'] = _('Digest Header')
-            self._message.attach(header)
-        # Calculate the set of headers we're to keep in the MIME digest.
-        self._keepers = set(config.digests.mime_digest_keep_headers.split())
+            self._parts.append(header)
+        # The parts are written out between boundaries the same way the email
+        # package's generator would.  The boundary can't be checked against
+        # the messages' text in advance, but a random boundary is as good as
+        # the one the generator would have picked.
+        boundary = self._message.get_boundary().encode('ascii')
+        self._first = b'--' + boundary + b'\n'
+        self._delimiter = b'\n--' + boundary + b'\n'
+        self._close = b'\n--' + boundary + b'--\n'
 
     def _make_message(self):
-        return MIMEMultipart('mixed')
+        return MIMEMultipart('mixed', boundary=_make_boundary())
 
     def add_toc(self, count):
         """Add the table of contents."""
@@ -183,16 +261,27 @@ class MIMEDigester(Digester):
         except UnicodeError:
             toc_part = MIMEText(toc_text.encode('utf-8'), _charset='utf-8')
         toc_part['Content-Description']= _("Today's Topics ($count messages)")
-        self._message.attach(toc_part)
+        self._parts.append(toc_part)
 
     def add_message(self, msg, count):
         """Add the message to the digest."""
-        # Make a copy of the message object, since the RFC 1153 processing
-        # scrubs out attachments.
-        self._message.attach(MIMEMessage(deepcopy(msg)))
+        self._spool.write(self._delimiter + _flatten(MIMEMessage(msg)))
+
+    def _body(self, trailer):
+        """Produce the multipart body, in blocks."""
+        first = True
+        for part in self._parts:
+            yield (self._first if first else self._delimiter) + _flatten(part)
+            first = False
+        for block in self._spooled():
+            yield block
+        for part in trailer:
+            yield self._delimiter + _flatten(part)
+        yield self._close
 
     def finish(self):
         """Finish up the digest, producing the email-ready copy."""
+        trailer = []
         if self._mlist.digest_footer_uri is not None:
             try:
                 footer_text = decorate(
@@ -206,17 +295,11 @@ class MIMEDigester(Digester):
             footer = MIMEText(footer_text.encode(self._charset),
                               _charset=self._charset)
             footer['Content-Description'] = _('Digest Footer')
-            self._message.attach(footer)
-        # This stuff is outside the normal MIME goo, and it's what the old
-        # MIME digester did.  No one seemed to complain, probably because you
-        # won't see it in an MUA that can't display the raw message.  We've
-        # never got complaints before, but if we do, just wax this.  It's
-        # primarily included for (marginally useful) backwards compatibility.
-        self._message.postamble = _('End of ') + self._digest_id
-        return self._message
+            trailer.append(footer)
+        return self._make_digest(self._body(trailer))
+
 
 
-
 class RFC1153Digester(Digester):
     """A digester of the format specified by RFC 1153."""
 
@@ -233,10 +316,20 @@ class RFC1153Digester(Digester):
             print(file=self._text)
         # Calculate the set of headers we're to keep in the RFC1153 digest.
         self._keepers = set(config.digests.plain_digest_keep_headers.split())
+        # The spool holds the message sections as UTF-8.  The digest is only
+        # encoded in the list's character set if all of it can be.
+        self._encodable = True
 
     def _make_message(self):
         return Message()
 
+    def _check(self, text):
+        if self._encodable:
+            try:
+                Charset(self._charset).convert(text.encode(self._charset))
+            except UnicodeError:
+                self._encodable = False
+
     def add_toc(self, count):
         """Add the table of contents."""
         print(self._toc.getvalue(), file=self._text)
@@ -246,17 +339,18 @@ class RFC1153Digester(Digester):
 
     def add_message(self, msg, count):
         """Add the message to the digest."""
+        text = StringIO()
         if count > 1:
-            print(self._separator30, file=self._text)
-            print(file=self._text)
+            print(self._separator30, file=text)
+            print(file=text)
         # Each message section contains a few headers.
         for header in config.digests.plain_digest_keep_headers.split():
             if header in msg:
                 value = oneline(msg[header], in_unicode=True)
                 value = wrap('{0}: {1}'.format(header, value))
                 value = '\n\t'.join(value.split('\n'))
-                print(value, file=self._text)
-        print(file=self._text)
+                print(value, file=text)
+        print(file=text)
         # Add the payload.  If the decoded payload is empty, this may be a
         # multipart message.  In that case, just stringify it.
         payload = msg.get_payload(decode=True)
@@ -267,12 +361,59 @@ class RFC1153Digester(Digester):
         except (LookupError, TypeError):
             # Unknown or empty charset.
             payload = unicode(payload, 'us-ascii', 'replace')
-        print(payload, file=self._text)
+        print(payload, file=text)
         if not payload.endswith('\n'):
-            print(file=self._text)
+            print(file=text)
+        text = text.getvalue()
+        self._check(text)
+        self._spool.write(text.encode('utf-8'))
+
+    def _lines(self, prologue, epilogue):
+        """Produce the digest's text, in blocks of whole lines."""
+        yield prologue
+        # Lines are never split, so stateful encodings like ISO-2022-JP come
+        # out the same as if the text was encoded all at once.
+        pending = ''
+        for block in codecs.iterdecode(self._spooled(), 'utf-8'):
+            pending += block
+            end = pending.rfind('\n') + 1
+            yield pending[:end]
+            pending = pending[end:]
+        yield pending
+        yield epilogue
+
+    def _encode(self, charset, blocks):
+        """Encode the text for the digest's character set and encoding.
+
+        This is what `Message.set_payload()` would do to the whole text.
+        """
+        encoded = (charset.convert(block.encode(charset.input_charset))
+                   for block in blocks)
+        body_encoding = charset.get_body_encoding()
+        # ISO 2022 encodings are 7bit even though they aren't ASCII.
+        seven_bit = charset.get_output_charset().lower().startswith(
+            'iso-2022-')
+        if body_encoding == 'base64':
+            encoded = _base64(encoded)
+        elif body_encoding == 'quoted-printable':
+            encoded = _quoted_printable(encoded)
+        else:
+            # 7bit or 8bit, depending on what the text turns out to be.
+            body_encoding = '7bit'
+        for block in encoded:
+            if body_encoding == '7bit' and not seven_bit:
+                try:
+                    block.decode('ascii')
+                except UnicodeError:
+                    body_encoding = '8bit'
+            # The blocks start at the beginning of a line.
+            yield FROM_LINE.sub(b'>From ', block)
+        # The whole body has been written out, so now the header is known.
+        self._message['Content-Transfer-Encoding'] = body_encoding
 
     def finish(self):
         """Finish up the digest, producing the email-ready copy."""
+        epilogue = StringIO()
         if self._mlist.digest_footer_uri is not None:
             try:
                 footer_text = decorate(
@@ -286,86 +427,57 @@ class RFC1153Digester(Digester):
             # MAS: There is no real place for the digest_footer in an RFC 1153
             # compliant digest, so add it as an additional message with
             # Subject: Digest Footer
-            print(self._separator30, file=self._text)
-            print(file=self._text)
-            print('Subject: ' + _('Digest Footer'), file=self._text)
-            print(file=self._text)
-            print(footer_text, file=self._text)
-            print(file=self._text)
-            print(self._separator30, file=self._text)
-            print(file=self._text)
+            print(self._separator30, file=epilogue)
+            print(file=epilogue)
+            print('Subject: ' + _('Digest Footer'), file=epilogue)
+            print(file=epilogue)
+            print(footer_text, file=epilogue)
+            print(file=epilogue)
+            print(self._separator30, file=epilogue)
+            print(file=epilogue)
         # Add the sign-off.
         sign_off = _('End of ') + self._digest_id
-        print(sign_off, file=self._text)
-        print('*' * len(sign_off), file=self._text)
-        # If the digest message can't be encoded by the list character set,
-        # fall back to utf-8.
-        text = self._text.getvalue()
-        try:
-            self._message.set_payload(text.encode(self._charset),
-                                      charset=self._charset)
-        except UnicodeError:
-            self._message.set_payload(text.encode('utf-8'), charset='utf-8')
-        return self._message
+        print(sign_off, file=epilogue)
+        print('*' * len(sign_off), file=epilogue)
+        prologue = self._text.getvalue()
+        epilogue = epilogue.getvalue()
+        self._check(prologue)
+        self._check(epilogue)
+        # If the digest can't be encoded by the list character set, fall back
+        # to utf-8.
+        charset = Charset(self._charset if self._encodable else 'utf-8')
+        self._message['MIME-Version'] = '1.0'
+        self._message.add_header('Content-Type', 'text/plain',
+                                 charset=charset.get_output_charset())
+        return self._make_digest(
+            self._encode(charset, self._lines(prologue, epilogue)))
+
 
 
-
 class DigestRunner(Runner):
     """The digest runner."""
 
-    def _dispose(self, mlist, msg, msgdata):
-        """See `IRunner`."""
-        volume = msgdata['volume']
-        digest_number = msgdata['digest_number']
-        # Backslashes make me cry.
-        code = mlist.preferred_language.code
-        with Mailbox(msgdata['digest_path']) as mailbox, _.using(code):
-            # Create the digesters.
-            mime_digest = MIMEDigester(mlist, volume, digest_number)
-            rfc1153_digest = RFC1153Digester(mlist, volume, digest_number)
-            # Cruise through all the messages in the mailbox, first building
-            # the table of contents and accumulating Subject: headers and
-            # authors.  The question really is whether it's better from a1
-            # performance and memory footprint to go through the mailbox once
-            # and cache the messages in a list, or to cruise through the
-            # mailbox twice.  We'll do the latter, but it's a complete guess.
-            count = None
-            for count, (key, message) in enumerate(mailbox.iteritems(), 1):
-                mime_digest.add_to_toc(message, count)
-                rfc1153_digest.add_to_toc(message, count)
-            assert count is not None, 'No digest messages?'
-            # Add the table of contents.
-            mime_digest.add_toc(count)
-            rfc1153_digest.add_toc(count)
-            # Cruise through the set of messages a second time, adding them to
-            # the actual digest.
-            for count, (key, message) in enumerate(mailbox.iteritems(), 1):
-                mime_digest.add_message(message, count)
-                rfc1153_digest.add_message(message, count)
-            # Finish up the digests.
-            mime = mime_digest.finish()
-            rfc1153 = rfc1153_digest.finish()
-        # Calculate the recipients lists
+    def _recipients(self, mlist):
+        """Return the recipients of the MIME and the RFC 1153 digests."""
         mime_recipients = set()
         rfc1153_recipients = set()
         # When someone turns off digest delivery, they will get one last
         # digest to ensure that there will be no gaps in the messages they
         # receive.
-        digest_members = set(mlist.digest_members.members)
-        for member in digest_members:
-            if member.delivery_status is not DeliveryStatus.enabled:
-                continue
+        enabled_members = mlist.digest_members.get_resolved_members(
+            [DeliveryStatus.enabled])
+        for member, preferences in enabled_members:
             # Send the digest to the case-preserved address of the digest
             # members.
             email_address = member.address.original_email
-            if member.delivery_mode == DeliveryMode.plaintext_digests:
+            if preferences.delivery_mode == DeliveryMode.plaintext_digests:
                 rfc1153_recipients.add(email_address)
-            elif member.delivery_mode == DeliveryMode.mime_digests:
+            elif preferences.delivery_mode == DeliveryMode.mime_digests:
                 mime_recipients.add(email_address)
             else:
                 raise AssertionError(
                     'Digest member "{0}" unexpected delivery mode: {1}'.format(
-                        email_address, member.delivery_mode))
+                        email_address, preferences.delivery_mode))
         # Add also the folks who are receiving one last digest.
         for address, delivery_mode in mlist.last_digest_recipients:
             if delivery_mode == DeliveryMode.plaintext_digests:
@@ -376,13 +488,45 @@ class DigestRunner(Runner):
                 raise AssertionError(
                     'OLD recipient "{0}" unexpected delivery mode: {1}'.format(
                         address, delivery_mode))
+        return mime_recipients, rfc1153_recipients
+
+    def _dispose(self, mlist, msg, msgdata):
+        """See `IRunner`."""
+        volume = msgdata['volume']
+        digest_number = msgdata['digest_number']
+        # Calculate the recipients lists first, since there's no point in
+        # building a digest which nobody will get.
+        mime_recipients, rfc1153_recipients = self._recipients(mlist)
+        digests = []
+        for digester_class, recipients in (
+                (MIMEDigester, mime_recipients),
+                (RFC1153Digester, rfc1153_recipients)):
+            if len(recipients) > 0:
+                digests.append((digester_class, recipients))
+        # Backslashes make me cry.
+        code = mlist.preferred_language.code
+        with Mailbox(msgdata['digest_path']) as mailbox, _.using(code):
+            # Create the digesters.
+            digesters = [
+                (digester_class(mlist, volume, digest_number), recipients)
+                for digester_class, recipients in digests]
+            # Cruise through all the messages in the mailbox once, adding
+            # them to the table of contents and the digests as we go.
+            count = None
+            for count, message in enumerate(mailbox.itermessages(), 1):
+                for digester, recipients in digesters:
+                    digester.add_to_toc(message, count)
+                    digester.add_message(message, count)
+            assert count is not None, 'No digest messages?'
+            # Add the table of contents, and finish up the digests.
+            for digester, recipients in digesters:
+                digester.add_toc(count)
+            digests = [(digester.finish(), recipients)
+                       for digester, recipients in digesters]
         # Send the digests to the virgin queue for final delivery.
         queue = config.switchboards['virgin']
-        queue.enqueue(mime,
-                      recipients=mime_recipients,
-                      listname=mlist.fqdn_listname,
-                      isdigest=True)
-        queue.enqueue(rfc1153,
-                      recipients=rfc1153_recipients,
-                      listname=mlist.fqdn_listname,
-                      isdigest=True)
+        for digest, recipients in digests:
+            queue.enqueue(digest,
+                          recipients=recipients,
+                          listname=mlist.fqdn_listname,
+                          isdigest=True)
@@ -36,6 +36,7 @@ __all__ = [
 
 from zope.component import getUtility
 
+from mailman.app.senders import sender_context
 from mailman.core.chains import process
 from mailman.core.runner import Runner
 from mailman.database.transaction import transaction
@@ -55,11 +56,15 @@ class IncomingRunner(Runner):
         # to Mailman.  This will be used in nonmember posting dispositions.
         user_manager = getUtility(IUserManager)
         with transaction():
-            for sender in msg.senders:
+            context = sender_context(mlist, msg, msgdata)
+            for sender in context.senders:
+                if context.address(sender) is not None:
+                    continue
                 try:
-                    user_manager.create_address(sender)
+                    address = user_manager.create_address(sender)
                 except ExistingAddressError:
-                    pass
+                    address = user_manager.get_address(sender)
+                context.add_address(address)
         # Process the message through the mailing list's start chain.
         start_chain = (mlist.owner_chain
                        if msgdata.get('to_owner', False)
@@ -30,6 +30,11 @@ Mailman's incoming queue for normal processing.  If they don't look good, or
 are destined for a bogus sub-address, they are rejected right away, hopefully
 so that the peer mail server can provide better diagnostics.
 
+The sessions are served by a single event loop, but the messages are parsed
+and enqueued by a pool of worker threads, so that a slow enqueue doesn't stall
+the other sessions.  Several LMTP runner processes can share the listening
+socket.
+
 [1] RFC 2033 Local Mail Transport Protocol
     http://www.faqs.org/rfcs/rfc2033.html
 """
@@ -42,19 +47,23 @@ __all__ = [
     ]
 
 
+import os
 import email
 import smtpd
+import socket
 import logging
 import asyncore
 
+from Queue import Queue, Empty
 from email.utils import parseaddr
-from zope.component import getUtility
+from multiprocessing.pool import ThreadPool
 
+from mailman.app.listnames import list_name_registry
 from mailman.config import config
 from mailman.core.runner import Runner
+from mailman.core.switchboard import sync_queue_files
 from mailman.database.transaction import transactional
 from mailman.email.message import Message
-from mailman.interfaces.listmanager import IListManager
 from mailman.utilities.datetime import now
 from mailman.utilities.email import add_message_hash
 
@@ -101,6 +110,9 @@ ERR_550_MID = b'550 No Message-ID header provided'
 # XXX Blech
 smtpd.__version__ = b'Python LMTP runner 1.0'
 
+# Returned to the channel when a worker thread will answer the message later.
+_DEFERRED = object()
+
 
 
 def split_recipient(address):
@@ -135,9 +147,14 @@ class Channel(smtpd.SMTPChannel):
     """An LMTP channel."""
 
     def __init__(self, server, conn, addr):
-        smtpd.SMTPChannel.__init__(self, server, conn, addr)
+        # The channel hands the messages it receives to itself, so that the
+        # server can answer them once they have been processed.
+        smtpd.SMTPChannel.__init__(self, self, conn, addr)
         # Stash this here since the subclass uses private attributes. :(
         self._server = server
+        self._waiting = False
+        # The pipelined input which arrived while waiting for an answer.
+        self._held = b''
 
     def smtp_LHLO(self, arg):
         """The LMTP greeting, used instead of HELO/EHLO."""
@@ -147,12 +164,79 @@ class Channel(smtpd.SMTPChannel):
         """HELO is not a valid LMTP command."""
         self.push(ERR_502)
 
+    def smtp_RCPT(self, arg):
+        """Reject the recipients which aren't mailing lists right away."""
+        # Without a MAIL command, the base class answers with a 503.
+        mailfrom = self._SMTPChannel__mailfrom
+        if mailfrom and arg is not None and arg[:3].upper() == 'TO:':
+            address = parseaddr(arg[3:].strip())[1]
+            if len(address) > 0 and not self._server.is_recipient(address):
+                self.push(ERR_550)
+                return
+        smtpd.SMTPChannel.smtp_RCPT(self, arg)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        status = self._server.submit(self, peer, mailfrom, rcpttos, data)
+        if status is None:
+            # Don't read the client's next command until the message has
+            # been answered.
+            self._waiting = True
+            return _DEFERRED
+        return status
+
+    def push(self, data):
+        if data is not _DEFERRED:
+            smtpd.SMTPChannel.push(self, data)
+
+    def found_terminator(self):
+        smtpd.SMTPChannel.found_terminator(self)
+        if self._waiting:
+            # The client may have pipelined more commands, which must not be
+            # answered before the message is.
+            self._held = self.ac_in_buffer + self._held
+            self.ac_in_buffer = b''
+
+    def readable(self):
+        return not self._waiting and smtpd.SMTPChannel.readable(self)
+
+    def recv(self, buffer_size):
+        if len(self._held) > 0:
+            data, self._held = self._held, b''
+            return data
+        return smtpd.SMTPChannel.recv(self, buffer_size)
+
+    def answer(self, status):
+        """Send the status of the message a worker has processed."""
+        self._waiting = False
+        if not self.connected:
+            return
+        self.push(status)
+        if len(self._held) > 0:
+            self.handle_read()
+
+
+
+class _Waker(asyncore.file_dispatcher):
+    """Wake the event loop up when the workers have answers."""
+
+    def __init__(self, fd, callback):
+        asyncore.file_dispatcher.__init__(self, fd)
+        self._callback = callback
+
+    def writable(self):
+        return False
+
+    def handle_read(self):
+        self.recv(512)
+        self._callback()
+
+
 
-
 class LMTPRunner(Runner, smtpd.SMTPServer):
     # Only __init__ is called on startup. Asyncore is responsible for later
     # connections from the MTA.  slice and numslices are ignored and are
-    # necessary only to satisfy the API.
+    # necessary only to satisfy the API, except that all the instances of
+    # this runner share the listening socket.
 
     is_queue_runner = False
 
@@ -161,26 +245,133 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
         # Do not call Runner's constructor because there's no QDIR to create
         qlog.debug('LMTP server listening on %s:%s',
                    localaddr[0], localaddr[1])
-        smtpd.SMTPServer.__init__(self, localaddr, remoteaddr=None)
+        instances = int(getattr(config, 'runner.' + name).instances)
+        # This is smtpd.SMTPServer.__init__(), except that the port may have
+        # to be shared with the other instances.
+        self._localaddr = localaddr
+        self._remoteaddr = None
+        asyncore.dispatcher.__init__(self)
+        try:
+            self.create_socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.set_reuse_addr()
+            if instances > 1:
+                self._set_reuse_port()
+            self.bind(localaddr)
+            self.listen(int(config.mta.lmtp_backlog))
+        except:
+            self.close()
+            raise
         super(LMTPRunner, self).__init__(name, slice)
+        # The messages are processed by the workers, if there are any.
+        workers = int(config.mta.lmtp_workers)
+        self._pool = (ThreadPool(workers) if workers > 0 else None)
+        self._answers = Queue()
+        self._wake_fd = None
+        if self._pool is not None:
+            read_fd, self._wake_fd = os.pipe()
+            _Waker(read_fd, self._answer)
+            os.close(read_fd)
+
+    def _set_reuse_port(self):
+        # Python 2 only defines SO_REUSEPORT on some platforms.
+        option = getattr(socket, 'SO_REUSEPORT', None)
+        if option is None:
+            elog.error('SO_REUSEPORT is not available, LMTP runner '
+                       'instances cannot share the listening socket')
+            return
+        self.socket.setsockopt(socket.SOL_SOCKET, option, 1)
 
     def handle_accept(self):
         conn, addr = self.accept()
         Channel(self, conn, addr)
         slog.debug('LMTP accept from %s', addr)
 
+    def submit(self, channel, peer, mailfrom, rcpttos, data):
+        """Process a message received on a channel.
+
+        :return: The LMTP status for the message, or None if a worker will
+            process it and give the channel its status later.
+        """
+        if self._pool is None:
+            return self.process_message(peer, mailfrom, rcpttos, data)
+        try:
+            listnames = self._list_names(rcpttos)
+        except Exception:
+            elog.exception('LMTP list names')
+            return CRLF.join(ERR_451 for to in rcpttos)
+        self._pool.apply_async(
+            self._work, (channel, listnames, mailfrom, rcpttos, data))
+        return None
+
+    def is_recipient(self, address):
+        """Whether the address belongs to a mailing list."""
+        try:
+            return len(self._list_names([address])) > 0
+        except Exception:
+            # Let the message through, it is checked again after DATA.
+            elog.exception('LMTP recipient check: %s', address)
+            return True
+
+    @transactional
+    def _list_names(self, rcpttos):
+        # Return the names of the existing mailing lists the recipients are
+        # addressed to.
+        listnames = set()
+        for to in rcpttos:
+            try:
+                listname, subaddress, domain = split_recipient(
+                    parseaddr(to)[1].lower())
+            except ValueError:
+                # The address has no domain.
+                continue
+            listname += '@' + domain
+            if listname in list_name_registry:
+                listnames.add(listname)
+        return listnames
+
+    def _work(self, channel, listnames, mailfrom, rcpttos, data):
+        # This runs in a worker thread, so it must not use the database.
+        try:
+            status = self._deliver(listnames, mailfrom, rcpttos, data)
+        except Exception:
+            elog.exception('LMTP message processing')
+            status = CRLF.join(ERR_451 for to in rcpttos)
+        self._answers.put((channel, status))
+        try:
+            os.write(self._wake_fd, b'x')
+        except OSError:
+            # The runner is stopping.
+            pass
+
+    def _answer(self):
+        while True:
+            try:
+                channel, status = self._answers.get_nowait()
+            except Empty:
+                break
+            channel.answer(status)
+
     @transactional
     def process_message(self, peer, mailfrom, rcpttos, data):
         try:
-            # Refresh the list of list names every time we process a message
-            # since the set of mailing lists could have changed.
-            listnames = set(getUtility(IListManager).names)
+            listnames = self._list_names(rcpttos)
+        except Exception:
+            elog.exception('LMTP list names')
+            config.db.abort()
+            return CRLF.join(ERR_451 for to in rcpttos)
+        return self._deliver(listnames, mailfrom, rcpttos, data)
+
+    def _deliver(self, listnames, mailfrom, rcpttos, data):
+        """Check the message and enqueue it for each recipient.
+
+        :return: The LMTP status, with one line for each recipient.
+        """
+        try:
             # Parse the message data.  If there are any defects in the
             # message, reject it right away; it's probably spam.
             msg = email.message_from_string(data, Message)
         except Exception:
             elog.exception('LMTP message parsing')
-            config.db.abort()
             return CRLF.join(ERR_451 for to in rcpttos)
         # Do basic post-processing of the message, checking it for defects or
         # other missing information.
@@ -246,15 +437,24 @@ class LMTPRunner(Runner, smtpd.SMTPServer):
                     status.append(b'250 Ok')
             except Exception:
                 slog.exception('Queue detection: %s', msg['message-id'])
-                config.db.abort()
                 status.append(ERR_550)
+        # The mail server forgets about the message once we accept it, so the
+        # queue files must be durable by now.
+        sync_queue_files()
         # All done; returning this big status string should give the expected
         # response to the LMTP client.
         return CRLF.join(status)
 
     def run(self):
         """See `IRunner`."""
-        asyncore.loop()
+        try:
+            asyncore.loop()
+        finally:
+            if self._pool is not None:
+                # Let the workers finish enqueuing the messages they have.
+                self._pool.close()
+                self._pool.join()
+                os.close(self._wake_fd)
 
     def stop(self):
         """See `IRunner`."""
@@ -32,6 +32,7 @@ from mailman.interfaces.mailinglist import Personalization
 from mailman.interfaces.mta import SomeRecipientsFailed
 from mailman.interfaces.pending import IPendings
 from mailman.interfaces.subscriptions import ISubscriptionService
+from mailman.mta.connection import ConnectionPool
 from mailman.utilities.datetime import now
 from mailman.utilities.modules import find_name
 
@@ -58,6 +59,15 @@ class OutgoingRunner(Runner):
         # set if there was a socket.error.
         self._logged = False
         self._retryq = config.switchboards['retry']
+        # The delivery agents borrow their SMTP connections from this pool,
+        # so that connections survive from one message to the next.
+        pool_size = int(config.mta.connection_pool_size)
+        if pool_size > 0:
+            idle_timeout = as_timedelta(config.mta.connection_idle_timeout)
+            self._pool = ConnectionPool(
+                pool_size, idle_timeout.total_seconds())
+        else:
+            self._pool = None
 
     def _dispose(self, mlist, msg, msgdata):
         # See if we should retry delivery of this message again.
@@ -90,7 +100,11 @@ class OutgoingRunner(Runner):
         try:
             debug_log.debug('[outgoing] {0}: {1}'.format(
                 self._func, msg.get('message-id', 'n/a')))
-            self._func(mlist, msg, msgdata)
+            if self._pool is None:
+                self._func(mlist, msg, msgdata)
+            else:
+                with self._pool.in_use():
+                    self._func(mlist, msg, msgdata)
             self._logged = False
         except socket.error:
             # There was a problem connecting to the SMTP server.  Log this
@@ -163,3 +177,15 @@ class OutgoingRunner(Runner):
                     self._retryq.enqueue(msg, msgdata)
         # We've successfully completed handling of this message.
         return False
+
+    def _do_periodic(self):
+        """See `IRunner`."""
+        if self._pool is not None:
+            self._pool.prune()
+
+    def _clean_up(self):
+        """See `IRunner`."""
+        if self._pool is not None:
+            self._pool.close()
+            smtp_log.info('SMTP connections opened: %d, reused: %d',
+                          self._pool.opened, self._pool.reused)
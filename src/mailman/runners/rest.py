@@ -25,16 +25,35 @@ __all__ = [
     ]
 
 
+import os
+import sys
+import mmap
+import time
+import errno
+import random
 import signal
+import struct
 import logging
 import threading
+import traceback
 
+from functools import partial
+
+from mailman.config import config
 from mailman.core.runner import Runner
 from mailman.rest.wsgiapp import make_server
 
 
 log = logging.getLogger('mailman.http')
 
+# How often the REST runner checks on its workers, in seconds.
+WORKER_CHECK_INTERVAL = 0.5
+# How long a worker waits for a request before it checks whether it should
+# stop, in seconds.
+WORKER_POLL_INTERVAL = 0.5
+# The time each worker started its current request, or 0 when it is idle.
+BUSY_SLOT = struct.Struct(b'd')
+
 
 
 class RESTRunner(Runner):
@@ -55,18 +74,38 @@ class RESTRunner(Runner):
         # to use the signal handler to notify a shutdown thread that the
         # shutdown should happen.  That thread will wake up and stop the main
         # server.
+        #
+        # With workers, none of this is needed: the workers are forked
+        # processes serving the requests on the shared listening socket, and
+        # the main thread just watches them until the runner is stopped.
         self._server = make_server()
         self._event = threading.Event()
-        def stopper(event, server):
-            event.wait()
-            server.shutdown()
-        self._thread = threading.Thread(
-            target=stopper, args=(self._event, self._server))
-        self._thread.start()
+        self._workers = int(config.webservice.workers)
+        self._pids = {}
+        if self._workers > 0:
+            self._thread = None
+            self._busy = mmap.mmap(-1, BUSY_SLOT.size * self._workers)
+        else:
+            def stopper(event, server):
+                event.wait()
+                server.shutdown()
+            self._thread = threading.Thread(
+                target=stopper, args=(self._event, self._server))
+            self._thread.start()
 
     def run(self):
         """See `IRunner`."""
-        self._server.serve_forever()
+        if self._workers == 0:
+            self._server.serve_forever()
+            return
+        for number in range(self._workers):
+            self._start_worker(number)
+        try:
+            while not self._stop:
+                time.sleep(WORKER_CHECK_INTERVAL)
+                self._check_workers()
+        finally:
+            self._stop_workers()
 
     def signal_handler(self, signum, frame):
         super(RESTRunner, self).signal_handler(signum, frame)
@@ -76,9 +115,94 @@ class RESTRunner(Runner):
 
     def _one_iteration(self):
         # Just keep going
-        if self._thread.is_alive():
+        if self._thread is not None and self._thread.is_alive():
             self._thread.join(timeout=0.1)
         return 1
 
     def _snooze(self, filecnt):
         pass
+
+    def _start_worker(self, number):
+        """Fork a worker, which serves requests until the runner stops.
+
+        :param number: The worker's slot in the table of busy times.
+        :type number: int
+        """
+        BUSY_SLOT.pack_into(self._busy, BUSY_SLOT.size * number, 0)
+        pid = os.fork()
+        if pid != 0:
+            self._pids[pid] = number
+            return
+        # The worker inherits the runner's signal handlers, which set the
+        # stop flag, so an in-flight request is finished before it exits.
+        status = 1
+        try:
+            self._pids.clear()
+            random.seed()
+            config.db.after_fork()
+            self._server.timeout = WORKER_POLL_INTERVAL
+            self._server.heartbeat = partial(self._heartbeat, number)
+            while not self._stop:
+                self._server.handle_request()
+            status = 0
+        except:
+            traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+            finally:
+                os._exit(status)
+
+    def _heartbeat(self, number, started):
+        BUSY_SLOT.pack_into(self._busy, BUSY_SLOT.size * number, started)
+
+    def _check_workers(self):
+        """Kill the workers which are too slow, and replace the dead ones."""
+        timeout = self._server.request_timeout
+        now = time.time()
+        for pid, number in self._pids.items():
+            started = BUSY_SLOT.unpack_from(
+                self._busy, BUSY_SLOT.size * number)[0]
+            if timeout is not None and started > 0 and now - started > timeout:
+                log.error('REST worker %d timed out after %d seconds',
+                          pid, now - started)
+                self._kill(pid, signal.SIGKILL)
+        for pid in list(self._pids):
+            try:
+                pid, status = os.waitpid(pid, os.WNOHANG)
+            except OSError as error:
+                if error.errno != errno.ECHILD:
+                    raise
+                # Someone else reaped it.
+                status = None
+            if pid == 0:
+                continue
+            number = self._pids.pop(pid)
+            log.error('REST worker %d exited with status %s, restarting',
+                      pid, status)
+            if not self._stop:
+                self._start_worker(number)
+
+    def _stop_workers(self):
+        """Stop the workers, and wait for their in-flight requests."""
+        for pid in self._pids:
+            self._kill(pid, signal.SIGTERM)
+        for pid in self._pids:
+            while True:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError as error:
+                    if error.errno == errno.EINTR:
+                        continue
+                    if error.errno != errno.ECHILD:
+                        raise
+                break
+        self._pids.clear()
+
+    def _kill(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except OSError as error:
+            if error.errno != errno.ESRCH:
+                raise
@@ -0,0 +1,140 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the digest runner."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestDigest',
+    ]
+
+
+import os
+import unittest
+
+from zope.component import getUtility
+
+from mailman.app.lifecycle import create_list
+from mailman.config import config
+from mailman.interfaces.member import DeliveryMode
+from mailman.interfaces.usermanager import IUserManager
+from mailman.runners.digest import DigestRunner
+from mailman.testing.helpers import (
+    configuration,
+    get_queue_messages,
+    make_testable_runner,
+    specialized_message_from_string as mfs)
+from mailman.testing.layers import ConfigLayer
+from mailman.utilities.mailbox import Mailbox
+
+
+
+class TestDigest(unittest.TestCase):
+    """Test the digest runner."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._mlist = create_list('test@example.com')
+        self._mlist.send_welcome_message = False
+        self._user_manager = getUtility(IUserManager)
+        self._runner = make_testable_runner(DigestRunner, 'digest')
+        self._path = os.path.join(self._mlist.data_path, 'digest.1.1.mmdf')
+        with Mailbox(self._path, create=True) as mailbox:
+            for i in range(1, 4):
+                mailbox.add(mfs("""\
+From: anne@example.com
+To: test@example.com
+Subject: Message {0}
+Message-ID: <message.{0}>
+
+From the text of message {0}.
+""".format(i)))
+
+    def _subscribe(self, email, delivery_mode):
+        member = self._mlist.subscribe(
+            self._user_manager.create_address(email))
+        member.preferences.delivery_mode = delivery_mode
+
+    def _run(self):
+        config.switchboards['digest'].enqueue(
+            mfs('\n'), listname='test@example.com',
+            digest_path=self._path, volume=1, digest_number=1)
+        self._runner.run()
+        return get_queue_messages('virgin')
+
+    def test_mime_digest_only(self):
+        # When nobody gets plain text digests, only the MIME digest is built.
+        self._subscribe('anne@example.com', DeliveryMode.mime_digests)
+        messages = self._run()
+        self.assertEqual(len(messages), 1)
+        digest = messages[0].msg
+        self.assertTrue(digest.is_multipart())
+        self.assertEqual(messages[0].msgdata['recipients'],
+                         set(['anne@example.com']))
+        # The masthead, the table of contents, the messages, and the footer.
+        parts = digest.get_payload()
+        self.assertEqual([part.get_content_type() for part in parts],
+                         ['text/plain', 'text/plain'] +
+                         ['message/rfc822'] * 3 +
+                         ['text/plain'])
+        subjects = [str(part.get_payload(0)['subject'])
+                    for part in parts[2:5]]
+        self.assertEqual(subjects, ['Message 1', 'Message 2', 'Message 3'])
+
+    def test_rfc1153_digest_only(self):
+        # When nobody gets MIME digests, only the plain text digest is built.
+        self._subscribe('bart@example.com', DeliveryMode.plaintext_digests)
+        messages = self._run()
+        self.assertEqual(len(messages), 1)
+        digest = messages[0].msg
+        self.assertFalse(digest.is_multipart())
+        self.assertEqual(messages[0].msgdata['recipients'],
+                         set(['bart@example.com']))
+        text = digest.get_payload()
+        for i in range(1, 4):
+            self.assertIn('Subject: Message {0}'.format(i), text)
+            # The body lines starting with From are escaped.
+            self.assertIn('>From the text of message {0}.'.format(i), text)
+
+    def test_no_digest_members(self):
+        # Without any digest members, no digest is built.
+        self._subscribe('anne@example.com', DeliveryMode.regular)
+        self.assertEqual(len(self._run()), 0)
+
+    def test_framed_queue_files(self):
+        # The digests read back from framed queue files are the same as from
+        # pickled ones.
+        self._subscribe('anne@example.com', DeliveryMode.mime_digests)
+        self._subscribe('bart@example.com', DeliveryMode.plaintext_digests)
+        with configuration('switchboard', qfile_format='pickle'):
+            pickled = self._run()
+        with configuration('switchboard', qfile_format='framed'):
+            framed = self._run()
+        self.assertEqual(len(pickled), 2)
+        self.assertEqual(len(framed), 2)
+        # The digests have different boundaries and dates, but the same text.
+        for pickled_item, framed_item in zip(pickled, framed):
+            self.assertEqual(pickled_item.msg.is_multipart(),
+                             framed_item.msg.is_multipart())
+            self.assertEqual(
+                [part.get_payload(decode=True)
+                 for part in pickled_item.msg.walk()],
+                [part.get_payload(decode=True)
+                 for part in framed_item.msg.walk()])
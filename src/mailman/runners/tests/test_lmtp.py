@@ -28,6 +28,7 @@ __all__ = [
 import os
 import smtplib
 import unittest
+import threading
 
 from datetime import datetime
 
@@ -112,6 +113,92 @@ Message-ID: <ant>
         self.assertEqual(messages[0].msgdata['received_time'],
                          datetime(2005, 8, 1, 7, 49, 23))
 
+    def test_concurrent_sessions(self):
+        # The LMTP server serves several sessions at the same time.
+        clients = [get_lmtp_client(quiet=True) for i in range(5)]
+        results = {}
+        def send(i, lmtp):
+            lmtp.lhlo('remote.example.org')
+            results[i] = lmtp.sendmail(
+                'anne@example.com', ['test@example.com'], """\
+From: anne@example.com
+To: test@example.com
+Message-ID: <ant{0}>
+
+""".format(i))
+            lmtp.close()
+        threads = [threading.Thread(target=send, args=(i, lmtp))
+                   for i, lmtp in enumerate(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, dict((i, {}) for i in range(5)))
+        messages = get_queue_messages('in')
+        self.assertEqual(
+            sorted(message.msg['message-id'] for message in messages),
+            ['<ant{0}>'.format(i) for i in range(5)])
+
+    def test_pipelined_commands(self):
+        # The client can send its next commands along with the end of the
+        # message data, and they are only answered after the message is.
+        # RFC 2033 requires a status for each recipient.
+        self._lmtp.docmd('MAIL FROM:<anne@example.com>')
+        self._lmtp.docmd('RCPT TO:<test@example.com>')
+        self._lmtp.docmd('RCPT TO:<test-owner@example.com>')
+        self._lmtp.docmd('DATA')
+        self._lmtp.send(b"""\
+From: anne@example.com\r
+To: test@example.com\r
+Message-ID: <ant>\r
+\r
+.\r
+HELO remote.example.org\r
+""")
+        replies = []
+        for i in range(3):
+            replies.append(self._lmtp.getreply())
+        self.assertEqual(replies, [
+            (250, b'Ok'),
+            (250, b'Ok'),
+            (502, b'Error: command HELO not implemented'),
+            ])
+        messages = get_queue_messages('in')
+        self.assertEqual(len(messages), 2)
+
+    def test_unknown_recipients_rejected(self):
+        # Recipients which are not mailing lists are rejected before the
+        # message is sent.
+        self._lmtp.docmd('MAIL FROM:<anne@example.com>')
+        self.assertEqual(self._lmtp.docmd('RCPT TO:<test@example.com>'),
+                         (250, b'Ok'))
+        self.assertEqual(
+            self._lmtp.docmd('RCPT TO:<test-bogus@example.com>'),
+            (550, b'Requested action not taken: mailbox unavailable'))
+        self.assertEqual(
+            self._lmtp.docmd('RCPT TO:<other@example.com>'),
+            (550, b'Requested action not taken: mailbox unavailable'))
+        self.assertEqual(
+            self._lmtp.docmd('RCPT TO:<test-request@example.com>'),
+            (250, b'Ok'))
+
+    def test_recipient_before_sender(self):
+        # Recipients are only checked once the session has a sender.
+        self.assertEqual(
+            self._lmtp.docmd('RCPT TO:<other@example.com>'),
+            (503, b'Error: need MAIL command'))
+
+    def test_new_list_accepted(self):
+        # A mailing list created while the LMTP server is running can be
+        # posted to right away.
+        self._lmtp.docmd('MAIL FROM:<anne@example.com>')
+        self.assertEqual(self._lmtp.docmd('RCPT TO:<new@example.com>')[0],
+                         550)
+        with transaction():
+            create_list('new@example.com')
+        self.assertEqual(self._lmtp.docmd('RCPT TO:<new@example.com>'),
+                         (250, b'Ok'))
+
     def test_queue_directory(self):
         # The LMTP runner is not queue runner, so it should not have a
         # directory in var/queue.
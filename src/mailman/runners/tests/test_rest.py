@@ -22,15 +22,27 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'TestRESTRunner',
+    'TestRESTWorkers',
     ]
 
 
 import os
+import time
 import signal
+import httplib
 import unittest
+import threading
+import traceback
 
-from mailman.testing.helpers import call_api, wait_for_webservice
-from mailman.testing.layers import RESTLayer
+from mock import patch
+from restish import http
+from zope.component import getUtility
+
+from mailman.config import config
+from mailman.interfaces.domain import IDomainManager
+from mailman.testing.helpers import (
+    call_api, configuration, wait_for_webservice)
+from mailman.testing.layers import ConfigLayer, RESTLayer
 
 
 
@@ -50,3 +62,112 @@ class TestRESTRunner(unittest.TestCase):
         response, json = call_api('http://localhost:9001/3.0/system')
         self.assertEqual(json['content-location'],
                          'http://localhost:9001/3.0/system')
+
+
+
+def _application(environ, start_response):
+    # Answer with the worker's pid, after sleeping for the number of seconds
+    # given in the query string.
+    time.sleep(float(environ.get('QUERY_STRING') or 0))
+    start_response(b'200 OK', [(b'Content-Type', b'text/plain')])
+    return [str(os.getpid())]
+
+
+def _add_domain(request):
+    # Add the domain named in the query string, then fail if asked to.
+    getUtility(IDomainManager).add(request.GET['domain'])
+    if 'fail' in request.GET:
+        raise RuntimeError('Failing as requested')
+    return http.ok([], str(os.getpid()))
+
+
+def _get(query=''):
+    connection = httplib.HTTPConnection(
+        config.webservice.hostname, int(config.webservice.port))
+    try:
+        connection.request('GET', '/?' + query)
+        return int(connection.getresponse().read())
+    finally:
+        connection.close()
+
+
+class TestRESTWorkers(unittest.TestCase):
+    """Test the REST runner's worker processes."""
+
+    layer = ConfigLayer
+
+    def setUp(self):
+        self._pid = None
+
+    def tearDown(self):
+        if self._pid is not None:
+            os.kill(self._pid, signal.SIGTERM)
+            os.waitpid(self._pid, 0)
+
+    def _start(self):
+        # Start the REST runner in a child process, like the master does.
+        # The REST application can only be imported once Mailman is
+        # configured.
+        from mailman.runners.rest import RESTRunner
+        self._pid = os.fork()
+        if self._pid == 0:
+            status = 1
+            try:
+                config.db.after_fork()
+                runner = RESTRunner('rest')
+                runner.set_signals()
+                runner.run()
+                status = 0
+            except:
+                traceback.print_exc()
+            finally:
+                os._exit(status)
+        wait_for_webservice()
+
+    @configuration('webservice', workers=2)
+    def test_concurrent_requests(self):
+        # A slow request doesn't hold up the others.
+        with patch('mailman.rest.wsgiapp.make_application',
+                   return_value=_application):
+            self._start()
+        pids = []
+        slow = threading.Thread(target=lambda: pids.append(_get('3')))
+        slow.start()
+        time.sleep(0.5)
+        pids.append(_get())
+        self.assertTrue(slow.is_alive())
+        slow.join()
+        self.assertEqual(len(set(pids)), 2)
+        self.assertNotIn(self._pid, pids)
+
+    @configuration('webservice', workers=1, request_timeout='1s')
+    def test_request_timeout(self):
+        # A worker which takes too long to answer a request is killed, and
+        # replaced with a new one.
+        with patch('mailman.rest.wsgiapp.make_application',
+                   return_value=_application):
+            self._start()
+        before = _get()
+        start = time.time()
+        self.assertRaises(httplib.HTTPException, _get, '30')
+        self.assertLess(time.time() - start, 10)
+        after = _get()
+        self.assertNotEqual(before, after)
+
+    @configuration('webservice', workers=2)
+    def test_transactions(self):
+        # Every request is committed by its worker, so the other workers and
+        # processes see its changes, and a failing request is rolled back.
+        with patch('mailman.rest.wsgiapp.Root', return_value=_add_domain):
+            self._start()
+        pids = set()
+        for i in range(4):
+            pids.add(_get('domain=example{0}.org'.format(i)))
+        self.assertNotIn(self._pid, pids)
+        # The error page is not a pid.
+        self.assertRaises(ValueError, _get, 'domain=example.net&fail')
+        config.db.abort()
+        manager = getUtility(IDomainManager)
+        for i in range(4):
+            self.assertIn('example{0}.org'.format(i), manager)
+        self.assertNotIn('example.net', manager)
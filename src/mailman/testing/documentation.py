@@ -60,6 +60,8 @@ def dump_msgdata(msgdata, *additional_skips):
     # Some stuff we always want to skip, because their values will always be
     # variable data.
     skips.add('received_time')
+    # The sender context is only a cache of database records.
+    skips.add('_sender_context')
     longest = max(len(key) for key in msgdata if key not in skips)
     for key in sorted(msgdata):
         if key in skips:
@@ -32,6 +32,7 @@ __all__ = [
     'get_nntp_server',
     'get_queue_messages',
     'make_testable_runner',
+    'query_log',
     'reset_the_world',
     'specialized_message_from_string',
     'subscribe',
@@ -59,6 +60,7 @@ from contextlib import contextmanager
 from email import message_from_string
 from httplib2 import Http
 from lazr.config import as_timedelta
+from storm.tracer import install_tracer, remove_tracer
 from urllib import urlencode
 from urllib2 import HTTPError
 from zope import event
@@ -363,6 +365,38 @@ def event_subscribers(*subscribers):
 
 
 
+class _QueryTracer:
+    def __init__(self, params):
+        self.statements = []
+        self._params = params
+
+    def connection_raw_execute(self, connection, raw_cursor, statement,
+                               params):
+        if self._params:
+            self.statements.append((statement, tuple(params)))
+        else:
+            self.statements.append(statement)
+
+
+@contextmanager
+def query_log(params=False):
+    """Collect the SQL statements executed against the database.
+
+    :param params: Whether to collect the statements' parameters too.
+    :type params: bool
+    :return: The list the statements are appended to, or 2-tuples of the
+        statements and their parameters when `params` is true.
+    :rtype: list of strings
+    """
+    tracer = _QueryTracer(params)
+    install_tracer(tracer)
+    try:
+        yield tracer.statements
+    finally:
+        remove_tracer(tracer)
+
+
+
 class configuration:
     """A decorator/context manager for temporarily setting configurations."""
 
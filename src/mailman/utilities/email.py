@@ -22,12 +22,18 @@ from __future__ import absolute_import, print_function, unicode_literals
 __metaclass__ = type
 __all__ = [
     'add_message_hash',
+    'flatten_headers',
     'split_email',
     ]
 
 
+import email.message
+
 from base64 import b32encode
+from email.generator import Generator
 from hashlib import sha1
+# cStringIO doesn't support unicode.
+from StringIO import StringIO
 
 
 
@@ -72,3 +78,33 @@ def add_message_hash(msg):
     message_id_hash = b32encode(digest)
     del msg['x-message-id-hash']
     msg['X-Message-ID-Hash'] = message_id_hash
+
+
+def flatten_headers(msg, maxheaderlen=78):
+    """Return the headers of a message as `Message.as_string()` writes them.
+
+    The text ends with the blank line which separates the headers from the
+    body.  Only the headers of the message are read.  Unicode header values
+    are encoded as UTF-8.
+
+    :param msg: An email message
+    :type msg: `email.message.Message` or derived
+    :param maxheaderlen: The length at which long header values are folded,
+        as for `email.generator.Generator`.  With 0, string header values are
+        written as they are.
+    :type maxheaderlen: int
+    :return: The flattened headers.
+    :rtype: 8-bit string
+    """
+    # The generator writes whatever payload it is given after the headers,
+    # whatever the content type says the payload should be.
+    headers = email.message.Message()
+    for name, value in msg.items():
+        headers[name] = value
+    headers.set_payload(b'')
+    fp = StringIO()
+    Generator(fp, maxheaderlen=maxheaderlen).flatten(headers)
+    text = fp.getvalue()
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return text
@@ -21,12 +21,14 @@ from __future__ import absolute_import, print_function, unicode_literals
 
 __metaclass__ = type
 __all__ = [
+    'GenerationFile',
     'makedirs',
     'umask',
     ]
 
 
 import os
+import uuid
 import errno
 
 
@@ -76,3 +78,35 @@ def makedirs(path, mode=0o2775):
             os.chmod(dirpath, mode)
         except OSError:
             pass
+
+
+
+class GenerationFile:
+    """A file which is replaced every time some shared state changes.
+
+    Processes which keep a copy of the state in memory compare the file's
+    status with the one they saw when they loaded it, which is much cheaper
+    than reading the file, let alone the state.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def status(self):
+        """The status of the file, or None if it doesn't exist yet."""
+        try:
+            info = os.stat(self.path)
+        except OSError:
+            return None
+        return (info.st_mtime, info.st_ctime, info.st_ino)
+
+    def bump(self):
+        """Replace the file, telling the other processes the state changed.
+
+        :raises EnvironmentError: when the file can't be replaced.
+        """
+        tmp_path = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp_path, 'w') as fp:
+            fp.write(uuid.uuid4().hex)
+        os.rename(tmp_path, self.path)
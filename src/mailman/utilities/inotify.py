@@ -0,0 +1,153 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A minimal ctypes binding to the Linux inotify API.
+
+Only the small part of the API needed to watch queue directories is exposed.
+On platforms without inotify, `available()` returns False and creating an
+`Inotify` instance raises `OSError`.
+"""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'IN_CLOSE_WRITE',
+    'IN_CREATE',
+    'IN_DELETE',
+    'IN_MOVED_FROM',
+    'IN_MOVED_TO',
+    'IN_Q_OVERFLOW',
+    'Inotify',
+    'available',
+    ]
+
+
+import os
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+
+
+# From <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT = struct.Struct(b'iIII')
+
+
+def _load_libc():
+    name = ctypes.util.find_library('c')
+    if name is None:
+        return None
+    try:
+        libc = ctypes.CDLL(name, use_errno=True)
+    except OSError:
+        return None
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+
+def available():
+    """Return True when the inotify API can be used on this system."""
+    return _libc is not None
+
+
+
+class Inotify:
+    """An inotify instance watching one or more directories."""
+
+    def __init__(self):
+        if _libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        self._fd = fd
+
+    def fileno(self):
+        return self._fd
+
+    def add_watch(self, path, mask):
+        """Watch `path` for the events in `mask`.
+
+        :return: The watch descriptor.
+        :rtype: int
+        """
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        wd = _libc.inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code), path)
+        return wd
+
+    def read_events(self, timeout=None):
+        """Wait up to `timeout` seconds for events and return them.
+
+        :param timeout: Seconds to wait, or None to block until an event
+            arrives.  A timeout of 0 only collects already pending events.
+        :type timeout: float or None
+        :return: The (mask, name) pairs for all pending events.  The list is
+            empty when the timeout expired, or when the wait was interrupted
+            by a signal.
+        :rtype: list
+        """
+        try:
+            readable, ignore, ignore = select.select(
+                [self._fd], [], [], timeout)
+        except select.error as error:
+            if error.args[0] != errno.EINTR:
+                raise
+            return []
+        if not readable:
+            return []
+        events = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as error:
+                if error.errno in (errno.EAGAIN, errno.EINTR):
+                    break
+                raise
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = data[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((mask, name.decode('utf-8', 'replace')))
+        return events
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
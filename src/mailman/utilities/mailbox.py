@@ -25,6 +25,8 @@ __all__ = [
     ]
 
 
+import os
+
 # Use a single file format for the digest mailbox because this makes it easier
 # to calculate the current size of the mailbox.  This way, we don't have to
 # carry around or store the size of the mailbox, we can just stat the file to
@@ -34,6 +36,10 @@ __all__ = [
 from mailbox import MMDF
 
 
+EMPTYSTRING = b''
+MARKER = b'\001\001\001\001' + os.linesep.encode('ascii')
+
+
 
 class Mailbox(MMDF):
     """A mailbox that interoperates with the 'with' statement."""
@@ -47,3 +53,43 @@ class Mailbox(MMDF):
         self.unlock()
         # Don't suppress the exception.
         return False
+
+    def itermessages(self):
+        """Iterate over the messages in a single pass over the mailbox file.
+
+        `iteritems()` scans the whole file for the offsets of the messages
+        first, and then seeks back to read each message.  This reads the file
+        once, from start to end, and only holds one message at a time.  The
+        mailbox must not be changed while it is being iterated over.
+        """
+        self._file.seek(0)
+        lines = None
+        while True:
+            line = self._file.readline()
+            if lines is None:
+                # Between messages.
+                if line == b'':
+                    break
+                if line.startswith(MARKER):
+                    lines = []
+            elif line == MARKER:
+                # The line separator before the closing marker was added when
+                # the message was written.
+                if len(lines) > 0:
+                    lines[-1] = lines[-1][:-len(os.linesep)]
+                    yield self._make_message(lines)
+                lines = None
+            elif line == b'':
+                if len(lines) > 0:
+                    yield self._make_message(lines)
+                break
+            else:
+                lines.append(line)
+
+    def _make_message(self, lines):
+        # This is what get_message() does with the message's lines.
+        from_line = lines[0].replace(os.linesep, b'')
+        text = EMPTYSTRING.join(lines[1:]).replace(os.linesep, b'\n')
+        message = self._message_factory(text)
+        message.set_from(from_line[5:])
+        return message
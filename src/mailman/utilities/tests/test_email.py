@@ -27,9 +27,13 @@ __all__ = [
 
 import unittest
 
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
 from mailman.testing.helpers import (
     specialized_message_from_string as mfs)
-from mailman.utilities.email import add_message_hash, split_email
+from mailman.utilities.email import (
+    add_message_hash, flatten_headers, split_email)
 
 
 
@@ -108,3 +112,38 @@ Message-ID: aardvark>
         add_message_hash(msg)
         self.assertEqual(msg['x-message-id-hash'],
                          '5KH3RA7ZM4VM6XOZXA7AST2XN2X4S3WY')
+
+    def test_flatten_headers(self):
+        # The headers are written the way the whole message is.
+        msg = mfs("""\
+From: anne@example.com
+Subject: A very long subject, which has to be folded when the message is
+ written out again
+Message-ID: <ant>
+
+From the body.
+""")
+        text = flatten_headers(msg)
+        self.assertTrue(text.endswith(b'<ant>\n\n'))
+        self.assertEqual(msg.as_string(), text + b'>From the body.\n')
+
+    def test_flatten_headers_unfolded(self):
+        # With no maximum header length, long values are written as they are.
+        msg = mfs("""\
+From: anne@example.com
+Subject: {0}
+Message-ID: <ant>
+
+""".format(' '.join(['word'] * 30)))
+        text = flatten_headers(msg, maxheaderlen=0)
+        self.assertIn(b'Subject: ' + b' '.join([b'word'] * 30) + b'\n', text)
+
+    def test_flatten_multipart_headers(self):
+        # Only the headers of a multipart message are written.
+        msg = MIMEMultipart(boundary='BOUNDARY')
+        msg['Subject'] = 'Parts'
+        msg.attach(MIMEText('One part.'))
+        text = flatten_headers(msg)
+        self.assertNotIn(b'--BOUNDARY', text)
+        self.assertTrue(msg.as_string().startswith(text))
+        self.assertEqual(len(msg.get_payload()), 1)
@@ -0,0 +1,67 @@
+# Copyright (C) 2014 by the Free Software Foundation, Inc.
+#
+# This file is part of GNU Mailman.
+#
+# GNU Mailman is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option)
+# any later version.
+#
+# GNU Mailman is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General Public License for
+# more details.
+#
+# You should have received a copy of the GNU General Public License along with
+# GNU Mailman.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Test the digest mailbox."""
+
+from __future__ import absolute_import, print_function, unicode_literals
+
+__metaclass__ = type
+__all__ = [
+    'TestMailbox',
+    ]
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from mailman.testing.helpers import specialized_message_from_string as mfs
+from mailman.utilities.mailbox import Mailbox
+
+
+
+class TestMailbox(unittest.TestCase):
+    """Test the digest mailbox."""
+
+    def setUp(self):
+        self._tempdir = tempfile.mkdtemp()
+        self._path = os.path.join(self._tempdir, 'digest.mmdf')
+
+    def tearDown(self):
+        shutil.rmtree(self._tempdir)
+
+    def test_itermessages(self):
+        # Reading the mailbox in a single pass finds the same messages as
+        # reading it the usual way.
+        with Mailbox(self._path, create=True) as mailbox:
+            for i in range(3):
+                mailbox.add(mfs("""\
+From: anne@example.com
+Subject: Message {0}
+
+{1}""".format(i, 'A line of the body.\n' * (i * 1000))))
+        with Mailbox(self._path) as mailbox:
+            expected = [msg.as_string(unixfrom=True) for msg in mailbox]
+            found = [msg.as_string(unixfrom=True)
+                     for msg in mailbox.itermessages()]
+        self.assertEqual(len(found), 3)
+        self.assertEqual(found, expected)
+
+    def test_itermessages_empty(self):
+        with Mailbox(self._path, create=True) as mailbox:
+            self.assertEqual(list(mailbox.itermessages()), [])